@@ -9,134 +9,33 @@ This script:
 """
 
 import os
-import json
 import time
 from typing import Dict, List
-from datetime import datetime
 
 from google.cloud import bigquery
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from bq_metrics import MeteredClient
+from dome_client import MARKETS_BATCH_SIZE
+from dome_markets import fetch_markets_by_condition_ids, MARKETS_MAX_IN_FLIGHT
+from market_hash import select_changed_markets
+from key_snapshot import known_keys
 
 # Configuration
 PROJECT_ID = os.getenv('GOOGLE_CLOUD_PROJECT', 'gen-lang-client-0299056258')
 DATASET = os.getenv('DATASET', 'polycopy_v1')
 MARKETS_TABLE = f"{PROJECT_ID}.{DATASET}.markets"
 DOME_API_KEY = os.getenv('DOME_API_KEY')
-BATCH_SIZE = int(os.getenv('BATCH_SIZE', '100'))
-API_RATE_LIMIT_DELAY = float(os.getenv('API_RATE_LIMIT_DELAY', '0.1'))
+CHUNK_SIZE = int(os.getenv('CHUNK_SIZE', '1000'))  # condition_ids fetched + merged per BigQuery update
 
 if not DOME_API_KEY:
     raise ValueError("DOME_API_KEY environment variable is required")
 
-# Dome API configuration
-DOME_API_BASE = "https://api.domeapi.io/v1"
-DOME_HEADERS = {"Authorization": f"Bearer {DOME_API_KEY}"}
-
-# Setup requests session with retry
-session = requests.Session()
-retry_strategy = Retry(
-    total=3,
-    backoff_factor=1,
-    status_forcelist=[429, 500, 502, 503, 504],
-)
-adapter = HTTPAdapter(max_retries=retry_strategy)
-session.mount("http://", adapter)
-session.mount("https://", adapter)
-
 # Initialize BigQuery client
-bq_client = bigquery.Client(project=PROJECT_ID)
-
-
-def fetch_markets_by_condition_ids(condition_ids: List[str]) -> List[Dict]:
-    """Fetch markets from Dome API in batches"""
-    all_markets = []
-    
-    for i in range(0, len(condition_ids), BATCH_SIZE):
-        batch = condition_ids[i:i + BATCH_SIZE]
-        
-        from urllib.parse import urlencode
-        url = f"{DOME_API_BASE}/polymarket/markets"
-        params = [('limit', len(batch))]
-        for cid in batch:
-            params.append(('condition_id', cid))
-        url = f"{url}?{urlencode(params)}"
-        
-        try:
-            time.sleep(API_RATE_LIMIT_DELAY)
-            response = session.get(url, headers=DOME_HEADERS, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-            markets = data.get('markets', []) if isinstance(data, dict) else (data if isinstance(data, list) else [])
-            all_markets.extend(markets)
-            print(f"  Fetched batch {i // BATCH_SIZE + 1}: {len(markets)} markets", flush=True)
-        except Exception as e:
-            print(f"  ⚠️  Error fetching batch {i // BATCH_SIZE + 1}: {e}", flush=True)
-            continue
-    
-    return all_markets
-
-
-def map_market_to_bigquery(market: Dict) -> Dict:
-    """Map Dome API market to BigQuery schema with all fields"""
-    def to_timestamp(unix_seconds):
-        if unix_seconds and isinstance(unix_seconds, (int, float)):
-            dt = datetime.fromtimestamp(unix_seconds)
-            return dt.strftime('%Y-%m-%d %H:%M:%S')
-        return None
-    
-    def to_number(value):
-        if value is None:
-            return None
-        try:
-            return float(value) if isinstance(value, (int, float, str)) else None
-        except:
-            return None
-    
-    return {
-        'condition_id': market.get('condition_id'),
-        'event_slug': market.get('event_slug'),
-        'market_slug': market.get('market_slug'),
-        'bet_structure': market.get('bet_structure'),
-        'market_subtype': market.get('market_subtype'),
-        'market_type': market.get('market_type'),
-        'liquidity': to_number(market.get('liquidity')),
-        'status': market.get('status'),
-        'winning_label': market.get('winning_side', {}).get('label') if isinstance(market.get('winning_side'), dict) else market.get('winning_side'),
-        'winning_id': market.get('winning_side', {}).get('id') if isinstance(market.get('winning_side'), dict) else None,
-        # Text fields
-        'title': market.get('title'),
-        'description': market.get('description'),
-        'resolution_source': market.get('resolution_source'),
-        'image': market.get('image'),
-        'negative_risk_id': market.get('negative_risk_id'),
-        'game_start_time_raw': market.get('game_start_time'),
-        # Volume fields
-        'volume_1_week': to_number(market.get('volume_1_week')),
-        'volume_1_month': to_number(market.get('volume_1_month')),
-        'volume_1_year': to_number(market.get('volume_1_year')),
-        'volume_total': to_number(market.get('volume_total')),
-        # Timestamp fields
-        'start_time': to_timestamp(market.get('start_time')),
-        'end_time': to_timestamp(market.get('end_time')),
-        'completed_time': to_timestamp(market.get('completed_time')),
-        'close_time': to_timestamp(market.get('close_time')),
-        'game_start_time': to_timestamp(market.get('game_start_time')),
-        # Unix timestamp fields
-        'start_time_unix': int(market.get('start_time')) if market.get('start_time') else None,
-        'end_time_unix': int(market.get('end_time')) if market.get('end_time') else None,
-        'completed_time_unix': int(market.get('completed_time')) if market.get('completed_time') else None,
-        'close_time_unix': int(market.get('close_time')) if market.get('close_time') else None,
-        # JSON fields
-        'side_a': json.dumps(market.get('side_a')) if market.get('side_a') else None,
-        'side_b': json.dumps(market.get('side_b')) if market.get('side_b') else None,
-        'tags': json.dumps(market.get('tags')) if market.get('tags') else None,
-    }
+bq_client = MeteredClient(project=PROJECT_ID)
 
 
 def update_markets_in_bigquery(markets: List[Dict]):
     """Update markets in BigQuery with all fields"""
+    markets = select_changed_markets(bq_client, MARKETS_TABLE, markets)
     if not markets:
         return
     
@@ -200,6 +99,7 @@ def update_markets_in_bigquery(markets: List[Dict]):
             side_a = source.side_a,
             side_b = source.side_b,
             tags = source.tags,
+            content_hash = source.content_hash,
             last_updated = CURRENT_TIMESTAMP()
         """.strip()
         
@@ -227,9 +127,7 @@ def main():
     
     # Get all condition_ids from markets table
     print("Step 1: Getting all condition_ids from markets table...")
-    query = f"SELECT DISTINCT condition_id FROM `{MARKETS_TABLE}` WHERE condition_id IS NOT NULL"
-    results = bq_client.query(query).result()
-    condition_ids = [row['condition_id'] for row in results if row.get('condition_id')]
+    condition_ids = list(known_keys(bq_client, "market", MARKETS_TABLE))
     
     print(f"  Found {len(condition_ids):,} condition_ids to update")
     print()
@@ -239,28 +137,25 @@ def main():
         return
     
     # Process in batches
-    total_batches = (len(condition_ids) + BATCH_SIZE - 1) // BATCH_SIZE
+    total_batches = (len(condition_ids) + MARKETS_BATCH_SIZE - 1) // MARKETS_BATCH_SIZE
     print(f"Step 2: Fetching markets from Dome API...")
     print(f"  Processing {len(condition_ids):,} condition_ids in {total_batches} batches")
-    print(f"  Estimated time: ~{total_batches * API_RATE_LIMIT_DELAY / 60:.1f} minutes")
+    print(f"  Keeping up to {MARKETS_MAX_IN_FLIGHT} batches in flight")
     print()
     
     processed = 0
-    for i in range(0, len(condition_ids), BATCH_SIZE * 10):  # Process 10 batches at a time
-        batch_ids = condition_ids[i:i + BATCH_SIZE * 10]
+    for i in range(0, len(condition_ids), CHUNK_SIZE):
+        batch_ids = condition_ids[i:i + CHUNK_SIZE]
         
-        print(f"\n📦 Processing batch {i // (BATCH_SIZE * 10) + 1} ({len(batch_ids)} condition_ids)...")
+        print(f"\n📦 Processing batch {i // CHUNK_SIZE + 1} ({len(batch_ids)} condition_ids)...")
         
-        # Fetch markets
-        markets_raw = fetch_markets_by_condition_ids(batch_ids)
+        # Fetch markets (mapped to BigQuery schema)
+        markets_mapped, _ = fetch_markets_by_condition_ids(batch_ids, api_key=DOME_API_KEY)
         
-        if not markets_raw:
+        if not markets_mapped:
             print(f"  ⚠️  No markets fetched for this batch")
             continue
         
-        # Map to BigQuery schema
-        markets_mapped = [map_market_to_bigquery(m) for m in markets_raw if m.get('condition_id')]
-        
         # Update BigQuery
         if markets_mapped:
             update_markets_in_bigquery(markets_mapped)
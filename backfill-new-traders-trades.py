@@ -15,10 +15,15 @@ import json
 import time
 import requests
 from datetime import datetime, timedelta
-from typing import List, Dict, Set, Tuple, Optional
+from typing import List, Dict, Set, Optional
 from google.cloud import bigquery
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from bq_metrics import MeteredClient
+from dome_throttle import get_throttled_session, get_shared_limiter
+from dome_markets import fetch_markets_by_condition_ids
+from market_hash import select_changed_markets
+from bq_parquet import load_table_from_rows
+from trades_merge import trade_bounds, trades_merge_sql
+from dead_letter import FETCH_MAX_ATTEMPTS, DeadLetterQueue, FetchFailed, backoff_delay, is_retryable
 
 # Load environment variables
 try:
@@ -41,10 +46,10 @@ TRADERS_TABLE = f"{PROJECT_ID}.{DATASET}.traders"
 TRADES_TABLE = f"{PROJECT_ID}.{DATASET}.trades"
 MARKETS_TABLE = f"{PROJECT_ID}.{DATASET}.markets"
 EVENTS_TABLE = f"{PROJECT_ID}.{DATASET}.events"
+DEAD_LETTER_TABLE = f"{PROJECT_ID}.{DATASET}.ingestion_dead_letters"
+DLQ_SOURCE = "new_traders"
 
 # API settings
-API_RATE_LIMIT_DELAY = 0.05  # 20 RPS
-BATCH_SIZE = 100  # Dome API limit for condition_ids
 MAX_RETRIES = 3
 RETRY_BACKOFF_BASE = 2
 
@@ -54,21 +59,11 @@ if not DOME_API_KEY:
 
 def get_bigquery_client():
     """Initializes BigQuery client."""
-    return bigquery.Client(project=PROJECT_ID)
+    return MeteredClient(project=PROJECT_ID)
 
 def get_http_session():
-    """Creates HTTP session with retry logic."""
-    session = requests.Session()
-    retry_strategy = Retry(
-        total=MAX_RETRIES,
-        backoff_factor=RETRY_BACKOFF_BASE,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["GET"]
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
-    return session
+    """HTTP session paced by the shared adaptive Dome throttle (429s/Retry-After handled there)."""
+    return get_throttled_session(max_retries=MAX_RETRIES)
 
 def find_wallets_without_trades(client: bigquery.Client) -> List[str]:
     """Finds wallets in traders table that don't have trades."""
@@ -90,7 +85,11 @@ def find_wallets_without_trades(client: bigquery.Client) -> List[str]:
     return wallets
 
 def fetch_all_trades_for_wallet(session: requests.Session, wallet: str) -> List[Dict]:
-    """Fetches ALL trades for a wallet (full history)."""
+    """
+    Fetches ALL trades for a wallet (full history). A page is retried
+    FETCH_MAX_ATTEMPTS times; after that FetchFailed is raised so a partial
+    wallet is never loaded.
+    """
     all_trades = []
     base_url = "https://api.domeapi.io/v1"
     headers = {"Authorization": f"Bearer {DOME_API_KEY}", "Accept": "application/json"}
@@ -98,15 +97,16 @@ def fetch_all_trades_for_wallet(session: requests.Session, wallet: str) -> List[
     # Start from beginning (no start_time)
     params = {"user": wallet, "limit": 100}
     offset = 0
+    attempts = 0  # Consecutive failures of the current page
     
     while True:
         params["offset"] = offset
         
         try:
-            time.sleep(API_RATE_LIMIT_DELAY)
             response = session.get(f"{base_url}/polymarket/orders", headers=headers, params=params, timeout=60)
             response.raise_for_status()
             data = response.json()
+            attempts = 0
             
             orders = data.get('orders', [])
             if not orders:
@@ -130,8 +130,12 @@ def fetch_all_trades_for_wallet(session: requests.Session, wallet: str) -> List[
                 print(f"    📊 Fetched {len(all_trades)} trades so far...", flush=True)
         
         except Exception as e:
-            print(f"    ⚠️  Error fetching trades: {e}", flush=True)
-            break
+            attempts += 1
+            if attempts >= FETCH_MAX_ATTEMPTS or not is_retryable(e):
+                raise FetchFailed(wallet, {'offset': offset}, e, attempts)
+            delay = backoff_delay(attempts)
+            print(f"    ⚠️  Error fetching trades (attempt {attempts}/{FETCH_MAX_ATTEMPTS}): {e} - retrying in {delay:.1f}s", flush=True)
+            time.sleep(delay)
     
     return all_trades
 
@@ -206,25 +210,11 @@ def load_trades_to_bigquery(client: bigquery.Client, trades: List[Dict]) -> bool
             autodetect=False
         )
         
-        job = client.load_table_from_json(valid_trades, temp_table_id, job_config=job_config)
+        job = load_table_from_rows(client, valid_trades, temp_table_id, job_config=job_config, schema=dest_table.schema)
         job.result()
         
         # MERGE from temp to production with deduplication
-        merge_query = f"""
-        MERGE `{TRADES_TABLE}` AS target
-        USING (
-            SELECT *
-            FROM `{temp_table_id}`
-            QUALIFY ROW_NUMBER() OVER (
-                PARTITION BY wallet_address, tx_hash, COALESCE(order_hash, '')
-                ORDER BY timestamp DESC, id DESC
-            ) = 1
-        ) AS source
-        ON target.wallet_address = source.wallet_address
-           AND target.tx_hash = source.tx_hash
-           AND COALESCE(target.order_hash, '') = COALESCE(source.order_hash, '')
-        WHEN NOT MATCHED THEN INSERT ROW
-        """
+        merge_query = trades_merge_sql(TRADES_TABLE, f"`{temp_table_id}`", trade_bounds(valid_trades))
         
         client.query(merge_query).result()
         
@@ -445,64 +435,15 @@ def extract_events_from_markets(markets_raw: List[Dict]) -> List[Dict]:
     
     return events
 
-def fetch_markets_by_condition_ids(session: requests.Session, condition_ids: List[str]) -> Tuple[List[Dict], List[Dict]]:
-    """Fetches markets from Dome API."""
-    if not condition_ids:
-        return [], []
-    
-    all_markets_mapped = []
-    all_markets_raw = []
-    base_url = "https://api.domeapi.io/v1"
-    
-    total_batches = (len(condition_ids) + BATCH_SIZE - 1) // BATCH_SIZE
-    
-    for i in range(0, len(condition_ids), BATCH_SIZE):
-        batch = condition_ids[i:i + BATCH_SIZE]
-        batch_num = i // BATCH_SIZE + 1
-        
-        from urllib.parse import urlencode
-        url = f"{base_url}/polymarket/markets"
-        params = [('limit', len(batch))]
-        for cid in batch:
-            params.append(('condition_id', cid))
-        url = f"{url}?{urlencode(params)}"
-        
-        headers = {"Authorization": f"Bearer {DOME_API_KEY}", "Accept": "application/json"}
-        
-        try:
-            time.sleep(API_RATE_LIMIT_DELAY)
-            response = session.get(url, headers=headers, timeout=60)
-            response.raise_for_status()
-            data = response.json()
-            
-            markets = []
-            if isinstance(data, list):
-                markets = data
-            elif isinstance(data, dict):
-                markets = data.get('markets', [])
-                if not markets and 'results' in data:
-                    markets = data.get('results', [])
-            
-            for market in markets:
-                all_markets_raw.append(market)
-                mapped = map_market_to_schema(market)
-                if mapped['condition_id']:
-                    all_markets_mapped.append(mapped)
-            
-            if batch_num % 50 == 0:
-                print(f"  📊 Batch {batch_num}/{total_batches}: Fetched {len(markets)} markets", flush=True)
-        
-        except Exception as e:
-            print(f"  ⚠️  Error fetching batch {batch_num}: {e}", flush=True)
-            continue
-    
-    return all_markets_mapped, all_markets_raw
-
 def load_markets_to_bigquery(client: bigquery.Client, markets: List[Dict]) -> bool:
     """Loads markets using MERGE."""
     if not markets:
         return True
     
+    markets = select_changed_markets(client, MARKETS_TABLE, markets)
+    if not markets:
+        return True
+    
     try:
         temp_table_id = f"{MARKETS_TABLE}_temp_{int(time.time() * 1000000)}"
         dest_table = client.get_table(MARKETS_TABLE)
@@ -515,7 +456,7 @@ def load_markets_to_bigquery(client: bigquery.Client, markets: List[Dict]) -> bo
             autodetect=False
         )
         
-        job = client.load_table_from_json(markets, temp_table_id, job_config=job_config)
+        job = load_table_from_rows(client, markets, temp_table_id, job_config=job_config, schema=dest_table.schema)
         job.result()
         
         # MERGE
@@ -559,7 +500,8 @@ def load_markets_to_bigquery(client: bigquery.Client, markets: List[Dict]) -> bo
                 close_time_unix = source.close_time_unix,
                 side_a = COALESCE(source.side_a, target.side_a),
                 side_b = COALESCE(source.side_b, target.side_b),
-                tags = COALESCE(source.tags, target.tags)
+                tags = COALESCE(source.tags, target.tags),
+                content_hash = source.content_hash
         WHEN NOT MATCHED THEN
             INSERT ROW
         """
@@ -591,7 +533,7 @@ def load_events_to_bigquery(client: bigquery.Client, events: List[Dict]) -> bool
             autodetect=False
         )
         
-        job = client.load_table_from_json(events, temp_table_id, job_config=job_config)
+        job = load_table_from_rows(client, events, temp_table_id, job_config=job_config, schema=dest_table.schema)
         job.result()
         
         # MERGE
@@ -630,6 +572,14 @@ def main():
     client = get_bigquery_client()
     session = get_http_session()
     
+    # Dead-lettered wallets loaded nothing, so they are still "without trades" and this run retries them
+    try:
+        dead_letters = DeadLetterQueue(client, DEAD_LETTER_TABLE)
+        dead_lettered = dead_letters.pending_wallets(DLQ_SOURCE)
+    except Exception as e:
+        print(f"⚠️  Dead-letter table unavailable ({e}) - failed wallets are only logged", flush=True)
+        dead_letters, dead_lettered = None, set()
+    
     # Find wallets without trades
     wallets = find_wallets_without_trades(client)
     
@@ -645,10 +595,20 @@ def main():
     all_condition_ids = set()
     
     for i, wallet in enumerate(wallets, 1):
-        print(f"[{i}/{len(wallets)}] Processing wallet: {wallet}", flush=True)
+        print(f"[{i}/{len(wallets)}] Processing wallet: {wallet} (Dome rate: {get_shared_limiter().current_rps:.1f} req/s)", flush=True)
         
         # Fetch all trades
-        trades = fetch_all_trades_for_wallet(session, wallet)
+        try:
+            trades = fetch_all_trades_for_wallet(session, wallet)
+        except FetchFailed as e:
+            # Never load a partial wallet: it would no longer count as "without trades"
+            print(f"  ❌ Giving up on {wallet}: {e}", flush=True)
+            if dead_letters is not None:
+                dead_letters.record(DLQ_SOURCE, e)
+            print()
+            continue
+        if dead_letters is not None and wallet.lower() in dead_lettered:
+            dead_letters.resolve(wallet, DLQ_SOURCE)
         
         if not trades:
             print(f"  ⏭️  No trades found", flush=True)
@@ -678,7 +638,7 @@ def main():
         condition_ids_list = list(all_condition_ids)
         print(f"\n📊 Fetching markets for {len(condition_ids_list)} condition_ids...", flush=True)
         
-        markets_mapped, markets_raw = fetch_markets_by_condition_ids(session, condition_ids_list)
+        markets_mapped, markets_raw = fetch_markets_by_condition_ids(condition_ids_list, map_market=map_market_to_schema, api_key=DOME_API_KEY)
         
         if markets_mapped:
             if load_markets_to_bigquery(client, markets_mapped):
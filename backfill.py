@@ -4,8 +4,8 @@ import sys
 import json
 import requests
 from datetime import datetime
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from dome_throttle import get_throttled_session, get_shared_limiter
+import dome_markets
 
 # Force unbuffered output for Cloud Run logs - CRITICAL for immediate log visibility
 sys.stdout.reconfigure(line_buffering=True)
@@ -26,6 +26,13 @@ print(f"  PROJECT_ID: {os.getenv('PROJECT_ID', 'NOT SET')}", flush=True)
 try:
     print("Importing google.cloud.bigquery...", flush=True)
     from google.cloud import bigquery
+    from bq_metrics import MeteredClient
+    from key_snapshot import known_keys
+    from trade_key_index import load_trade_key_index
+    from google.cloud import storage
+    from gcs_staging import staging_path
+    from wallet_cursor import WALLET_CURSOR_ENABLED, ResumableWalletWriter
+    from dead_letter import FETCH_MAX_ATTEMPTS, DeadLetterQueue, FetchFailed, backoff_delay, is_retryable
     print("BigQuery imported successfully", flush=True)
 except Exception as e:
     print(f"ERROR importing BigQuery: {e}", flush=True)
@@ -41,19 +48,20 @@ MARKETS_TABLE = f"{PROJECT_ID}.polycopy_v1.markets"
 TRADES_TABLE = f"{PROJECT_ID}.polycopy_v1.trades"
 TRADES_STAGING_TABLE = f"{PROJECT_ID}.polycopy_v1.trades_staging"  # Non-partitioned staging table
 CHECKPOINT_TABLE = f"{PROJECT_ID}.polycopy_v1.backfill_checkpoint"
+GCS_BUCKET = os.getenv("GCS_BUCKET", f"{PROJECT_ID}-backfill-temp")  # Part files + pagination cursors for mid-wallet resume
+DEAD_LETTER_TABLE = f"{PROJECT_ID}.polycopy_v1.ingestion_dead_letters"  # Replay: rerun with WALLET_ADDRESSES set to the entries
+DLQ_SOURCE = "backfill"
 
 # Use staging table to avoid partition modification quota
 USE_STAGING_TABLE = os.getenv("USE_STAGING_TABLE", "true").lower() == "true"
 
 # Performance tuning
-API_RATE_LIMIT_DELAY = float(os.getenv("API_RATE_LIMIT_DELAY", "0.1"))  # Reduced from 0.5s
 BATCH_UPLOAD_SIZE = int(os.getenv("BATCH_UPLOAD_SIZE", "100"))  # Upload after N wallets (increased significantly to reduce partition mods)
 LARGE_WALLET_THRESHOLD = int(os.getenv("LARGE_WALLET_THRESHOLD", "50000"))  # Upload immediately if wallet has > N trades (increased)
 IN_MEMORY_CHUNK_SIZE = int(os.getenv("IN_MEMORY_CHUNK_SIZE", "500000"))  # Upload chunk if memory gets too large (increased significantly)
 BIGQUERY_UPLOAD_DELAY = float(os.getenv("BIGQUERY_UPLOAD_DELAY", "30.0"))  # Delay between BigQuery uploads to avoid quota (increased to 30s)
 BIGQUERY_CHUNK_SIZE = int(os.getenv("BIGQUERY_CHUNK_SIZE", "50000"))  # Chunk size for very large uploads (50K rows per chunk - reduced to minimize partition mods)
 MAX_RETRIES = 3
-RETRY_BACKOFF_BASE = 2  # Exponential backoff base
 
 # Optional: Provide wallet addresses via environment variable (comma-separated)
 # If set, this will be used instead of querying the traders table
@@ -63,7 +71,7 @@ def get_bigquery_client():
     """Initializes BigQuery client using Application Default Credentials."""
     print(f"Creating BigQuery client for project: {PROJECT_ID}", flush=True)
     try:
-        client = bigquery.Client(project=PROJECT_ID)
+        client = MeteredClient(project=PROJECT_ID)
         print("BigQuery client created successfully", flush=True)
         return client
     except Exception as e:
@@ -71,27 +79,8 @@ def get_bigquery_client():
         raise
 
 def get_http_session():
-    """Creates a requests session with connection pooling and retry logic."""
-    session = requests.Session()
-    
-    # Retry strategy with exponential backoff
-    retry_strategy = Retry(
-        total=MAX_RETRIES,
-        backoff_factor=RETRY_BACKOFF_BASE,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["GET"]
-    )
-    
-    adapter = HTTPAdapter(
-        max_retries=retry_strategy,
-        pool_connections=10,
-        pool_maxsize=20
-    )
-    
-    session.mount("https://", adapter)
-    session.mount("http://", adapter)
-    
-    return session
+    """HTTP session paced by the shared adaptive Dome throttle (429s/Retry-After handled there)."""
+    return get_throttled_session(max_retries=MAX_RETRIES)
 
 def get_existing_ids(client, table_id, column_name):
     """Fetches all existing IDs from a table to prevent duplicates."""
@@ -162,61 +151,23 @@ def mark_wallet_complete(client, wallet_address, trade_count):
     except Exception as e:
         print(f"Warning: Could not update checkpoint: {e}")
 
-def fetch_markets_by_condition_ids(session, condition_ids, existing_market_ids):
+def fetch_markets_by_condition_ids(condition_ids, existing_market_ids):
     """
     Fetches markets from Dome API /polymarket/markets endpoint.
-    Can batch up to 100 condition_ids per request.
+    Skips condition_ids already in existing_market_ids and adds the fetched ones.
+    Batches are pipelined by dome_markets (100 condition_ids per request).
     Returns tuple: (mapped_markets_list, raw_markets_list)
     """
-    if not condition_ids:
-        return [], []
-    
     # Filter out already-fetched markets
     new_condition_ids = [cid for cid in condition_ids if cid and cid not in existing_market_ids]
     if not new_condition_ids:
         return [], []
     
-    all_markets_mapped = []
-    all_markets_raw = []
-    base_url = "https://api.domeapi.io/v1"
-    
-    # Batch in chunks of 100 (API limit)
-    batch_size = 100
-    for i in range(0, len(new_condition_ids), batch_size):
-        batch = new_condition_ids[i:i + batch_size]
-        
-        # Build URL with multiple condition_id params (Dome API accepts multiple)
-        from urllib.parse import urlencode
-        url = f"{base_url}/polymarket/markets"
-        params = [('limit', len(batch))]
-        for cid in batch:
-            params.append(('condition_id', cid))
-        url = f"{url}?{urlencode(params)}"
-        
-        headers = {"Authorization": f"Bearer {DOME_API_KEY}", "Accept": "application/json"}
-        
-        try:
-            response = session.get(url, headers=headers, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-            
-            # Handle both {markets: [...]} and [...] response formats
-            markets = data.get('markets', []) if isinstance(data, dict) else (data if isinstance(data, list) else [])
-            
-            for market in markets:
-                mapped_market = map_market_to_bigquery(market)
-                if mapped_market:
-                    all_markets_mapped.append(mapped_market)
-                    all_markets_raw.append(market)  # Keep raw for event extraction
-                    existing_market_ids.add(market.get('condition_id'))
-            
-            # Rate limiting
-            if API_RATE_LIMIT_DELAY > 0:
-                time.sleep(API_RATE_LIMIT_DELAY)
-                
-        except requests.RequestException as e:
-            print(f"  Warning: Failed to fetch markets batch: {e}", flush=True)
-            continue
+    all_markets_mapped, all_markets_raw = dome_markets.fetch_markets_by_condition_ids(
+        new_condition_ids, map_market=map_market_to_bigquery, api_key=DOME_API_KEY
+    )
+    for market in all_markets_mapped:
+        existing_market_ids.add(market['condition_id'])
     
     return all_markets_mapped, all_markets_raw
 
@@ -444,12 +395,15 @@ def main():
     print("\n" + "="*80, flush=True)
     print("STEP 3: Loading existing data for deduplication...", flush=True)
     print("="*80, flush=True)
-    existing_event_slugs = get_existing_ids(client, EVENTS_TABLE, "event_slug")
-    existing_market_ids = get_existing_ids(client, MARKETS_TABLE, "condition_id")
+    existing_event_slugs = known_keys(client, "event", EVENTS_TABLE)
+    existing_market_ids = known_keys(client, "market", MARKETS_TABLE)
     
     # CRITICAL: Load existing trade IDs to prevent duplicates
     print("Loading existing trade IDs for deduplication...", flush=True)
-    existing_trade_ids = get_existing_ids(client, TRADES_STAGING_TABLE if USE_STAGING_TABLE else TRADES_TABLE, "id")
+    trades_dedup_table = TRADES_STAGING_TABLE if USE_STAGING_TABLE else TRADES_TABLE
+    existing_trade_ids = load_trade_key_index(client, trades_dedup_table, "id")
+    if existing_trade_ids is None:
+        existing_trade_ids = get_existing_ids(client, trades_dedup_table, "id")
     print(f"Loaded {len(existing_trade_ids):,} existing trade IDs for deduplication.", flush=True)
     
     print(f"Loaded {len(existing_event_slugs)} existing events and {len(existing_market_ids)} existing markets.")
@@ -457,6 +411,16 @@ def main():
     # Get wallets that were already processed (for resume capability)
     processed_wallets = get_processed_wallets(client)
     
+    # This backfill's dead-lettered wallets are skipped so they cannot stall the run;
+    # listing them in WALLET_ADDRESSES replays them (resuming from their cursors)
+    dead_letter_queue = None
+    dead_lettered_wallets = set()
+    try:
+        dead_letter_queue = DeadLetterQueue(client, DEAD_LETTER_TABLE)
+        dead_lettered_wallets = dead_letter_queue.pending_wallets(DLQ_SOURCE)
+    except Exception as e:
+        print(f"Warning: dead-letter table unavailable ({e}). Failed wallets are only logged.", flush=True)
+    
     # Fetch wallet addresses - either from env var or traders table
     if WALLET_ADDRESSES_ENV:
         trader_wallets = [w.strip() for w in WALLET_ADDRESSES_ENV.split(",") if w.strip()]
@@ -485,13 +449,14 @@ def main():
     
     # Filter out already processed wallets
     trader_wallets_lower = {w.lower() for w in trader_wallets}
-    remaining_wallets = [w for w in trader_wallets if w.lower() not in processed_wallets]
+    skipped_dead_letters = set() if WALLET_ADDRESSES_ENV else dead_lettered_wallets
+    remaining_wallets = [w for w in trader_wallets if w.lower() not in processed_wallets and w.lower() not in skipped_dead_letters]
     skipped_count = len(trader_wallets) - len(remaining_wallets)
     
     print(f"\n{'='*60}")
     print(f"Resume Summary:")
     print(f"  Total wallets: {len(trader_wallets)}")
-    print(f"  Already processed: {skipped_count}")
+    print(f"  Already processed or dead-lettered: {skipped_count} ({len(skipped_dead_letters)} dead-lettered)")
     print(f"  Remaining to process: {len(remaining_wallets)}")
     print(f"{'='*60}\n")
     
@@ -518,6 +483,15 @@ def main():
     batch_events = []
     batch_wallets = []  # Track which wallets are in the current batch (wallet_address, trade_count)
     batch_newly_fetched_market_ids = set()  # Track markets we've fetched in this run
+    batch_cursors = []  # Cursor writers with durable parts, discarded once their wallet is marked complete
+    
+    # Mid-wallet resume: pages fetched so far are persisted to GCS every WALLET_CURSOR_EVERY_PAGES pages
+    cursor_bucket = None
+    if WALLET_CURSOR_ENABLED:
+        try:
+            cursor_bucket = storage.Client(project=PROJECT_ID).bucket(GCS_BUCKET)
+        except Exception as e:
+            print(f"Warning: GCS unavailable for wallet cursors ({e}). Wallets restart from offset 0.", flush=True)
     
     start_time = time.time()
     total_trades_processed = 0
@@ -533,6 +507,22 @@ def main():
         pagination_key = None
         page_count = 0
         
+        attempts = 0  # Consecutive failures of the current page
+        fetch_failed = None
+        cursor_writer = None
+        durable_trades = 0  # wallet_trades[:durable_trades] are already in GCS parts
+        if cursor_bucket is not None:
+            cursor_writer = ResumableWalletWriter(cursor_bucket, wallet, staging_path(f"trades/{wallet}"))
+            if cursor_writer.resumed:
+                cursor = cursor_writer.cursor
+                wallet_trades = list(cursor_writer.read_rows())
+                wallet_condition_ids = set(cursor.condition_ids)
+                offset, pagination_key, page_count = cursor.offset, cursor.pagination_key, cursor.page_count
+                durable_trades = len(wallet_trades)
+                for trade in wallet_trades:
+                    if trade.get('id'):
+                        existing_trade_ids.add(trade['id'])
+        
         while True:
             # Use correct Dome API endpoint - /polymarket/orders with pagination
             base_url = "https://api.domeapi.io/v1"
@@ -564,6 +554,7 @@ def main():
                 orders = data.get('orders', [])
                 pagination = data.get('pagination', {})
                 page_count += 1
+                attempts = 0
                 
                 # Progress logging for large wallets
                 if page_count % 10 == 0:
@@ -670,26 +661,47 @@ def main():
                     print(f"  Warning: Pagination state error (offset={offset}, pagination_key={pagination_key}). Stopping.", flush=True)
                     break
                 
-                # Reduced rate limit delay
-                if API_RATE_LIMIT_DELAY > 0:
-                    time.sleep(API_RATE_LIMIT_DELAY)
+                # Persist the trades and the cursor for the next page every WALLET_CURSOR_EVERY_PAGES pages
+                if cursor_writer is not None:
+                    if cursor_writer.checkpoint_due(page_count):
+                        cursor_writer.write_rows(wallet_trades[durable_trades:])
+                        durable_trades = len(wallet_trades)
+                    cursor_writer.page_done(offset, pagination_key, page_count, len(wallet_trades), wallet_condition_ids)
 
             except requests.RequestException as e:
-                print(f"API request failed: {e}. Will retry with exponential backoff...")
-                # Retry logic is handled by the session's retry strategy
-                time.sleep(RETRY_BACKOFF_BASE ** MAX_RETRIES)
+                attempts += 1
+                if attempts >= FETCH_MAX_ATTEMPTS or not is_retryable(e):
+                    fetch_failed = FetchFailed(wallet, {'offset': offset, 'pagination_key': pagination_key, 'page': page_count}, e, attempts)
+                    break
+                delay = backoff_delay(attempts)
+                print(f"API request failed (attempt {attempts}/{FETCH_MAX_ATTEMPTS}): {e}. Retrying in {delay:.1f}s...")
+                time.sleep(delay)
+        
+        if fetch_failed is not None:
+            # Never upload a partial wallet or mark it complete: park it in the dead-letter table
+            print(f"  Giving up on {wallet}: {fetch_failed}", flush=True)
+            if cursor_writer is not None and cursor_writer.enabled:
+                # Keep the pages fetched so far; a replay resumes from this cursor
+                cursor_writer.write_rows(wallet_trades[durable_trades:])
+                cursor_writer.checkpoint()
+            if dead_letter_queue is not None:
+                dead_letter_queue.record(DLQ_SOURCE, fetch_failed)
+            wallet_trades, wallet_condition_ids = [], set()  # Still runs the batch checks below
 
         wallet_elapsed = time.time() - wallet_start
         total_trades_processed += len(wallet_trades)
         
-        print(f"Wallet complete: {len(wallet_trades):,} trades in {wallet_elapsed:.2f}s ({len(wallet_trades)/wallet_elapsed:.0f} trades/sec)")
+        if fetch_failed is None and dead_letter_queue is not None and wallet.lower() in dead_lettered_wallets:
+            dead_letter_queue.resolve(wallet, DLQ_SOURCE)
+        if fetch_failed is None:
+            print(f"Wallet complete: {len(wallet_trades):,} trades in {wallet_elapsed:.2f}s ({len(wallet_trades)/wallet_elapsed:.0f} trades/sec, Dome rate: {get_shared_limiter().current_rps:.1f} req/s)")
         
         # Fetch markets and events for the condition_ids found in trades
         wallet_markets = []
         wallet_events = []
         if wallet_condition_ids:
             print(f"  Fetching markets for {len(wallet_condition_ids)} unique condition_ids...", flush=True)
-            wallet_markets, raw_markets = fetch_markets_by_condition_ids(session, list(wallet_condition_ids), existing_market_ids)
+            wallet_markets, raw_markets = fetch_markets_by_condition_ids(list(wallet_condition_ids), existing_market_ids)
             print(f"  Fetched {len(wallet_markets)} markets", flush=True)
             
             # Extract events from raw markets
@@ -702,7 +714,9 @@ def main():
         
         # For large wallets, upload immediately to avoid memory issues
         # Very large wallets (100K+ trades) will be chunked to avoid quota limits
-        if len(wallet_trades) >= LARGE_WALLET_THRESHOLD:
+        if fetch_failed is not None:
+            pass  # Dead-lettered: nothing to upload, not marked complete
+        elif len(wallet_trades) >= LARGE_WALLET_THRESHOLD:
             print(f"  Large wallet detected ({len(wallet_trades):,} trades). Uploading immediately...")
             # Chunk very large uploads to avoid partition modification quota
             chunk_size = BIGQUERY_CHUNK_SIZE if len(wallet_trades) > BIGQUERY_CHUNK_SIZE else None
@@ -714,12 +728,17 @@ def main():
             print(f"  Upload complete for wallet {i+1}/{len(trader_wallets)}")
             # CRITICAL: Mark wallet as completed ONLY AFTER successful upload
             mark_wallet_complete(client, wallet, len(wallet_trades))
+            # A cursor may be persisted with no rows (every trade already known); it must not outlive the wallet
+            if cursor_writer is not None and cursor_writer.persisted:
+                cursor_writer.discard()
         else:
             # Add wallet data to batch for smaller wallets
             batch_events.extend(wallet_events)
             batch_markets.extend(wallet_markets)
             batch_trades.extend(wallet_trades)
             batch_wallets.append((wallet, len(wallet_trades)))  # Track wallet and trade count
+            if cursor_writer is not None and cursor_writer.persisted:
+                batch_cursors.append(cursor_writer)
         
         # Check if batch is getting too large in memory
         if len(batch_trades) >= IN_MEMORY_CHUNK_SIZE:
@@ -734,7 +753,9 @@ def main():
             # CRITICAL: Mark all wallets in this batch as completed ONLY AFTER successful upload
             for wallet_addr, trade_count in batch_wallets:
                 mark_wallet_complete(client, wallet_addr, trade_count)
-            batch_events, batch_markets, batch_trades, batch_wallets = [], [], [], []
+            for writer in batch_cursors:
+                writer.discard()
+            batch_events, batch_markets, batch_trades, batch_wallets, batch_cursors = [], [], [], [], []
             print(f"Batch cleared. Continuing...")
 
         # Batch upload every N wallets or at the end
@@ -751,8 +772,15 @@ def main():
                 # CRITICAL: Mark all wallets in this batch as completed ONLY AFTER successful upload
                 for wallet_addr, trade_count in batch_wallets:
                     mark_wallet_complete(client, wallet_addr, trade_count)
-                batch_events, batch_markets, batch_trades, batch_wallets = [], [], [], []
+                for writer in batch_cursors:
+                    writer.discard()
+                batch_events, batch_markets, batch_trades, batch_wallets, batch_cursors = [], [], [], [], []
                 print(f"Batch cleared. Continuing...")
+            else:
+                # No new rows for these wallets: their cursors would otherwise skip pages on the next run
+                for writer in batch_cursors:
+                    writer.discard()
+                batch_cursors = []
     
     total_elapsed = time.time() - start_time
     print(f"\n--- Backfill Complete! ---")
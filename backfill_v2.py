@@ -18,10 +18,11 @@ import json
 import requests
 from datetime import datetime
 from typing import List, Dict, Set, Optional, Tuple
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from dome_throttle import get_throttled_session, get_shared_limiter
+import dome_markets
 from google.cloud import bigquery
 from google.api_core import exceptions as bq_exceptions
+from bq_metrics import MeteredClient
 
 # Force unbuffered output
 sys.stdout.reconfigure(line_buffering=True)
@@ -41,7 +42,6 @@ CHECKPOINT_TABLE = f"{PROJECT_ID}.polycopy_v1.backfill_checkpoint"
 USE_STAGING_TABLE = os.getenv("USE_STAGING_TABLE", "true").lower() == "true"
 
 # Performance tuning - optimized for speed
-API_RATE_LIMIT_DELAY = float(os.getenv("API_RATE_LIMIT_DELAY", "0.1"))
 BATCH_UPLOAD_SIZE = int(os.getenv("BATCH_UPLOAD_SIZE", "50"))  # Smaller batches for faster checkpointing
 LARGE_WALLET_THRESHOLD = int(os.getenv("LARGE_WALLET_THRESHOLD", "100000"))  # Upload immediately if > 100K trades
 IN_MEMORY_CHUNK_SIZE = int(os.getenv("IN_MEMORY_CHUNK_SIZE", "1000000"))  # 1M trades in memory max
@@ -60,27 +60,13 @@ class BackfillError(Exception):
 
 def get_bigquery_client():
     """Initializes BigQuery client"""
-    client = bigquery.Client(project=PROJECT_ID)
+    client = MeteredClient(project=PROJECT_ID)
     return client
 
 
 def get_http_session():
-    """Creates HTTP session with retry logic"""
-    session = requests.Session()
-    retry_strategy = Retry(
-        total=MAX_RETRIES,
-        backoff_factor=RETRY_BACKOFF_BASE,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["GET"]
-    )
-    adapter = HTTPAdapter(
-        max_retries=retry_strategy,
-        pool_connections=10,
-        pool_maxsize=20
-    )
-    session.mount("https://", adapter)
-    session.mount("http://", adapter)
-    return session
+    """HTTP session paced by the shared adaptive Dome throttle (429s/Retry-After handled there)."""
+    return get_throttled_session(max_retries=MAX_RETRIES)
 
 
 def create_checkpoint_table(client):
@@ -351,9 +337,6 @@ def fetch_trades_for_wallet(
             else:
                 break
             
-            # Rate limiting
-            if API_RATE_LIMIT_DELAY > 0:
-                time.sleep(API_RATE_LIMIT_DELAY)
                 
         except requests.RequestException as e:
             print(f"  ❌ API error: {e}. Retrying...", flush=True)
@@ -363,56 +346,26 @@ def fetch_trades_for_wallet(
     return trades, condition_ids
 
 
-def fetch_markets_by_condition_ids(session: requests.Session, condition_ids: List[str]) -> Tuple[List[Dict], List[Dict]]:
-    """Fetches markets for condition IDs"""
-    if not condition_ids:
-        return [], []
-    
-    markets_mapped = []
-    markets_raw = []
-    base_url = "https://api.domeapi.io/v1"
-    batch_size = 100
-    
-    for i in range(0, len(condition_ids), batch_size):
-        batch = condition_ids[i:i + batch_size]
-        from urllib.parse import urlencode
-        url = f"{base_url}/polymarket/markets"
-        params = [('limit', len(batch))]
-        for cid in batch:
-            params.append(('condition_id', cid))
-        url = f"{url}?{urlencode(params)}"
-        
-        headers = {"Authorization": f"Bearer {DOME_API_KEY}", "Accept": "application/json"}
-        
-        try:
-            response = session.get(url, headers=headers, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-            markets = data.get('markets', []) if isinstance(data, dict) else (data if isinstance(data, list) else [])
-            
-            for market in markets:
-                mapped = {
-                    'condition_id': market.get('condition_id'),
-                    'event_slug': market.get('event_slug'),
-                    'market_slug': market.get('market_slug'),
-                    'bet_structure': market.get('bet_structure'),
-                    'market_subtype': market.get('market_subtype'),
-                    'liquidity': float(market.get('liquidity')) if market.get('liquidity') is not None else None,
-                    'status': market.get('status'),
-                    'winning_label': market.get('winning_side', {}).get('label') if isinstance(market.get('winning_side'), dict) else market.get('winning_side'),
-                    'winning_id': market.get('winning_side', {}).get('id') if isinstance(market.get('winning_side'), dict) else None,
-                }
-                if mapped['condition_id']:
-                    markets_mapped.append(mapped)
-                    markets_raw.append(market)
-            
-            if API_RATE_LIMIT_DELAY > 0:
-                time.sleep(API_RATE_LIMIT_DELAY)
-        except Exception as e:
-            print(f"  ⚠️  Market fetch error: {e}", flush=True)
-            continue
-    
-    return markets_mapped, markets_raw
+def map_market_to_bigquery(market: Dict) -> Dict:
+    """Maps Dome API market to the core markets columns"""
+    return {
+        'condition_id': market.get('condition_id'),
+        'event_slug': market.get('event_slug'),
+        'market_slug': market.get('market_slug'),
+        'bet_structure': market.get('bet_structure'),
+        'market_subtype': market.get('market_subtype'),
+        'liquidity': float(market.get('liquidity')) if market.get('liquidity') is not None else None,
+        'status': market.get('status'),
+        'winning_label': market.get('winning_side', {}).get('label') if isinstance(market.get('winning_side'), dict) else market.get('winning_side'),
+        'winning_id': market.get('winning_side', {}).get('id') if isinstance(market.get('winning_side'), dict) else None,
+    }
+
+
+def fetch_markets_by_condition_ids(condition_ids: List[str]) -> Tuple[List[Dict], List[Dict]]:
+    """Fetches markets for condition IDs (pipelined 100-id batches via dome_markets)"""
+    return dome_markets.fetch_markets_by_condition_ids(
+        condition_ids, map_market=map_market_to_bigquery, api_key=DOME_API_KEY
+    )
 
 
 def extract_events_from_markets(markets_raw: List[Dict]) -> List[Dict]:
@@ -523,7 +476,7 @@ def main():
     total_trades = 0
     
     for i, wallet in enumerate(remaining_wallets):
-        print(f"\n[{i+1}/{len(remaining_wallets)}] Processing {wallet}...", flush=True)
+        print(f"\n[{i+1}/{len(remaining_wallets)}] Processing {wallet}... (Dome rate: {get_shared_limiter().current_rps:.1f} req/s)", flush=True)
         wallet_start = time.time()
         
         try:
@@ -541,7 +494,7 @@ def main():
             wallet_markets = []
             wallet_events = []
             if condition_ids:
-                wallet_markets, raw_markets = fetch_markets_by_condition_ids(session, list(condition_ids))
+                wallet_markets, raw_markets = fetch_markets_by_condition_ids(list(condition_ids))
                 wallet_events = extract_events_from_markets(raw_markets)
                 print(f"  Found {len(wallet_markets)} markets, {len(wallet_events)} events", flush=True)
             
@@ -11,13 +11,25 @@ import os
 import time
 import sys
 import json
+import argparse
 import requests
 from datetime import datetime
 from typing import List, Dict, Set, Optional, Tuple
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from dome_client import DOME_API_BASE
+from dome_throttle import get_throttled_session, get_shared_limiter
+import dome_markets
+from market_hash import select_changed_markets
+from bq_parquet import load_table_from_rows
+from gcs_staging import staging_path
+from bq_load_coordinator import LoadJobCoordinator, staged_files_from_gcs
+from trades_merge import trades_merge_sql
+from checkpoint_writer import BACKFILL_CHECKPOINT_COLUMNS, CHECKPOINT_BUFFERED, CheckpointWriter
+from wallet_cursor import ResumableWalletWriter
+from dead_letter import DLQ_REPLAY_CONCURRENCY, FETCH_MAX_ATTEMPTS, DeadLetterQueue, FetchFailed, backoff_delay, is_retryable
+from shard_lease import BACKFILL_SHARDS, LEASE_MAX_ATTEMPTS, get_lease_store, group_by_shard, lease_owner_id, run_leased_shards
 from google.cloud import bigquery
+from bq_metrics import MeteredClient
 from google.cloud import storage
 try:
     from google.cloud import bigquery_datatransfer
@@ -36,21 +48,21 @@ MARKETS_TABLE = f"{PROJECT_ID}.polycopy_v1.markets"
 TRADES_TABLE = f"{PROJECT_ID}.polycopy_v1.trades"
 TRADES_STAGING_TABLE = f"{PROJECT_ID}.polycopy_v1.trades_staging"
 CHECKPOINT_TABLE = f"{PROJECT_ID}.polycopy_v1.backfill_checkpoint"
+SHARD_LEASES_TABLE = f"{PROJECT_ID}.polycopy_v1.backfill_shard_leases"  # Work table for BACKFILL_SHARDS mode
+DEAD_LETTER_TABLE = f"{PROJECT_ID}.polycopy_v1.ingestion_dead_letters"
+DLQ_SOURCE = "backfill_v3"
 
 USE_STAGING_TABLE = os.getenv("USE_STAGING_TABLE", "true").lower() == "true"
 USE_DTS = os.getenv("USE_DTS", "true").lower() == "true"  # Use Data Transfer Service instead of load jobs
 MAX_WORKERS = int(os.getenv("MAX_WORKERS", "5"))  # Reduced to avoid BigQuery load job quota
-API_RATE_LIMIT_DELAY = float(os.getenv("API_RATE_LIMIT_DELAY", "0.05"))  # 20 RPS
 BIGQUERY_MAX_RETRIES = int(os.getenv("BIGQUERY_MAX_RETRIES", "3"))
 BIGQUERY_RETRY_DELAY = float(os.getenv("BIGQUERY_RETRY_DELAY", "2.0"))
-BIGQUERY_LOAD_DELAY = float(os.getenv("BIGQUERY_LOAD_DELAY", "1.0"))  # Delay between load jobs to avoid quota
-BATCH_LOAD_SIZE = int(os.getenv("BATCH_LOAD_SIZE", "20"))  # Number of wallets to batch into single load job
 
 WALLET_ADDRESSES_ENV = os.getenv("WALLET_ADDRESSES")
 
 
 def get_bigquery_client():
-    return bigquery.Client(project=PROJECT_ID)
+    return MeteredClient(project=PROJECT_ID)
 
 
 def get_storage_client():
@@ -58,17 +70,8 @@ def get_storage_client():
 
 
 def get_http_session():
-    """HTTP session with retry logic"""
-    session = requests.Session()
-    retry_strategy = Retry(
-        total=5,
-        backoff_factor=2,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["GET"]
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy, pool_connections=10, pool_maxsize=20)
-    session.mount("https://", adapter)
-    return session
+    """HTTP session paced by the shared adaptive Dome throttle (429s/Retry-After handled there)."""
+    return get_throttled_session(max_retries=5)
 
 
 def create_checkpoint_table(client):
@@ -106,74 +109,114 @@ def create_checkpoint_table(client):
         print(f"⚠️  Checkpoint table setup error: {e}", flush=True)
 
 
-def verify_wallet_has_trades(client, wallet: str) -> bool:
+# Local checkpoint journal mirrored to BigQuery in the background (created in main when CHECKPOINT_BUFFERED)
+checkpoint_writer: Optional[CheckpointWriter] = None
+
+# Wallets whose fetch gave up after bounded retries (created in main / replay-dlq)
+dead_letter_queue: Optional[DeadLetterQueue] = None
+dead_lettered_wallets: Set[str] = set()  # Unresolved entries at startup (lowercase)
+
+
+def verify_checkpointed_wallets(client) -> Tuple[Set[str], List[Dict]]:
     """
-    Verifies that a wallet actually has trades in BigQuery.
-    Checks both staging and production tables.
+    Verifies every checkpointed wallet in one query: the latest checkpoint row
+    per wallet joined against distinct trade ids per wallet in staging +
+    production (one scan of wallet_address/id instead of two COUNT(*) queries
+    per wallet). A wallet is verified when it has at least the trade_count it
+    was checkpointed with (wallets checkpointed with 0 trades need none).
+    Returns (verified_wallets, mismatches).
     """
-    try:
-        # Check staging table
-        staging_query = f"""
-        SELECT COUNT(*) as cnt
-        FROM `{TRADES_STAGING_TABLE}`
-        WHERE LOWER(wallet_address) = LOWER('{wallet}')
-        """
-        staging_result = list(client.query(staging_query).result())
-        staging_count = staging_result[0].cnt if staging_result else 0
-        
-        # Check production table
-        prod_query = f"""
-        SELECT COUNT(*) as cnt
-        FROM `{TRADES_TABLE}`
-        WHERE LOWER(wallet_address) = LOWER('{wallet}')
-        """
-        prod_result = list(client.query(prod_query).result())
-        prod_count = prod_result[0].cnt if prod_result else 0
-        
-        total_count = staging_count + prod_count
-        return total_count > 0
-    except Exception as e:
-        print(f"  ⚠️  Verification error for {wallet}: {e}", flush=True)
-        return False  # If we can't verify, assume not complete
+    query = f"""
+    WITH checkpoint AS (
+        SELECT
+            LOWER(wallet_address) AS wallet,
+            ARRAY_AGG(IFNULL(trade_count, 0) ORDER BY processed_at DESC LIMIT 1)[OFFSET(0)] AS expected
+        FROM `{CHECKPOINT_TABLE}`
+        WHERE completed = true AND upload_successful = true AND wallet_address IS NOT NULL
+        GROUP BY wallet
+    ),
+    actual AS (
+        SELECT LOWER(wallet_address) AS wallet, COUNT(DISTINCT id) AS trades
+        FROM (
+            SELECT wallet_address, id FROM `{TRADES_STAGING_TABLE}`
+            UNION ALL
+            SELECT wallet_address, id FROM `{TRADES_TABLE}`
+        )
+        WHERE LOWER(wallet_address) IN (SELECT wallet FROM checkpoint)
+        GROUP BY wallet
+    )
+    SELECT c.wallet, c.expected, IFNULL(a.trades, 0) AS actual
+    FROM checkpoint c
+    LEFT JOIN actual a USING (wallet)
+    """
+    verified = set()
+    mismatches = []
+    for row in client.query(query).result():
+        if row.actual >= row.expected:
+            verified.add(row.wallet)
+        else:
+            mismatches.append({'wallet': row.wallet, 'expected': row.expected, 'actual': row.actual})
+    return verified, mismatches
 
 
 def get_processed_wallets(client, verify: bool = True) -> Set[str]:
     """
     Gets successfully processed wallets.
-    If verify=True, also checks that wallets actually have trades in BigQuery.
+    If verify=True, also checks that wallets actually have their checkpointed
+    trades in BigQuery (one set-based query, see verify_checkpointed_wallets).
     """
     create_checkpoint_table(client)
     try:
-        query = f"""
-        SELECT DISTINCT wallet_address 
-        FROM `{CHECKPOINT_TABLE}` 
-        WHERE completed = true AND upload_successful = true
-        """
-        results = client.query(query).result()
-        checkpoint_wallets = {row.wallet_address.lower() for row in results if row.wallet_address}
-        
-        if not verify:
-            return checkpoint_wallets
-        
-        # Verify wallets actually have trades
-        verified_wallets = set()
-        for wallet in checkpoint_wallets:
-            if verify_wallet_has_trades(client, wallet):
-                verified_wallets.add(wallet)
-            else:
-                print(f"  ⚠️  Wallet {wallet} marked complete but has no trades. Will reprocess.", flush=True)
-        
-        return verified_wallets
+        if verify:
+            processed, mismatches = verify_checkpointed_wallets(client)
+            for mismatch in mismatches[:20]:
+                print(f"  ⚠️  Wallet {mismatch['wallet']} checkpointed with {mismatch['expected']:,} trades but has {mismatch['actual']:,}. Will reprocess.", flush=True)
+            if len(mismatches) > 20:
+                print(f"  ⚠️  ... and {len(mismatches) - 20} more wallets with missing trades", flush=True)
+        else:
+            query = f"""
+            SELECT DISTINCT wallet_address 
+            FROM `{CHECKPOINT_TABLE}` 
+            WHERE completed = true AND upload_successful = true
+            """
+            results = client.query(query).result()
+            processed = {row.wallet_address.lower() for row in results if row.wallet_address}
     except Exception as e:
         print(f"  ⚠️  Error getting processed wallets: {e}", flush=True)
-        return set()
+        processed = set()
+    
+    # Records in the local journal that have not reached BigQuery yet override it
+    if checkpoint_writer is not None:
+        local = checkpoint_writer.journal.latest_rows(CHECKPOINT_TABLE, unmirrored_only=True)
+        for wallet, row in local.items():
+            if row.get('completed') and row.get('upload_successful'):
+                processed.add(wallet)
+            else:
+                processed.discard(wallet)
+        if local:
+            print(f"  📒 {len(local)} wallet checkpoints taken from the local journal (not yet in BigQuery)", flush=True)
+    return processed
 
 
 def mark_wallet_complete(client, wallet: str, trade_count: int, gcs_file: str, success: bool, retry_count: int = 0):
     """
     Marks wallet complete with retry logic.
     CRITICAL: This must succeed for resume capability.
+    With the checkpoint writer the row is committed to the local journal and
+    mirrored by its background MERGE; the worker does not wait on BigQuery.
     """
+    row = {
+        'wallet_address': wallet.lower(),
+        'completed': True,
+        'processed_at': datetime.utcnow().isoformat(),
+        'trade_count': trade_count,
+        'gcs_file': gcs_file,
+        'upload_successful': success
+    }
+    if checkpoint_writer is not None:
+        checkpoint_writer.record(row)
+        return True
+    
     max_retries = 5
     for attempt in range(max_retries):
         try:
@@ -183,15 +226,7 @@ def mark_wallet_complete(client, wallet: str, trade_count: int, gcs_file: str, s
             except:
                 pass
             
-            rows = [{
-                'wallet_address': wallet.lower(),
-                'completed': True,
-                'processed_at': datetime.utcnow().isoformat(),
-                'trade_count': trade_count,
-                'gcs_file': gcs_file,
-                'upload_successful': success
-            }]
-            errors = client.insert_rows_json(CHECKPOINT_TABLE, rows)
+            errors = client.insert_rows_json(CHECKPOINT_TABLE, [row])
             if errors:
                 raise Exception(f"Insert errors: {errors}")
             return True  # Success
@@ -209,115 +244,131 @@ def mark_wallet_complete(client, wallet: str, trade_count: int, gcs_file: str, s
 
 def fetch_trades_to_gcs(session: requests.Session, storage_client: storage.Client, wallet: str) -> tuple[str, int, Set[str]]:
     """
-    Fetches all trades for a wallet and streams to GCS JSONL file.
+    Fetches all trades for a wallet and streams them to a gzip NDJSON file in GCS
+    (batched serialization via NDJSONStagingWriter parts). Pages go to part files and the
+    pagination cursor is persisted every WALLET_CURSOR_EVERY_PAGES pages, so a
+    restarted job continues the wallet from its last durable page; the parts are
+    composed into the staging file at the end.
     Returns (gcs_file_path, trade_count, condition_ids_set)
     """
-    gcs_file = f"trades/{wallet}.jsonl"
+    gcs_file = staging_path(f"trades/{wallet}")
     bucket = storage_client.bucket(GCS_BUCKET)
-    blob = bucket.blob(gcs_file)
+    writer = ResumableWalletWriter(bucket, wallet, gcs_file)
+    cursor = writer.cursor
     
-    # Use blob.open() for streaming write
-    trade_count = 0
+    trade_count = cursor.trade_count
     seen_ids = set()  # Only for within-this-fetch deduplication
-    condition_ids = set()  # Track condition_ids from trades
+    condition_ids = set(cursor.condition_ids)  # Track condition_ids from trades
     
-    offset = 0
+    offset = cursor.offset
     limit = 1000
-    pagination_key = None
-    page_count = 0
+    pagination_key = cursor.pagination_key
+    page_count = cursor.page_count
+    attempts = 0  # Consecutive failures of the current page
     
-    with blob.open('w') as f:
-        while True:
-            base_url = "https://api.domeapi.io/v1"
-            url = f"{base_url}/polymarket/orders?user={wallet}&limit={limit}"
-            
-            if pagination_key:
-                url += f"&pagination_key={pagination_key}"
-            elif offset <= 10000:
-                url += f"&offset={offset}"
-            else:
-                break
+    while True:
+        base_url = DOME_API_BASE
+        url = f"{base_url}/polymarket/orders?user={wallet}&limit={limit}"
+        
+        if pagination_key:
+            url += f"&pagination_key={pagination_key}"
+        elif offset <= 10000:
+            url += f"&offset={offset}"
+        else:
+            break
+        
+        headers = {"Authorization": f"Bearer {DOME_API_KEY}", "Accept": "application/json"}
+        
+        try:
+            response = session.get(url, headers=headers, timeout=30)
+            response.raise_for_status()
+            data = response.json()
+            orders = data.get('orders', [])
+            pagination = data.get('pagination', {})
+            page_count += 1
+            attempts = 0
             
-            headers = {"Authorization": f"Bearer {DOME_API_KEY}", "Accept": "application/json"}
+            if page_count % 50 == 0:
+                print(f"    [{wallet[:10]}...] Page {page_count}: {trade_count:,} trades", flush=True)
             
-            try:
-                time.sleep(API_RATE_LIMIT_DELAY)  # Rate limiting
-                response = session.get(url, headers=headers, timeout=30)
-                response.raise_for_status()
-                data = response.json()
-                orders = data.get('orders', [])
-                pagination = data.get('pagination', {})
-                page_count += 1
+            # Stream to file
+            for order in orders:
+                trade_id = order.get('order_hash') or order.get('tx_hash')
+                if not trade_id or trade_id in seen_ids:
+                    continue
+                seen_ids.add(trade_id)
                 
-                if page_count % 50 == 0:
-                    print(f"    [{wallet[:10]}...] Page {page_count}: {trade_count:,} trades", flush=True)
+                # Convert timestamp
+                timestamp_unix = order.get('timestamp')
+                timestamp_str = None
+                if timestamp_unix:
+                    timestamp_str = datetime.fromtimestamp(timestamp_unix).strftime('%Y-%m-%d %H:%M:%S')
                 
-                # Stream to file
-                for order in orders:
-                    trade_id = order.get('order_hash') or order.get('tx_hash')
-                    if not trade_id or trade_id in seen_ids:
-                        continue
-                    seen_ids.add(trade_id)
-                    
-                    # Convert timestamp
-                    timestamp_unix = order.get('timestamp')
-                    timestamp_str = None
-                    if timestamp_unix:
-                        timestamp_str = datetime.fromtimestamp(timestamp_unix).strftime('%Y-%m-%d %H:%M:%S')
-                    
-                    condition_id = order.get('condition_id')
-                    
-                    trade = {
-                        "id": trade_id,
-                        "condition_id": condition_id,
-                        "wallet_address": order.get("user") or wallet,
-                        "timestamp": timestamp_str,
-                        "side": order.get("side"),
-                        "price": float(order.get('price')) if order.get('price') is not None else None,
-                        "shares_normalized": float(order.get('shares_normalized')) if order.get('shares_normalized') is not None else None,
-                        "token_label": order.get("token_label"),
-                        "token_id": order.get("token_id"),
-                        "tx_hash": order.get("tx_hash"),
-                        # Note: order_hash, taker, market_slug, title not included
-                        # - order_hash: redundant (have id and tx_hash)
-                        # - taker: counterparty wallet, not needed for ML model
-                        # - market_slug, title: join to markets table via condition_id
-                    }
-                    
-                    f.write(json.dumps(trade) + '\n')
-                    trade_count += 1
-                    
-                    # Track condition_id for markets/events fetching
-                    if condition_id:
-                        condition_ids.add(condition_id)
+                condition_id = order.get('condition_id')
                 
-                # Pagination
-                has_more = pagination.get('has_more', False)
-                new_pagination_key = pagination.get('pagination_key')
+                trade = {
+                    "id": trade_id,
+                    "condition_id": condition_id,
+                    "wallet_address": order.get("user") or wallet,
+                    "timestamp": timestamp_str,
+                    "side": order.get("side"),
+                    "price": float(order.get('price')) if order.get('price') is not None else None,
+                    "shares_normalized": float(order.get('shares_normalized')) if order.get('shares_normalized') is not None else None,
+                    "token_label": order.get("token_label"),
+                    "token_id": order.get("token_id"),
+                    "tx_hash": order.get("tx_hash"),
+                    # Note: order_hash, taker, market_slug, title not included
+                    # - order_hash: redundant (have id and tx_hash)
+                    # - taker: counterparty wallet, not needed for ML model
+                    # - market_slug, title: join to markets table via condition_id
+                }
                 
-                if not has_more or len(orders) == 0:
-                    break
+                writer.write(trade)
+                trade_count += 1
                 
-                if new_pagination_key:
+                # Track condition_id for markets/events fetching
+                if condition_id:
+                    condition_ids.add(condition_id)
+            
+            # Pagination
+            has_more = pagination.get('has_more', False)
+            new_pagination_key = pagination.get('pagination_key')
+            
+            if not has_more or len(orders) == 0:
+                break
+            
+            if new_pagination_key:
+                pagination_key = new_pagination_key
+                offset = None
+            elif offset is not None:
+                next_offset = offset + len(orders)
+                if next_offset > 10000:
+                    if not new_pagination_key:
+                        break
                     pagination_key = new_pagination_key
                     offset = None
-                elif offset is not None:
-                    next_offset = offset + len(orders)
-                    if next_offset > 10000:
-                        if not new_pagination_key:
-                            break
-                        pagination_key = new_pagination_key
-                        offset = None
-                    else:
-                        offset = next_offset
                 else:
-                    break
-                    
-            except Exception as e:
-                print(f"  ❌ Error fetching {wallet}: {e}", flush=True)
-                time.sleep(5)
-                continue
+                    offset = next_offset
+            else:
+                break
+            
+            # Cursor for the next page; durable every WALLET_CURSOR_EVERY_PAGES pages
+            writer.page_done(offset, pagination_key, page_count, trade_count, condition_ids)
+                
+        except Exception as e:
+            attempts += 1
+            if attempts >= FETCH_MAX_ATTEMPTS or not is_retryable(e):
+                # Pages fetched so far stay durable; a replay resumes from this cursor
+                if writer.enabled:
+                    writer.checkpoint()
+                raise FetchFailed(wallet, {'offset': offset, 'pagination_key': pagination_key, 'page': page_count}, e, attempts)
+            delay = backoff_delay(attempts)
+            print(f"  ❌ Error fetching {wallet} (attempt {attempts}/{FETCH_MAX_ATTEMPTS}): {e} - retrying in {delay:.1f}s", flush=True)
+            time.sleep(delay)
+            continue
     
+    writer.finish()
+    print(f"    📦 {writer.summary()}", flush=True)
     return gcs_file, trade_count, condition_ids
 
 
@@ -347,114 +398,87 @@ def ensure_staging_table_exists(client):
         print(f"✅ Staging table created (non-partitioned)", flush=True)
 
 
-def load_gcs_to_bigquery(client: bigquery.Client, gcs_file: str, table_id: str) -> bool:
+def load_gcs_to_bigquery(client: bigquery.Client, gcs_file: str, table_id: str, load_table: Optional[str] = None) -> bool:
     """
-    Loads JSONL file from GCS to BigQuery with deduplication and retry logic.
+    Loads JSONL files from GCS to BigQuery in ONE load job. Errors propagate
+    so LoadJobCoordinator can retry rate limits and stop on quota errors.
     - If staging table: Direct INSERT (dedup happens in copy_staging_to_production)
-    - If production table: MERGE for deduplication (avoids partition quota issues)
+    - If production table: load into load_table (truncated), then MERGE for deduplication
     Supports single file or list of files for batching.
     """
-    # Support both single file and list of files
+    # Support both single file and list of files (paths in GCS_BUCKET or gs:// URIs)
     if isinstance(gcs_file, str):
         gcs_files = [gcs_file]
     else:
         gcs_files = gcs_file
+    gcs_uris = [f if f.startswith("gs://") else f"gs://{GCS_BUCKET}/{f}" for f in gcs_files]
     
-    for attempt in range(BIGQUERY_MAX_RETRIES):
-        try:
-            is_staging = table_id == TRADES_STAGING_TABLE
-            temp_table_id = None
-            
-            if is_staging:
-                # Staging table: Direct INSERT (non-partitioned, no quota)
-                # Batch multiple files into single load job to reduce quota usage
-                job_config = bigquery.LoadJobConfig(
-                    write_disposition="WRITE_APPEND",
-                    source_format="NEWLINE_DELIMITED_JSON",
-                    autodetect=False,
-                    ignore_unknown_values=False
-                )
-                gcs_uris = [f"gs://{GCS_BUCKET}/{f}" for f in gcs_files]
-                # Load multiple URIs in single job (reduces quota usage)
-                load_job = client.load_table_from_uri(gcs_uris, table_id, job_config=job_config)
-                load_job.result()
-                return True
-            else:
-                # Production table: Use MERGE for deduplication
-                temp_table_id = f"{table_id}_temp_{int(time.time() * 1000000)}"
-                dest_table = client.get_table(table_id)
-                temp_table = bigquery.Table(temp_table_id, schema=dest_table.schema)
-                client.create_table(temp_table)
-                
-                # Load to temp
-                job_config = bigquery.LoadJobConfig(
-                    write_disposition="WRITE_TRUNCATE",
-                    source_format="NEWLINE_DELIMITED_JSON",
-                    autodetect=False
-                )
-                gcs_uri = f"gs://{GCS_BUCKET}/{gcs_file}"
-                load_job = client.load_table_from_uri(gcs_uri, temp_table_id, job_config=job_config)
-                load_job.result()
-                
-                # MERGE to production with appropriate deduplication
-                # For trades table: use idempotency key (wallet_address + tx_hash + order_hash)
-                # For other tables: use id
-                is_trades_table = 'trades' in table_id.lower() and 'staging' not in table_id.lower()
-                
-                if is_trades_table:
-                    merge_query = f"""
-                    MERGE `{table_id}` AS target
-                    USING (
-                        SELECT *
-                        FROM `{temp_table_id}`
-                        QUALIFY ROW_NUMBER() OVER (
-                            PARTITION BY wallet_address, tx_hash, COALESCE(order_hash, '')
-                            ORDER BY timestamp DESC, id DESC
-                        ) = 1
-                    ) AS source
-                    ON target.wallet_address = source.wallet_address
-                       AND target.tx_hash = source.tx_hash
-                       AND COALESCE(target.order_hash, '') = COALESCE(source.order_hash, '')
-                    WHEN NOT MATCHED THEN INSERT ROW
-                    """
-                else:
-                    # For markets, events, etc. - use id-based deduplication
-                    merge_query = f"""
-                    MERGE `{table_id}` AS target
-                    USING (
-                        SELECT *
-                        FROM `{temp_table_id}`
-                        QUALIFY ROW_NUMBER() OVER (PARTITION BY id ORDER BY timestamp DESC) = 1
-                    ) AS source
-                    ON target.id = source.id
-                    WHEN NOT MATCHED THEN INSERT ROW
-                    """
-                
-                merge_job = client.query(merge_query)
-                merge_job.result()
-                
-                client.delete_table(temp_table_id)
-                return True
-            
-        except Exception as e:
-            # Clean up temp table on error
-            if temp_table_id:
-                try:
-                    client.delete_table(temp_table_id)
-                except:
-                    pass
-            
-            if attempt < BIGQUERY_MAX_RETRIES - 1:
-                wait_time = BIGQUERY_RETRY_DELAY * (2 ** attempt)
-                print(f"  ⚠️  BigQuery load failed (attempt {attempt + 1}/{BIGQUERY_MAX_RETRIES}): {e}. Retrying in {wait_time}s...", flush=True)
-                time.sleep(wait_time)
-            else:
-                print(f"  ❌ BigQuery load failed after {BIGQUERY_MAX_RETRIES} attempts: {e}", flush=True)
-                import traceback
-                traceback.print_exc()
-                return False
+    if table_id == TRADES_STAGING_TABLE:
+        # Staging table: Direct INSERT (non-partitioned, no quota)
+        # Batch multiple files into single load job to reduce quota usage
+        job_config = bigquery.LoadJobConfig(
+            write_disposition="WRITE_APPEND",
+            source_format="NEWLINE_DELIMITED_JSON",
+            autodetect=False,
+            ignore_unknown_values=False
+        )
+        client.load_table_from_uri(gcs_uris, table_id, job_config=job_config).result()
+        return True
     
-    return False
+    # Production table: Use MERGE for deduplication
+    temp_table_id = None if load_table else f"{table_id}_temp_{int(time.time() * 1000000)}"
+    load_table = load_table or temp_table_id
+    try:
+        dest_table = client.get_table(table_id)
+        client.create_table(bigquery.Table(load_table, schema=dest_table.schema), exists_ok=True)
+    
+        # Load to the load table (replaces the previous batch)
+        job_config = bigquery.LoadJobConfig(
+            write_disposition="WRITE_TRUNCATE",
+            source_format="NEWLINE_DELIMITED_JSON",
+            autodetect=False
+        )
+        client.load_table_from_uri(gcs_uris, load_table, job_config=job_config).result()
+    
+        # MERGE to production with appropriate deduplication
+        # For trades table: use idempotency key (wallet_address + tx_hash + order_hash)
+        # For other tables: use id
+        is_trades_table = 'trades' in table_id.lower() and 'staging' not in table_id.lower()
+    
+        if is_trades_table:
+            merge_query = f"""
+            MERGE `{table_id}` AS target
+            USING (
+                SELECT *
+                FROM `{load_table}`
+                QUALIFY ROW_NUMBER() OVER (
+                    PARTITION BY wallet_address, tx_hash, COALESCE(order_hash, '')
+                    ORDER BY timestamp DESC, id DESC
+                ) = 1
+            ) AS source
+            ON target.wallet_address = source.wallet_address
+               AND target.tx_hash = source.tx_hash
+               AND COALESCE(target.order_hash, '') = COALESCE(source.order_hash, '')
+            WHEN NOT MATCHED THEN INSERT ROW
+            """
+        else:
+            # For markets, events, etc. - use id-based deduplication
+            merge_query = f"""
+            MERGE `{table_id}` AS target
+            USING (
+                SELECT *
+                FROM `{load_table}`
+                QUALIFY ROW_NUMBER() OVER (PARTITION BY id ORDER BY timestamp DESC) = 1
+            ) AS source
+            ON target.id = source.id
+            WHEN NOT MATCHED THEN INSERT ROW
+            """
+    
+        client.query(merge_query).result()
+    finally:
+        if temp_table_id:
+            client.delete_table(temp_table_id, not_found_ok=True)
+    return True
 
 
 def copy_staging_to_production(client: bigquery.Client):
@@ -498,12 +522,11 @@ def copy_staging_to_production(client: bigquery.Client):
 
 
 def fetch_markets_by_condition_ids(
-    session: requests.Session, 
     condition_ids: List[str],
     already_fetched: Set[str] = None
 ) -> Tuple[List[Dict], List[Dict], Set[str]]:
     """
-    Fetches markets for condition IDs.
+    Fetches markets for condition IDs (pipelined 100-id batches via dome_markets).
     Skips condition_ids that are already in already_fetched set.
     Returns (markets_mapped, markets_raw, newly_fetched_condition_ids)
     """
@@ -518,94 +541,11 @@ def fetch_markets_by_condition_ids(
     if not new_condition_ids:
         return [], [], set()
     
-    markets_mapped = []
-    markets_raw = []
-    newly_fetched = set()
-    base_url = "https://api.domeapi.io/v1"
-    batch_size = 100
+    markets_mapped, markets_raw = dome_markets.fetch_markets_by_condition_ids(new_condition_ids, api_key=DOME_API_KEY)
     
-    for i in range(0, len(new_condition_ids), batch_size):
-        batch = new_condition_ids[i:i + batch_size]
-        from urllib.parse import urlencode
-        url = f"{base_url}/polymarket/markets"
-        params = [('limit', len(batch))]
-        for cid in batch:
-            params.append(('condition_id', cid))
-        url = f"{url}?{urlencode(params)}"
-        
-        headers = {"Authorization": f"Bearer {DOME_API_KEY}", "Accept": "application/json"}
-        
-        try:
-            time.sleep(API_RATE_LIMIT_DELAY)
-            response = session.get(url, headers=headers, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-            markets = data.get('markets', []) if isinstance(data, dict) else (data if isinstance(data, list) else [])
-            
-            for market in markets:
-                # Convert timestamps
-                def to_timestamp(unix_seconds):
-                    if unix_seconds and isinstance(unix_seconds, (int, float)):
-                        dt = datetime.fromtimestamp(unix_seconds)
-                        return dt.strftime('%Y-%m-%d %H:%M:%S')
-                    return None
-                
-                def to_number(value):
-                    if value is None:
-                        return None
-                    try:
-                        return float(value) if isinstance(value, (int, float, str)) else None
-                    except:
-                        return None
-                
-                mapped = {
-                    'condition_id': market.get('condition_id'),
-                    'event_slug': market.get('event_slug'),
-                    'market_slug': market.get('market_slug'),
-                    'bet_structure': market.get('bet_structure'),
-                    'market_subtype': market.get('market_subtype'),
-                    'market_type': market.get('market_type'),  # For classification
-                    'liquidity': to_number(market.get('liquidity')),
-                    'status': market.get('status'),
-                    'winning_label': market.get('winning_side', {}).get('label') if isinstance(market.get('winning_side'), dict) else market.get('winning_side'),
-                    'winning_id': market.get('winning_side', {}).get('id') if isinstance(market.get('winning_side'), dict) else None,
-                    # Text fields
-                    'title': market.get('title'),
-                    'description': market.get('description'),
-                    'resolution_source': market.get('resolution_source'),
-                    'image': market.get('image'),
-                    'negative_risk_id': market.get('negative_risk_id'),  # Risk field
-                    'game_start_time_raw': market.get('game_start_time'),
-                    # Volume fields
-                    'volume_1_week': to_number(market.get('volume_1_week')),
-                    'volume_1_month': to_number(market.get('volume_1_month')),
-                    'volume_1_year': to_number(market.get('volume_1_year')),
-                    'volume_total': to_number(market.get('volume_total')),
-                    # Timestamp fields
-                    'start_time': to_timestamp(market.get('start_time')),
-                    'end_time': to_timestamp(market.get('end_time')),
-                    'completed_time': to_timestamp(market.get('completed_time')),
-                    'close_time': to_timestamp(market.get('close_time')),
-                    'game_start_time': to_timestamp(market.get('game_start_time')),
-                    # Unix timestamp fields
-                    'start_time_unix': int(market.get('start_time')) if market.get('start_time') else None,
-                    'end_time_unix': int(market.get('end_time')) if market.get('end_time') else None,
-                    'completed_time_unix': int(market.get('completed_time')) if market.get('completed_time') else None,
-                    'close_time_unix': int(market.get('close_time')) if market.get('close_time') else None,
-                    # JSON fields
-                    'side_a': json.dumps(market.get('side_a')) if market.get('side_a') else None,
-                    'side_b': json.dumps(market.get('side_b')) if market.get('side_b') else None,
-                    'tags': json.dumps(market.get('tags')) if market.get('tags') else None,
-                }
-                if mapped['condition_id']:
-                    markets_mapped.append(mapped)
-                    markets_raw.append(market)
-                    # Track that we've fetched this condition_id
-                    newly_fetched.add(mapped['condition_id'])
-                    already_fetched.add(mapped['condition_id'])
-        except Exception as e:
-            print(f"  ⚠️  Market fetch error: {e}", flush=True)
-            continue
+    # Track that we've fetched these condition_ids
+    newly_fetched = {market['condition_id'] for market in markets_mapped}
+    already_fetched.update(newly_fetched)
     
     return markets_mapped, markets_raw, newly_fetched
 
@@ -657,6 +597,10 @@ def load_markets_to_bigquery(client: bigquery.Client, markets: List[Dict]) -> bo
     if not markets:
         return True
     
+    markets = select_changed_markets(client, MARKETS_TABLE, markets)
+    if not markets:
+        return True
+    
     for attempt in range(BIGQUERY_MAX_RETRIES):
         temp_table_id = None
         try:
@@ -672,7 +616,7 @@ def load_markets_to_bigquery(client: bigquery.Client, markets: List[Dict]) -> bo
                 source_format="NEWLINE_DELIMITED_JSON",
                 autodetect=False
             )
-            load_job = client.load_table_from_json(markets, temp_table_id, job_config=job_config)
+            load_job = load_table_from_rows(client, markets, temp_table_id, job_config=job_config, schema=dest_table.schema)
             load_job.result()
             
             # MERGE to destination (deduplicates on condition_id)
@@ -717,6 +661,7 @@ def load_markets_to_bigquery(client: bigquery.Client, markets: List[Dict]) -> bo
                 side_a = source.side_a,
                 side_b = source.side_b,
                 tags = source.tags,
+                content_hash = source.content_hash,
                 last_updated = CURRENT_TIMESTAMP()
             """
             
@@ -763,7 +708,7 @@ def load_events_to_bigquery(client: bigquery.Client, events: List[Dict]) -> bool
                 source_format="NEWLINE_DELIMITED_JSON",
                 autodetect=False
             )
-            load_job = client.load_table_from_json(events, temp_table_id, job_config=job_config)
+            load_job = load_table_from_rows(client, events, temp_table_id, job_config=job_config, schema=dest_table.schema)
             load_job.result()
             
             # MERGE to destination (deduplicates on event_slug)
@@ -831,6 +776,8 @@ def process_wallet_fetch_only(
         gcs_file, trade_count, condition_ids = fetch_trades_to_gcs(session, storage_client, wallet)
         print(f"  ✅ Fetched {trade_count:,} trades to {gcs_file}", flush=True)
         print(f"  Found {len(condition_ids)} unique condition_ids in trades", flush=True)
+        if dead_letter_queue is not None and wallet.lower() in dead_lettered_wallets:
+            dead_letter_queue.resolve(wallet, DLQ_SOURCE)
         
         if trade_count == 0:
             # Mark complete immediately for wallets with no trades (no load needed)
@@ -840,73 +787,36 @@ def process_wallet_fetch_only(
         # Return GCS file info for batching (don't load immediately)
         # Loading will happen in batches via DTS or batched load jobs
         return (wallet, gcs_file, trade_count, condition_ids, fetched_markets, fetched_events)
+    
+    except FetchFailed as e:
+        # Bounded retries exhausted: park the wallet in the dead-letter table and free the worker
+        print(f"  ❌ Giving up on {wallet}: {e}", flush=True)
+        if dead_letter_queue is not None:
+            dead_letter_queue.record(DLQ_SOURCE, e)
+        return None
             
     except Exception as e:
         print(f"  ❌ Error processing {wallet}: {e}", flush=True)
         import traceback
         traceback.print_exc()
+        if dead_letter_queue is not None:
+            dead_letter_queue.record(DLQ_SOURCE, FetchFailed(wallet, {}, e, 1))
         # Return None to indicate failure
         return None
 
 
-def main():
-    """Main function with parallel processing"""
-    if not DOME_API_KEY:
-        raise ValueError("DOME_API_KEY not set")
-    
-    print("=" * 80, flush=True)
-    print("BACKFILL v3 (Hybrid) STARTING", flush=True)
-    print("=" * 80, flush=True)
-    
-    bq_client = get_bigquery_client()
-    storage_client = get_storage_client()
-    session = get_http_session()
-    
-    # Ensure staging table exists (CRITICAL for partition quota)
-    if USE_STAGING_TABLE:
-        ensure_staging_table_exists(bq_client)
-    
-    # Ensure GCS bucket exists
-    try:
-        bucket = storage_client.bucket(GCS_BUCKET)
-        if not bucket.exists():
-            bucket.create(location="US")
-    except:
-        pass
-    
-    # Get wallets
-    if WALLET_ADDRESSES_ENV:
-        trader_wallets = [w.strip() for w in WALLET_ADDRESSES_ENV.split(",") if w.strip()]
-    else:
-        query = f"SELECT DISTINCT wallet_address FROM `{TRADERS_TABLE}` WHERE wallet_address IS NOT NULL"
-        results = bq_client.query(query).result()
-        trader_wallets = [row['wallet_address'] for row in results if row.get('wallet_address')]
-    
-    if not trader_wallets:
-        raise ValueError("No wallets to process")
-    
-    # Filter processed wallets (with verification)
-    print("Checking for already-processed wallets...", flush=True)
-    verify_checkpoints = os.getenv("VERIFY_CHECKPOINTS", "true").lower() == "true"
-    processed = get_processed_wallets(bq_client, verify=verify_checkpoints)
-    remaining = [w for w in trader_wallets if w.lower() not in processed]
-    
-    print(f"\n{'='*80}", flush=True)
-    print(f"Wallet Summary:", flush=True)
-    print(f"  Total wallets: {len(trader_wallets)}", flush=True)
-    print(f"  Already processed (verified): {len(processed)}", flush=True)
-    print(f"  Remaining to process: {len(remaining)}", flush=True)
-    print(f"  Max workers: {MAX_WORKERS}", flush=True)
-    print(f"{'='*80}", flush=True)
-    
-    if len(processed) > 0:
-        print(f"\nSkipping {len(processed)} already-processed wallets.", flush=True)
-        print(f"Set VERIFY_CHECKPOINTS=false to skip verification (faster startup).", flush=True)
-    
-    if not remaining:
-        print("All wallets processed!")
-        return
-    
+def process_wallets(
+    bq_client: bigquery.Client,
+    storage_client: storage.Client,
+    session: requests.Session,
+    wallets: List[str],
+    use_dts: bool = USE_DTS,
+    max_workers: int = MAX_WORKERS,
+) -> int:
+    """
+    Runs the three phases (fetch to GCS, load trades, markets/events) for a list of wallets.
+    Returns the number of wallets whose trades were loaded.
+    """
     # Shared sets to track fetched markets/events across all wallets (avoid duplicate API calls)
     # Use Lock for thread-safe access
     from threading import Lock
@@ -914,17 +824,14 @@ def main():
     fetched_markets = set()  # condition_ids already fetched in this run
     fetched_events = set()   # event_slugs already fetched in this run
     
-    # Process in parallel with batching
-    start_time = time.time()
-    
     # Phase 1: Fetch all wallets to GCS (parallel)
     print(f"\n{'='*80}", flush=True)
-    print("Phase 1: Fetching trades to GCS (parallel)...", flush=True)
+    print(f"Phase 1: Fetching trades to GCS (parallel, {len(wallets)} wallets)...", flush=True)
     print(f"{'='*80}", flush=True)
     
     wallet_results = []  # List of (wallet, gcs_file, trade_count, condition_ids) tuples
     
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
         def fetch_wallet(wallet):
             # Get current state (thread-safe)
             with fetched_markets_lock:
@@ -944,7 +851,7 @@ def main():
         
         futures = {
             executor.submit(fetch_wallet, wallet): wallet
-            for wallet in remaining
+            for wallet in wallets
         }
         
         completed = 0
@@ -963,12 +870,12 @@ def main():
                 failed += 1
                 print(f"  ❌ {wallet} failed: {e}", flush=True)
             
-            if completed % 10 == 0 or completed == len(remaining):
-                print(f"Fetch progress: {completed}/{len(remaining)} wallets ({failed} failed, {len(wallet_results)} ready for batch load)", flush=True)
+            if completed % 10 == 0 or completed == len(wallets):
+                print(f"Fetch progress: {completed}/{len(wallets)} wallets ({failed} failed, {len(wallet_results)} ready for batch load) | Dome throttle: {get_shared_limiter().metrics()}", flush=True)
     
     # Phase 2: Load trades to BigQuery (via DTS or direct load)
     print(f"\n{'='*80}", flush=True)
-    if USE_DTS:
+    if use_dts:
         print(f"Phase 2: Triggering Data Transfer Service ({len(wallet_results)} wallets)...", flush=True)
         print(f"{'='*80}", flush=True)
         
@@ -976,7 +883,7 @@ def main():
         # All files in GCS matching the pattern will be loaded
         if not DTS_AVAILABLE:
             print(f"  ⚠️  DTS library not available - falling back to direct load", flush=True)
-            USE_DTS = False
+            use_dts = False
         else:
             try:
                 dts_client = bigquery_datatransfer.DataTransferServiceClient()
@@ -1008,7 +915,7 @@ def main():
                             data_source_id="google_cloud_storage",
                             destination_dataset_id="polycopy_v1",
                             params={
-                                "data_path_template": f"gs://{GCS_BUCKET}/trades/*.jsonl",
+                                "data_path_template": f"gs://{GCS_BUCKET}/trades/*",  # .jsonl and .jsonl.gz
                                 "destination_table_name_template": "trades_staging",
                                 "file_format": "NEWLINE_DELIMITED_JSON",
                                 "write_disposition": "WRITE_APPEND",
@@ -1027,7 +934,7 @@ def main():
                     except Exception as e:
                         print(f"  ❌ Failed to create DTS config: {e}", flush=True)
                         print(f"  ⚠️  Falling back to direct load jobs...", flush=True)
-                        USE_DTS = False
+                        use_dts = False
                 
                 print(f"Triggering DTS transfer for all GCS files...", flush=True)
                 run_request = bigquery_datatransfer.StartManualTransferRunsRequest(
@@ -1074,41 +981,53 @@ def main():
                         successful_wallets = wallet_results
                 else:
                     print(f"  ⚠️  Could not start DTS transfer - falling back to direct load", flush=True)
-                    USE_DTS = False  # Fall back to direct load
+                    use_dts = False  # Fall back to direct load
             
             except Exception as e:
                 print(f"  ⚠️  DTS error: {e}. Falling back to direct load jobs...", flush=True)
                 import traceback
                 traceback.print_exc()
-                USE_DTS = False  # Fall back to direct load
+                use_dts = False  # Fall back to direct load
     
-    if not USE_DTS:
+    if not use_dts:
         # Fallback: Direct batch loading (original approach)
         print(f"Phase 2: Batch loading trades to BigQuery ({len(wallet_results)} wallets)...", flush=True)
         print(f"{'='*80}", flush=True)
         
         target_table = TRADES_STAGING_TABLE if USE_STAGING_TABLE else TRADES_TABLE
-        batch_num = 0
+        # Load jobs go straight into staging; production batches go through one
+        # load table per run (then MERGE), so that is the table whose quota counts
+        load_table = target_table if USE_STAGING_TABLE else f"{TRADES_TABLE}_load_{int(time.time())}_{os.getpid()}"
         successful_wallets = []
         
-        for i in range(0, len(wallet_results), BATCH_LOAD_SIZE):
-            batch = wallet_results[i:i + BATCH_LOAD_SIZE]
-            batch_num += 1
-            batch_gcs_files = [result[1] for result in batch]  # Extract GCS file paths
-            
-            print(f"\nBatch {batch_num}: Loading {len(batch)} wallets ({len(batch_gcs_files)} GCS files)...", flush=True)
-            
-            # Load batch of GCS files in single load job
-            trades_success = load_gcs_to_bigquery(bq_client, batch_gcs_files, target_table)
-            
-            if trades_success:
-                print(f"  ✅ Batch {batch_num} loaded successfully", flush=True)
-                successful_wallets.extend(batch)
+        # Batches are sized by GCS bytes and paced against the table's daily load-job quota
+        coordinator = LoadJobCoordinator(bq_client, load_table)
+        results_by_file = {result[1]: result for result in wallet_results}
+        staged_files = staged_files_from_gcs(storage_client, GCS_BUCKET, "trades/", names=results_by_file.keys())
+        batches = coordinator.plan(staged_files)
+        
+        def on_batch_loaded(batch, success):
+            batch_results = [results_by_file[name] for name in batch.keys]
+            if success:
+                successful_wallets.extend(batch_results)
             else:
-                print(f"  ❌ Batch {batch_num} failed - wallets will be retried", flush=True)
-                # Mark wallets as failed
-                for wallet, gcs_file, trade_count, _, _, _ in batch:
+                # Mark wallets as failed - they will be retried
+                for wallet, gcs_file, trade_count, _, _, _ in batch_results:
                     mark_wallet_complete(bq_client, wallet, trade_count, gcs_file, False)
+        
+        _, deferred = coordinator.run(
+            batches,
+            lambda uris: load_gcs_to_bigquery(bq_client, uris, target_table, load_table),
+            on_result=on_batch_loaded,
+        )
+        if load_table != target_table:
+            bq_client.delete_table(load_table, not_found_ok=True)
+        # Deferred (quota) and missing files are left unmarked so the next run picks them up
+        staged_names = {f.key for f in staged_files}
+        missing = [r for r in wallet_results if r[1] not in staged_names]
+        if deferred or missing:
+            print(f"  ⚠️  {sum(len(b.files) for b in deferred)} wallets deferred by load quota, {len(missing)} staging files not found", flush=True)
+        print(f"  📊 {coordinator.summary()}", flush=True)
     
     # Phase 3: Process markets/events for successfully loaded wallets
     print(f"\n{'='*80}", flush=True)
@@ -1125,7 +1044,7 @@ def main():
                 new_condition_ids = [cid for cid in condition_ids if cid not in fetched_markets]
                 
                 if new_condition_ids:
-                    wallet_markets, raw_markets, newly_fetched_cids = fetch_markets_by_condition_ids(session, new_condition_ids, fetched_markets)
+                    wallet_markets, raw_markets, newly_fetched_cids = fetch_markets_by_condition_ids(new_condition_ids, fetched_markets)
                     wallet_events, newly_fetched_slugs = extract_events_from_markets(raw_markets, fetched_events)
                     
                     fetched_markets.update(newly_fetched_cids)
@@ -1148,12 +1067,213 @@ def main():
             print(f"  ❌ {wallet} markets/events error: {e}", flush=True)
             mark_wallet_complete(bq_client, wallet, trade_count, gcs_file, False)
     
+    return len(successful_wallets)
+
+
+def run_sharded_backfill(
+    bq_client: bigquery.Client,
+    storage_client: storage.Client,
+    session: requests.Session,
+    remaining: List[str],
+) -> bool:
+    """
+    Multi-task mode (BACKFILL_SHARDS > 0): wallets are hashed into shards and this
+    task processes whichever shards it can lease until all are complete; expired
+    leases of dead tasks are reclaimed. Returns True for the one task that should
+    run the final staging -> production copy.
+    """
+    store = get_lease_store(bq_client, SHARD_LEASES_TABLE)
+    store.ensure_shards(BACKFILL_SHARDS)
+    owner = lease_owner_id()
+    shards = group_by_shard(remaining, BACKFILL_SHARDS)
+    print(f"\n🧩 Sharded mode: {len(remaining)} wallets in {BACKFILL_SHARDS} shards, run {store.run_id}, owner {owner}", flush=True)
+    
+    def process_shard(lease):
+        wallets = shards.get(lease.shard, [])
+        if lease.reclaimed and wallets:
+            # The previous owner may have finished some wallets before its lease expired
+            processed = get_processed_wallets(bq_client, verify=False)
+            wallets = [w for w in wallets if w.lower() not in processed]
+        print(f"  Shard {lease.shard}: {len(wallets)} wallets", flush=True)
+        if wallets:
+            # A manual DTS run loads every file under trades/, including other tasks' files,
+            # so sharded tasks load their own files with load jobs
+            process_wallets(bq_client, storage_client, session, wallets, use_dts=False)
+    
+    completed = run_leased_shards(store, owner, process_shard)
+    status = store.status()
+    print(f"🧩 Completed {completed} shards in this task ({status['completed']}/{status['total']} overall, {status['claims']} claims)", flush=True)
+    if status['failed']:
+        # Their wallets were not marked complete; the next run picks them up again
+        print(f"⚠️  {status['failed']} shards failed after {LEASE_MAX_ATTEMPTS} attempts (see {SHARD_LEASES_TABLE}.error)", flush=True)
+    return store.try_finalize(owner)
+
+
+def open_dead_letter_queue(bq_client: bigquery.Client):
+    """
+    Creates the dead-letter table handle and loads this backfill's unresolved
+    wallets (other sources replay with their own fetchers and cursors).
+    """
+    global dead_letter_queue
+    try:
+        dead_letter_queue = DeadLetterQueue(bq_client, DEAD_LETTER_TABLE)
+        dead_lettered_wallets.update(dead_letter_queue.pending_wallets(DLQ_SOURCE))
+    except Exception as e:
+        print(f"⚠️  Dead-letter table unavailable ({e}) - failed wallets are only logged", flush=True)
+        dead_letter_queue = None
+
+
+def merge_replayed_wallets(client: bigquery.Client, wallets: List[str]) -> bool:
+    """
+    Merges only the replayed wallets' staging rows into production on the trade
+    key (copy_staging_to_production would re-insert all of staging).
+    """
+    source = f"""(
+            SELECT *
+            FROM `{TRADES_STAGING_TABLE}`
+            WHERE LOWER(wallet_address) IN UNNEST(@wallets)
+        )"""
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ArrayQueryParameter("wallets", "STRING", [w.lower() for w in wallets]),
+    ])
+    try:
+        job = client.query(trades_merge_sql(TRADES_TABLE, source), job_config=job_config)
+        job.result()
+        print(f"✅ Merged {job.num_dml_affected_rows or 0:,} new trades for {len(wallets)} replayed wallets", flush=True)
+        return True
+    except Exception as e:
+        print(f"❌ Merge of replayed wallets failed: {e}", flush=True)
+        return False
+
+
+def replay_dead_letters(concurrency: int = DLQ_REPLAY_CONCURRENCY, limit: Optional[int] = None):
+    """
+    Drains this backfill's dead-letter entries: re-fetches the unresolved wallets
+    (resuming from their GCS cursors) with its own worker count and loads them
+    like a normal run. Wallets that fail again stay in the table with failures
+    incremented.
+    """
+    global checkpoint_writer
+    if not DOME_API_KEY:
+        raise ValueError("DOME_API_KEY not set")
+    
+    bq_client = get_bigquery_client()
+    storage_client = get_storage_client()
+    session = get_http_session()
+    if USE_STAGING_TABLE:
+        ensure_staging_table_exists(bq_client)
+    if CHECKPOINT_BUFFERED:
+        create_checkpoint_table(bq_client)
+        checkpoint_writer = CheckpointWriter(bq_client, CHECKPOINT_TABLE, "wallet_address", BACKFILL_CHECKPOINT_COLUMNS)
+    open_dead_letter_queue(bq_client)
+    if dead_letter_queue is None:
+        return
+    
+    entries = dead_letter_queue.pending(DLQ_SOURCE, limit)
+    wallets = list(dict.fromkeys(entry["wallet_address"] for entry in entries))
+    print(f"☠️  Replaying {len(wallets)} dead-lettered wallets ({len(entries)} entries) with {concurrency} workers", flush=True)
+    for entry in entries:
+        print(f"  {entry['wallet_address']} {entry['error_class']} x{entry['failures']} at {entry['cursor']}", flush=True)
+    
+    if wallets:
+        # Load jobs only: a manual DTS run would also pick up unrelated files under trades/
+        loaded = process_wallets(bq_client, storage_client, session, wallets, use_dts=False, max_workers=concurrency)
+        print(f"☠️  Replay loaded {loaded}/{len(wallets)} wallets", flush=True)
+        if loaded and USE_STAGING_TABLE:
+            merge_replayed_wallets(bq_client, wallets)
+    
+    if checkpoint_writer is not None:
+        checkpoint_writer.close()
+
+
+def main():
+    """Main function with parallel processing"""
+    global checkpoint_writer
+    if not DOME_API_KEY:
+        raise ValueError("DOME_API_KEY not set")
+    
+    print("=" * 80, flush=True)
+    print("BACKFILL v3 (Hybrid) STARTING", flush=True)
+    print("=" * 80, flush=True)
+    
+    bq_client = get_bigquery_client()
+    storage_client = get_storage_client()
+    session = get_http_session()
+    
+    # Ensure staging table exists (CRITICAL for partition quota)
+    if USE_STAGING_TABLE:
+        ensure_staging_table_exists(bq_client)
+    
+    # Ensure GCS bucket exists
+    try:
+        bucket = storage_client.bucket(GCS_BUCKET)
+        if not bucket.exists():
+            bucket.create(location="US")
+    except:
+        pass
+    
+    # Get wallets
+    if WALLET_ADDRESSES_ENV:
+        trader_wallets = [w.strip() for w in WALLET_ADDRESSES_ENV.split(",") if w.strip()]
+    else:
+        query = f"SELECT DISTINCT wallet_address FROM `{TRADERS_TABLE}` WHERE wallet_address IS NOT NULL"
+        results = bq_client.query(query).result()
+        trader_wallets = [row['wallet_address'] for row in results if row.get('wallet_address')]
+    
+    if not trader_wallets:
+        raise ValueError("No wallets to process")
+    
+    # Checkpoint journal: records an interrupted run never mirrored go to BigQuery first
+    if CHECKPOINT_BUFFERED:
+        create_checkpoint_table(bq_client)
+        checkpoint_writer = CheckpointWriter(bq_client, CHECKPOINT_TABLE, "wallet_address", BACKFILL_CHECKPOINT_COLUMNS)
+        checkpoint_writer.flush()
+    
+    # Dead-lettered wallets are left to replay-dlq so they cannot pin this run's workers
+    open_dead_letter_queue(bq_client)
+    
+    # Filter processed wallets (with verification)
+    print("Checking for already-processed wallets...", flush=True)
+    verify_checkpoints = os.getenv("VERIFY_CHECKPOINTS", "true").lower() == "true"
+    processed = get_processed_wallets(bq_client, verify=verify_checkpoints)
+    remaining = [w for w in trader_wallets if w.lower() not in processed and w.lower() not in dead_lettered_wallets]
+    
+    print(f"\n{'='*80}", flush=True)
+    print(f"Wallet Summary:", flush=True)
+    print(f"  Total wallets: {len(trader_wallets)}", flush=True)
+    print(f"  Already processed (verified): {len(processed)}", flush=True)
+    print(f"  Dead-lettered (replay-dlq): {len(dead_lettered_wallets)}", flush=True)
+    print(f"  Remaining to process: {len(remaining)}", flush=True)
+    print(f"  Max workers: {MAX_WORKERS}", flush=True)
+    print(f"{'='*80}", flush=True)
+    
+    if len(processed) > 0:
+        print(f"\nSkipping {len(processed)} already-processed wallets.", flush=True)
+        print(f"Set VERIFY_CHECKPOINTS=false to skip verification (faster startup).", flush=True)
+    
+    if not remaining:
+        print("All wallets processed!")
+        return
+    
+    start_time = time.time()
+    
+    if BACKFILL_SHARDS > 0:
+        finalize = run_sharded_backfill(bq_client, storage_client, session, remaining)
+    else:
+        process_wallets(bq_client, storage_client, session, remaining)
+        finalize = True
+    
+    if checkpoint_writer is not None:
+        checkpoint_writer.close()
+    
     elapsed = time.time() - start_time
     print(f"\n{'='*80}", flush=True)
     print(f"✅ All wallets processed in {elapsed:.1f}s", flush=True)
     
     # CRITICAL: Copy staging to production ONCE at the end (minimizes partition mods)
-    if USE_STAGING_TABLE:
+    if USE_STAGING_TABLE and not finalize:
+        print("Staging -> production copy is left to the task that completes the last shard", flush=True)
+    elif USE_STAGING_TABLE:
         print(f"\n{'='*80}", flush=True)
         print("Final step: Copying staging to production table...", flush=True)
         print(f"{'='*80}", flush=True)
@@ -1163,9 +1283,22 @@ def main():
     print(f"{'='*80}", flush=True)
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Dome backfill v3 (hybrid)")
+    sub = parser.add_subparsers(dest="command")
+    replay = sub.add_parser("replay-dlq", help=f"Re-fetch {DLQ_SOURCE} wallets from the dead-letter table")
+    replay.add_argument("--concurrency", type=int, default=DLQ_REPLAY_CONCURRENCY, help="Replay workers")
+    replay.add_argument("--limit", type=int, help="Replay at most N entries")
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
+    args = parse_args()
     try:
-        main()
+        if args.command == "replay-dlq":
+            replay_dead_letters(args.concurrency, args.limit)
+        else:
+            main()
     except Exception as e:
         print(f"\n{'='*80}", flush=True)
         print(f"FATAL ERROR: {e}", flush=True)
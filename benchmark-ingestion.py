@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+"""
+Offline ingestion benchmark against a local mock Dome API.
+
+Starts mock_dome_server.py in-process, points the Dome clients at it
+(DOME_API_BASE) and drives the real fetchers:
+- gcs:     backfill_v3_hybrid.fetch_trades_to_gcs (sync session, MAX_WORKERS threads,
+           staging files written to a local directory instead of GCS)
+- wallet:  daily-sync fetch_trades_for_wallet (async client, WALLET_CONCURRENCY wallets)
+- markets: dome_markets.iter_markets (100-id batches, MARKETS_MAX_IN_FLIGHT in flight;
+           market cache disabled)
+
+Reports pages/sec, rows/sec and p50/p99 request latency per scenario. Latency
+is measured per API call as the fetcher sees it (limiter waits and 429
+retries included). No API quota or GCP credentials are used.
+
+Usage:
+    python benchmark-ingestion.py
+    python benchmark-ingestion.py --scenarios gcs,wallet --trades-per-wallet 15000 --throttle-rate 0.02
+    python benchmark-ingestion.py --json results.json --baseline last-release.json
+    # Record real responses once (uses the Dome API), then replay them offline
+    python benchmark-ingestion.py --record 0xabc...,0xdef... --fixtures fixtures.json
+    python benchmark-ingestion.py --fixtures fixtures.json
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import threading
+import importlib.util
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from mock_dome_server import MockDomeConfig, MockDomeServer
+
+SCENARIOS = ("gcs", "wallet", "markets")
+BENCHMARK_MAX_REGRESSION = float(os.getenv("BENCHMARK_MAX_REGRESSION", "0.2"))  # Fail if rows/sec drops >20% vs baseline
+
+
+class LatencyRecorder:
+    """Thread-safe list of per-request latencies (seconds)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples: List[float] = []
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, p: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, max(0, int(round(p / 100.0 * len(ordered))) - 1))
+        return ordered[index]
+
+
+class LocalBlob:
+    """Minimal storage.Blob stand-in backed by a local file (what gcs_staging and wallet_cursor use)."""
+
+    def __init__(self, root: str, name: str):
+        self.name = name
+        self.path = os.path.join(root, name)
+        self.content_type = None
+
+    @property
+    def size(self) -> Optional[int]:
+        return os.path.getsize(self.path) if self.exists() else None
+
+    def open(self, mode: str = "wb", chunk_size: Optional[int] = None):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        return open(self.path, mode)
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.path)
+
+    def download_as_bytes(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def upload_from_string(self, data, content_type: Optional[str] = None):
+        with self.open("wb") as f:
+            f.write(data.encode() if isinstance(data, str) else data)
+
+    def compose(self, sources: List["LocalBlob"]):
+        # Read first: the destination may be one of the sources
+        data = b"".join(source.download_as_bytes() for source in sources)
+        self.upload_from_string(data)
+
+    def delete(self):
+        os.remove(self.path)
+
+
+class LocalBucket:
+    def __init__(self, root: str):
+        self.root = root
+
+    def blob(self, name: str) -> LocalBlob:
+        return LocalBlob(self.root, name)
+
+    def list_blobs(self, prefix: str = "") -> List[LocalBlob]:
+        blobs = []
+        for dirpath, _, files in os.walk(self.root):
+            for f in files:
+                name = os.path.relpath(os.path.join(dirpath, f), self.root).replace(os.sep, "/")
+                if name.startswith(prefix):
+                    blobs.append(LocalBlob(self.root, name))
+        return sorted(blobs, key=lambda blob: blob.name)
+
+
+class LocalStorageClient:
+    """storage.Client stand-in so fetch_trades_to_gcs writes under a temp directory."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def bucket(self, name: str) -> LocalBucket:
+        return LocalBucket(os.path.join(self.root, name))
+
+
+def load_script(name: str, filename: str):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def timed_client_class(recorder: LatencyRecorder):
+    """DomeAsyncClient subclass that records get_json latency."""
+    from dome_client import DomeAsyncClient
+
+    class TimedDomeClient(DomeAsyncClient):
+        async def get_json(self, path: str, params=None):
+            started = time.perf_counter()
+            try:
+                return await super().get_json(path, params)
+            finally:
+                recorder.record(time.perf_counter() - started)
+
+    return TimedDomeClient
+
+
+def summarize(name: str, server: MockDomeServer, recorder: LatencyRecorder, elapsed: float, rows: int, pages: int, extra: Optional[Dict] = None) -> Dict:
+    result = {
+        'scenario': name,
+        'elapsed_seconds': round(elapsed, 2),
+        'pages': pages,
+        'rows': rows,
+        'pages_per_sec': round(pages / elapsed, 1) if elapsed > 0 else 0.0,
+        'rows_per_sec': round(rows / elapsed, 1) if elapsed > 0 else 0.0,
+        'requests': len(recorder.samples),
+        'latency_p50_ms': round(recorder.percentile(50) * 1000, 1),
+        'latency_p99_ms': round(recorder.percentile(99) * 1000, 1),
+        'throttled': server.stats['throttled'],
+        'server_errors': server.stats['errors'],
+    }
+    result.update(extra or {})
+    return result
+
+
+def run_gcs_scenario(server: MockDomeServer, wallets: List[str]) -> Dict:
+    """fetch_trades_to_gcs for every wallet with backfill_v3_hybrid's thread pool."""
+    backfill = load_script("backfill_v3_hybrid", "backfill_v3_hybrid.py")
+    recorder = LatencyRecorder()
+    session = backfill.get_http_session()
+    session_get = session.get
+
+    def timed_get(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return session_get(*args, **kwargs)
+        finally:
+            recorder.record(time.perf_counter() - started)
+
+    session.get = timed_get
+    root = tempfile.mkdtemp(prefix="benchmark-gcs-")
+    storage_client = LocalStorageClient(root)
+    server.reset_stats()
+    try:
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=backfill.MAX_WORKERS) as executor:
+            results = list(executor.map(lambda w: backfill.fetch_trades_to_gcs(session, storage_client, w), wallets))
+        elapsed = time.time() - started
+        staged_bytes = sum(
+            os.path.getsize(os.path.join(dirpath, f))
+            for dirpath, _, files in os.walk(root)
+            for f in files
+        )
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    trades = sum(count for _, count, _ in results)
+    return summarize("gcs", server, recorder, elapsed, trades, server.stats['orders_pages'], {
+        'workers': backfill.MAX_WORKERS,
+        'staged_mb': round(staged_bytes / 1e6, 2),
+    })
+
+
+def run_wallet_scenario(server: MockDomeServer, wallets: List[str]) -> Dict:
+    """daily-sync fetch_trades_for_wallet with WALLET_CONCURRENCY wallets in flight."""
+    daily_sync = load_script("daily_sync_trades_markets", "daily-sync-trades-markets.py")
+    recorder = LatencyRecorder()
+    client_class = timed_client_class(recorder)
+    server.reset_stats()
+
+    async def run():
+        semaphore = asyncio.Semaphore(daily_sync.WALLET_CONCURRENCY)
+        async with client_class() as dome:
+            async def one(wallet):
+                async with semaphore:
+                    return await daily_sync.fetch_trades_for_wallet(dome, wallet, None, None)
+            return await asyncio.gather(*(one(w) for w in wallets))
+
+    started = time.time()
+    results = asyncio.run(run())
+    elapsed = time.time() - started
+
+    trades = sum(len(trades) for trades, _, _ in results)
+    failed = sum(1 for _, error, _ in results if error is not None)
+    return summarize("wallet", server, recorder, elapsed, trades, server.stats['orders_pages'], {
+        'concurrency': daily_sync.WALLET_CONCURRENCY,
+        'failed_wallets': failed,
+    })
+
+
+def run_markets_scenario(server: MockDomeServer, condition_ids: List[str]) -> Dict:
+    """dome_markets.iter_markets over every fixture condition_id."""
+    import dome_markets
+    recorder = LatencyRecorder()
+    client_class = timed_client_class(recorder)
+    server.reset_stats()
+    stats = dome_markets.MarketFetchStats(len(condition_ids))
+
+    async def run():
+        async with client_class(max_concurrency=dome_markets.MARKETS_MAX_IN_FLIGHT) as dome:
+            async for _ in dome_markets.iter_markets(dome, condition_ids, stats=stats, use_cache=False):
+                pass
+
+    started = time.time()
+    asyncio.run(run())
+    elapsed = time.time() - started
+    return summarize("markets", server, recorder, elapsed, stats.markets, server.stats['markets_requests'], {
+        'max_in_flight': dome_markets.MARKETS_MAX_IN_FLIGHT,
+        'failed_batches': stats.batches_failed,
+    })
+
+
+def record_fixtures(wallets: List[str], path: str):
+    """Fetches real orders and markets for `wallets` from the Dome API into a fixture file."""
+    from dome_client import DomeAsyncClient
+    from dome_markets import iter_markets
+
+    async def run():
+        fixtures = {'orders': {}, 'markets': []}
+        async with DomeAsyncClient() as dome:
+            for wallet in wallets:
+                orders = await dome.fetch_orders(wallet, limit=1000)
+                fixtures['orders'][wallet.lower()] = orders
+                print(f"  📥 {wallet[:10]}...: {len(orders):,} orders", flush=True)
+            condition_ids = sorted({o['condition_id'] for orders in fixtures['orders'].values() for o in orders if o.get('condition_id')})
+            async for _, raw_batch in iter_markets(dome, condition_ids, use_cache=False):
+                fixtures['markets'].extend(raw_batch)
+        return fixtures
+
+    fixtures = asyncio.run(run())
+    with open(path, 'w') as f:
+        json.dump(fixtures, f)
+    print(f"✅ Recorded {len(fixtures['orders'])} wallets and {len(fixtures['markets'])} markets to {path}", flush=True)
+
+
+def compare_to_baseline(results: List[Dict], baseline_path: str) -> List[str]:
+    """Scenarios whose rows/sec fell more than BENCHMARK_MAX_REGRESSION below the baseline."""
+    with open(baseline_path) as f:
+        baseline = {r['scenario']: r for r in json.load(f).get('results', [])}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result['scenario'])
+        if not previous or not previous.get('rows_per_sec'):
+            continue
+        change = result['rows_per_sec'] / previous['rows_per_sec'] - 1
+        print(f"  {result['scenario']:<8} {previous['rows_per_sec']:>10,.1f} -> {result['rows_per_sec']:>10,.1f} rows/s ({change:+.0%})", flush=True)
+        if change < -BENCHMARK_MAX_REGRESSION:
+            regressions.append(result['scenario'])
+    return regressions
+
+
+def print_results(results: List[Dict]):
+    print()
+    print(f"{'scenario':<9}{'pages':>8}{'rows':>10}{'secs':>8}{'pages/s':>9}{'rows/s':>11}{'p50 ms':>9}{'p99 ms':>9}{'429s':>6}")
+    for r in results:
+        print(
+            f"{r['scenario']:<9}{r['pages']:>8,}{r['rows']:>10,}{r['elapsed_seconds']:>8.1f}"
+            f"{r['pages_per_sec']:>9.1f}{r['rows_per_sec']:>11,.1f}{r['latency_p50_ms']:>9.1f}"
+            f"{r['latency_p99_ms']:>9.1f}{r['throttled']:>6}"
+        )
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline ingestion benchmark against a mock Dome API")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument("--fixtures", help="Recorded fixture JSON to replay (default: synthetic data)")
+    parser.add_argument("--record", help="Comma-separated wallets to record into --fixtures from the real API, then exit")
+    parser.add_argument("--wallets", type=int, default=10, help="Synthetic wallets")
+    parser.add_argument("--trades-per-wallet", type=int, default=12000, help="Synthetic trades per wallet (>10000 exercises pagination_key)")
+    parser.add_argument("--markets", type=int, default=2000, help="Synthetic markets")
+    parser.add_argument("--latency-ms", type=float, default=30.0)
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--retry-after", type=float, default=0.2, help="Retry-After seconds on injected 429s")
+    parser.add_argument("--max-rps", type=float, help="Override DOME_THROTTLE_MAX_RPS for the run")
+    parser.add_argument("--json", help="Write results to this file")
+    parser.add_argument("--baseline", help="Results JSON from a previous run; exit 1 on a rows/sec regression")
+    args = parser.parse_args()
+
+    if args.record:
+        if not args.fixtures:
+            parser.error("--record needs --fixtures to write to")
+        record_fixtures([w.strip() for w in args.record.split(",") if w.strip()], args.fixtures)
+        return
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    server = MockDomeServer(MockDomeConfig(
+        wallets=args.wallets,
+        trades_per_wallet=args.trades_per_wallet,
+        markets=args.markets,
+        fixtures_path=args.fixtures,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+    ))
+    base_url = server.start()
+
+    # Must be set before the Dome modules are imported (they read env at import time)
+    os.environ["DOME_API_BASE"] = base_url
+    os.environ.setdefault("DOME_API_KEY", "benchmark")
+    os.environ["MARKET_CACHE_ENABLED"] = "false"
+    if args.max_rps:
+        os.environ["DOME_THROTTLE_MAX_RPS"] = str(args.max_rps)
+
+    wallets = server.wallets
+    print(f"🧪 Mock Dome API at {base_url}: {len(wallets)} wallets, {len(server.condition_ids())} markets", flush=True)
+    print(f"   latency {args.latency_ms:.0f}+{args.jitter_ms:.0f}ms, 429 rate {args.throttle_rate:.1%}", flush=True)
+
+    results = []
+    try:
+        for scenario in scenarios:
+            print(f"\n▶️  Scenario: {scenario}", flush=True)
+            if scenario == "gcs":
+                results.append(run_gcs_scenario(server, wallets))
+            elif scenario == "wallet":
+                results.append(run_wallet_scenario(server, wallets))
+            elif scenario == "markets":
+                results.append(run_markets_scenario(server, server.condition_ids()))
+    finally:
+        server.stop()
+
+    print_results(results)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'run_at': datetime.utcnow().isoformat(), 'args': vars(args), 'results': results}, f, indent=2)
+        print(f"💾 Results written to {args.json}", flush=True)
+
+    if args.baseline:
+        print(f"📏 Compared to {args.baseline}:", flush=True)
+        regressions = compare_to_baseline(results, args.baseline)
+        if regressions:
+            print(f"❌ Throughput regression in: {', '.join(regressions)}", flush=True)
+            sys.exit(1)
+        print("✅ No throughput regressions", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""
+Quota-aware scheduling of GCS -> BigQuery load jobs.
+
+BigQuery allows 1,500 load jobs per table per day (failed jobs count too),
+and each job may read up to 10,000 URIs. Instead of fixed knobs (N wallets
+per load, sleep between loads) LoadJobCoordinator:
+
+1. reads how many load jobs already hit the table in the last 24h from
+   INFORMATION_SCHEMA.JOBS (shared by every job/script writing the table)
+2. coalesces staged files into batches of ~LOAD_TARGET_BYTES (by GCS object
+   size, not file count), growing the batch size when the remaining quota
+   would otherwise run out
+3. runs the batches through a caller-supplied load function, pacing
+   submissions and stopping before the quota (minus headroom) is used up
+
+Usage:
+    coordinator = LoadJobCoordinator(bq_client, TRADES_STAGING_TABLE)
+    files = staged_files_from_gcs(storage_client, GCS_BUCKET, "trades/")
+    batches = coordinator.plan(files)
+    loaded, leftover = coordinator.run(batches, lambda uris: load(uris))
+"""
+
+import os
+import time
+import math
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Any
+
+from google.cloud import bigquery
+from gcs_staging import is_staging_file
+
+LOAD_QUOTA_PER_TABLE_DAY = int(os.getenv("LOAD_QUOTA_PER_TABLE_DAY", "1500"))  # BigQuery load jobs per table per day
+LOAD_QUOTA_HEADROOM = float(os.getenv("LOAD_QUOTA_HEADROOM", "0.1"))  # Fraction of the quota left for other jobs
+LOAD_TARGET_BYTES = int(os.getenv("LOAD_TARGET_BYTES", str(2 * 1024 ** 3)))  # GCS bytes per load job (2 GiB)
+LOAD_MAX_BYTES = int(os.getenv("LOAD_MAX_BYTES", str(1024 ** 4)))  # Upper bound when batches grow to fit the quota (1 TiB)
+LOAD_MAX_URIS = int(os.getenv("LOAD_MAX_URIS", "10000"))  # BigQuery limit per load job
+LOAD_MIN_INTERVAL_SECONDS = float(os.getenv("LOAD_MIN_INTERVAL_SECONDS", "2.0"))  # Table metadata updates: 5 per 10s
+LOAD_MAX_RETRIES = int(os.getenv("LOAD_MAX_RETRIES", "3"))
+JOBS_REGION = os.getenv("BIGQUERY_JOBS_REGION", "region-us")
+
+
+class StagedFile:
+    """One staged GCS object; `key` is whatever the caller needs back (e.g. the wallet)."""
+
+    def __init__(self, uri: str, size: int, key: Any = None):
+        self.uri = uri
+        self.size = size
+        self.key = key
+
+
+class LoadBatch:
+    """Files loaded together in one load job."""
+
+    def __init__(self):
+        self.files: List[StagedFile] = []
+        self.bytes = 0
+
+    @property
+    def uris(self) -> List[str]:
+        return [f.uri for f in self.files]
+
+    @property
+    def keys(self) -> List[Any]:
+        return [f.key for f in self.files]
+
+    def add(self, staged: StagedFile):
+        self.files.append(staged)
+        self.bytes += staged.size
+
+
+class QuotaExhausted(Exception):
+    """The table's daily load-job quota (minus headroom) is used up."""
+
+
+def is_quota_error(error: Exception) -> bool:
+    """Daily quota errors do not clear with a retry; rate limits do."""
+    message = str(error)
+    return "quotaExceeded" in message or "Quota exceeded" in message
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    message = str(error)
+    return "rateLimitExceeded" in message or "rate limit" in message.lower()
+
+
+def count_load_jobs_today(client: bigquery.Client, table_id: str, region: str = JOBS_REGION) -> Optional[int]:
+    """
+    Load jobs (any state) that targeted table_id in the last 24 hours, or
+    None if INFORMATION_SCHEMA.JOBS cannot be read.
+    """
+    project, dataset, table = table_id.split(".")
+    query = f"""
+    SELECT COUNT(*) AS jobs
+    FROM `{project}`.`{region}`.INFORMATION_SCHEMA.JOBS
+    WHERE job_type = 'LOAD'
+      AND creation_time >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 24 HOUR)
+      AND destination_table.project_id = @project
+      AND destination_table.dataset_id = @dataset
+      AND destination_table.table_id = @table
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[
+        bigquery.ScalarQueryParameter("project", "STRING", project),
+        bigquery.ScalarQueryParameter("dataset", "STRING", dataset),
+        bigquery.ScalarQueryParameter("table", "STRING", table),
+    ])
+    try:
+        row = next(iter(client.query(query, job_config=job_config).result()), None)
+        return int(row["jobs"]) if row else 0
+    except Exception as e:
+        print(f"  ⚠️  Could not read load job usage for {table_id}: {e}", flush=True)
+        return None
+
+
+def staged_files_from_gcs(
+    storage_client,
+    bucket_name: str,
+    prefix: str,
+    names: Optional[Iterable[str]] = None,
+    keys: Optional[Dict[str, Any]] = None,
+) -> List[StagedFile]:
+    """
+    Lists staging files (.jsonl / .jsonl.gz) under prefix with their sizes.
+    If `names` is given only those objects are returned; `keys` maps object
+    name -> key for StagedFile.key (defaults to the object name).
+    """
+    wanted = set(names) if names is not None else None
+    keys = keys or {}
+    files = []
+    for blob in storage_client.bucket(bucket_name).list_blobs(prefix=prefix):
+        if not is_staging_file(blob.name) or (wanted is not None and blob.name not in wanted):
+            continue
+        files.append(StagedFile(f"gs://{bucket_name}/{blob.name}", blob.size or 0, keys.get(blob.name, blob.name)))
+    return files
+
+
+def plan_batches(
+    files: List[StagedFile],
+    target_bytes: int = LOAD_TARGET_BYTES,
+    max_uris: int = LOAD_MAX_URIS,
+    max_jobs: Optional[int] = None,
+    max_bytes: int = LOAD_MAX_BYTES,
+) -> List[LoadBatch]:
+    """
+    Packs files into batches of about target_bytes (first-fit decreasing, at
+    most max_uris each). With max_jobs set, the target grows (up to
+    max_bytes) so the files fit in that many jobs when possible.
+    """
+    if not files:
+        return []
+    if max_jobs is not None and max_jobs > 0:
+        total = sum(f.size for f in files)
+        target_bytes = min(max(target_bytes, math.ceil(total / max_jobs)), max_bytes)
+
+    batches: List[LoadBatch] = []
+    for staged in sorted(files, key=lambda f: f.size, reverse=True):
+        for batch in batches:
+            if len(batch.files) < max_uris and batch.bytes + staged.size <= target_bytes:
+                batch.add(staged)
+                break
+        else:
+            batch = LoadBatch()
+            batch.add(staged)
+            batches.append(batch)
+    return batches
+
+
+class LoadJobCoordinator:
+    """Plans and paces load jobs into one table within its daily quota."""
+
+    def __init__(
+        self,
+        client: bigquery.Client,
+        table_id: str,
+        quota: int = LOAD_QUOTA_PER_TABLE_DAY,
+        headroom: float = LOAD_QUOTA_HEADROOM,
+        target_bytes: int = LOAD_TARGET_BYTES,
+        min_interval: float = LOAD_MIN_INTERVAL_SECONDS,
+        max_retries: int = LOAD_MAX_RETRIES,
+    ):
+        self.client = client
+        self.table_id = table_id
+        self.quota = quota
+        self.headroom = headroom
+        self.target_bytes = target_bytes
+        self.min_interval = min_interval
+        self.max_retries = max_retries
+        self.used_before = 0  # Jobs in the last 24h when last refreshed
+        self.submitted = 0  # Jobs submitted by this coordinator since then
+        self.loaded_files = 0
+        self.loaded_bytes = 0
+        self.failed_batches = 0
+        self._last_submit = 0.0
+        self.refresh_usage()
+
+    @property
+    def budget(self) -> int:
+        return int(self.quota * (1 - self.headroom))
+
+    def refresh_usage(self):
+        used = count_load_jobs_today(self.client, self.table_id)
+        if used is not None:
+            self.used_before = used
+            self.submitted = 0
+
+    def remaining(self) -> int:
+        return max(self.budget - self.used_before - self.submitted, 0)
+
+    def plan(self, files: List[StagedFile]) -> List[LoadBatch]:
+        """Right-sized batches that fit the remaining quota when possible."""
+        batches = plan_batches(files, self.target_bytes, max_jobs=self.remaining() or None)
+        total = sum(b.bytes for b in batches)
+        print(
+            f"  📦 Planned {len(batches)} load jobs for {len(files)} files ({total / 1e6:.1f} MB) | "
+            f"quota: {self.used_before} used in 24h, {self.remaining()} left of {self.budget}",
+            flush=True,
+        )
+        return batches
+
+    def _pace(self):
+        wait = self._last_submit + self.min_interval - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        self._last_submit = time.time()
+
+    def _run_batch(self, batch: LoadBatch, load_fn: Callable[[List[str]], bool]) -> bool:
+        for attempt in range(self.max_retries):
+            if self.remaining() <= 0:
+                raise QuotaExhausted(f"Load quota for {self.table_id} used up ({self.used_before + self.submitted}/{self.budget})")
+            self._pace()
+            self.submitted += 1  # Failed jobs count against the quota too
+            try:
+                return load_fn(batch.uris)
+            except Exception as e:
+                if is_quota_error(e):
+                    raise QuotaExhausted(str(e))
+                if not is_rate_limit_error(e) or attempt == self.max_retries - 1:
+                    print(f"  ❌ Load of {len(batch.files)} files failed: {e}", flush=True)
+                    return False
+                wait_time = self.min_interval * (2 ** (attempt + 1))
+                print(f"  ⏳ Rate limited, retrying in {wait_time:.0f}s...", flush=True)
+                time.sleep(wait_time)
+        return False
+
+    def run(
+        self,
+        batches: List[LoadBatch],
+        load_fn: Callable[[List[str]], bool],
+        on_result: Optional[Callable[[LoadBatch, bool], None]] = None,
+    ) -> Tuple[List[LoadBatch], List[LoadBatch]]:
+        """
+        Runs load_fn(uris) per batch (it should raise or return False on
+        failure). Returns (attempted, leftover): leftover batches were not
+        run because the quota ran out and can be retried tomorrow.
+        on_result(batch, success) is called after each batch.
+        """
+        attempted: List[LoadBatch] = []
+        for i, batch in enumerate(batches):
+            try:
+                success = self._run_batch(batch, load_fn)
+            except QuotaExhausted as e:
+                print(f"  🛑 {e} - deferring {len(batches) - i} batches", flush=True)
+                return attempted, batches[i:]
+            attempted.append(batch)
+            if success:
+                self.loaded_files += len(batch.files)
+                self.loaded_bytes += batch.bytes
+            else:
+                self.failed_batches += 1
+            if on_result:
+                on_result(batch, success)
+            print(f"  {'✅' if success else '❌'} Load {i + 1}/{len(batches)}: {len(batch.files)} files, {batch.bytes / 1e6:.1f} MB", flush=True)
+        return attempted, []
+
+    def summary(self) -> str:
+        return (
+            f"{self.loaded_files} files ({self.loaded_bytes / 1e6:.1f} MB) loaded into {self.table_id}, "
+            f"{self.failed_batches} failed jobs, {self.submitted} jobs submitted, {self.remaining()} quota left"
+        )
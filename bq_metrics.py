@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+BigQuery job cost and latency instrumentation.
+
+MeteredClient is a drop-in bigquery.Client: every query/load/copy/extract job
+is labelled with the running script and the calling function, and when its
+result() returns (or raises) one record is written with job id, label, bytes
+processed/billed, slot-ms, cache hit and wall time.
+
+Records go to BQ_METRICS_SINK (comma-separated):
+- jsonl: appended to BQ_METRICS_PATH as each job finishes (default)
+- table: streamed to BQ_METRICS_TABLE at exit (and every 100 jobs)
+- none: disabled
+
+Usage:
+    from bq_metrics import MeteredClient
+    client = MeteredClient(project=PROJECT_ID)   # instead of bigquery.Client(...)
+
+    python bq_metrics.py report                          # from BQ_METRICS_PATH
+    python bq_metrics.py report --table --days 7 --top 30
+    python bq_metrics.py report --script daily-sync-trades-markets
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import atexit
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from google.cloud import bigquery
+
+PROJECT_ID = "gen-lang-client-0299056258"
+BQ_METRICS_SINK = os.getenv("BQ_METRICS_SINK", "jsonl").lower()  # jsonl | table | jsonl,table | none
+BQ_METRICS_PATH = os.getenv("BQ_METRICS_PATH", "/tmp/bq_job_metrics.jsonl")
+BQ_METRICS_TABLE = os.getenv("BQ_METRICS_TABLE", f"{PROJECT_ID}.polycopy_v1.bq_job_metrics")
+BQ_METRICS_FLUSH_EVERY = 100  # Table sink: rows buffered before a streaming insert
+BQ_USD_PER_TIB = float(os.getenv("BQ_USD_PER_TIB", "6.25"))  # On-demand price used for cost estimates
+
+# Frames in these files are helpers, not the step that issued the job
+_HELPER_FILES = {"bq_metrics.py", "bq_parquet.py"}
+
+METRICS_SCHEMA = [
+    bigquery.SchemaField("job_id", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("script", "STRING"),
+    bigquery.SchemaField("label", "STRING"),
+    bigquery.SchemaField("job_type", "STRING"),
+    bigquery.SchemaField("statement_type", "STRING"),
+    bigquery.SchemaField("state", "STRING"),
+    bigquery.SchemaField("error", "STRING"),
+    bigquery.SchemaField("bytes_processed", "INTEGER"),
+    bigquery.SchemaField("bytes_billed", "INTEGER"),
+    bigquery.SchemaField("slot_ms", "INTEGER"),
+    bigquery.SchemaField("cache_hit", "BOOLEAN"),
+    bigquery.SchemaField("rows", "INTEGER"),
+    bigquery.SchemaField("wall_seconds", "FLOAT"),
+    bigquery.SchemaField("server_seconds", "FLOAT"),
+    bigquery.SchemaField("created_at", "TIMESTAMP"),
+]
+
+
+def script_name() -> str:
+    return os.path.splitext(os.path.basename(sys.argv[0] or "interactive"))[0] or "interactive"
+
+
+def _label_value(value: str) -> str:
+    """BigQuery label values: lowercase letters, digits, _ and -, at most 63 chars."""
+    return re.sub(r"[^a-z0-9_-]", "_", value.lower())[:63]
+
+
+def _caller_label() -> str:
+    """Name of the first function up the stack outside this module and library code."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if os.path.basename(filename) not in _HELPER_FILES and "site-packages" not in filename:
+            return frame.f_code.co_name
+        frame = frame.f_back
+    return "unknown"
+
+
+def _job_record(job, label: str, wall_seconds: float, error: Optional[Exception]) -> Dict:
+    server_seconds = None
+    if getattr(job, "started", None) and getattr(job, "ended", None):
+        server_seconds = round((job.ended - job.started).total_seconds(), 3)
+    if job.job_type == "query":
+        rows = getattr(job, "num_dml_affected_rows", None)
+        stats = {
+            "statement_type": getattr(job, "statement_type", None),
+            "bytes_processed": getattr(job, "total_bytes_processed", None),
+            "bytes_billed": getattr(job, "total_bytes_billed", None),
+            "slot_ms": getattr(job, "slot_millis", None),
+            "cache_hit": getattr(job, "cache_hit", None),
+        }
+    else:
+        rows = getattr(job, "output_rows", None)
+        stats = {"statement_type": None, "bytes_processed": getattr(job, "output_bytes", None),
+                 "bytes_billed": None, "slot_ms": None, "cache_hit": None}
+    return {
+        "job_id": job.job_id,
+        "script": script_name(),
+        "label": label,
+        "job_type": job.job_type,
+        "state": getattr(job, "state", None),
+        "error": str(error)[:1000] if error else None,
+        "rows": rows,
+        "wall_seconds": round(wall_seconds, 3),
+        "server_seconds": server_seconds,
+        "created_at": (job.created or datetime.now(timezone.utc)).isoformat(),
+        **stats,
+    }
+
+
+class MetricsRecorder:
+    """Writes job records to the configured sinks (one per process)."""
+
+    def __init__(self, sinks: str = BQ_METRICS_SINK, path: str = BQ_METRICS_PATH, table: str = BQ_METRICS_TABLE):
+        self.sinks = {s.strip() for s in sinks.split(",") if s.strip()} - {"none"}
+        self.path = path
+        self.table = table
+        self.client: Optional[bigquery.Client] = None  # Used for the table sink
+        self.buffer: List[Dict] = []
+        self.jobs = 0
+        self.bytes_billed = 0
+        self.slot_ms = 0
+        self.wall_seconds = 0.0
+        self._lock = threading.Lock()
+        self._table_ready = False
+        atexit.register(self.close)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.sinks)
+
+    def record(self, record: Dict):
+        with self._lock:
+            self.jobs += 1
+            self.bytes_billed += record.get("bytes_billed") or 0
+            self.slot_ms += record.get("slot_ms") or 0
+            self.wall_seconds += record.get("wall_seconds") or 0
+            if "jsonl" in self.sinks:
+                try:
+                    with open(self.path, "a") as f:
+                        f.write(json.dumps(record) + "\n")
+                except OSError as e:
+                    print(f"  ⚠️  Could not write BigQuery metrics to {self.path}: {e}", flush=True)
+            if "table" in self.sinks:
+                self.buffer.append(record)
+                if len(self.buffer) >= BQ_METRICS_FLUSH_EVERY:
+                    self._flush_locked()
+
+    def _flush_locked(self):
+        if not self.buffer or self.client is None:
+            return
+        rows, self.buffer = self.buffer, []
+        try:
+            if not self._table_ready:
+                table = bigquery.Table(self.table, schema=METRICS_SCHEMA)
+                table.time_partitioning = bigquery.TimePartitioning(field="created_at")
+                self.client.create_table(table, exists_ok=True)
+                self._table_ready = True
+            errors = self.client.insert_rows_json(self.table, rows)
+            if errors:
+                print(f"  ⚠️  BigQuery metrics insert errors: {errors[:3]}", flush=True)
+        except Exception as e:
+            print(f"  ⚠️  Could not write BigQuery metrics to {self.table}: {e}", flush=True)
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def summary(self) -> str:
+        return (
+            f"{self.jobs} jobs, {self.bytes_billed / 1e9:.2f} GB billed "
+            f"(~${self.bytes_billed / 2 ** 40 * BQ_USD_PER_TIB:.2f}), "
+            f"{self.slot_ms / 1000:.0f} slot-s, {self.wall_seconds:.1f}s waiting"
+        )
+
+    def close(self):
+        self.flush()
+        if self.jobs:
+            print(f"📊 BigQuery usage ({script_name()}): {self.summary()}", flush=True)
+
+
+_recorder: Optional[MetricsRecorder] = None
+
+
+def get_recorder() -> MetricsRecorder:
+    global _recorder
+    if _recorder is None:
+        _recorder = MetricsRecorder()
+    return _recorder
+
+
+class MeteredClient(bigquery.Client):
+    """bigquery.Client that labels jobs and records their cost and latency."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._metrics = get_recorder()
+        if self._metrics.client is None:
+            self._metrics.client = self
+        self._local = threading.local()
+
+    def _tracked(self, method, config_cls, args, kwargs, config_index: int):
+        # load_table_from_json calls load_table_from_file on self: only the outer call is tracked
+        if not self._metrics.enabled or getattr(self._local, "depth", 0):
+            return method(*args, **kwargs)
+        label = _caller_label()
+        args = list(args)
+        positional = len(args) > config_index
+        job_config = args[config_index] if positional else kwargs.get("job_config")
+        if job_config is None:
+            job_config = config_cls()
+            if positional:
+                args[config_index] = job_config
+            else:
+                kwargs["job_config"] = job_config
+        job_config.labels = {**(job_config.labels or {}), "script": _label_value(script_name()), "step": _label_value(label)}
+
+        self._local.depth = 1
+        try:
+            job = method(*args, **kwargs)
+        finally:
+            self._local.depth = 0
+        self._instrument(job, label)
+        return job
+
+    def _instrument(self, job, label: str):
+        started = time.time()
+        result = job.result
+        recorded = []
+
+        def timed_result(*args, **kwargs):
+            error = None
+            try:
+                return result(*args, **kwargs)
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                if not recorded:
+                    recorded.append(True)
+                    try:
+                        self._metrics.record(_job_record(job, label, time.time() - started, error))
+                    except Exception as e:
+                        print(f"  ⚠️  Could not record BigQuery job {job.job_id}: {e}", flush=True)
+
+        job.result = timed_result
+
+    def query(self, *args, **kwargs):
+        return self._tracked(super().query, bigquery.QueryJobConfig, args, kwargs, 1)
+
+    def load_table_from_uri(self, *args, **kwargs):
+        return self._tracked(super().load_table_from_uri, bigquery.LoadJobConfig, args, kwargs, 6)
+
+    def load_table_from_file(self, *args, **kwargs):
+        return self._tracked(super().load_table_from_file, bigquery.LoadJobConfig, args, kwargs, 9)
+
+    def load_table_from_json(self, *args, **kwargs):
+        return self._tracked(super().load_table_from_json, bigquery.LoadJobConfig, args, kwargs, 7)
+
+    def copy_table(self, *args, **kwargs):
+        return self._tracked(super().copy_table, bigquery.CopyJobConfig, args, kwargs, 6)
+
+    def extract_table(self, *args, **kwargs):
+        return self._tracked(super().extract_table, bigquery.ExtractJobConfig, args, kwargs, 6)
+
+
+# --- Report ---
+
+def _aggregate(records: List[Dict]) -> List[Dict]:
+    groups: Dict[tuple, Dict] = {}
+    for r in records:
+        key = (r.get("script"), r.get("label"), r.get("job_type"))
+        g = groups.setdefault(key, {"script": key[0], "label": key[1], "job_type": key[2], "jobs": 0,
+                                    "bytes_billed": 0, "bytes_processed": 0, "slot_ms": 0,
+                                    "wall_seconds": 0.0, "cache_hits": 0, "errors": 0})
+        g["jobs"] += 1
+        g["bytes_billed"] += r.get("bytes_billed") or 0
+        g["bytes_processed"] += r.get("bytes_processed") or 0
+        g["slot_ms"] += r.get("slot_ms") or 0
+        g["wall_seconds"] += r.get("wall_seconds") or 0
+        g["cache_hits"] += 1 if r.get("cache_hit") else 0
+        g["errors"] += 1 if r.get("error") else 0
+    return list(groups.values())
+
+
+def load_records_from_jsonl(path: str, since: datetime) -> List[Dict]:
+    records = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            created = datetime.fromisoformat(record["created_at"])
+            if created.tzinfo is None:
+                created = created.replace(tzinfo=timezone.utc)
+            if created >= since:
+                records.append(record)
+    return records
+
+
+def load_groups_from_table(client: bigquery.Client, table: str, since: datetime) -> List[Dict]:
+    query = f"""
+    SELECT script, label, job_type, COUNT(*) AS jobs,
+           IFNULL(SUM(bytes_billed), 0) AS bytes_billed,
+           IFNULL(SUM(bytes_processed), 0) AS bytes_processed,
+           IFNULL(SUM(slot_ms), 0) AS slot_ms,
+           IFNULL(SUM(wall_seconds), 0) AS wall_seconds,
+           COUNTIF(cache_hit) AS cache_hits,
+           COUNTIF(error IS NOT NULL) AS errors
+    FROM `{table}`
+    WHERE created_at >= @since
+    GROUP BY script, label, job_type
+    """
+    job_config = bigquery.QueryJobConfig(query_parameters=[bigquery.ScalarQueryParameter("since", "TIMESTAMP", since)])
+    return [dict(row.items()) for row in client.query(query, job_config=job_config).result()]
+
+
+def print_report(groups: List[Dict], top: int, sort_by: str):
+    groups = sorted(groups, key=lambda g: (g[sort_by], g["wall_seconds"]), reverse=True)
+    total_billed = sum(g["bytes_billed"] for g in groups)
+    total_jobs = sum(g["jobs"] for g in groups)
+    print(f"{total_jobs} jobs, {total_billed / 1e9:.2f} GB billed (~${total_billed / 2 ** 40 * BQ_USD_PER_TIB:.2f})")
+    print()
+    header = f"{'script':<36} {'label':<36} {'type':<6} {'jobs':>6} {'GB billed':>10} {'$':>8} {'slot-s':>9} {'wall-s':>9} {'cache':>6} {'err':>4}"
+    print(header)
+    print("-" * len(header))
+    for g in groups[:top]:
+        print(
+            f"{(g['script'] or '')[:36]:<36} {(g['label'] or '')[:36]:<36} {(g['job_type'] or '')[:6]:<6} "
+            f"{g['jobs']:>6} {g['bytes_billed'] / 1e9:>10.2f} {g['bytes_billed'] / 2 ** 40 * BQ_USD_PER_TIB:>8.2f} "
+            f"{g['slot_ms'] / 1000:>9.0f} {g['wall_seconds']:>9.1f} {g['cache_hits'] / g['jobs']:>6.0%} {g['errors']:>4}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BigQuery job cost/latency report")
+    sub = parser.add_subparsers(dest="command")
+    report = sub.add_parser("report", help="Rank the most expensive steps per script")
+    report.add_argument("--path", default=BQ_METRICS_PATH, help="JSONL metrics file")
+    report.add_argument("--table", nargs="?", const=BQ_METRICS_TABLE, help="Read from the metrics table instead")
+    report.add_argument("--script", help="Only this script (e.g. daily-sync-trades-markets)")
+    report.add_argument("--days", type=float, default=7, help="Look back this many days (7)")
+    report.add_argument("--top", type=int, default=20, help="Rows to show (20)")
+    report.add_argument("--sort", choices=["bytes_billed", "slot_ms", "wall_seconds", "jobs"], default="bytes_billed")
+    args = parser.parse_args()
+
+    if args.command != "report":
+        parser.print_help()
+        return
+
+    since = datetime.now(timezone.utc) - timedelta(days=args.days)
+    if args.table:
+        groups = load_groups_from_table(bigquery.Client(project=PROJECT_ID), args.table, since)
+    else:
+        if not os.path.exists(args.path):
+            print(f"❌ No metrics file at {args.path}")
+            sys.exit(1)
+        groups = _aggregate(load_records_from_jsonl(args.path, since))
+    if args.script:
+        groups = [g for g in groups if g["script"] == args.script]
+    print_report(groups, args.top, args.sort)
+
+
+if __name__ == "__main__":
+    main()
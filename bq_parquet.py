@@ -0,0 +1,208 @@
+"""
+Columnar load path for BigQuery: mapped rows -> Arrow table -> Parquet.
+
+load_table_from_rows() is a drop-in for client.load_table_from_json(). Rows
+are converted column by column to the destination schema's types (so bad
+values fail here, before a load job is created), written as compressed
+Parquet in memory and loaded with load_table_from_file. Upload size, client
+CPU and load-job parse time all drop compared to NDJSON.
+
+Falls back to load_table_from_json when pyarrow is not installed,
+BQ_LOAD_FORMAT=json, or the schema has column types this module does not
+convert (RECORD, REPEATED, JSON, ...).
+
+Usage:
+    load_job = load_table_from_rows(client, rows, temp_table_id, job_config=job_config, schema=dest_table.schema)
+    load_job.result()
+"""
+
+import io
+import os
+import json
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional, Sequence
+
+from google.cloud import bigquery
+
+# pyarrow is optional: without it every load goes through NDJSON
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+BQ_LOAD_FORMAT = os.getenv("BQ_LOAD_FORMAT", "parquet").lower()  # parquet | json
+BQ_PARQUET_COMPRESSION = os.getenv("BQ_PARQUET_COMPRESSION", "snappy")  # snappy | gzip | zstd
+
+SUPPORTED_TYPES = {
+    "STRING", "INTEGER", "INT64", "FLOAT", "FLOAT64", "NUMERIC",
+    "BOOLEAN", "BOOL", "TIMESTAMP", "DATE",
+}
+
+
+class RowConversionError(ValueError):
+    """A row value could not be converted to its column's BigQuery type."""
+
+
+def _to_string(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+
+def _to_int(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError(f"{value} is not an integer")
+        return int(value)
+    return int(value)
+
+
+def _to_bool(value):
+    if isinstance(value, str):
+        lowered = value.strip().lower()
+        if lowered in ("true", "1"):
+            return True
+        if lowered in ("false", "0"):
+            return False
+        raise ValueError(f"{value!r} is not a boolean")
+    return bool(value)
+
+
+def _to_timestamp(value):
+    """TIMESTAMP from datetime, unix seconds or a 'YYYY-MM-DD HH:MM:SS[.ffffff][+00:00|Z]' string (naive = UTC)."""
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, tz=timezone.utc)
+    else:
+        text = str(value).strip().replace("T", " ")
+        if text.endswith(("Z", " UTC")):
+            text = text[:-1] if text.endswith("Z") else text[:-4]
+            text += "+00:00"
+        parsed = datetime.fromisoformat(text)
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def _to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def _to_decimal(value):
+    return Decimal(str(value))
+
+
+CONVERTERS: Dict[str, Callable] = {
+    "STRING": _to_string,
+    "INTEGER": _to_int,
+    "INT64": _to_int,
+    "FLOAT": float,
+    "FLOAT64": float,
+    "NUMERIC": _to_decimal,
+    "BOOLEAN": _to_bool,
+    "BOOL": _to_bool,
+    "TIMESTAMP": _to_timestamp,
+    "DATE": _to_date,
+}
+
+
+def _arrow_type(field_type: str):
+    return {
+        "STRING": pa.string(),
+        "INTEGER": pa.int64(),
+        "INT64": pa.int64(),
+        "FLOAT": pa.float64(),
+        "FLOAT64": pa.float64(),
+        "NUMERIC": pa.decimal128(38, 9),
+        "BOOLEAN": pa.bool_(),
+        "BOOL": pa.bool_(),
+        "TIMESTAMP": pa.timestamp("us", tz="UTC"),
+        "DATE": pa.date32(),
+    }[field_type]
+
+
+def supports_schema(schema: Sequence[bigquery.SchemaField]) -> bool:
+    """True if every column is a scalar type this module can convert."""
+    return all(f.field_type.upper() in SUPPORTED_TYPES and f.mode != "REPEATED" for f in schema)
+
+
+def rows_to_arrow(rows: List[Dict], schema: Sequence[bigquery.SchemaField], ignore_unknown_values: bool = False):
+    """
+    Builds a pyarrow.Table with one column per schema field (missing keys are
+    NULL). Keys not in the schema raise RowConversionError unless
+    ignore_unknown_values, matching what a JSON load job would do.
+    """
+    names = {f.name for f in schema}
+    if not ignore_unknown_values:
+        unknown = set()
+        for row in rows:
+            unknown.update(k for k in row if k not in names)
+        if unknown:
+            raise RowConversionError(f"Fields not in destination schema: {', '.join(sorted(unknown))}")
+
+    arrays = []
+    fields = []
+    for field in schema:
+        field_type = field.field_type.upper()
+        convert = CONVERTERS[field_type]
+        values = []
+        for i, row in enumerate(rows):
+            value = row.get(field.name)
+            if value is None or (value == "" and field_type != "STRING"):
+                if field.mode == "REQUIRED":
+                    raise RowConversionError(f"Row {i}: {field.name} is REQUIRED but missing")
+                values.append(None)
+                continue
+            try:
+                values.append(convert(value))
+            except (TypeError, ValueError, ArithmeticError) as e:
+                raise RowConversionError(f"Row {i}: cannot convert {field.name}={value!r} to {field_type}: {e}")
+        arrow_type = _arrow_type(field_type)
+        arrays.append(pa.array(values, type=arrow_type))
+        fields.append(pa.field(field.name, arrow_type, nullable=field.mode != "REQUIRED"))
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def rows_to_parquet(rows: List[Dict], schema: Sequence[bigquery.SchemaField], ignore_unknown_values: bool = False) -> io.BytesIO:
+    table = rows_to_arrow(rows, schema, ignore_unknown_values)
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression=BQ_PARQUET_COMPRESSION)
+    buffer.seek(0)
+    return buffer
+
+
+def load_table_from_rows(
+    client: bigquery.Client,
+    rows: List[Dict],
+    table_id: str,
+    job_config: Optional[bigquery.LoadJobConfig] = None,
+    schema: Optional[Sequence[bigquery.SchemaField]] = None,
+) -> bigquery.LoadJob:
+    """
+    Loads dict rows into table_id as Parquet typed by `schema` (defaults to
+    the table's current schema). Returns the LoadJob like load_table_from_json.
+    """
+    job_config = job_config or bigquery.LoadJobConfig()
+    if BQ_LOAD_FORMAT != "parquet" or not PYARROW_AVAILABLE:
+        return client.load_table_from_json(rows, table_id, job_config=job_config)
+
+    if schema is None:
+        schema = client.get_table(table_id).schema
+    if not supports_schema(schema):
+        return client.load_table_from_json(rows, table_id, job_config=job_config)
+
+    parquet = rows_to_parquet(rows, schema, bool(job_config.ignore_unknown_values))
+    job_config.source_format = bigquery.SourceFormat.PARQUET
+    job_config.schema = schema
+    job_config.autodetect = False
+    return client.load_table_from_file(parquet, table_id, job_config=job_config, rewind=True)
@@ -0,0 +1,368 @@
+"""
+BigQuery Storage Write API sink (no temp tables, load jobs or per-run MERGE).
+
+StorageWriteSink appends dict rows to a table over a gRPC write stream:
+- pending (default): rows are buffered server-side and become visible
+  atomically when commit() finalizes and batch-commits the stream. A run
+  that dies before commit() leaves nothing behind, so re-running it never
+  duplicates rows.
+- committed: rows are visible as soon as each append is acknowledged.
+Every append carries the stream offset it expects, so retrying an append
+after a dropped connection cannot write the same rows twice (the server
+answers ALREADY_EXISTS, which is treated as success).
+
+Rows land in a stream ("landing") table. Duplicates across runs are removed
+at read time (create_dedup_view) or by compact_stream_table, which MERGEs
+rows older than STREAM_COMPACTION_MIN_AGE_MINUTES into the main table and
+deletes them from the landing table.
+
+Requires google-cloud-bigquery-storage (optional; callers fall back to the
+load-job path when it is missing).
+
+Usage:
+    sink = StorageWriteSink(bq_client, TRADES_STREAM_TABLE, schema)
+    sink.append(rows)
+    sink.commit()
+"""
+
+import os
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence
+
+from google.api_core import exceptions as api_exceptions
+from google.cloud import bigquery
+from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+
+from bq_parquet import CONVERTERS
+
+# Storage Write API client is optional (only needed for the streaming sink)
+try:
+    from google.cloud import bigquery_storage_v1
+    from google.cloud.bigquery_storage_v1 import types as write_types
+    from google.cloud.bigquery_storage_v1 import writer as write_writer
+    STORAGE_WRITE_AVAILABLE = True
+except ImportError:
+    STORAGE_WRITE_AVAILABLE = False
+
+STORAGE_WRITE_MODE = os.getenv("STORAGE_WRITE_MODE", "pending").lower()  # pending | committed
+STORAGE_WRITE_MAX_BATCH_BYTES = int(os.getenv("STORAGE_WRITE_MAX_BATCH_BYTES", str(8 * 1024 * 1024)))  # API limit is 10 MB per append
+STORAGE_WRITE_MAX_RETRIES = int(os.getenv("STORAGE_WRITE_MAX_RETRIES", "5"))
+STREAM_COMPACTION_MIN_AGE_MINUTES = int(os.getenv("STREAM_COMPACTION_MIN_AGE_MINUTES", "60"))
+
+INGESTED_AT_COLUMN = "ingested_at"
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+EPOCH_DATE = date(1970, 1, 1)
+
+FieldType = descriptor_pb2.FieldDescriptorProto
+
+# BigQuery type -> (proto field type, encoder for the bq_parquet-converted value).
+# TIMESTAMP is int64 microseconds since the epoch, DATE int32 days, NUMERIC a decimal string.
+PROTO_TYPES = {
+    "STRING": (FieldType.TYPE_STRING, str),
+    "INTEGER": (FieldType.TYPE_INT64, int),
+    "INT64": (FieldType.TYPE_INT64, int),
+    "FLOAT": (FieldType.TYPE_DOUBLE, float),
+    "FLOAT64": (FieldType.TYPE_DOUBLE, float),
+    "BOOLEAN": (FieldType.TYPE_BOOL, bool),
+    "BOOL": (FieldType.TYPE_BOOL, bool),
+    "TIMESTAMP": (FieldType.TYPE_INT64, lambda dt: (dt - EPOCH) // timedelta(microseconds=1)),
+    "DATE": (FieldType.TYPE_INT32, lambda d: (d - EPOCH_DATE).days),
+    "NUMERIC": (FieldType.TYPE_STRING, str),
+}
+
+
+def build_row_message_class(schema: Sequence[bigquery.SchemaField], name: str = "Row"):
+    """Builds a proto2 message class with one optional field per (scalar) schema column."""
+    unsupported = [f.name for f in schema if f.field_type.upper() not in PROTO_TYPES or f.mode == "REPEATED"]
+    if unsupported:
+        raise ValueError(f"Storage Write sink does not support columns: {', '.join(unsupported)}")
+
+    file_proto = descriptor_pb2.FileDescriptorProto(
+        name=f"{name.lower()}_{int(time.time() * 1000000)}.proto",
+        package="polycopy.storage_write",
+        syntax="proto2",
+    )
+    message_proto = file_proto.message_type.add(name=name)
+    for number, field in enumerate(schema, start=1):
+        message_proto.field.add(
+            name=field.name,
+            number=number,
+            type=PROTO_TYPES[field.field_type.upper()][0],
+            label=FieldType.LABEL_OPTIONAL,
+        )
+
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(file_proto)
+    descriptor = pool.FindMessageTypeByName(f"polycopy.storage_write.{name}")
+    if hasattr(message_factory, "GetMessageClass"):
+        return message_factory.GetMessageClass(descriptor)
+    return message_factory.MessageFactory(pool).GetPrototype(descriptor)
+
+
+def serialize_row(message_class, schema: Sequence[bigquery.SchemaField], row: Dict) -> bytes:
+    """Converts a dict row (same value conventions as bq_parquet) to serialized proto bytes."""
+    message = message_class()
+    for field in schema:
+        value = row.get(field.name)
+        field_type = field.field_type.upper()
+        if value is None or (value == "" and field_type != "STRING"):
+            if field.mode == "REQUIRED":
+                raise ValueError(f"{field.name} is REQUIRED but missing")
+            continue
+        encode = PROTO_TYPES[field_type][1]
+        setattr(message, field.name, encode(CONVERTERS[field_type](value)))
+    return message.SerializeToString()
+
+
+class StorageWriteSink:
+    """
+    Appends rows to one table through a single pending or committed write
+    stream with explicit offsets. Call commit() once all rows are appended.
+    """
+
+    def __init__(
+        self,
+        bq_client: bigquery.Client,
+        table_id: str,
+        schema: Optional[Sequence[bigquery.SchemaField]] = None,
+        mode: str = STORAGE_WRITE_MODE,
+        write_client=None,
+    ):
+        if not STORAGE_WRITE_AVAILABLE:
+            raise RuntimeError("google-cloud-bigquery-storage is not installed")
+        if mode not in ("pending", "committed"):
+            raise ValueError(f"Unknown Storage Write mode: {mode}")
+
+        self.table_id = table_id
+        self.schema = list(schema if schema is not None else bq_client.get_table(table_id).schema)
+        self.mode = mode
+        project, dataset, table = table_id.split(".")
+        self.table_path = f"projects/{project}/datasets/{dataset}/tables/{table}"
+        self.write_client = write_client or bigquery_storage_v1.BigQueryWriteClient()
+        self.message_class = build_row_message_class(self.schema)
+
+        stream_type = write_types.WriteStream.Type.PENDING if mode == "pending" else write_types.WriteStream.Type.COMMITTED
+        self.stream = self.write_client.create_write_stream(
+            parent=self.table_path,
+            write_stream=write_types.WriteStream(type_=stream_type),
+        )
+        self.offset = 0  # Rows acknowledged so far = offset of the next append
+        self.appends = 0
+        self.bytes_sent = 0
+        self._append_stream = None
+        self._closed = False
+
+    def _open_append_stream(self):
+        proto_descriptor = descriptor_pb2.DescriptorProto()
+        self.message_class.DESCRIPTOR.CopyToProto(proto_descriptor)
+        template = write_types.AppendRowsRequest()
+        template.write_stream = self.stream.name
+        proto_data = write_types.AppendRowsRequest.ProtoData()
+        proto_data.writer_schema = write_types.ProtoSchema(proto_descriptor=proto_descriptor)
+        template.proto_rows = proto_data
+        self._append_stream = write_writer.AppendRowsStream(self.write_client, template)
+
+    def _close_append_stream(self):
+        if self._append_stream is not None:
+            try:
+                self._append_stream.close()
+            except Exception:
+                pass
+            self._append_stream = None
+
+    def _send(self, serialized_rows: List[bytes]):
+        """Appends one batch at self.offset, retrying transient errors with the same offset."""
+        request = write_types.AppendRowsRequest()
+        request.offset = self.offset
+        proto_data = write_types.AppendRowsRequest.ProtoData()
+        proto_data.rows = write_types.ProtoRows(serialized_rows=serialized_rows)
+        request.proto_rows = proto_data
+
+        for attempt in range(1, STORAGE_WRITE_MAX_RETRIES + 1):
+            if self._append_stream is None:
+                self._open_append_stream()
+            try:
+                self._append_stream.send(request).result()
+                break
+            except api_exceptions.AlreadyExists:
+                # An earlier attempt landed before its ack was lost: rows are already written
+                break
+            except (api_exceptions.ServiceUnavailable, api_exceptions.InternalServerError,
+                    api_exceptions.DeadlineExceeded, api_exceptions.Aborted, api_exceptions.Cancelled) as e:
+                self._close_append_stream()
+                if attempt == STORAGE_WRITE_MAX_RETRIES:
+                    raise
+                wait = min(30, 2 ** attempt)
+                print(f"  ⚠️  Storage Write append at offset {self.offset} failed ({type(e).__name__}), retrying in {wait}s...", flush=True)
+                time.sleep(wait)
+
+        self.offset += len(serialized_rows)
+        self.appends += 1
+        self.bytes_sent += sum(len(r) for r in serialized_rows)
+
+    def append(self, rows: List[Dict]) -> int:
+        """Serializes and appends rows in batches under STORAGE_WRITE_MAX_BATCH_BYTES. Returns rows appended."""
+        if self._closed:
+            raise RuntimeError("Storage Write sink already committed")
+        batch: List[bytes] = []
+        batch_bytes = 0
+        for row in rows:
+            serialized = serialize_row(self.message_class, self.schema, row)
+            if batch and batch_bytes + len(serialized) > STORAGE_WRITE_MAX_BATCH_BYTES:
+                self._send(batch)
+                batch, batch_bytes = [], 0
+            batch.append(serialized)
+            batch_bytes += len(serialized)
+        if batch:
+            self._send(batch)
+        return len(rows)
+
+    def commit(self) -> int:
+        """Finalizes the stream (and batch-commits it in pending mode). Returns total rows written."""
+        if self._closed:
+            return self.offset
+        self._close_append_stream()
+        self.write_client.finalize_write_stream(name=self.stream.name)
+        if self.mode == "pending":
+            response = self.write_client.batch_commit_write_streams(
+                write_types.BatchCommitWriteStreamsRequest(parent=self.table_path, write_streams=[self.stream.name])
+            )
+            if response.stream_errors:
+                raise RuntimeError(f"Storage Write commit failed: {list(response.stream_errors)}")
+        self._closed = True
+        return self.offset
+
+    def abort(self):
+        """Drops the connection without committing (pending rows are discarded by BigQuery)."""
+        self._close_append_stream()
+        self._closed = True
+
+    def summary(self) -> str:
+        return f"{self.offset:,} rows in {self.appends} appends ({self.bytes_sent / 1e6:.2f} MB, {self.mode} stream)"
+
+
+def ensure_stream_table(
+    client: bigquery.Client,
+    stream_table: str,
+    target_table: str,
+    cluster_fields: Optional[List[str]] = None,
+) -> List[bigquery.SchemaField]:
+    """
+    Creates the landing table (target schema + ingested_at, day-partitioned
+    on ingested_at) if missing. Returns its schema.
+    """
+    try:
+        return list(client.get_table(stream_table).schema)
+    except Exception:
+        pass
+    target_schema = list(client.get_table(target_table).schema)
+    schema = [
+        bigquery.SchemaField(f.name, f.field_type, mode="NULLABLE", description=f.description)
+        for f in target_schema
+    ] + [bigquery.SchemaField(INGESTED_AT_COLUMN, "TIMESTAMP", mode="REQUIRED")]
+    table = bigquery.Table(stream_table, schema=schema)
+    table.time_partitioning = bigquery.TimePartitioning(field=INGESTED_AT_COLUMN)
+    if cluster_fields:
+        table.clustering_fields = cluster_fields
+    table.description = f"Storage Write API landing table for {target_table}; compacted into it periodically"
+    client.create_table(table, exists_ok=True)
+    print(f"✅ Created stream landing table {stream_table}", flush=True)
+    return schema
+
+
+def create_dedup_view(
+    client: bigquery.Client,
+    view_id: str,
+    target_table: str,
+    stream_table: str,
+    key_columns: List[str],
+    order_by: str,
+):
+    """
+    View over target + landing rows not yet compacted, one row per key
+    (read-time dedup). key_columns are SQL expressions, e.g. COALESCE(order_hash, '').
+    """
+    columns = [f.name for f in client.get_table(target_table).schema]
+    column_list = ", ".join(f"`{c}`" for c in columns)
+    key_list = ", ".join(key_columns)
+    query = f"""
+    CREATE OR REPLACE VIEW `{view_id}` AS
+    SELECT * EXCEPT(_rn, _from_target) FROM (
+        SELECT *, ROW_NUMBER() OVER (PARTITION BY {key_list} ORDER BY _from_target DESC, {order_by}) AS _rn
+        FROM (
+            SELECT {column_list}, TRUE AS _from_target FROM `{target_table}`
+            UNION ALL
+            SELECT {column_list}, FALSE AS _from_target FROM `{stream_table}`
+        )
+    )
+    WHERE _rn = 1
+    """
+    client.query(query).result()
+
+
+def compact_stream_table(
+    client: bigquery.Client,
+    stream_table: str,
+    target_table: str,
+    key_conditions: List[str],
+    partition_keys: List[str],
+    order_by: str,
+    min_age_minutes: int = STREAM_COMPACTION_MIN_AGE_MINUTES,
+    prune_column: Optional[str] = None,
+    prune_padding_hours: int = 0,
+) -> bool:
+    """
+    Moves landing rows older than min_age_minutes into target_table (insert
+    if the key is new) and deletes them from the landing table, in one
+    transaction. Younger rows are left alone: rows just written through the
+    Storage Write API cannot be modified by DML yet.
+
+    With prune_column (the target's partition column), the MERGE only reads
+    target rows between the settled rows' MIN/MAX of that column, widened by
+    prune_padding_hours each side, instead of the whole target table.
+    """
+    try:
+        columns = [f.name for f in client.get_table(target_table).schema]
+        client.get_table(stream_table)
+    except Exception as e:
+        print(f"  ⚠️  Skipping stream compaction: {e}", flush=True)
+        return False
+    column_list = ", ".join(f"`{c}`" for c in columns)
+    conditions = list(key_conditions)
+    bounds = ""
+    if prune_column:
+        conditions.append(f"target.`{prune_column}` BETWEEN lo AND hi")
+        bounds = f"""
+    DECLARE lo TIMESTAMP;
+    DECLARE hi TIMESTAMP;
+    SET (lo, hi) = (
+        SELECT AS STRUCT
+            TIMESTAMP_SUB(MIN(`{prune_column}`), INTERVAL {prune_padding_hours} HOUR),
+            TIMESTAMP_ADD(MAX(`{prune_column}`), INTERVAL {prune_padding_hours} HOUR)
+        FROM `{stream_table}`
+        WHERE {INGESTED_AT_COLUMN} < cutoff
+    );"""
+    on_clause = "\n           AND ".join(conditions)
+    script = f"""
+    DECLARE cutoff TIMESTAMP DEFAULT TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {min_age_minutes} MINUTE);{bounds}
+    BEGIN TRANSACTION;
+    MERGE `{target_table}` AS target
+    USING (
+        SELECT {column_list}
+        FROM `{stream_table}`
+        WHERE {INGESTED_AT_COLUMN} < cutoff
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY {", ".join(partition_keys)} ORDER BY {order_by}) = 1
+    ) AS source
+    ON {on_clause}
+    WHEN NOT MATCHED THEN INSERT ROW;
+    DELETE FROM `{stream_table}` WHERE {INGESTED_AT_COLUMN} < cutoff;
+    COMMIT TRANSACTION;
+    """
+    try:
+        client.query(script).result()
+        return True
+    except Exception as e:
+        print(f"  ⚠️  Stream compaction failed (rows stay in {stream_table}, retried next run): {e}", flush=True)
+        return False
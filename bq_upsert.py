@@ -0,0 +1,136 @@
+"""
+Atomic multi-table upsert through a BigQuery session.
+
+The per-table loaders (get_table -> create_table -> load job -> MERGE ->
+delete_table, once per entity) cost ~5 round trips per table and can leave
+trades merged while markets/events failed. upsert_in_transaction() instead:
+
+1. loads every entity into a session temp table (_SESSION.<name>); the first
+   load job creates the session, the rest run in parallel inside it
+2. runs all MERGEs as one multi-statement transaction in that session
+   (BEGIN TRANSACTION ... COMMIT TRANSACTION; any failure rolls back all)
+3. aborts the session, which drops the temp tables
+
+No permanent temp tables are created, so nothing is left behind when the job
+dies mid-run.
+
+Usage:
+    staged = [
+        StagedMerge("trades", trades, TRADES_TABLE, trades_merge_sql),
+        StagedMerge("markets", markets, MARKETS_TABLE, markets_merge_sql),
+    ]
+    ok = upsert_in_transaction(client, staged)
+"""
+
+import os
+from typing import Callable, Dict, List, Optional
+
+from google.cloud import bigquery
+from bq_parquet import load_table_from_rows
+
+ATOMIC_UPSERT = os.getenv("ATOMIC_UPSERT", "true").lower() == "true"  # false = one temp table + MERGE per entity
+SESSION_DATASET = "_SESSION"
+
+
+class StagedMerge:
+    """
+    One entity to upsert: its rows, target table and a MERGE builder that
+    takes the source table reference (e.g. `_SESSION.trades_stage`).
+    """
+
+    def __init__(self, name: str, rows: List[Dict], target_table: str, merge_sql: Callable[[str], str]):
+        self.name = name
+        self.rows = rows
+        self.target_table = target_table
+        self.merge_sql = merge_sql
+        self.stage_table = f"{name}_stage"
+
+    @property
+    def source(self) -> str:
+        return f"{SESSION_DATASET}.{self.stage_table}"
+
+
+def _session_properties(session_id: str) -> List[bigquery.ConnectionProperty]:
+    return [bigquery.ConnectionProperty("session_id", session_id)]
+
+
+def _load_stage(
+    client: bigquery.Client,
+    entity: StagedMerge,
+    schema,
+    session_id: Optional[str],
+) -> bigquery.LoadJob:
+    """Starts the load of entity.rows into its session temp table (creates the session if session_id is None)."""
+    job_config = bigquery.LoadJobConfig(
+        write_disposition="WRITE_TRUNCATE",
+        source_format="NEWLINE_DELIMITED_JSON",
+        schema=schema,
+        autodetect=False,
+    )
+    if session_id:
+        job_config.connection_properties = _session_properties(session_id)
+    else:
+        job_config.create_session = True
+    destination = f"{client.project}.{SESSION_DATASET}.{entity.stage_table}"
+    return load_table_from_rows(client, entity.rows, destination, job_config=job_config, schema=schema)
+
+
+def build_transaction_script(staged: List[StagedMerge]) -> str:
+    """All MERGEs in one transaction; an error rolls every table back and re-raises."""
+    statements = "\n".join(f"{entity.merge_sql(entity.source).strip()};" for entity in staged)
+    return f"""
+    BEGIN
+      BEGIN TRANSACTION;
+      {statements}
+      COMMIT TRANSACTION;
+    EXCEPTION WHEN ERROR THEN
+      ROLLBACK TRANSACTION;
+      RAISE USING MESSAGE = @@error.message;
+    END;
+    """
+
+
+def _abort_session(client: bigquery.Client, session_id: str):
+    try:
+        job_config = bigquery.QueryJobConfig(connection_properties=_session_properties(session_id))
+        client.query("CALL BQ.ABORT_SESSION()", job_config=job_config).result()
+    except Exception as e:
+        # Sessions expire on their own after 24h of inactivity
+        print(f"  ⚠️  Could not abort session {session_id}: {e}", flush=True)
+
+
+def upsert_in_transaction(client: bigquery.Client, staged: List[StagedMerge]) -> bool:
+    """
+    Stages every non-empty entity in session temp tables and applies all
+    MERGEs atomically. Returns True when the transaction committed (or there
+    was nothing to do); on failure no target table has changed.
+    """
+    staged = [entity for entity in staged if entity.rows]
+    if not staged:
+        return True
+
+    session_id = None
+    try:
+        schemas = {entity.name: client.get_table(entity.target_table).schema for entity in staged}
+
+        print(f"  📊 Staging {', '.join(f'{len(e.rows)} {e.name}' for e in staged)} in a BigQuery session...", flush=True)
+        first_job = _load_stage(client, staged[0], schemas[staged[0].name], None)
+        first_job.result()
+        session_id = first_job.session_info.session_id
+        jobs = [_load_stage(client, entity, schemas[entity.name], session_id) for entity in staged[1:]]
+        for job in jobs:
+            job.result()
+
+        print(f"  📊 Merging {', '.join(e.name for e in staged)} in one transaction...", flush=True)
+        job_config = bigquery.QueryJobConfig(connection_properties=_session_properties(session_id))
+        client.query(build_transaction_script(staged), job_config=job_config).result()
+        print("  ✅ Transaction committed", flush=True)
+        return True
+    except Exception as e:
+        print(f"  ❌ Atomic upsert failed (no table changed): {e}", flush=True)
+        import traceback
+        traceback.print_exc()
+        return False
+    finally:
+        if session_id:
+            _abort_session(client, session_id)
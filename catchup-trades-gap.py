@@ -8,12 +8,20 @@ import os
 import sys
 import json
 import time
+import argparse
 import requests
 from datetime import datetime, timedelta
-from typing import List, Dict, Set, Tuple, Optional
+from typing import List, Dict, Set, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
 from google.cloud import bigquery
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from bq_metrics import MeteredClient
+from dome_throttle import get_throttled_session, get_shared_limiter
+from dome_markets import fetch_markets_by_condition_ids
+from market_hash import select_changed_markets
+from key_snapshot import known_keys
+from bq_parquet import load_table_from_rows
+from trades_merge import trade_bounds, trades_merge_sql
+from dead_letter import DLQ_REPLAY_CONCURRENCY, FETCH_MAX_ATTEMPTS, DeadLetterQueue, FetchFailed, backoff_delay, is_retryable
 
 # Load environment variables from .env.local if it exists
 try:
@@ -36,10 +44,10 @@ TRADERS_TABLE = f"{PROJECT_ID}.{DATASET}.traders"
 TRADES_TABLE = f"{PROJECT_ID}.{DATASET}.trades"
 MARKETS_TABLE = f"{PROJECT_ID}.{DATASET}.markets"
 EVENTS_TABLE = f"{PROJECT_ID}.{DATASET}.events"
+DEAD_LETTER_TABLE = f"{PROJECT_ID}.{DATASET}.ingestion_dead_letters"  # Drained by `catchup-trades-gap.py replay-dlq`
+DLQ_SOURCE = "catchup"
 
 # API settings
-API_RATE_LIMIT_DELAY = 0.05  # 20 RPS
-BATCH_SIZE = 100
 MAX_RETRIES = 3
 RETRY_BACKOFF_BASE = 2
 
@@ -48,20 +56,11 @@ GAP_START = datetime(2026, 1, 29, 4, 22, 50)
 
 def get_bigquery_client():
     """Initializes BigQuery client."""
-    return bigquery.Client(project=PROJECT_ID)
+    return MeteredClient(project=PROJECT_ID)
 
 def get_http_session():
-    """Creates HTTP session with retry logic."""
-    session = requests.Session()
-    retry_strategy = Retry(
-        total=MAX_RETRIES,
-        backoff_factor=RETRY_BACKOFF_BASE,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["GET"]
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy, pool_connections=10, pool_maxsize=20)
-    session.mount("https://", adapter)
-    return session
+    """HTTP session paced by the shared adaptive Dome throttle (429s/Retry-After handled there)."""
+    return get_throttled_session(max_retries=MAX_RETRIES)
 
 def get_all_wallets(bq_client: bigquery.Client) -> Set[str]:
     """Gets all wallet addresses from traders table."""
@@ -79,23 +78,36 @@ def get_all_wallets(bq_client: bigquery.Client) -> Set[str]:
     print(f"✅ Total unique wallets: {len(wallets)}", flush=True)
     return wallets
 
-def fetch_trades_for_wallet(session: requests.Session, wallet: str, since: datetime) -> List[Dict]:
-    """Fetches trades for a wallet since the given timestamp."""
+def fetch_trades_for_wallet(
+    session: requests.Session,
+    wallet: str,
+    since: datetime,
+    dead_letters: Optional[DeadLetterQueue] = None,
+) -> Tuple[List[Dict], bool]:
+    """
+    Fetches trades for a wallet since the given timestamp.
+    A page is retried FETCH_MAX_ATTEMPTS times; after that the trades so far
+    are returned and the wallet is recorded in the dead-letter table. The
+    recorded cursor is the start of the fetch (offset 0), not the failing page:
+    the pages before it only live in memory until load_fetched_data() runs, so
+    a replay must fetch them again. Returns (trades, complete).
+    """
     all_trades = []
     base_url = "https://api.domeapi.io/v1"
     headers = {"Authorization": f"Bearer {DOME_API_KEY}", "Accept": "application/json"}
     
     params = {"user": wallet, "limit": 100, "start_time": int(since.timestamp())}
+    attempts = 0  # Consecutive failures of the current page
     offset = 0
     
     while True:
         params["offset"] = offset
         
         try:
-            time.sleep(API_RATE_LIMIT_DELAY)
             response = session.get(f"{base_url}/polymarket/orders", headers=headers, params=params, timeout=30)
             response.raise_for_status()
             data = response.json()
+            attempts = 0
             
             orders = data.get('orders', [])
             if not orders:
@@ -118,10 +130,18 @@ def fetch_trades_for_wallet(session: requests.Session, wallet: str, since: datet
                 print(f"    Fetched {len(all_trades)} trades so far...", flush=True)
         
         except Exception as e:
-            print(f"    ⚠️  Error fetching trades for {wallet[:10]}...: {e}", flush=True)
-            break
-    
-    return all_trades
+            attempts += 1
+            if attempts >= FETCH_MAX_ATTEMPTS or not is_retryable(e):
+                failure = FetchFailed(wallet, {'start_time': params["start_time"], 'offset': 0, 'failed_offset': offset}, e, attempts)
+                print(f"    ⚠️  Giving up on {wallet[:10]}... after {len(all_trades)} trades: {failure}", flush=True)
+                if dead_letters is not None:
+                    dead_letters.record(DLQ_SOURCE, failure)
+                return all_trades, False
+            delay = backoff_delay(attempts)
+            print(f"    ⚠️  Error fetching trades for {wallet[:10]}... (attempt {attempts}/{FETCH_MAX_ATTEMPTS}): {e} - retrying in {delay:.1f}s", flush=True)
+            time.sleep(delay)
+    
+    return all_trades, True
 
 def map_trade_to_schema(trade: Dict, wallet: str) -> Dict:
     """Maps Dome API trade to BigQuery schema."""
@@ -159,110 +179,6 @@ def map_trade_to_schema(trade: Dict, wallet: str) -> Dict:
         'order_hash': trade.get('order_hash'),
     }
 
-def fetch_markets_by_condition_ids(session: requests.Session, condition_ids: List[str]) -> Tuple[List[Dict], List[Dict]]:
-    """Fetches markets from Dome API."""
-    if not condition_ids:
-        return [], []
-    
-    all_markets_mapped = []
-    all_markets_raw = []
-    base_url = "https://api.domeapi.io/v1"
-    
-    total_batches = (len(condition_ids) + BATCH_SIZE - 1) // BATCH_SIZE
-    
-    for i in range(0, len(condition_ids), BATCH_SIZE):
-        batch = condition_ids[i:i + BATCH_SIZE]
-        batch_num = i // BATCH_SIZE + 1
-        
-        from urllib.parse import urlencode
-        url = f"{base_url}/polymarket/markets"
-        params = [('limit', len(batch))]
-        for cid in batch:
-            params.append(('condition_id', cid))
-        url = f"{url}?{urlencode(params)}"
-        
-        headers = {"Authorization": f"Bearer {DOME_API_KEY}", "Accept": "application/json"}
-        
-        try:
-            time.sleep(API_RATE_LIMIT_DELAY)
-            response = session.get(url, headers=headers, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-            
-            markets = []
-            if isinstance(data, list):
-                markets = data
-            elif isinstance(data, dict):
-                markets = data.get('markets', [])
-                if not markets and 'results' in data:
-                    markets = data.get('results', [])
-            
-            for market in markets:
-                all_markets_raw.append(market)
-                mapped = map_market_to_schema(market)
-                if mapped['condition_id']:
-                    all_markets_mapped.append(mapped)
-            
-            if batch_num % 50 == 0:
-                print(f"  Batch {batch_num}/{total_batches}: Fetched {len(markets)} markets", flush=True)
-        
-        except Exception as e:
-            print(f"  ⚠️  Error fetching batch {batch_num}: {e}", flush=True)
-            continue
-    
-    return all_markets_mapped, all_markets_raw
-
-def map_market_to_schema(market: Dict) -> Dict:
-    """Maps Dome API market to BigQuery schema."""
-    def to_timestamp(unix_seconds):
-        if unix_seconds and isinstance(unix_seconds, (int, float)):
-            dt = datetime.fromtimestamp(unix_seconds)
-            return dt.strftime('%Y-%m-%d %H:%M:%S')
-        return None
-    
-    def to_number(value):
-        if value is None:
-            return None
-        try:
-            return float(value) if isinstance(value, (int, float, str)) else None
-        except:
-            return None
-    
-    return {
-        'condition_id': market.get('condition_id'),
-        'event_slug': market.get('event_slug'),
-        'market_slug': market.get('market_slug'),
-        'bet_structure': market.get('bet_structure'),
-        'market_subtype': market.get('market_subtype'),
-        'market_type': market.get('market_type'),
-        'liquidity': to_number(market.get('liquidity')),
-        'status': market.get('status'),
-        'winning_label': market.get('winning_side', {}).get('label') if isinstance(market.get('winning_side'), dict) else market.get('winning_side'),
-        'winning_id': market.get('winning_side', {}).get('id') if isinstance(market.get('winning_side'), dict) else None,
-        'title': market.get('title'),
-        'description': market.get('description'),
-        'resolution_source': market.get('resolution_source'),
-        'image': market.get('image'),
-        'negative_risk_id': market.get('negative_risk_id'),
-        'game_start_time_raw': market.get('game_start_time'),
-        'volume_1_week': to_number(market.get('volume_1_week')),
-        'volume_1_month': to_number(market.get('volume_1_month')),
-        'volume_1_year': to_number(market.get('volume_1_year')),
-        'volume_total': to_number(market.get('volume_total')),
-        'start_time': to_timestamp(market.get('start_time')),
-        'end_time': to_timestamp(market.get('end_time')),
-        'completed_time': to_timestamp(market.get('completed_time')),
-        'close_time': to_timestamp(market.get('close_time')),
-        'game_start_time': to_timestamp(market.get('game_start_time')),
-        'start_time_unix': int(market.get('start_time')) if market.get('start_time') else None,
-        'end_time_unix': int(market.get('end_time')) if market.get('end_time') else None,
-        'completed_time_unix': int(market.get('completed_time')) if market.get('completed_time') else None,
-        'close_time_unix': int(market.get('close_time')) if market.get('close_time') else None,
-        'side_a': json.dumps(market.get('side_a')) if market.get('side_a') else None,
-        'side_b': json.dumps(market.get('side_b')) if market.get('side_b') else None,
-        'tags': json.dumps(market.get('tags')) if market.get('tags') else None,
-    }
-
 def extract_events_from_markets(markets_raw: List[Dict]) -> List[Dict]:
     """Extracts events from markets."""
     events = []
@@ -321,24 +237,10 @@ def load_trades_to_bigquery(client: bigquery.Client, trades: List[Dict]) -> bool
             source_format="NEWLINE_DELIMITED_JSON",
             autodetect=False
         )
-        load_job = client.load_table_from_json(valid_trades, temp_table_id, job_config=job_config)
+        load_job = load_table_from_rows(client, valid_trades, temp_table_id, job_config=job_config, schema=dest_table.schema)
         load_job.result()
         
-        merge_query = f"""
-        MERGE `{TRADES_TABLE}` AS target
-        USING (
-            SELECT *
-            FROM `{temp_table_id}`
-            QUALIFY ROW_NUMBER() OVER (
-                PARTITION BY wallet_address, tx_hash, COALESCE(order_hash, '')
-                ORDER BY timestamp DESC, id DESC
-            ) = 1
-        ) AS source
-        ON target.wallet_address = source.wallet_address
-           AND target.tx_hash = source.tx_hash
-           AND COALESCE(target.order_hash, '') = COALESCE(source.order_hash, '')
-        WHEN NOT MATCHED THEN INSERT ROW
-        """
+        merge_query = trades_merge_sql(TRADES_TABLE, f"`{temp_table_id}`", trade_bounds(valid_trades))
         
         merge_job = client.query(merge_query)
         merge_job.result()
@@ -356,6 +258,10 @@ def load_markets_to_bigquery(client: bigquery.Client, markets: List[Dict]) -> bo
     if not markets:
         return True
     
+    markets = select_changed_markets(client, MARKETS_TABLE, markets)
+    if not markets:
+        return True
+    
     try:
         temp_table_id = f"{MARKETS_TABLE}_temp_{int(time.time() * 1000000)}"
         dest_table = client.get_table(MARKETS_TABLE)
@@ -367,7 +273,7 @@ def load_markets_to_bigquery(client: bigquery.Client, markets: List[Dict]) -> bo
             source_format="NEWLINE_DELIMITED_JSON",
             autodetect=False
         )
-        load_job = client.load_table_from_json(markets, temp_table_id, job_config=job_config)
+        load_job = load_table_from_rows(client, markets, temp_table_id, job_config=job_config, schema=dest_table.schema)
         load_job.result()
         
         merge_query = f"""
@@ -411,6 +317,7 @@ def load_markets_to_bigquery(client: bigquery.Client, markets: List[Dict]) -> bo
             side_a = source.side_a,
             side_b = source.side_b,
             tags = source.tags,
+            content_hash = source.content_hash,
             last_updated = CURRENT_TIMESTAMP()
         """
         
@@ -441,7 +348,7 @@ def load_events_to_bigquery(client: bigquery.Client, events: List[Dict]) -> bool
             source_format="NEWLINE_DELIMITED_JSON",
             autodetect=False
         )
-        load_job = client.load_table_from_json(events, temp_table_id, job_config=job_config)
+        load_job = load_table_from_rows(client, events, temp_table_id, job_config=job_config, schema=dest_table.schema)
         load_job.result()
         
         merge_query = f"""
@@ -472,55 +379,21 @@ def load_events_to_bigquery(client: bigquery.Client, events: List[Dict]) -> bool
         traceback.print_exc()
         return False
 
-def main():
-    if not DOME_API_KEY:
-        raise ValueError("DOME_API_KEY not set")
-    
-    start_time = datetime.now(datetime.UTC) if hasattr(datetime, 'UTC') else datetime.utcnow()
-    print("=" * 80, flush=True)
-    print("Catch-Up Job: Backfilling Gap from Jan 29, 2026", flush=True)
-    print("=" * 80, flush=True)
-    print()
-    print(f"📅 Fetching trades since: {GAP_START.isoformat()}", flush=True)
-    print()
-    
-    bq_client = get_bigquery_client()
-    session = get_http_session()
-    
-    # Get all wallets
-    wallets = get_all_wallets(bq_client)
-    print(f"📊 Processing {len(wallets)} wallets", flush=True)
-    print()
-    
-    # Step 1: Fetch trades
-    print("Step 1: Fetching trades from gap period...", flush=True)
-    all_trades = []
-    all_condition_ids = set()
-    
-    for i, wallet in enumerate(sorted(wallets), 1):
-        if i % 50 == 0:
-            print(f"  Processing wallet {i}/{len(wallets)}...", flush=True)
-        
-        trades = fetch_trades_for_wallet(session, wallet, GAP_START)
-        for trade in trades:
-            mapped = map_trade_to_schema(trade, wallet)
-            if mapped.get('id') and mapped.get('timestamp') and mapped.get('tx_hash'):
-                all_trades.append(mapped)
-                if mapped.get('condition_id'):
-                    all_condition_ids.add(mapped['condition_id'])
-    
-    print(f"  ✅ Fetched {len(all_trades)} trades", flush=True)
-    print(f"  ✅ Found {len(all_condition_ids)} unique condition_ids", flush=True)
-    print()
-    
+def add_wallet_trades(wallet: str, trades: List[Dict], all_trades: List[Dict], all_condition_ids: Set[str]):
+    """Maps a wallet's fetched trades and collects the valid ones and their condition_ids."""
+    for trade in trades:
+        mapped = map_trade_to_schema(trade, wallet)
+        if mapped.get('id') and mapped.get('timestamp') and mapped.get('tx_hash'):
+            all_trades.append(mapped)
+            if mapped.get('condition_id'):
+                all_condition_ids.add(mapped['condition_id'])
+
+def load_fetched_data(bq_client: bigquery.Client, all_trades: List[Dict], all_condition_ids: Set[str]) -> Dict:
+    """Steps 2-7: fetches the new markets/events and loads trades, markets and events. Returns counts and trades_success."""
     # Step 2: Get condition_ids for markets
     print("Step 2: Identifying markets to fetch...", flush=True)
     
-    existing_query = f"SELECT DISTINCT condition_id FROM `{MARKETS_TABLE}` WHERE condition_id IS NOT NULL"
-    existing_results = bq_client.query(existing_query).result()
-    existing_condition_ids = {row['condition_id'] for row in existing_results if row.get('condition_id')}
-    
-    new_condition_ids = all_condition_ids - existing_condition_ids
+    new_condition_ids = known_keys(bq_client, "market", MARKETS_TABLE).missing(all_condition_ids)
     print(f"  ✅ New condition_ids: {len(new_condition_ids)}", flush=True)
     
     markets_to_fetch = list(new_condition_ids)
@@ -532,7 +405,7 @@ def main():
     markets_raw = []
     if markets_to_fetch:
         print("Step 3: Fetching markets from Dome API...", flush=True)
-        markets_mapped, markets_raw = fetch_markets_by_condition_ids(session, markets_to_fetch)
+        markets_mapped, markets_raw = fetch_markets_by_condition_ids(markets_to_fetch, api_key=DOME_API_KEY)
         print(f"  ✅ Fetched {len(markets_mapped)} markets", flush=True)
         print()
     
@@ -545,6 +418,7 @@ def main():
         print()
     
     # Step 5: Load to BigQuery
+    trades_success = True
     if all_trades:
         print("Step 5: Loading trades to BigQuery...", flush=True)
         trades_success = load_trades_to_bigquery(bq_client, all_trades)
@@ -572,16 +446,130 @@ def main():
             print("  ❌ Events load failed", flush=True)
         print()
     
+    return {'trades': len(all_trades), 'markets': len(markets_mapped), 'events': len(events), 'trades_success': trades_success}
+
+def open_dead_letters(bq_client: bigquery.Client) -> Optional[DeadLetterQueue]:
+    try:
+        return DeadLetterQueue(bq_client, DEAD_LETTER_TABLE)
+    except Exception as e:
+        print(f"⚠️  Dead-letter table unavailable ({e}) - failed wallets are only logged", flush=True)
+        return None
+
+def print_summary(start_time: datetime, counts: Dict):
     end_time = datetime.now(datetime.UTC) if hasattr(datetime, 'UTC') else datetime.utcnow()
     duration = (end_time - start_time).total_seconds()
     
     print("=" * 80, flush=True)
     print("✅ Catch-up complete!", flush=True)
     print(f"Duration: {duration:.1f} seconds", flush=True)
-    print(f"Trades: {len(all_trades)}", flush=True)
-    print(f"Markets: {len(markets_mapped)}", flush=True)
-    print(f"Events: {len(events)}", flush=True)
+    print(f"Trades: {counts['trades']}", flush=True)
+    print(f"Markets: {counts['markets']}", flush=True)
+    print(f"Events: {counts['events']}", flush=True)
+    print("=" * 80, flush=True)
+
+def main():
+    if not DOME_API_KEY:
+        raise ValueError("DOME_API_KEY not set")
+    
+    start_time = datetime.now(datetime.UTC) if hasattr(datetime, 'UTC') else datetime.utcnow()
+    print("=" * 80, flush=True)
+    print("Catch-Up Job: Backfilling Gap from Jan 29, 2026", flush=True)
     print("=" * 80, flush=True)
+    print()
+    print(f"📅 Fetching trades since: {GAP_START.isoformat()}", flush=True)
+    print()
+    
+    bq_client = get_bigquery_client()
+    session = get_http_session()
+    dead_letters = open_dead_letters(bq_client)
+    
+    # Get all wallets; dead-lettered ones are left to replay-dlq, which resumes them from their cursor
+    wallets = get_all_wallets(bq_client)
+    if dead_letters is not None:
+        dead_lettered = dead_letters.pending_wallets(DLQ_SOURCE)
+        wallets -= dead_lettered
+        print(f"☠️  Skipping {len(dead_lettered)} dead-lettered wallets (catchup-trades-gap.py replay-dlq)", flush=True)
+    print(f"📊 Processing {len(wallets)} wallets", flush=True)
+    print()
+    
+    # Step 1: Fetch trades
+    print("Step 1: Fetching trades from gap period...", flush=True)
+    all_trades = []
+    all_condition_ids = set()
+    
+    for i, wallet in enumerate(sorted(wallets), 1):
+        if i % 50 == 0:
+            print(f"  Processing wallet {i}/{len(wallets)}... (Dome rate: {get_shared_limiter().current_rps:.1f} req/s)", flush=True)
+        
+        trades, _ = fetch_trades_for_wallet(session, wallet, GAP_START, dead_letters)
+        add_wallet_trades(wallet, trades, all_trades, all_condition_ids)
+    
+    print(f"  ✅ Fetched {len(all_trades)} trades", flush=True)
+    print(f"  ✅ Found {len(all_condition_ids)} unique condition_ids", flush=True)
+    print()
+    
+    counts = load_fetched_data(bq_client, all_trades, all_condition_ids)
+    if not counts['trades_success']:
+        print("⚠️  Trades load failed - rerun the job (the trades MERGE skips rows already loaded)", flush=True)
+    print_summary(start_time, counts)
+
+def replay_dead_letters(concurrency: int = DLQ_REPLAY_CONCURRENCY, limit: Optional[int] = None):
+    """
+    Re-fetches the unresolved catchup entries from their recorded start_time
+    (always from offset 0; see fetch_trades_for_wallet) with its own worker count and loads them like a
+    normal run. An entry is resolved once its wallet fetched cleanly and the
+    trades loaded; wallets that fail again stay with failures incremented.
+    """
+    if not DOME_API_KEY:
+        raise ValueError("DOME_API_KEY not set")
+    
+    start_time = datetime.now(datetime.UTC) if hasattr(datetime, 'UTC') else datetime.utcnow()
+    bq_client = get_bigquery_client()
+    session = get_http_session()
+    dead_letters = open_dead_letters(bq_client)
+    if dead_letters is None:
+        return
+    
+    entries = dead_letters.pending(DLQ_SOURCE, limit)
+    print(f"☠️  Replaying {len(entries)} dead-lettered catchup wallets with {concurrency} workers", flush=True)
+    
+    def replay(entry: Dict) -> Tuple[str, List[Dict], bool]:
+        wallet = entry["wallet_address"]
+        cursor = json.loads(entry["cursor"] or "{}")
+        since = datetime.fromtimestamp(cursor["start_time"]) if cursor.get("start_time") else GAP_START
+        # Older entries carry the failing page as `offset`; the pages before it may never have loaded
+        print(f"  {wallet} {entry['error_class']} x{entry['failures']} since {since.isoformat()}", flush=True)
+        trades, complete = fetch_trades_for_wallet(session, wallet, since, dead_letters)
+        return wallet, trades, complete
+    
+    all_trades = []
+    all_condition_ids = set()
+    completed = []
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        for wallet, trades, complete in executor.map(replay, entries):
+            add_wallet_trades(wallet, trades, all_trades, all_condition_ids)
+            if complete:
+                completed.append(wallet)
+    print(f"  ✅ Fetched {len(all_trades)} trades ({len(completed)}/{len(entries)} wallets complete)", flush=True)
+    print()
+    
+    counts = load_fetched_data(bq_client, all_trades, all_condition_ids)
+    if counts['trades_success']:
+        for wallet in completed:
+            dead_letters.resolve(wallet, DLQ_SOURCE)
+    print_summary(start_time, counts)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Trades gap catch-up")
+    sub = parser.add_subparsers(dest="command")
+    replay = sub.add_parser("replay-dlq", help=f"Re-fetch {DLQ_SOURCE} wallets from the dead-letter table")
+    replay.add_argument("--concurrency", type=int, default=DLQ_REPLAY_CONCURRENCY, help="Replay workers")
+    replay.add_argument("--limit", type=int, help="Replay at most N entries")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    if args.command == "replay-dlq":
+        replay_dead_letters(args.concurrency, args.limit)
+    else:
+        main()
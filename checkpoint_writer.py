@@ -0,0 +1,314 @@
+"""
+Local checkpoint journal mirrored to BigQuery in the background.
+
+Progress used to live only in BigQuery: one DELETE + insert_rows_json per
+wallet (backfill_checkpoint) or one INSERT per run (daily_sync_checkpoint).
+When DML quota ran out or BigQuery was slow, workers either waited on those
+writes or the progress was lost. Now:
+
+1. CheckpointJournal is the primary record: an append-only SQLite table in
+   WAL mode (synchronous=FULL, so a committed record survives a crash).
+   record() only appends locally and returns; no network call.
+2. CheckpointWriter runs a background thread that mirrors unmirrored
+   records to the BigQuery table every CHECKPOINT_FLUSH_ROWS records or
+   CHECKPOINT_FLUSH_SECONDS, as a MERGE (latest record per key, rows passed
+   as an ARRAY<STRUCT> query parameter - no temp table, no streaming
+   buffer). A backlog is mirrored CHECKPOINT_FLUSH_ROWS records per MERGE.
+   A failed mirror is retried on the next cycle.
+3. Records that never reached BigQuery (failed flush, killed process) are
+   mirrored by the next writer that opens the same journal, and readers can
+   consult latest_rows() for progress BigQuery does not have yet.
+
+Put CHECKPOINT_JOURNAL_PATH on a disk that outlives the process for
+cross-run durability (SQLite needs working file locks, so not GCS FUSE).
+On Cloud Run's in-memory /tmp the journal still decouples workers from
+BigQuery and survives failed flushes within the run.
+
+Usage:
+    writer = CheckpointWriter(bq_client, CHECKPOINT_TABLE, "wallet_address", BACKFILL_CHECKPOINT_COLUMNS)
+    writer.record({"wallet_address": wallet, "completed": True, ...})
+    writer.close()   # final mirror, stops the background thread
+"""
+
+import os
+import json
+import time
+import atexit
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from google.cloud import bigquery
+
+CHECKPOINT_BUFFERED = os.getenv("CHECKPOINT_BUFFERED", "true").lower() == "true"  # false = write BigQuery directly
+CHECKPOINT_FLUSH_ROWS = int(os.getenv("CHECKPOINT_FLUSH_ROWS", "500"))  # Mirror after this many unmirrored records
+CHECKPOINT_FLUSH_SECONDS = float(os.getenv("CHECKPOINT_FLUSH_SECONDS", "60"))  # ... or this long since the last mirror
+CHECKPOINT_JOURNAL_PATH = os.getenv("CHECKPOINT_JOURNAL_PATH", "/tmp/checkpoint_journal.sqlite")
+CHECKPOINT_CLOSE_TIMEOUT_SECONDS = float(os.getenv("CHECKPOINT_CLOSE_TIMEOUT_SECONDS", "120"))  # Final mirror retries at exit
+CHECKPOINT_MAX_RETRIES = 3
+
+# (column, BigQuery type) of backfill_checkpoint
+BACKFILL_CHECKPOINT_COLUMNS: List[Tuple[str, str]] = [
+    ("wallet_address", "STRING"),
+    ("completed", "BOOL"),
+    ("processed_at", "TIMESTAMP"),
+    ("trade_count", "INT64"),
+    ("gcs_file", "STRING"),
+    ("upload_successful", "BOOL"),
+]
+
+# (column, BigQuery type) of daily_sync_checkpoint (one row per run, keyed by last_sync_time)
+DAILY_SYNC_CHECKPOINT_COLUMNS: List[Tuple[str, str]] = [
+    ("last_sync_time", "TIMESTAMP"),
+    ("sync_duration_seconds", "FLOAT64"),
+    ("trades_fetched", "INT64"),
+    ("markets_fetched", "INT64"),
+    ("events_fetched", "INT64"),
+    ("wallets_processed", "INT64"),
+]
+
+
+def _parse_timestamp(value):
+    if isinstance(value, str):
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return value
+
+
+def _struct(row: Dict, columns: List[Tuple[str, str]]) -> bigquery.StructQueryParameter:
+    return bigquery.StructQueryParameter(
+        None,
+        *[
+            bigquery.ScalarQueryParameter(name, bq_type, _parse_timestamp(row.get(name)) if bq_type == "TIMESTAMP" else row.get(name))
+            for name, bq_type in columns
+        ],
+    )
+
+
+def merge_rows_sql(table_id: str, key_column: str, columns: List[Tuple[str, str]]) -> str:
+    """MERGE of the @rows ARRAY<STRUCT> parameter into table_id on key_column (last write wins)."""
+    names = [name for name, _ in columns]
+    updates = ",\n            ".join(f"{name} = source.{name}" for name in names if name != key_column)
+    return f"""
+        MERGE `{table_id}` AS target
+        USING (SELECT * FROM UNNEST(@rows)) AS source
+        ON target.{key_column} = source.{key_column}
+        WHEN MATCHED THEN UPDATE SET
+            {updates}
+        WHEN NOT MATCHED THEN INSERT ({", ".join(names)})
+        VALUES ({", ".join(f"source.{name}" for name in names)})
+        """
+
+
+class CheckpointJournal:
+    """
+    Append-only SQLite journal of checkpoint records, one stream per target
+    table. Table: entries(seq, stream, key, row, recorded_at, mirrored).
+    """
+
+    def __init__(self, path: str = CHECKPOINT_JOURNAL_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                stream TEXT NOT NULL,
+                key TEXT NOT NULL,
+                row TEXT NOT NULL,
+                recorded_at REAL NOT NULL,
+                mirrored INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_pending ON entries (stream, mirrored, seq)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_key ON entries (stream, key, seq)")
+        self._conn.commit()
+
+    def append(self, stream: str, key: str, row: Dict) -> int:
+        """Durably appends one record; returns its sequence number."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO entries (stream, key, row, recorded_at) VALUES (?, ?, ?, ?)",
+                (stream, str(key), json.dumps(row, default=str), time.time()),
+            )
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def unmirrored(self, stream: str, limit: Optional[int] = None) -> Tuple[Dict[str, Dict], int, int]:
+        """
+        Latest record per key among the oldest `limit` unmirrored records (all
+        when None), the highest seq read and the number of records read.
+        """
+        query = "SELECT seq, key, row FROM entries WHERE stream = ? AND mirrored = 0 ORDER BY seq"
+        params: Tuple = (stream,)
+        if limit is not None:
+            query += " LIMIT ?"
+            params += (limit,)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        latest = {key: json.loads(row) for _, key, row in rows}
+        return latest, (rows[-1][0] if rows else 0), len(rows)
+
+    def pending_count(self, stream: str) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM entries WHERE stream = ? AND mirrored = 0", (stream,)
+            ).fetchone()[0]
+
+    def mark_mirrored(self, stream: str, through_seq: int):
+        """Marks records up to through_seq as mirrored and drops mirrored records superseded by a newer one."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE entries SET mirrored = 1 WHERE stream = ? AND mirrored = 0 AND seq <= ?", (stream, through_seq)
+            )
+            self._conn.execute(
+                """
+                DELETE FROM entries
+                WHERE stream = ? AND mirrored = 1
+                  AND seq < (SELECT MAX(seq) FROM entries AS newer WHERE newer.stream = entries.stream AND newer.key = entries.key)
+                """,
+                (stream,),
+            )
+            self._conn.commit()
+
+    def latest_rows(self, stream: str, unmirrored_only: bool = False) -> Dict[str, Dict]:
+        """Latest journaled record per key (progress that may not be in BigQuery yet)."""
+        condition = " AND mirrored = 0" if unmirrored_only else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key, row FROM entries WHERE stream = ?{condition} ORDER BY seq", (stream,)
+            ).fetchall()
+        return {key: json.loads(row) for key, row in rows}
+
+
+_journals: Dict[str, CheckpointJournal] = {}
+_journals_lock = threading.Lock()
+
+
+def get_checkpoint_journal(path: str = CHECKPOINT_JOURNAL_PATH) -> CheckpointJournal:
+    """One journal per path per process (shared by every writer)."""
+    with _journals_lock:
+        if path not in _journals:
+            _journals[path] = CheckpointJournal(path)
+        return _journals[path]
+
+
+class CheckpointWriter:
+    """Journals checkpoint rows locally and mirrors them to table_id from a background thread."""
+
+    def __init__(
+        self,
+        client: bigquery.Client,
+        table_id: str,
+        key_column: str,
+        columns: List[Tuple[str, str]],
+        journal: Optional[CheckpointJournal] = None,
+        flush_rows: int = CHECKPOINT_FLUSH_ROWS,
+        flush_seconds: float = CHECKPOINT_FLUSH_SECONDS,
+    ):
+        self.client = client
+        self.table_id = table_id
+        self.key_column = key_column
+        self.columns = columns
+        self.journal = journal or get_checkpoint_journal()
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.flushes = 0
+        self.rows_flushed = 0
+        self.failed_flushes = 0
+        self._recorded = 0
+        self._last_flush = time.time()
+        self._closed = False
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+
+        pending = self.journal.pending_count(table_id)
+        if pending:
+            print(f"  📒 {pending} checkpoint records for {table_id} in {self.journal.path} not yet in BigQuery - mirroring", flush=True)
+        self._thread = threading.Thread(target=self._run, name=f"checkpoint-mirror-{table_id.split('.')[-1]}", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def record(self, row: Dict):
+        """Appends one record to the local journal; never waits on BigQuery."""
+        self.journal.append(self.table_id, row[self.key_column], row)
+        self._recorded += 1
+        if self._recorded % self.flush_rows == 0:
+            self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(timeout=min(self.flush_seconds, 5.0))
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            due = time.time() - self._last_flush >= self.flush_seconds
+            if due or self.journal.pending_count(self.table_id) >= self.flush_rows:
+                self.flush()
+
+    def flush(self) -> bool:
+        """
+        Mirrors every unmirrored record, at most flush_rows records per MERGE
+        (a backlog from a long outage would exceed BigQuery's request size in
+        one). Each chunk is marked mirrored when its MERGE succeeds. Returns
+        False (remaining records kept) on failure.
+        """
+        with self._flush_lock:
+            self._last_flush = time.time()
+            while True:
+                rows, through_seq, read = self.journal.unmirrored(self.table_id, self.flush_rows)
+                if not rows:
+                    return True
+                if not self._merge_chunk(rows, through_seq):
+                    return False
+                if read < self.flush_rows:
+                    return True
+
+    def _merge_chunk(self, rows: Dict[str, Dict], through_seq: int) -> bool:
+        """One MERGE of rows; marks the journal mirrored through through_seq on success."""
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ArrayQueryParameter("rows", "STRUCT", [_struct(row, self.columns) for row in rows.values()])
+        ])
+        query = merge_rows_sql(self.table_id, self.key_column, self.columns)
+        for attempt in range(CHECKPOINT_MAX_RETRIES):
+            try:
+                self.client.query(query, job_config=job_config).result()
+                break
+            except Exception as e:
+                if attempt == CHECKPOINT_MAX_RETRIES - 1:
+                    self.failed_flushes += 1
+                    print(f"  ⚠️  Checkpoint mirror of {len(rows)} rows to {self.table_id} failed: {e} - kept in the journal", flush=True)
+                    return False
+                time.sleep(2 ** attempt)
+
+        self.journal.mark_mirrored(self.table_id, through_seq)
+        self.flushes += 1
+        self.rows_flushed += len(rows)
+        print(f"  💾 Mirrored {len(rows)} checkpoint rows to {self.table_id} in one MERGE", flush=True)
+        return True
+
+    def close(self, timeout: float = CHECKPOINT_CLOSE_TIMEOUT_SECONDS) -> bool:
+        """Stops the background thread and mirrors what is left; safe to call more than once."""
+        if self._closed:
+            return True
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        deadline = time.time() + timeout
+        success = self.flush()
+        while not success and time.time() < deadline:
+            time.sleep(min(10.0, max(deadline - time.time(), 0)))
+            success = self.flush()
+        self._closed = True
+        print(
+            f"  💾 Checkpoint writer ({self.table_id}): {self.rows_flushed} rows in {self.flushes} MERGEs, "
+            f"{self.failed_flushes} failed, {self.journal.pending_count(self.table_id)} left in {self.journal.path}",
+            flush=True,
+        )
+        return success
@@ -27,6 +27,7 @@ from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 
 from google.cloud import bigquery
+from bq_metrics import MeteredClient
 from google.cloud.exceptions import NotFound
 import requests
 from requests.adapters import HTTPAdapter
@@ -66,7 +67,7 @@ with open(HEURISTICS_MODEL_PATH, 'r') as f:
     heuristics_model = json.load(f)
 
 # Initialize BigQuery client
-bq_client = bigquery.Client(project=PROJECT_ID)
+bq_client = MeteredClient(project=PROJECT_ID)
 
 
 def ensure_market_type_column():
@@ -2,19 +2,48 @@
 """
 Combine all JSONL files from GCS and load to BigQuery
 Much simpler than DTS!
+
+Files are combined at the load-job level: bq_load_coordinator packs them into
+byte-sized batches (up to 10,000 URIs per job) paced against the table's
+daily load-job quota, so no composed copy has to be written to GCS first.
+
+Loads append, so files that were deferred (load quota) or failed are written
+to PENDING_MANIFEST. While it exists, a rerun loads only those files instead
+of re-appending everything under trades/.
 """
 
 import os
+import json
 from google.cloud import bigquery
+from bq_metrics import MeteredClient
 from google.cloud import storage
 from google.cloud.bigquery import LoadJobConfig
+from bq_load_coordinator import LoadJobCoordinator, staged_files_from_gcs
 
 PROJECT_ID = "gen-lang-client-0299056258"
 BUCKET = "gen-lang-client-0299056258-backfill-temp"
 DATASET = "polycopy_v1"
 TABLE = "trades_staging"
 SOURCE_PREFIX = "trades/"
-COMBINED_FILE = "trades_combined.jsonl"
+LEGACY_COMBINED_PREFIXES = ("trades/trades_combined", "trades/_temp_batch_")  # Left behind by the old compose step
+PENDING_MANIFEST = "manifests/combine_and_load_pending.json"  # Files still to load (outside trades/)
+
+
+def read_pending_manifest(bucket):
+    """Object names left over by the last run, or None when it loaded everything."""
+    blob = bucket.blob(PENDING_MANIFEST)
+    if not blob.exists():
+        return None
+    return json.loads(blob.download_as_bytes())["files"]
+
+
+def write_pending_manifest(bucket, names):
+    blob = bucket.blob(PENDING_MANIFEST)
+    if names:
+        blob.upload_from_string(json.dumps({"files": sorted(names)}), content_type="application/json")
+    elif blob.exists():
+        blob.delete()
+
 
 def main():
     print("=" * 80)
@@ -24,79 +53,64 @@ def main():
     
     # Initialize clients
     storage_client = storage.Client(project=PROJECT_ID)
-    bq_client = bigquery.Client(project=PROJECT_ID)
+    bq_client = MeteredClient(project=PROJECT_ID)
     
-    # Step 1: List all JSONL files
-    print("Step 1: Listing all JSONL files...")
+    table_id = f"{PROJECT_ID}.{DATASET}.{TABLE}"
     bucket = storage_client.bucket(BUCKET)
-    blobs = list(bucket.list_blobs(prefix=SOURCE_PREFIX))
-    jsonl_blobs = [b for b in blobs if b.name.endswith('.jsonl')]
     
-    print(f"  Found {len(jsonl_blobs)} JSONL files")
+    # Step 1: List all JSONL files (plain and gzip), or only those the last run left over
+    pending = read_pending_manifest(bucket)
+    if pending is not None:
+        print(f"Step 1: Resuming {len(pending)} files left over by the last run (gs://{BUCKET}/{PENDING_MANIFEST})...")
+    else:
+        print("Step 1: Listing all JSONL files...")
+    staged_files = [
+        f for f in staged_files_from_gcs(storage_client, BUCKET, SOURCE_PREFIX, names=pending)
+        if not f.key.startswith(LEGACY_COMBINED_PREFIXES)
+    ]
+    total_bytes = sum(f.size for f in staged_files)
+    print(f"  Found {len(staged_files)} JSONL files ({total_bytes / 1e6:.1f} MB)")
     print()
     
-    if not jsonl_blobs:
+    if not staged_files:
+        if pending is not None:
+            write_pending_manifest(bucket, [])  # Its files are gone; the next run lists trades/ again
         print("❌ No JSONL files found!")
         return
     
-    # Step 2: Create combined file in GCS (using compose for efficiency)
-    print("Step 2: Combining files using GCS compose...")
-    print("  (This is efficient - no download needed)")
-    
-    # GCS compose can combine up to 32 files at a time
-    # So we'll do it in batches
-    MAX_COMPOSE = 32
-    combined_blobs = []
-    
-    for i in range(0, len(jsonl_blobs), MAX_COMPOSE):
-        batch = jsonl_blobs[i:i + MAX_COMPOSE]
-        temp_name = f"{SOURCE_PREFIX}_temp_batch_{i // MAX_COMPOSE}.jsonl"
-        temp_blob = bucket.blob(temp_name)
-        
-        # Compose this batch
-        temp_blob.compose(batch)
-        combined_blobs.append(temp_blob)
-        print(f"  Combined batch {i // MAX_COMPOSE + 1} ({len(batch)} files)")
-    
-    # If we have multiple batches, compose them into final file
-    if len(combined_blobs) > 1:
-        print(f"  Combining {len(combined_blobs)} batches into final file...")
-        final_blob = bucket.blob(f"{SOURCE_PREFIX}{COMBINED_FILE}")
-        final_blob.compose(combined_blobs)
-        # Clean up temp batches
-        for blob in combined_blobs:
-            blob.delete()
-        combined_file_uri = f"gs://{BUCKET}/{SOURCE_PREFIX}{COMBINED_FILE}"
-    else:
-        # Only one batch, rename it
-        final_blob = bucket.blob(f"{SOURCE_PREFIX}{COMBINED_FILE}")
-        final_blob.upload_from_string(combined_blobs[0].download_as_bytes())
-        combined_blobs[0].delete()
-        combined_file_uri = f"gs://{BUCKET}/{SOURCE_PREFIX}{COMBINED_FILE}"
-    
-    print(f"✅ Combined file created: {combined_file_uri}")
+    # Step 2: Combine files into right-sized load jobs
+    print("Step 2: Planning load jobs...")
+    coordinator = LoadJobCoordinator(bq_client, table_id)
+    batches = coordinator.plan(staged_files)
     print()
     
     # Step 3: Load to BigQuery
     print("Step 3: Loading to BigQuery...")
-    table_id = f"{PROJECT_ID}.{DATASET}.{TABLE}"
     
-    job_config = LoadJobConfig(
-        source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
-        write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
-        autodetect=False,  # Use existing schema
-    )
+    def load_batch(uris):
+        job_config = LoadJobConfig(
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+            autodetect=False,  # Use existing schema
+        )
+        load_job = bq_client.load_table_from_uri(uris, table_id, job_config=job_config)
+        print(f"  Job started: {load_job.job_id} ({len(uris)} files)")
+        load_job.result()  # Wait for completion
+        return True
     
-    load_job = bq_client.load_table_from_uri(
-        combined_file_uri,
-        table_id,
-        job_config=job_config
-    )
+    failed = []
     
-    print(f"  Job started: {load_job.job_id}")
-    print("  Waiting for job to complete...")
+    def on_result(batch, success):
+        if not success:
+            failed.extend(batch.files)
     
-    load_job.result()  # Wait for completion
+    _, deferred = coordinator.run(batches, load_batch, on_result)
+    print(f"  {coordinator.summary()}")
+    left_over = failed + [f for b in deferred for f in b.files]
+    write_pending_manifest(bucket, [f.key for f in left_over])
+    if left_over:
+        print(f"  ⏳ {len(left_over)} files not loaded (deferred by load quota or failed) - saved to "
+              f"gs://{BUCKET}/{PENDING_MANIFEST}; rerun tomorrow to load only those")
     
     # Get stats
     table = bq_client.get_table(table_id)
@@ -7,7 +7,7 @@ Uses MERGE to avoid inserting duplicates.
 import os
 import sys
 from datetime import datetime
-from google.cloud import bigquery
+from bq_metrics import MeteredClient
 from dotenv import load_dotenv
 
 load_dotenv('.env.local')
@@ -23,7 +23,7 @@ def print_section(title):
     print("=" * 80)
 
 def main():
-    client = bigquery.Client(project=PROJECT_ID)
+    client = MeteredClient(project=PROJECT_ID)
     
     print_section("COPY STAGING TO PRODUCTION (WITH DEDUPLICATION)")
     print(f"Timestamp: {datetime.now().isoformat()}")
@@ -6,23 +6,44 @@ This script:
 1. Gets wallets from:
    - BigQuery traders table
    - Supabase user wallets (profiles, turnkey_wallets, clob_credentials, user_wallets)
-2. Fetches new trades since last checkpoint
+2. Fetches new trades per wallet since its watermark (last ingested trade),
+   resuming wallets that failed last run from their saved pagination cursor.
+   Wallets are tiered hot/cold by recent trade count; cold wallets are only
+   polled every COLD_POLL_INTERVAL_HOURS (see wallet_tiers.py)
 3. Fetches new markets and events for new condition_ids
 4. Updates open (not resolved) markets to get latest data
-5. Uses checkpointing to track last sync time
+5. Uses checkpointing to track last sync time (fallback `since` for wallets
+   without a watermark)
 """
 
 import os
 import sys
 import json
 import time
-import requests
+import asyncio
 import importlib.util
-from datetime import datetime, timedelta
-from typing import List, Dict, Set, Tuple, Optional
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Set, Tuple, Optional, AsyncIterator
 from google.cloud import bigquery
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from bq_metrics import MeteredClient
+from dome_client import DomeAsyncClient, advance_order_cursor
+from dome_throttle import get_shared_limiter
+from wallet_tiers import WALLET_TIERING, assign_tiers, get_wallet_activity, select_due_wallets, tier_summary
+from dome_markets import fetch_markets_by_condition_ids, stream_markets_by_condition_ids
+from market_hash import select_changed_markets
+from key_snapshot import known_keys
+from bq_parquet import load_table_from_rows
+from bq_upsert import ATOMIC_UPSERT, StagedMerge, upsert_in_transaction
+from flush_buffer import FlushBuffer
+from checkpoint_writer import CHECKPOINT_BUFFERED, DAILY_SYNC_CHECKPOINT_COLUMNS, CheckpointWriter
+from trades_merge import (
+    TRADE_KEY_COLUMNS, TRADE_KEY_CONDITIONS, TRADES_MERGE_PADDING_HOURS, TRADES_MERGE_PRUNE,
+    trade_bounds, trades_merge_sql,
+)
+from bq_storage_write import (
+    STORAGE_WRITE_AVAILABLE, INGESTED_AT_COLUMN, StorageWriteSink,
+    compact_stream_table, create_dedup_view, ensure_stream_table,
+)
 # Load environment variables from .env.local if it exists
 try:
     from dotenv import load_dotenv
@@ -58,12 +79,20 @@ TRADES_TABLE = f"{PROJECT_ID}.{DATASET}.trades"
 MARKETS_TABLE = f"{PROJECT_ID}.{DATASET}.markets"
 EVENTS_TABLE = f"{PROJECT_ID}.{DATASET}.events"
 CHECKPOINT_TABLE = f"{PROJECT_ID}.{DATASET}.daily_sync_checkpoint"
+WATERMARKS_TABLE = f"{PROJECT_ID}.{DATASET}.wallet_sync_watermarks"
+TRADES_STREAM_TABLE = f"{PROJECT_ID}.{DATASET}.trades_stream"  # Storage Write landing table
+TRADES_DEDUP_VIEW = f"{PROJECT_ID}.{DATASET}.trades_deduped"  # trades + not-yet-compacted stream rows
 
-# API settings
-API_RATE_LIMIT_DELAY = 0.05  # 20 RPS
-BATCH_SIZE = 100  # Dome API limit for condition_ids
-MAX_RETRIES = 3
-RETRY_BACKOFF_BASE = 2
+# Trades sink: "merge" = temp table + load job + MERGE per run,
+# "storage_write" = Storage Write API into TRADES_STREAM_TABLE, compacted into trades every run
+TRADES_SINK = os.getenv("TRADES_SINK", "merge").lower()
+
+# Streaming mode: load trades, markets and events in bounded chunks as they arrive instead of
+# holding the whole run in memory (chunk size and memory ceiling: see flush_buffer.py)
+SYNC_STREAMING = os.getenv("SYNC_STREAMING", "false").lower() == "true"
+
+# API settings (rate limit, retries and market batching live in dome_client / dome_markets)
+WALLET_CONCURRENCY = int(os.getenv("WALLET_CONCURRENCY", "10"))  # Wallets fetched concurrently (shared 20 RPS bucket)
 
 # Default lookback window (if no checkpoint exists)
 DEFAULT_LOOKBACK_HOURS = 24
@@ -73,7 +102,7 @@ TEST_MODE_WALLET_LIMIT = int(os.getenv("TEST_MODE_WALLET_LIMIT", "0"))  # 0 = no
 
 def get_bigquery_client():
     """Initializes BigQuery client."""
-    return bigquery.Client(project=PROJECT_ID)
+    return MeteredClient(project=PROJECT_ID)
 
 def get_supabase_client() -> Optional[Client]:
     """Initializes Supabase client."""
@@ -89,19 +118,6 @@ def get_supabase_client() -> Optional[Client]:
         print(f"⚠️  Error initializing Supabase client: {e}. Skipping user wallets.", flush=True)
         return None
 
-def get_http_session():
-    """Creates HTTP session with retry logic."""
-    session = requests.Session()
-    retry_strategy = Retry(
-        total=MAX_RETRIES,
-        backoff_factor=RETRY_BACKOFF_BASE,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["GET"]
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy, pool_connections=10, pool_maxsize=20)
-    session.mount("https://", adapter)
-    return session
-
 def get_all_wallets(bq_client: bigquery.Client, supabase_client: Optional[Client]) -> Set[str]:
     """Gets all wallet addresses from traders table and user wallets."""
     wallets = set()
@@ -170,8 +186,19 @@ def get_all_wallets(bq_client: bigquery.Client, supabase_client: Optional[Client
     print(f"✅ Total unique wallets: {len(wallets)}", flush=True)
     return wallets
 
+# Local checkpoint journal mirrored to BigQuery in the background (created in main when CHECKPOINT_BUFFERED)
+checkpoint_writer: Optional[CheckpointWriter] = None
+
 def get_last_checkpoint(bq_client: bigquery.Client) -> Optional[datetime]:
-    """Gets the last checkpoint timestamp."""
+    """Gets the last checkpoint timestamp (BigQuery or, if newer, the local checkpoint journal)."""
+    local = None
+    if checkpoint_writer is not None:
+        local_times = [
+            datetime.fromisoformat(row['last_sync_time']).replace(tzinfo=None)
+            for row in checkpoint_writer.journal.latest_rows(CHECKPOINT_TABLE, unmirrored_only=True).values()
+            if row.get('last_sync_time')
+        ]
+        local = max(local_times) if local_times else None
     try:
         query = f"""
         SELECT last_sync_time
@@ -182,14 +209,20 @@ def get_last_checkpoint(bq_client: bigquery.Client) -> Optional[datetime]:
         results = bq_client.query(query).result()
         row = next(results, None)
         if row and row.get('last_sync_time'):
+            if local and local.replace(tzinfo=timezone.utc) > row['last_sync_time']:
+                print(f"📒 Using checkpoint from local journal (not yet in BigQuery): {local.isoformat()}", flush=True)
+                return local.replace(tzinfo=timezone.utc)
             return row['last_sync_time']
     except Exception as e:
         print(f"⚠️  No checkpoint found (first run?): {e}", flush=True)
-    return None
+    return local.replace(tzinfo=timezone.utc) if local else None
 
 def update_checkpoint(bq_client: bigquery.Client, sync_time: datetime, duration: float, 
                      trades: int, markets: int, events: int, wallets: int):
-    """Updates or creates checkpoint."""
+    """
+    Updates or creates checkpoint. With the checkpoint writer the row is
+    committed to the local journal and mirrored to BigQuery in the background.
+    """
     try:
         # Create table if it doesn't exist
         create_table_query = f"""
@@ -203,7 +236,22 @@ def update_checkpoint(bq_client: bigquery.Client, sync_time: datetime, duration:
         )
         """
         bq_client.query(create_table_query).result()
-        
+    except Exception as e:
+        print(f"⚠️  Could not create checkpoint table: {e}", flush=True)
+    
+    if checkpoint_writer is not None:
+        checkpoint_writer.record({
+            'last_sync_time': sync_time.isoformat(),
+            'sync_duration_seconds': duration,
+            'trades_fetched': trades,
+            'markets_fetched': markets,
+            'events_fetched': events,
+            'wallets_processed': wallets,
+        })
+        print(f"✅ Checkpoint journaled: {sync_time.isoformat()}", flush=True)
+        return
+    
+    try:
         # Insert checkpoint
         insert_query = f"""
         INSERT INTO `{CHECKPOINT_TABLE}` 
@@ -216,116 +264,294 @@ def update_checkpoint(bq_client: bigquery.Client, sync_time: datetime, duration:
     except Exception as e:
         print(f"⚠️  Error updating checkpoint: {e}", flush=True)
 
-def fetch_trades_for_wallet(session: requests.Session, wallet: str, since: Optional[datetime]) -> List[Dict]:
-    """Fetches trades for a wallet since the given timestamp."""
-    all_trades = []
-    base_url = "https://api.domeapi.io/v1"
-    headers = {"Authorization": f"Bearer {DOME_API_KEY}", "Accept": "application/json"}
-    
-    # Use 'user' parameter (not 'wallet') and 'start_time' (not 'since') per Dome API docs
-    params = {"user": wallet, "limit": 100}
-    if since:
-        # Convert datetime to Unix timestamp
-        params["start_time"] = int(since.timestamp())
-    
-    offset = 0
+WATERMARK_SCHEMA = [
+    bigquery.SchemaField("wallet_address", "STRING", mode="REQUIRED"),
+    bigquery.SchemaField("last_trade_time", "TIMESTAMP"),        # Every trade up to here is ingested
+    bigquery.SchemaField("cursor_start_time", "TIMESTAMP"),      # start_time of an interrupted fetch
+    bigquery.SchemaField("cursor_offset", "INT64"),
+    bigquery.SchemaField("cursor_pagination_key", "STRING"),
+    bigquery.SchemaField("cursor_high_water", "TIMESTAMP"),      # Newest trade seen by the interrupted fetch
+    bigquery.SchemaField("last_error", "STRING"),
+    bigquery.SchemaField("updated_at", "TIMESTAMP"),
+    bigquery.SchemaField("tier", "STRING"),                      # hot/cold (wallet_tiers)
+    bigquery.SchemaField("last_polled_at", "TIMESTAMP"),
+]
+
+def _unix(ts) -> Optional[int]:
+    """datetime (BigQuery TIMESTAMP) -> unix seconds."""
+    return int(ts.timestamp()) if ts else None
+
+def _ts(unix_seconds: Optional[int]) -> Optional[str]:
+    """unix seconds -> TIMESTAMP string for load_table_from_json."""
+    if unix_seconds is None:
+        return None
+    return datetime.utcfromtimestamp(unix_seconds).strftime('%Y-%m-%d %H:%M:%S')
+
+def _latest(*values: Optional[int]) -> Optional[int]:
+    """Max of the non-None values (None if there are none)."""
+    present = [v for v in values if v is not None]
+    return max(present) if present else None
+
+def _has_cursor(watermark: Dict) -> bool:
+    """True if the wallet's last fetch was interrupted and can be resumed."""
+    return watermark.get('cursor_offset') is not None or bool(watermark.get('cursor_pagination_key'))
+
+def _trade_unix(trade: Dict) -> Optional[int]:
+    value = trade.get('timestamp') or trade.get('created_at')
+    return int(value) if isinstance(value, (int, float)) else None
+
+def ensure_watermarks_table(bq_client: bigquery.Client):
+    """Creates the watermarks table, adding columns introduced after it was first created."""
+    table = bq_client.create_table(bigquery.Table(WATERMARKS_TABLE, schema=WATERMARK_SCHEMA), exists_ok=True)
+    existing = {field.name for field in table.schema}
+    missing = [field for field in WATERMARK_SCHEMA if field.name not in existing]
+    if missing:
+        add_columns = ", ".join(f"ADD COLUMN IF NOT EXISTS {field.name} {field.field_type}" for field in missing)
+        bq_client.query(f"ALTER TABLE `{WATERMARKS_TABLE}` {add_columns}").result()
+
+def get_wallet_watermarks(bq_client: bigquery.Client) -> Dict[str, Dict]:
+    """
+    Loads per-wallet watermarks keyed by wallet_address.
+    Timestamps are returned as unix seconds; an empty dict means first run.
+    """
+    watermarks = {}
+    try:
+        ensure_watermarks_table(bq_client)
+        query = f"""
+        SELECT wallet_address, last_trade_time, cursor_start_time, cursor_offset,
+               cursor_pagination_key, cursor_high_water, tier, last_polled_at
+        FROM `{WATERMARKS_TABLE}`
+        """
+        for row in bq_client.query(query).result():
+            watermarks[row['wallet_address']] = {
+                'last_trade_time': _unix(row['last_trade_time']),
+                'cursor_start_time': _unix(row['cursor_start_time']),
+                'cursor_offset': row['cursor_offset'],
+                'cursor_pagination_key': row['cursor_pagination_key'],
+                'cursor_high_water': _unix(row['cursor_high_water']),
+                'tier': row['tier'],
+                'last_polled_at': _unix(row['last_polled_at']),
+            }
+    except Exception as e:
+        print(f"⚠️  No wallet watermarks found (first run?): {e}", flush=True)
+    return watermarks
+
+def update_wallet_watermarks(bq_client: bigquery.Client, watermarks: Dict[str, Dict]) -> bool:
+    """Upserts watermarks for the wallets processed this run (temp table + MERGE)."""
+    if not watermarks:
+        return True
     
-    while True:
-        params["offset"] = offset
+    try:
+        ensure_watermarks_table(bq_client)
         
+        now = _ts(int(time.time()))
+        rows = []
+        for wallet, wm in watermarks.items():
+            rows.append({
+                'wallet_address': wallet,
+                'last_trade_time': _ts(wm.get('last_trade_time')),
+                'cursor_start_time': _ts(wm.get('cursor_start_time')),
+                'cursor_offset': wm.get('cursor_offset'),
+                'cursor_pagination_key': wm.get('cursor_pagination_key'),
+                'cursor_high_water': _ts(wm.get('cursor_high_water')),
+                'last_error': wm.get('last_error'),
+                'updated_at': now,
+                'tier': wm.get('tier'),
+                'last_polled_at': _ts(wm.get('last_polled_at')),
+            })
+        
+        temp_table_id = f"{WATERMARKS_TABLE}_temp_{int(time.time() * 1000000)}"
+        bq_client.create_table(bigquery.Table(temp_table_id, schema=WATERMARK_SCHEMA))
         try:
-            time.sleep(API_RATE_LIMIT_DELAY)
-            response = session.get(f"{base_url}/polymarket/orders", headers=headers, params=params, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-            
-            # Dome API returns orders in 'orders' field
-            orders = data.get('orders', [])
-            if not orders:
-                # Fallback to 'results' if 'orders' doesn't exist
-                orders = data.get('results', [])
-            
-            if not orders:
-                break
-            
-            all_trades.extend(orders)
+            job_config = bigquery.LoadJobConfig(
+                write_disposition="WRITE_TRUNCATE",
+                source_format="NEWLINE_DELIMITED_JSON",
+                schema=WATERMARK_SCHEMA,
+            )
+            bq_client.load_table_from_json(rows, temp_table_id, job_config=job_config).result()
             
-            # Check pagination
-            pagination = data.get('pagination', {})
-            has_more = pagination.get('has_more', False)
-            
-            if not has_more:
-                break
-            
-            offset += len(orders)
-            
-            if len(all_trades) % 1000 == 0:
-                print(f"    Fetched {len(all_trades)} trades so far...", flush=True)
+            merge_query = f"""
+            MERGE `{WATERMARKS_TABLE}` AS target
+            USING `{temp_table_id}` AS source
+            ON target.wallet_address = source.wallet_address
+            WHEN MATCHED THEN UPDATE SET
+                last_trade_time = source.last_trade_time,
+                cursor_start_time = source.cursor_start_time,
+                cursor_offset = source.cursor_offset,
+                cursor_pagination_key = source.cursor_pagination_key,
+                cursor_high_water = source.cursor_high_water,
+                last_error = source.last_error,
+                updated_at = source.updated_at,
+                tier = source.tier,
+                last_polled_at = source.last_polled_at
+            WHEN NOT MATCHED THEN INSERT ROW
+            """
+            bq_client.query(merge_query).result()
+        finally:
+            bq_client.delete_table(temp_table_id, not_found_ok=True)
         
+        resumable = sum(1 for wm in watermarks.values() if _has_cursor(wm))
+        print(f"✅ Wallet watermarks updated: {len(watermarks)} wallets ({resumable} with a resume cursor)", flush=True)
+        return True
+    except Exception as e:
+        print(f"⚠️  Error updating wallet watermarks: {e}", flush=True)
+        return False
+
+async def fetch_trades_for_wallet(
+    dome: DomeAsyncClient,
+    wallet: str,
+    since: Optional[datetime],
+    watermark: Optional[Dict] = None,
+) -> Tuple[List[Dict], Optional[Exception], Dict]:
+    """
+    Fetches trades for a wallet since its watermark (or `since` if it has none).
+    If the last run was interrupted, first finishes that fetch from its saved
+    cursor, then fetches anything newer than the newest trade it had seen.
+    Returns (trades, error, new_watermark). Trades fetched before an error are
+    kept and the error's cursor is saved so the next run resumes there.
+    """
+    watermark = watermark or {}
+    all_trades = []
+    
+    async def drain(start_time: Optional[int], offset: Optional[int] = 0, pagination_key: Optional[str] = None):
+        """Pages through one start_time window; returns (resume_cursor, error)."""
+        cursor = {'cursor_start_time': start_time, 'cursor_offset': offset, 'cursor_pagination_key': pagination_key}
+        try:
+            async for orders, pagination in dome.iter_order_pages(
+                wallet, start_time=start_time, limit=100, offset=offset, pagination_key=pagination_key
+            ):
+                all_trades.extend(orders)
+                offset, pagination_key = advance_order_cursor(offset, pagination_key, orders, pagination)
+                cursor.update(cursor_offset=offset, cursor_pagination_key=pagination_key)
+                if len(all_trades) % 1000 == 0:
+                    print(f"    [{wallet[:10]}...] Fetched {len(all_trades)} trades so far...", flush=True)
         except Exception as e:
             print(f"    ⚠️  Error fetching trades for {wallet[:10]}...: {e}", flush=True)
-            if 'response' in locals():
-                try:
-                    error_text = response.text[:500]
-                    print(f"    Response: {error_text}", flush=True)
-                except:
-                    pass
-            break
+            body = getattr(e, 'body', None)
+            if body:
+                print(f"    Response: {body}", flush=True)
+            return cursor, e
+        return None, None
     
-    return all_trades
-
-def fetch_markets_by_condition_ids(session: requests.Session, condition_ids: List[str]) -> Tuple[List[Dict], List[Dict]]:
-    """Fetches markets from Dome API."""
-    if not condition_ids:
-        return [], []
+    def high_water(floor: Optional[int]) -> Optional[int]:
+        return _latest(floor, *(_trade_unix(t) for t in all_trades))
     
-    all_markets_mapped = []
-    all_markets_raw = []
-    base_url = "https://api.domeapi.io/v1"
+    # Everything up to last_trade_time is already in BigQuery
+    complete_through = watermark.get('last_trade_time')
     
-    total_batches = (len(condition_ids) + BATCH_SIZE - 1) // BATCH_SIZE
+    # Resume an interrupted fetch exactly where it stopped
+    if _has_cursor(watermark):
+        cursor, error = await drain(
+            watermark['cursor_start_time'],
+            watermark.get('cursor_offset'),
+            watermark.get('cursor_pagination_key'),
+        )
+        if error is not None:
+            cursor['cursor_high_water'] = high_water(watermark.get('cursor_high_water'))
+            return all_trades, error, dict(cursor, last_trade_time=complete_through, last_error=str(error)[:500])
+        complete_through = _latest(complete_through, watermark.get('cursor_high_water'))
     
-    for i in range(0, len(condition_ids), BATCH_SIZE):
-        batch = condition_ids[i:i + BATCH_SIZE]
-        batch_num = i // BATCH_SIZE + 1
-        
-        from urllib.parse import urlencode
-        url = f"{base_url}/polymarket/markets"
-        params = [('limit', len(batch))]
-        for cid in batch:
-            params.append(('condition_id', cid))
-        url = f"{url}?{urlencode(params)}"
-        
-        headers = {"Authorization": f"Bearer {DOME_API_KEY}", "Accept": "application/json"}
+    # Dome API uses 'user' (not 'wallet') and 'start_time' (not 'since'), as Unix seconds.
+    # start_time is inclusive; the trades MERGE drops the overlapping trade.
+    start_time = complete_through if complete_through is not None else (int(since.timestamp()) if since else None)
+    cursor, error = await drain(start_time)
+    if error is not None:
+        cursor['cursor_high_water'] = high_water(start_time)
+        return all_trades, error, dict(cursor, last_trade_time=complete_through, last_error=str(error)[:500])
+    
+    return all_trades, None, {'last_trade_time': high_water(complete_through)}
+
+async def iter_wallet_trades(
+    wallets: List[str],
+    since: Optional[datetime],
+    watermarks: Dict[str, Dict],
+) -> AsyncIterator[Tuple[str, List[Dict], Optional[Exception], Dict]]:
+    """
+    Fans fetch_trades_for_wallet out over WALLET_CONCURRENCY workers sharing one
+    Dome client (and its rate limiter). Yields (wallet, trades, error, watermark)
+    as each wallet completes, so callers can map results while other wallets are in flight.
+    """
+    pending = asyncio.Queue()
+    for wallet in wallets:
+        pending.put_nowait(wallet)
+    completed = asyncio.Queue()
+    
+    async with DomeAsyncClient(api_key=DOME_API_KEY, max_concurrency=WALLET_CONCURRENCY) as dome:
+        async def worker():
+            while True:
+                try:
+                    wallet = pending.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                trades, error, watermark = await fetch_trades_for_wallet(
+                    dome, wallet, since, watermarks.get(wallet.lower().strip())
+                )
+                await completed.put((wallet, trades, error, watermark))
         
+        workers = [asyncio.create_task(worker()) for _ in range(min(WALLET_CONCURRENCY, len(wallets)))]
         try:
-            time.sleep(API_RATE_LIMIT_DELAY)
-            response = session.get(url, headers=headers, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-            
-            markets = []
-            if isinstance(data, list):
-                markets = data
-            elif isinstance(data, dict):
-                markets = data.get('markets', [])
-                if not markets and 'results' in data:
-                    markets = data.get('results', [])
-            
-            for market in markets:
-                all_markets_raw.append(market)
-                mapped = map_market_to_schema(market)
-                if mapped['condition_id']:
-                    all_markets_mapped.append(mapped)
+            for _ in range(len(wallets)):
+                yield await completed.get()
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+def fetch_new_trades(
+    wallets: List[str],
+    since: Optional[datetime],
+    watermarks: Optional[Dict[str, Dict]] = None,
+    trades_buffer: Optional[FlushBuffer] = None,
+) -> Tuple[List[Dict], Set[str], List[str], Dict[str, Dict]]:
+    """
+    Step 1: fetches and maps new trades for all wallets concurrently, each from
+    its own watermark (wallets without one start at `since`).
+    Returns (mapped_trades, condition_ids, failed_wallets, new_watermarks). Trades
+    are returned in wallet order (not completion order) so downstream loads are deterministic.
+    With trades_buffer (streaming mode) trades are flushed through it as wallets
+    complete instead, and mapped_trades is empty.
+    """
+    watermarks = watermarks or {}
+    trades_by_wallet = {}
+    condition_ids = set()
+    failed_wallets = []
+    new_watermarks = {}
+    
+    async def run():
+        done = 0
+        trade_count = 0
+        async for wallet, trades, error, watermark in iter_wallet_trades(wallets, since, watermarks):
+            done += 1
+            new_watermarks[wallet.lower().strip()] = watermark
+            mapped_trades = []
+            for trade in trades:
+                mapped = map_trade_to_schema(trade, wallet)
+                # Only add trades that have required fields
+                if mapped.get('id') and mapped.get('timestamp') and mapped.get('tx_hash'):
+                    mapped_trades.append(mapped)
+                    if mapped.get('condition_id'):
+                        condition_ids.add(mapped['condition_id'])
+            trade_count += len(mapped_trades)
+            if trades_buffer is not None:
+                trades_buffer.add("trades", mapped_trades)
+                if trades_buffer.should_flush():
+                    # Off the event loop so in-flight fetches keep their sockets serviced
+                    await asyncio.get_running_loop().run_in_executor(None, trades_buffer.flush)
+            else:
+                trades_by_wallet[wallet] = mapped_trades
+            if error is not None:
+                failed_wallets.append(wallet)
             
-            if batch_num % 50 == 0:
-                print(f"  Batch {batch_num}/{total_batches}: Fetched {len(markets)} markets", flush=True)
-        
-        except Exception as e:
-            print(f"  ⚠️  Error fetching batch {batch_num}: {e}", flush=True)
-            continue
+            if done % 50 == 0 or done == len(wallets):
+                print(f"  Processed wallet {done}/{len(wallets)} ({trade_count} trades, {len(failed_wallets)} failed, Dome rate: {get_shared_limiter().current_rps:.1f} req/s)", flush=True)
+    
+    if wallets:
+        asyncio.run(run())
+    if trades_buffer is not None:
+        trades_buffer.flush()
     
-    return all_markets_mapped, all_markets_raw
+    all_trades = [trade for wallet in wallets for trade in trades_by_wallet.get(wallet, [])]
+    return all_trades, condition_ids, sorted(failed_wallets), new_watermarks
 
 def classify_market(market: Dict) -> Dict[str, Optional[str]]:
     """
@@ -621,6 +847,108 @@ def map_trade_to_schema(trade: Dict, wallet: str) -> Dict:
         'order_hash': trade.get('order_hash'),  # Also capture order_hash if available
     }
 
+def filter_valid_trades(trades: List[Dict]) -> List[Dict]:
+    """Drops trades missing a required field (id, timestamp, tx_hash)."""
+    return [t for t in trades if t.get('id') and t.get('timestamp') and t.get('tx_hash')]
+
+def markets_merge_sql(source: str) -> str:
+    """MERGE of `source` into MARKETS_TABLE (classification fields are kept when the new value is NULL)."""
+    return f"""
+        MERGE `{MARKETS_TABLE}` AS target
+        USING (
+            SELECT *
+            FROM {source}
+            QUALIFY ROW_NUMBER() OVER (PARTITION BY condition_id ORDER BY condition_id DESC) = 1
+        ) AS source
+        ON target.condition_id = source.condition_id
+        WHEN NOT MATCHED THEN INSERT ROW
+        WHEN MATCHED THEN UPDATE SET
+            event_slug = source.event_slug,
+            market_slug = source.market_slug,
+            bet_structure = COALESCE(source.bet_structure, target.bet_structure),
+            market_subtype = COALESCE(source.market_subtype, target.market_subtype),
+            market_type = COALESCE(source.market_type, target.market_type),
+            liquidity = source.liquidity,
+            status = source.status,
+            winning_label = source.winning_label,
+            winning_id = source.winning_id,
+            title = source.title,
+            description = source.description,
+            resolution_source = source.resolution_source,
+            image = source.image,
+            negative_risk_id = source.negative_risk_id,
+            game_start_time_raw = source.game_start_time_raw,
+            volume_1_week = source.volume_1_week,
+            volume_1_month = source.volume_1_month,
+            volume_1_year = source.volume_1_year,
+            volume_total = source.volume_total,
+            start_time = source.start_time,
+            end_time = source.end_time,
+            completed_time = source.completed_time,
+            close_time = source.close_time,
+            game_start_time = source.game_start_time,
+            start_time_unix = source.start_time_unix,
+            end_time_unix = source.end_time_unix,
+            completed_time_unix = source.completed_time_unix,
+            close_time_unix = source.close_time_unix,
+            side_a = source.side_a,
+            side_b = source.side_b,
+            tags = COALESCE(source.tags, target.tags),
+            content_hash = source.content_hash,
+            last_updated = CURRENT_TIMESTAMP()
+        """
+
+def events_order_by(schema) -> str:
+    """Newest event row wins when created_at exists, otherwise any row per slug."""
+    has_created_at = any(field.name == 'created_at' for field in schema)
+    return 'created_at DESC' if has_created_at else 'event_slug DESC'
+
+def events_merge_sql(source: str, order_by: str) -> str:
+    """MERGE of `source` into EVENTS_TABLE."""
+    return f"""
+        MERGE `{EVENTS_TABLE}` AS target
+        USING (
+            SELECT *
+            FROM {source}
+            QUALIFY ROW_NUMBER() OVER (PARTITION BY event_slug ORDER BY {order_by}) = 1
+        ) AS source
+        ON target.event_slug = source.event_slug
+        WHEN NOT MATCHED THEN INSERT ROW
+        WHEN MATCHED THEN UPDATE SET
+            title = source.title,
+            category = source.category,
+            tags = source.tags,
+            start_time = source.start_time,
+            end_time = source.end_time
+        """
+
+def upsert_all_to_bigquery(client: bigquery.Client, trades: List[Dict], markets: List[Dict], events: List[Dict]) -> bool:
+    """
+    Upserts trades, markets and events in one BigQuery session transaction
+    (see bq_upsert.py): either all three tables change or none do.
+    Trades are omitted when they go through the Storage Write sink, or when
+    none of them is valid (markets and events are still upserted).
+    """
+    valid_trades = filter_valid_trades(trades)
+    if trades and not valid_trades:
+        print("  ⚠️  No valid trades after filtering (required: id, timestamp, tx_hash) - upserting markets/events only", flush=True)
+    bounds = trade_bounds(valid_trades)
+    markets = select_changed_markets(client, MARKETS_TABLE, markets) if markets else []
+    
+    try:
+        order_by = events_order_by(client.get_table(EVENTS_TABLE).schema) if events else 'event_slug DESC'
+    except Exception:
+        order_by = 'event_slug DESC'
+    
+    staged = []
+    if valid_trades:
+        staged.append(StagedMerge("trades", valid_trades, TRADES_TABLE, lambda source: trades_merge_sql(TRADES_TABLE, source, bounds)))
+    staged += [
+        StagedMerge("markets", markets, MARKETS_TABLE, markets_merge_sql),
+        StagedMerge("events", events, EVENTS_TABLE, lambda source: events_merge_sql(source, order_by)),
+    ]
+    return upsert_in_transaction(client, staged)
+
 def load_trades_to_bigquery(client: bigquery.Client, trades: List[Dict]) -> bool:
     """Loads trades using MERGE with deduplication."""
     if not trades:
@@ -636,17 +964,7 @@ def load_trades_to_bigquery(client: bigquery.Client, trades: List[Dict]) -> bool
         temp_table = bigquery.Table(temp_table_id, schema=dest_table.schema)
         client.create_table(temp_table)
         
-        # Filter out trades missing required fields
-        valid_trades = []
-        for trade in trades:
-            if not trade.get('id'):
-                continue
-            if not trade.get('timestamp'):
-                continue
-            if not trade.get('tx_hash'):
-                continue
-            valid_trades.append(trade)
-        
+        valid_trades = filter_valid_trades(trades)
         if not valid_trades:
             print(f"  ⚠️  No valid trades after filtering (required: id, timestamp, tx_hash)", flush=True)
             client.delete_table(temp_table_id)
@@ -658,26 +976,13 @@ def load_trades_to_bigquery(client: bigquery.Client, trades: List[Dict]) -> bool
             source_format="NEWLINE_DELIMITED_JSON",
             autodetect=False
         )
-        load_job = client.load_table_from_json(valid_trades, temp_table_id, job_config=job_config)
+        load_job = load_table_from_rows(client, valid_trades, temp_table_id, job_config=job_config, schema=dest_table.schema)
         load_job.result()
         print(f"  ✅ Loaded to temp table", flush=True)
         
-        print(f"  📊 Merging to main table...", flush=True)
-        merge_query = f"""
-        MERGE `{TRADES_TABLE}` AS target
-        USING (
-            SELECT *
-            FROM `{temp_table_id}`
-            QUALIFY ROW_NUMBER() OVER (
-                PARTITION BY wallet_address, tx_hash, COALESCE(order_hash, '')
-                ORDER BY timestamp DESC, id DESC
-            ) = 1
-        ) AS source
-        ON target.wallet_address = source.wallet_address
-           AND target.tx_hash = source.tx_hash
-           AND COALESCE(target.order_hash, '') = COALESCE(source.order_hash, '')
-        WHEN NOT MATCHED THEN INSERT ROW
-        """
+        bounds = trade_bounds(valid_trades)
+        print(f"  📊 Merging to main table ({bounds or 'unpruned'})...", flush=True)
+        merge_query = trades_merge_sql(TRADES_TABLE, f"`{temp_table_id}`", bounds)
         
         merge_job = client.query(merge_query)
         merge_job.result()
@@ -691,11 +996,64 @@ def load_trades_to_bigquery(client: bigquery.Client, trades: List[Dict]) -> bool
         traceback.print_exc()
         return False
 
+def stream_trades_to_bigquery(client: bigquery.Client, trades: List[Dict]) -> bool:
+    """
+    Appends trades to TRADES_STREAM_TABLE through the Storage Write API (one
+    stream per run, exactly-once offsets). In pending mode nothing is visible
+    unless every append succeeds and the stream commits. Duplicates are
+    removed by the trades_deduped view and by compact_trades_stream.
+    """
+    valid_trades = filter_valid_trades(trades)
+    if not valid_trades:
+        print(f"  ⚠️  No valid trades after filtering (required: id, timestamp, tx_hash)", flush=True)
+        return False
+    
+    sink = None
+    try:
+        schema = ensure_stream_table(client, TRADES_STREAM_TABLE, TRADES_TABLE, cluster_fields=["wallet_address"])
+        ingested_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')
+        rows = [{**trade, INGESTED_AT_COLUMN: ingested_at} for trade in valid_trades]
+        
+        print(f"  📊 Streaming {len(rows)} trades to {TRADES_STREAM_TABLE}...", flush=True)
+        sink = StorageWriteSink(client, TRADES_STREAM_TABLE, schema)
+        sink.append(rows)
+        sink.commit()
+        print(f"  ✅ Storage Write: {sink.summary()}", flush=True)
+        return True
+    except Exception as e:
+        if sink is not None:
+            sink.abort()
+        print(f"  ❌ Trades stream failed: {e}", flush=True)
+        import traceback
+        traceback.print_exc()
+        return False
+
+def compact_trades_stream(client: bigquery.Client) -> bool:
+    """Folds settled stream rows into the trades table and refreshes the dedup view."""
+    try:
+        create_dedup_view(client, TRADES_DEDUP_VIEW, TRADES_TABLE, TRADES_STREAM_TABLE, TRADE_KEY_COLUMNS, "timestamp DESC, id DESC")
+    except Exception as e:
+        print(f"  ⚠️  Could not refresh {TRADES_DEDUP_VIEW}: {e}", flush=True)
+    return compact_stream_table(
+        client,
+        TRADES_STREAM_TABLE,
+        TRADES_TABLE,
+        TRADE_KEY_CONDITIONS,
+        TRADE_KEY_COLUMNS,
+        f"{INGESTED_AT_COLUMN} DESC, timestamp DESC, id DESC",
+        prune_column="timestamp" if TRADES_MERGE_PRUNE else None,
+        prune_padding_hours=TRADES_MERGE_PADDING_HOURS,
+    )
+
 def load_markets_to_bigquery(client: bigquery.Client, markets: List[Dict]) -> bool:
     """Loads markets using MERGE."""
     if not markets:
         return True
     
+    markets = select_changed_markets(client, MARKETS_TABLE, markets)
+    if not markets:
+        return True
+    
     try:
         temp_table_id = f"{MARKETS_TABLE}_temp_{int(time.time() * 1000000)}"
         dest_table = client.get_table(MARKETS_TABLE)
@@ -707,52 +1065,10 @@ def load_markets_to_bigquery(client: bigquery.Client, markets: List[Dict]) -> bo
             source_format="NEWLINE_DELIMITED_JSON",
             autodetect=False
         )
-        load_job = client.load_table_from_json(markets, temp_table_id, job_config=job_config)
+        load_job = load_table_from_rows(client, markets, temp_table_id, job_config=job_config, schema=dest_table.schema)
         load_job.result()
         
-        merge_query = f"""
-        MERGE `{MARKETS_TABLE}` AS target
-        USING (
-            SELECT *
-            FROM `{temp_table_id}`
-            QUALIFY ROW_NUMBER() OVER (PARTITION BY condition_id ORDER BY condition_id DESC) = 1
-        ) AS source
-        ON target.condition_id = source.condition_id
-        WHEN NOT MATCHED THEN INSERT ROW
-        WHEN MATCHED THEN UPDATE SET
-            event_slug = source.event_slug,
-            market_slug = source.market_slug,
-            bet_structure = COALESCE(source.bet_structure, target.bet_structure),
-            market_subtype = COALESCE(source.market_subtype, target.market_subtype),
-            market_type = COALESCE(source.market_type, target.market_type),
-            liquidity = source.liquidity,
-            status = source.status,
-            winning_label = source.winning_label,
-            winning_id = source.winning_id,
-            title = source.title,
-            description = source.description,
-            resolution_source = source.resolution_source,
-            image = source.image,
-            negative_risk_id = source.negative_risk_id,
-            game_start_time_raw = source.game_start_time_raw,
-            volume_1_week = source.volume_1_week,
-            volume_1_month = source.volume_1_month,
-            volume_1_year = source.volume_1_year,
-            volume_total = source.volume_total,
-            start_time = source.start_time,
-            end_time = source.end_time,
-            completed_time = source.completed_time,
-            close_time = source.close_time,
-            game_start_time = source.game_start_time,
-            start_time_unix = source.start_time_unix,
-            end_time_unix = source.end_time_unix,
-            completed_time_unix = source.completed_time_unix,
-            close_time_unix = source.close_time_unix,
-            side_a = source.side_a,
-            side_b = source.side_b,
-            tags = COALESCE(source.tags, target.tags),
-            last_updated = CURRENT_TIMESTAMP()
-        """
+        merge_query = markets_merge_sql(f"`{temp_table_id}`")
         
         merge_job = client.query(merge_query)
         merge_job.result()
@@ -840,34 +1156,10 @@ def load_events_to_bigquery(client: bigquery.Client, events: List[Dict]) -> bool
             source_format="NEWLINE_DELIMITED_JSON",
             autodetect=False
         )
-        load_job = client.load_table_from_json(events, temp_table_id, job_config=job_config)
+        load_job = load_table_from_rows(client, events, temp_table_id, job_config=job_config, schema=dest_table.schema)
         load_job.result()
         
-        # Check if created_at column exists
-        try:
-            table = client.get_table(EVENTS_TABLE)
-            has_created_at = any(field.name == 'created_at' for field in table.schema)
-        except:
-            has_created_at = False
-        
-        order_by = 'created_at DESC' if has_created_at else 'event_slug DESC'
-        
-        merge_query = f"""
-        MERGE `{EVENTS_TABLE}` AS target
-        USING (
-            SELECT *
-            FROM `{temp_table_id}`
-            QUALIFY ROW_NUMBER() OVER (PARTITION BY event_slug ORDER BY {order_by}) = 1
-        ) AS source
-        ON target.event_slug = source.event_slug
-        WHEN NOT MATCHED THEN INSERT ROW
-        WHEN MATCHED THEN UPDATE SET
-            title = source.title,
-            category = source.category,
-            tags = source.tags,
-            start_time = source.start_time,
-            end_time = source.end_time
-        """
+        merge_query = events_merge_sql(f"`{temp_table_id}`", events_order_by(dest_table.schema))
         
         merge_job = client.query(merge_query)
         merge_job.result()
@@ -880,6 +1172,28 @@ def load_events_to_bigquery(client: bigquery.Client, events: List[Dict]) -> bool
         traceback.print_exc()
         return False
 
+def load_sync_chunk(client: bigquery.Client, chunk: Dict[str, List[Dict]], stream_trades: bool) -> bool:
+    """
+    Streaming mode: loads one chunk of trades and/or markets+events through the
+    same sinks as the batch path. Returns False if any part failed.
+    """
+    trades = chunk.get("trades", [])
+    markets = chunk.get("markets", [])
+    events = chunk.get("events", [])
+    success = True
+    if trades and stream_trades:
+        success = stream_trades_to_bigquery(client, trades)
+        trades = []
+    if ATOMIC_UPSERT:
+        return upsert_all_to_bigquery(client, trades, markets, events) and success
+    if trades:
+        success = load_trades_to_bigquery(client, trades) and success
+    if markets:
+        success = load_markets_to_bigquery(client, markets) and success
+    if events:
+        success = load_events_to_bigquery(client, events) and success
+    return success
+
 def get_open_market_condition_ids(bq_client: bigquery.Client) -> List[str]:
     """Gets condition_ids for open markets that need updating."""
     try:
@@ -900,6 +1214,7 @@ def main():
         raise ValueError("DOME_API_KEY not set")
     
     start_time = datetime.now(datetime.UTC) if hasattr(datetime, 'UTC') else datetime.utcnow()
+    poll_time = int(time.time())  # Run start: tier due-checks and last_polled_at compare run to run
     print("=" * 80, flush=True)
     print("Daily Incremental Sync Job", flush=True)
     print("=" * 80, flush=True)
@@ -907,10 +1222,16 @@ def main():
     
     bq_client = get_bigquery_client()
     supabase_client = get_supabase_client()
-    session = get_http_session()
     
-    # Get last checkpoint
+    global checkpoint_writer
+    if CHECKPOINT_BUFFERED:
+        checkpoint_writer = CheckpointWriter(bq_client, CHECKPOINT_TABLE, "last_sync_time", DAILY_SYNC_CHECKPOINT_COLUMNS)
+    
+    # Get last checkpoint (the global `since` is only used for wallets without a watermark)
     last_checkpoint = get_last_checkpoint(bq_client)
+    watermarks = get_wallet_watermarks(bq_client)
+    resumable = sum(1 for wm in watermarks.values() if _has_cursor(wm))
+    print(f"📌 Wallet watermarks: {len(watermarks)} wallets ({resumable} resuming an interrupted fetch)", flush=True)
     
     # Also get the latest trade timestamp from BigQuery to catch any gaps
     try:
@@ -954,46 +1275,54 @@ def main():
     # Get all wallets
     wallets = get_all_wallets(bq_client, supabase_client)
     
+    # Sorted so test-mode limits and load order are deterministic
+    wallets = sorted(wallets)
+    
     # Test mode: limit wallets if TEST_MODE_WALLET_LIMIT is set
     if TEST_MODE_WALLET_LIMIT > 0:
-        wallets = list(wallets)[:TEST_MODE_WALLET_LIMIT]
+        wallets = wallets[:TEST_MODE_WALLET_LIMIT]
         print(f"🧪 TEST MODE: Limited to {len(wallets)} wallets", flush=True)
     
+    # Hot/cold tiering: hot wallets are polled every run, cold ones every COLD_POLL_INTERVAL_HOURS
+    tiers = assign_tiers(wallets, get_wallet_activity(bq_client, TRADES_TABLE) if WALLET_TIERING else {})
+    wallets, skipped_wallets = select_due_wallets(wallets, tiers, watermarks, poll_time)
+    if WALLET_TIERING:
+        print(f"🌡️  Wallet tiers: {tier_summary(tiers, wallets)} - skipping {len(skipped_wallets)} cold wallets not yet due", flush=True)
+    
     print(f"📊 Processing {len(wallets)} wallets", flush=True)
     print()
     
+    stream_trades = TRADES_SINK == "storage_write" and STORAGE_WRITE_AVAILABLE
+    if TRADES_SINK == "storage_write" and not STORAGE_WRITE_AVAILABLE:
+        print("⚠️  google-cloud-bigquery-storage not installed - using temp table + MERGE for trades", flush=True)
+    
+    # Streaming mode: trades are loaded in chunks during Step 1, markets and events during Step 3
+    trades_buffer = None
+    markets_buffer = None
+    if SYNC_STREAMING:
+        trades_buffer = FlushBuffer("trades", lambda chunk: load_sync_chunk(bq_client, chunk, stream_trades))
+        markets_buffer = FlushBuffer("markets", lambda chunk: load_sync_chunk(bq_client, chunk, stream_trades))
+        print(f"🚚 Streaming mode: flushing every {trades_buffer.max_rows:,} rows / {trades_buffer.max_bytes / 1e6:.0f} MB (memory ceiling {trades_buffer.memory_ceiling_mb:.0f} MB)", flush=True)
+    
     # Step 1: Fetch new trades
-    print("Step 1: Fetching new trades...", flush=True)
-    all_trades = []
-    all_condition_ids = set()
+    print(f"Step 1: Fetching new trades ({WALLET_CONCURRENCY} wallets in parallel)...", flush=True)
+    all_trades, all_condition_ids, failed_wallets, new_watermarks = fetch_new_trades(wallets, since, watermarks, trades_buffer)
+    for wallet, watermark in new_watermarks.items():
+        watermark['tier'] = tiers.get(wallet)
+        watermark['last_polled_at'] = poll_time
+    trade_count = trades_buffer.count("trades") if trades_buffer else len(all_trades)
     
-    for i, wallet in enumerate(sorted(wallets), 1):
-        if i % 50 == 0:
-            print(f"  Processing wallet {i}/{len(wallets)}...", flush=True)
-        
-        trades = fetch_trades_for_wallet(session, wallet, since)
-        for trade in trades:
-            mapped = map_trade_to_schema(trade, wallet)
-            # Only add trades that have required fields
-            if mapped.get('id') and mapped.get('timestamp') and mapped.get('tx_hash'):
-                all_trades.append(mapped)
-                if mapped.get('condition_id'):
-                    all_condition_ids.add(mapped['condition_id'])
-    
-    print(f"  ✅ Fetched {len(all_trades)} trades", flush=True)
+    print(f"  ✅ Fetched {trade_count} trades", flush=True)
     print(f"  ✅ Found {len(all_condition_ids)} unique condition_ids", flush=True)
+    if failed_wallets:
+        print(f"  ⚠️  {len(failed_wallets)} wallets had fetch errors (partial trades kept): {', '.join(w[:10] + '...' for w in failed_wallets[:10])}", flush=True)
     print()
     
     # Step 2: Get condition_ids for new markets and open markets to update
     print("Step 2: Identifying markets to fetch...", flush=True)
     
-    # Get existing condition_ids
-    existing_query = f"SELECT DISTINCT condition_id FROM `{MARKETS_TABLE}` WHERE condition_id IS NOT NULL"
-    existing_results = bq_client.query(existing_query).result()
-    existing_condition_ids = {row['condition_id'] for row in existing_results if row.get('condition_id')}
-    
-    # New condition_ids from trades
-    new_condition_ids = all_condition_ids - existing_condition_ids
+    # New condition_ids from trades (checked against the local key snapshot)
+    new_condition_ids = known_keys(bq_client, "market", MARKETS_TABLE).missing(all_condition_ids)
     print(f"  ✅ New condition_ids: {len(new_condition_ids)}", flush=True)
     
     # Open markets to update
@@ -1009,9 +1338,25 @@ def main():
     # Step 3: Fetch markets
     markets_mapped = []
     markets_raw = []
-    if markets_to_fetch:
+    if markets_to_fetch and markets_buffer is not None:
+        print("Steps 3-7: Fetching markets and loading markets/events in chunks...", flush=True)
+        seen_event_slugs = set()
+        
+        def on_markets_batch(mapped_batch: List[Dict], raw_batch: List[Dict]):
+            batch_events = extract_events_from_markets([m for m in raw_batch if m.get('event_slug') not in seen_event_slugs])
+            seen_event_slugs.update(e['event_slug'] for e in batch_events)
+            markets_buffer.add("markets", mapped_batch)
+            markets_buffer.add("events", batch_events)
+            if markets_buffer.should_flush():
+                markets_buffer.flush()
+        
+        stream_markets_by_condition_ids(markets_to_fetch, on_markets_batch, map_market=map_market_to_schema, api_key=DOME_API_KEY)
+        markets_buffer.flush()
+        print(f"  ✅ Fetched {markets_buffer.count('markets')} markets, {markets_buffer.count('events')} events ({markets_buffer.summary()})", flush=True)
+        print()
+    elif markets_to_fetch:
         print("Step 3: Fetching markets from Dome API...", flush=True)
-        markets_mapped, markets_raw = fetch_markets_by_condition_ids(session, markets_to_fetch)
+        markets_mapped, markets_raw = fetch_markets_by_condition_ids(markets_to_fetch, map_market=map_market_to_schema, api_key=DOME_API_KEY)
         print(f"  ✅ Fetched {len(markets_mapped)} markets", flush=True)
         print()
     
@@ -1025,7 +1370,33 @@ def main():
     
     # Step 5: Load to BigQuery
     trades_success = True  # no trades to load counts as success for checkpoint
-    if all_trades:
+    if trades_buffer is not None:
+        # Every trades and markets/events chunk must have loaded; the MERGEs are idempotent,
+        # so a re-fetch of the same window after a partial failure does not duplicate rows
+        trades_success = trades_buffer.ok and markets_buffer.ok
+        print(f"Step 5: Streamed {trade_count} trades ({trades_buffer.summary()})", flush=True)
+        print()
+    if all_trades and stream_trades:
+        print("Step 5: Streaming trades to BigQuery...", flush=True)
+        trades_success = stream_trades_to_bigquery(bq_client, all_trades)
+        if trades_success:
+            print(f"  ✅ Loaded {len(all_trades)} trades", flush=True)
+        else:
+            print("  ❌ Trades load failed", flush=True)
+        print()
+    
+    if ATOMIC_UPSERT:
+        # Steps 5-7 as one session transaction: trades, markets and events commit together
+        merge_trades = [] if stream_trades else all_trades
+        if merge_trades or markets_mapped or events:
+            print("Steps 5-7: Upserting trades, markets and events in one transaction...", flush=True)
+            upsert_success = upsert_all_to_bigquery(bq_client, merge_trades, markets_mapped, events)
+            if merge_trades:
+                trades_success = upsert_success and bool(filter_valid_trades(merge_trades))
+            if upsert_success:
+                print(f"  ✅ Loaded {len(merge_trades)} trades, {len(markets_mapped)} markets, {len(events)} events", flush=True)
+            print()
+    elif all_trades and not stream_trades:
         print("Step 5: Loading trades to BigQuery...", flush=True)
         trades_success = load_trades_to_bigquery(bq_client, all_trades)
         if trades_success:
@@ -1033,15 +1404,15 @@ def main():
         else:
             print("  ❌ Trades load failed", flush=True)
         print()
-        
-        # Step 5.5: Discover and add new wallets from trades
-        if trades_success:
-            new_wallets_count = discover_and_add_new_wallets(bq_client)
-            if new_wallets_count > 0:
-                print(f"  ✅ Discovered and added {new_wallets_count} new wallets", flush=True)
-            print()
     
-    if markets_mapped:
+    # Step 5.5: Discover and add new wallets from trades
+    if trade_count and trades_success:
+        new_wallets_count = discover_and_add_new_wallets(bq_client)
+        if new_wallets_count > 0:
+            print(f"  ✅ Discovered and added {new_wallets_count} new wallets", flush=True)
+        print()
+    
+    if markets_mapped and not ATOMIC_UPSERT:
         print("Step 6: Loading markets to BigQuery...", flush=True)
         markets_success = load_markets_to_bigquery(bq_client, markets_mapped)
         if markets_success:
@@ -1050,7 +1421,7 @@ def main():
             print("  ❌ Markets load failed", flush=True)
         print()
     
-    if events:
+    if events and not ATOMIC_UPSERT:
         print("Step 7: Loading events to BigQuery...", flush=True)
         events_success = load_events_to_bigquery(bq_client, events)
         if events_success:
@@ -1059,17 +1430,26 @@ def main():
             print("  ❌ Events load failed", flush=True)
         print()
     
+    if stream_trades:
+        print("Step 7.5: Compacting trades stream into trades table...", flush=True)
+        if compact_trades_stream(bq_client):
+            print(f"  ✅ Stream rows older than the compaction window merged into {TRADES_TABLE}", flush=True)
+        print()
+    
     # Update checkpoint only when trades were successfully loaded (or there were no trades).
     # If we had trades but load failed, do NOT advance checkpoint so next run re-fetches and retries.
     end_time = datetime.now(datetime.UTC) if hasattr(datetime, 'UTC') else datetime.utcnow()
     duration = (end_time - start_time).total_seconds()
+    market_count = markets_buffer.count("markets") if markets_buffer else len(markets_mapped)
+    event_count = markets_buffer.count("events") if markets_buffer else len(events)
     if trades_success:
-        update_checkpoint(bq_client, end_time, duration, len(all_trades), len(markets_mapped), len(events), len(wallets))
+        update_wallet_watermarks(bq_client, new_watermarks)
+        update_checkpoint(bq_client, end_time, duration, trade_count, market_count, event_count, len(wallets))
     else:
-        print("⚠️  Checkpoint NOT updated (trades load failed) - next run will re-fetch same window", flush=True)
+        print("⚠️  Checkpoint and wallet watermarks NOT updated (trades load failed) - next run will re-fetch same window", flush=True)
     
     # Step 8: Sync trader stats to Supabase (if trades were loaded)
-    if all_trades:
+    if trade_count:
         print("Step 8: Syncing trader stats to Supabase...", flush=True)
         try:
             # Import the sync functions directly
@@ -1120,12 +1500,15 @@ def main():
             traceback.print_exc()
         print()
     
+    if checkpoint_writer is not None:
+        checkpoint_writer.close()
+    
     print("=" * 80, flush=True)
     print("✅ Daily sync complete!", flush=True)
     print(f"Duration: {duration:.1f} seconds", flush=True)
-    print(f"Trades: {len(all_trades)}", flush=True)
-    print(f"Markets: {len(markets_mapped)}", flush=True)
-    print(f"Events: {len(events)}", flush=True)
+    print(f"Trades: {trade_count}", flush=True)
+    print(f"Markets: {market_count}", flush=True)
+    print(f"Events: {event_count}", flush=True)
     print("=" * 80, flush=True)
 
 if __name__ == "__main__":
@@ -0,0 +1,178 @@
+"""
+Bounded retries and a dead-letter table for ingestion failures.
+
+Fetch loops used to retry a failing page forever (sleep 5s, same URL) or
+break silently and keep a partial wallet. The uniform policy is:
+
+1. retry a failing page up to FETCH_MAX_ATTEMPTS times with full-jitter
+   exponential backoff (backoff_delay); client errors other than 408/429
+   are not retried (is_retryable);
+2. then give the wallet up and record it in `ingestion_dead_letters`
+   (source, wallet, cursor, error class, attempts) so the worker moves on;
+3. drain the table later, each source with its own fetcher and cursor
+   format: `python backfill_v3_hybrid.py replay-dlq --concurrency 4` for
+   backfill_v3 (its own concurrency), `catchup-trades-gap.py replay-dlq` for
+   catchup, a backfill.py run with the wallets in WALLET_ADDRESSES for
+   backfill; backfill-new-traders-trades.py loads nothing for a failed
+   wallet, so its next run retries new_traders entries. Entries are resolved
+   (resolved_at set, for that source only) once the wallet fetches cleanly.
+
+Usage:
+    dlq = DeadLetterQueue(bq_client, DEAD_LETTER_TABLE)
+    for attempt in range(1, FETCH_MAX_ATTEMPTS + 1):
+        try: ...; break
+        except Exception as e:
+            if attempt == FETCH_MAX_ATTEMPTS or not is_retryable(e):
+                raise FetchFailed(wallet, cursor, e, attempt)
+            time.sleep(backoff_delay(attempt))
+    ...
+    except FetchFailed as e:
+        dlq.record("backfill_v3", e)
+"""
+
+import os
+import json
+import time
+import random
+import threading
+from typing import Dict, List, Optional, Set
+
+import requests
+
+FETCH_MAX_ATTEMPTS = int(os.getenv("FETCH_MAX_ATTEMPTS", "5"))  # Attempts per page before the wallet is dead-lettered
+FETCH_RETRY_BASE_SECONDS = float(os.getenv("FETCH_RETRY_BASE_SECONDS", "2"))
+FETCH_RETRY_MAX_SECONDS = float(os.getenv("FETCH_RETRY_MAX_SECONDS", "60"))  # Backoff cap
+DLQ_REPLAY_CONCURRENCY = int(os.getenv("DLQ_REPLAY_CONCURRENCY", "2"))  # Workers for replay-dlq
+DML_MAX_RETRIES = 5
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff for the attempt-th failure (1-based)."""
+    return random.uniform(0, min(FETCH_RETRY_MAX_SECONDS, FETCH_RETRY_BASE_SECONDS * 2 ** attempt))
+
+
+def is_retryable(error: Exception) -> bool:
+    """Client errors (4xx except 408 / 429) fail the same way every time."""
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status >= 500 or status in (408, 429)
+    return True
+
+
+class FetchFailed(Exception):
+    """A wallet fetch gave up after bounded retries; carries what the DLQ records."""
+
+    def __init__(self, wallet: str, cursor: Dict, error: Exception, attempts: int):
+        super().__init__(f"{wallet}: {type(error).__name__} after {attempts} attempts: {error}")
+        self.wallet = wallet
+        self.cursor = cursor
+        self.error = error
+        self.attempts = attempts
+
+    @property
+    def error_class(self) -> str:
+        if isinstance(self.error, requests.HTTPError) and self.error.response is not None:
+            return f"HTTPError {self.error.response.status_code}"
+        return type(self.error).__name__
+
+
+class DeadLetterQueue:
+    """
+    Dead-letter table keyed by (source, wallet_address). Re-recording an entry
+    updates its cursor and error and increments `failures`.
+    """
+
+    def __init__(self, client, table_id: str):
+        from google.cloud import bigquery
+        self._bq = bigquery
+        self.client = client
+        self.table_id = table_id
+        self._lock = threading.Lock()
+        schema = [
+            bigquery.SchemaField("source", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("wallet_address", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("cursor", "STRING"),  # JSON: offset / pagination_key / page
+            bigquery.SchemaField("error_class", "STRING"),
+            bigquery.SchemaField("error_message", "STRING"),
+            bigquery.SchemaField("attempts", "INT64"),  # Attempts in the last failure
+            bigquery.SchemaField("failures", "INT64"),  # Times this wallet was dead-lettered
+            bigquery.SchemaField("first_failed_at", "TIMESTAMP"),
+            bigquery.SchemaField("last_failed_at", "TIMESTAMP"),
+            bigquery.SchemaField("resolved_at", "TIMESTAMP"),
+        ]
+        client.create_table(bigquery.Table(table_id, schema=schema), exists_ok=True)
+
+    def _query(self, sql: str, params: List):
+        """Runs one statement; concurrent DML from other workers is retried."""
+        job_config = self._bq.QueryJobConfig(query_parameters=params)
+        for attempt in range(1, DML_MAX_RETRIES + 1):
+            try:
+                return list(self.client.query(sql, job_config=job_config).result())
+            except Exception as e:
+                if "concurrent update" not in str(e).lower() or attempt == DML_MAX_RETRIES:
+                    raise
+                time.sleep(backoff_delay(attempt))
+
+    def record(self, source: str, failure: FetchFailed) -> bool:
+        """Upserts a failure. Returns False (after logging) if BigQuery is unreachable."""
+        p = self._bq.ScalarQueryParameter
+        params = [
+            p("source", "STRING", source),
+            p("wallet", "STRING", failure.wallet),
+            p("cursor", "STRING", json.dumps(failure.cursor)),
+            p("error_class", "STRING", failure.error_class),
+            p("error_message", "STRING", str(failure.error)[:1000]),
+            p("attempts", "INT64", failure.attempts),
+        ]
+        try:
+            with self._lock:
+                self._query(
+                    f"""
+                    MERGE `{self.table_id}` AS target
+                    USING (SELECT @source AS source, @wallet AS wallet_address) AS entry
+                    ON target.source = entry.source AND target.wallet_address = entry.wallet_address
+                    WHEN MATCHED THEN UPDATE SET
+                        cursor = @cursor, error_class = @error_class, error_message = @error_message,
+                        attempts = @attempts, failures = IFNULL(target.failures, 0) + 1,
+                        last_failed_at = CURRENT_TIMESTAMP(), resolved_at = NULL
+                    WHEN NOT MATCHED THEN INSERT
+                        (source, wallet_address, cursor, error_class, error_message, attempts, failures, first_failed_at, last_failed_at)
+                    VALUES (@source, @wallet, @cursor, @error_class, @error_message, @attempts, 1, CURRENT_TIMESTAMP(), CURRENT_TIMESTAMP())
+                    """,
+                    params,
+                )
+            print(f"  ☠️  Dead-lettered {failure.wallet[:10]}... ({failure.error_class}, {failure.attempts} attempts)", flush=True)
+            return True
+        except Exception as e:
+            print(f"  ⚠️  Could not record dead letter for {failure.wallet}: {e} (original error: {failure})", flush=True)
+            return False
+
+    def pending(self, source: Optional[str] = None, limit: Optional[int] = None) -> List[Dict]:
+        """Unresolved entries, oldest failure first."""
+        params = []
+        where = "resolved_at IS NULL"
+        if source:
+            where += " AND source = @source"
+            params.append(self._bq.ScalarQueryParameter("source", "STRING", source))
+        query = f"SELECT * FROM `{self.table_id}` WHERE {where} ORDER BY last_failed_at"
+        if limit:
+            query += f" LIMIT {int(limit)}"
+        return [dict(row.items()) for row in self._query(query, params)]
+
+    def pending_wallets(self, source: Optional[str] = None) -> Set[str]:
+        """Lowercased addresses of the unresolved entries."""
+        return {row["wallet_address"].lower() for row in self.pending(source)}
+
+    def resolve(self, wallet: str, source: Optional[str] = None):
+        """Marks the wallet's entries (from `source`, or every source) resolved."""
+        params = [self._bq.ScalarQueryParameter("wallet", "STRING", wallet)]
+        where = "LOWER(wallet_address) = LOWER(@wallet) AND resolved_at IS NULL"
+        if source:
+            where += " AND source = @source"
+            params.append(self._bq.ScalarQueryParameter("source", "STRING", source))
+        try:
+            with self._lock:
+                self._query(f"UPDATE `{self.table_id}` SET resolved_at = CURRENT_TIMESTAMP() WHERE {where}", params)
+            print(f"  ✅ Resolved dead letter for {wallet[:10]}...", flush=True)
+        except Exception as e:
+            print(f"  ⚠️  Could not resolve dead letter for {wallet}: {e}", flush=True)
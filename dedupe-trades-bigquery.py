@@ -15,6 +15,7 @@ import sys
 import time
 from datetime import datetime
 from google.cloud import bigquery
+from bq_metrics import MeteredClient
 
 # Load environment variables
 try:
@@ -38,7 +39,7 @@ def get_bigquery_client():
     """Initializes BigQuery client."""
     print(f"🔌 Creating BigQuery client for project: {PROJECT_ID}", flush=True)
     try:
-        client = bigquery.Client(project=PROJECT_ID)
+        client = MeteredClient(project=PROJECT_ID)
         print("✅ BigQuery client created successfully", flush=True)
         return client
     except Exception as e:
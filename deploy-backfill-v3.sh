@@ -12,6 +12,13 @@ IMAGE_NAME="backfill-v3"
 JOB_NAME="dome-backfill-v3"
 SERVICE_ACCOUNT="supabase-polyscore-api@${PROJECT_ID}.iam.gserviceaccount.com"
 
+# Multi-task mode: TASKS=N runs N parallel tasks that share the wallets through shard leases
+TASKS="${TASKS:-1}"
+BACKFILL_SHARDS="${BACKFILL_SHARDS:-0}"
+if [ "$TASKS" -gt 1 ] && [ "$BACKFILL_SHARDS" -eq 0 ]; then
+    BACKFILL_SHARDS=$((TASKS * 16))
+fi
+
 # Colors
 GREEN='\033[0;32m'
 YELLOW='\033[1;33m'
@@ -49,6 +56,20 @@ RUN pip install --no-cache-dir -r requirements.txt
 
 # Copy v3 script
 COPY backfill_v3_hybrid.py backfill.py
+COPY bq_metrics.py .
+COPY dome_client.py .
+COPY dome_throttle.py .
+COPY gcs_staging.py .
+COPY bq_load_coordinator.py .
+COPY checkpoint_writer.py .
+COPY wallet_cursor.py .
+COPY dead_letter.py .
+COPY shard_lease.py .
+COPY dome_markets.py .
+COPY market_cache.py .
+COPY market_hash.py .
+COPY bq_parquet.py .
+COPY trades_merge.py .
 
 # Run with unbuffered output
 CMD ["python", "-u", "backfill.py"]
@@ -70,9 +91,9 @@ gcloud run jobs deploy ${JOB_NAME} \
     --service-account=${SERVICE_ACCOUNT} \
     --max-retries=3 \
     --task-timeout=86400 \
-    --tasks=1 \
-    --parallelism=1 \
-    --set-env-vars="DOME_API_KEY=${DOME_API_KEY:-},USE_STAGING_TABLE=true,MAX_WORKERS=10,API_RATE_LIMIT_DELAY=0.05,VERIFY_CHECKPOINTS=true" \
+    --tasks=${TASKS} \
+    --parallelism=${TASKS} \
+    --set-env-vars="BQ_METRICS_SINK=table,DOME_API_KEY=${DOME_API_KEY:-},USE_STAGING_TABLE=true,MAX_WORKERS=10,VERIFY_CHECKPOINTS=true,BACKFILL_SHARDS=${BACKFILL_SHARDS}" \
     --memory=4Gi \
     --cpu=4
 
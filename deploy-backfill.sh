@@ -44,7 +44,7 @@ gcloud run jobs deploy ${JOB_NAME} \
     --max-retries=0 \
     --task-timeout=86400 \
     --tasks=1 \
-    --set-env-vars="DOME_API_KEY=${DOME_API_KEY}" \
+    --set-env-vars="BQ_METRICS_SINK=table,DOME_API_KEY=${DOME_API_KEY}" \
     --memory=2Gi \
     --cpu=2
 
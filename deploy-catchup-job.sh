@@ -39,6 +39,16 @@ RUN pip install --no-cache-dir -r requirements.txt
 
 # Copy catch-up script
 COPY catchup-trades-gap.py .
+COPY bq_metrics.py .
+COPY dome_client.py .
+COPY dome_throttle.py .
+COPY dome_markets.py .
+COPY market_cache.py .
+COPY key_snapshot.py .
+COPY market_hash.py .
+COPY bq_parquet.py .
+COPY trades_merge.py .
+COPY dead_letter.py .
 
 # Run with unbuffered output
 CMD ["python", "-u", "catchup-trades-gap.py"]
@@ -64,7 +74,7 @@ gcloud run jobs deploy ${JOB_NAME} \
     --task-timeout=10800 \
     --tasks=1 \
     --parallelism=1 \
-    --set-env-vars="DOME_API_KEY=${DOME_API_KEY:-}" \
+    --set-env-vars="BQ_METRICS_SINK=table,DOME_API_KEY=${DOME_API_KEY:-},KEY_SNAPSHOT_GCS_URI=gs://${PROJECT_ID}-backfill-temp/cache/known_keys.sqlite" \
     --memory=4Gi \
     --cpu=4
 
@@ -56,6 +56,20 @@ RUN pip install --no-cache-dir -r requirements.txt
 
 # Copy daily sync script
 COPY daily-sync-trades-markets.py .
+COPY bq_metrics.py .
+COPY dome_client.py .
+COPY dome_throttle.py .
+COPY wallet_tiers.py .
+COPY dome_markets.py .
+COPY market_cache.py .
+COPY key_snapshot.py .
+COPY market_hash.py .
+COPY bq_parquet.py .
+COPY trades_merge.py .
+COPY bq_storage_write.py .
+COPY bq_upsert.py .
+COPY flush_buffer.py .
+COPY checkpoint_writer.py .
 
 # Run with unbuffered output
 CMD ["python", "-u", "daily-sync-trades-markets.py"]
@@ -81,7 +95,7 @@ gcloud run jobs deploy ${JOB_NAME} \
     --task-timeout=3600 \
     --tasks=1 \
     --parallelism=1 \
-    --set-env-vars="DOME_API_KEY=${DOME_API_KEY:-},NEXT_PUBLIC_SUPABASE_URL=${NEXT_PUBLIC_SUPABASE_URL:-},SUPABASE_SERVICE_ROLE_KEY=${SUPABASE_SERVICE_ROLE_KEY:-}" \
+    --set-env-vars="BQ_METRICS_SINK=table,DOME_API_KEY=${DOME_API_KEY:-},NEXT_PUBLIC_SUPABASE_URL=${NEXT_PUBLIC_SUPABASE_URL:-},SUPABASE_SERVICE_ROLE_KEY=${SUPABASE_SERVICE_ROLE_KEY:-},MARKET_CACHE_GCS_URI=gs://${PROJECT_ID}-backfill-temp/cache/dome_market_cache.sqlite,KEY_SNAPSHOT_GCS_URI=gs://${PROJECT_ID}-backfill-temp/cache/known_keys.sqlite" \
     --memory=2Gi \
     --cpu=2
 
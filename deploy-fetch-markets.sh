@@ -45,7 +45,7 @@ gcloud run jobs deploy ${JOB_NAME} \
     --task-timeout=1800 \
     --tasks=1 \
     --parallelism=1 \
-    --set-env-vars="DOME_API_KEY=${DOME_API_KEY:-}" \
+    --set-env-vars="BQ_METRICS_SINK=table,DOME_API_KEY=${DOME_API_KEY:-}" \
     --memory=2Gi \
     --cpu=2
 
@@ -43,6 +43,7 @@ RUN pip install --no-cache-dir -r requirements.txt
 
 # Copy stats sync script
 COPY sync-trader-stats-from-bigquery.py .
+COPY bq_metrics.py .
 
 # Run with unbuffered output
 CMD ["python", "-u", "sync-trader-stats-from-bigquery.py"]
@@ -68,7 +69,7 @@ gcloud run jobs deploy ${JOB_NAME} \
     --task-timeout=1800 \
     --tasks=1 \
     --parallelism=1 \
-    --set-env-vars="NEXT_PUBLIC_SUPABASE_URL=${NEXT_PUBLIC_SUPABASE_URL:-},SUPABASE_SERVICE_ROLE_KEY=${SUPABASE_SERVICE_ROLE_KEY:-}" \
+    --set-env-vars="BQ_METRICS_SINK=table,NEXT_PUBLIC_SUPABASE_URL=${NEXT_PUBLIC_SUPABASE_URL:-},SUPABASE_SERVICE_ROLE_KEY=${SUPABASE_SERVICE_ROLE_KEY:-}" \
     --memory=2Gi \
     --cpu=2
 
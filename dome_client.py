@@ -0,0 +1,269 @@
+"""
+Shared asyncio client for the Dome API.
+
+Every request is paced by the process-wide AdaptiveRateLimiter from
+dome_throttle (shared with the sync requests sessions), so wallet pagination
+and market batches running concurrently share the API key's rate limit and
+back off together on 429s instead of each fetcher sleeping
+API_RATE_LIMIT_DELAY between blocking calls.
+
+Usage:
+    async with DomeAsyncClient() as dome:
+        orders = await dome.fetch_orders(wallet, start_time=since)
+        markets = await dome.fetch_markets_batch(condition_ids[:100])
+"""
+
+import os
+import random
+import asyncio
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from dome_throttle import AdaptiveRateLimiter, MAX_THROTTLE_RETRIES, get_shared_limiter, parse_retry_after
+
+DOME_API_BASE = os.getenv("DOME_API_BASE", "https://api.domeapi.io/v1")  # Point at a mock server for benchmarks
+
+# Concurrency (the request rate itself is set by dome_throttle)
+DOME_MAX_CONCURRENCY = int(os.getenv("DOME_MAX_CONCURRENCY", "10"))  # In-flight requests per client
+DOME_REQUEST_TIMEOUT = float(os.getenv("DOME_REQUEST_TIMEOUT", "30"))
+
+# 5xx/network retries; 429s wait for the limiter's pause instead of backoff
+MAX_RETRIES = int(os.getenv("DOME_MAX_RETRIES", "3"))
+RETRY_BACKOFF_BASE = 2
+RETRY_STATUS_CODES = {500, 502, 503, 504}
+
+MARKETS_BATCH_SIZE = 100  # Dome API limit for condition_ids
+ORDERS_MAX_OFFSET = 10000  # Offsets > 10K require pagination_key
+
+
+class DomeAPIError(Exception):
+    """Raised when a Dome API request fails after all retries."""
+
+    def __init__(self, message: str, status: Optional[int] = None, body: Optional[str] = None):
+        super().__init__(message)
+        self.status = status
+        self.body = body
+
+
+def retry_backoff(attempt: int, retry_after: Optional[str] = None) -> float:
+    """
+    Seconds to wait before retry number `attempt` (1-based).
+    Honors a Retry-After header, otherwise exponential backoff like
+    urllib3 (no wait on the first retry) with a little jitter.
+    """
+    retry_after_seconds = parse_retry_after(retry_after)
+    if retry_after_seconds is not None:
+        return retry_after_seconds
+    if attempt <= 1:
+        return 0.0
+    backoff = RETRY_BACKOFF_BASE * (2 ** (attempt - 1))
+    return backoff + random.uniform(0, backoff * 0.1)
+
+
+def advance_order_cursor(
+    offset: Optional[int],
+    pagination_key: Optional[str],
+    orders: List[Dict],
+    pagination: Dict,
+) -> Tuple[Optional[int], Optional[str]]:
+    """
+    Returns the (offset, pagination_key) cursor of the page after `orders`.
+    Once the API hands out a pagination_key it replaces the offset.
+    """
+    new_pagination_key = pagination.get('pagination_key')
+    if new_pagination_key:
+        return None, new_pagination_key
+    if pagination_key or offset is None:
+        return None, None
+    return offset + len(orders), None
+
+
+class DomeAsyncClient:
+    """
+    Asyncio Dome API client.
+    - An AdaptiveRateLimiter (process-wide by default) paces every request
+    - A semaphore caps in-flight requests (max_concurrency)
+    - 429s back off through the limiter; 5xx and connection errors are
+      retried up to max_retries times
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: str = DOME_API_BASE,
+        limiter: Optional[AdaptiveRateLimiter] = None,
+        max_concurrency: int = DOME_MAX_CONCURRENCY,
+        max_retries: int = MAX_RETRIES,
+        timeout: float = DOME_REQUEST_TIMEOUT,
+    ):
+        self.api_key = api_key or os.getenv("DOME_API_KEY")
+        self.base_url = base_url.rstrip("/")
+        self.limiter = limiter or get_shared_limiter()
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self._semaphore = None
+        self._session = None
+
+        # Counters for progress logging
+        self.requests_sent = 0
+        self.retries = 0
+        self.failures = 0
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        if self._session is None:
+            # Semaphore/session must be created inside the running loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={"Authorization": f"Bearer {self.api_key}", "Accept": "application/json"},
+            )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def get_json(self, path: str, params=None):
+        """
+        GET `path` and return decoded JSON. 429s pause the shared limiter and
+        are retried up to MAX_THROTTLE_RETRIES times; 5xx and network errors
+        are retried with backoff up to max_retries times.
+        """
+        if self._session is None:
+            await self.open()
+
+        url = f"{self.base_url}{path}"
+        attempt = 0
+        throttle_attempt = 0
+        while True:
+            retry_after = None
+            throttled = False
+            async with self._semaphore:
+                delay = self.limiter.reserve()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self.requests_sent += 1
+                try:
+                    async with self._session.get(url, params=params) as response:
+                        self.limiter.observe_headers(response.headers)
+                        if response.status == 429:
+                            throttled = True
+                            self.limiter.record_throttle(parse_retry_after(response.headers.get("Retry-After")))
+                            body = await response.text()
+                            error = DomeAPIError(f"HTTP 429 for {path}", 429, body[:500])
+                        elif response.status in RETRY_STATUS_CODES:
+                            retry_after = response.headers.get("Retry-After")
+                            body = await response.text()
+                            error = DomeAPIError(f"HTTP {response.status} for {path}", response.status, body[:500])
+                        elif response.status >= 400:
+                            body = await response.text()
+                            self.failures += 1
+                            raise DomeAPIError(f"HTTP {response.status} for {path}", response.status, body[:500])
+                        else:
+                            self.limiter.record_success()
+                            return await response.json(content_type=None)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = DomeAPIError(f"{type(e).__name__} for {path}: {e}")
+
+            if throttled:
+                # The limiter's pause delays our next reserve(), no extra sleep needed
+                throttle_attempt += 1
+                if throttle_attempt > MAX_THROTTLE_RETRIES:
+                    self.failures += 1
+                    raise error
+                self.retries += 1
+                continue
+
+            attempt += 1
+            if attempt > self.max_retries:
+                self.failures += 1
+                raise error
+            self.retries += 1
+            # Sleep outside the semaphore so other requests can use the slot
+            await asyncio.sleep(retry_backoff(attempt, retry_after))
+
+    async def iter_order_pages(
+        self,
+        wallet: str,
+        start_time: Optional[int] = None,
+        limit: int = 100,
+        offset: Optional[int] = 0,
+        pagination_key: Optional[str] = None,
+    ) -> AsyncIterator[Tuple[List[Dict], Dict]]:
+        """
+        Yields (orders, pagination) for each /polymarket/orders page of a wallet.
+        Uses offset up to 10K, then pagination_key (required by the API past 10K).
+        Pass offset/pagination_key from advance_order_cursor() to resume a
+        partially fetched wallet.
+        """
+        while True:
+            params = {"user": wallet, "limit": limit}
+            if start_time:
+                params["start_time"] = int(start_time)
+            if pagination_key:
+                params["pagination_key"] = pagination_key
+            elif offset is not None and offset <= ORDERS_MAX_OFFSET:
+                params["offset"] = offset
+            else:
+                break
+
+            data = await self.get_json("/polymarket/orders", params)
+            orders = data.get('orders', []) or data.get('results', [])
+            pagination = data.get('pagination', {})
+
+            if not orders:
+                break
+
+            yield orders, pagination
+
+            if not pagination.get('has_more', False):
+                break
+
+            offset, pagination_key = advance_order_cursor(offset, pagination_key, orders, pagination)
+            if pagination_key is None and (offset is None or offset > ORDERS_MAX_OFFSET):
+                # API requires pagination_key past 10K and did not send one
+                break
+
+    async def fetch_orders(self, wallet: str, start_time: Optional[int] = None, limit: int = 100) -> List[Dict]:
+        """Fetches every order for a wallet (optionally since start_time, unix seconds)."""
+        all_orders = []
+        async for orders, _ in self.iter_order_pages(wallet, start_time=start_time, limit=limit):
+            all_orders.extend(orders)
+        return all_orders
+
+    async def fetch_markets_batch(self, condition_ids: List[str]) -> List[Dict]:
+        """Fetches up to 100 markets by condition_id from /polymarket/markets."""
+        if not condition_ids:
+            return []
+        if len(condition_ids) > MARKETS_BATCH_SIZE:
+            raise ValueError(f"At most {MARKETS_BATCH_SIZE} condition_ids per request")
+
+        params = [('limit', len(condition_ids))]
+        for cid in condition_ids:
+            params.append(('condition_id', cid))
+
+        data = await self.get_json("/polymarket/markets", params)
+        if isinstance(data, list):
+            return data
+        if isinstance(data, dict):
+            return data.get('markets', []) or data.get('results', [])
+        return []
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            'requests': self.requests_sent,
+            'retries': self.retries,
+            'failures': self.failures,
+            'rate_rps': round(self.limiter.current_rps, 1),
+        }
@@ -0,0 +1,242 @@
+"""
+Shared market-metadata fetcher for the Dome API.
+
+Replaces the per-script copies of fetch_markets_by_condition_ids. Condition
+ids are split into 100-id /polymarket/markets batches and up to
+MARKETS_MAX_IN_FLIGHT batches are kept in flight at once through a
+DomeAsyncClient (so they share its rate limiter). Results are yielded per
+batch as they arrive, and every job gets the same progress/error accounting.
+Ids that are fresh in the on-disk market cache (market_cache.py) are served
+from it without calling Dome; fetched markets are written back to it.
+
+Sync callers:
+    markets_mapped, markets_raw = fetch_markets_by_condition_ids(condition_ids, map_market=map_market_to_schema)
+
+Async callers (sharing an existing client):
+    async for mapped, raw in iter_markets(dome, condition_ids):
+        ...
+"""
+
+import os
+import json
+import time
+import asyncio
+from datetime import datetime
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from dome_client import DomeAsyncClient, MARKETS_BATCH_SIZE
+from market_cache import MarketCache, get_market_cache, split_cached
+
+MARKETS_MAX_IN_FLIGHT = int(os.getenv("MARKETS_MAX_IN_FLIGHT", "5"))  # Concurrent 100-id batches
+PROGRESS_EVERY_BATCHES = 50
+
+
+def map_market_to_schema(market: Dict) -> Dict:
+    """Maps Dome API market to BigQuery markets schema (all fields, no classification)."""
+    def to_timestamp(unix_seconds):
+        if unix_seconds and isinstance(unix_seconds, (int, float)):
+            dt = datetime.fromtimestamp(unix_seconds)
+            return dt.strftime('%Y-%m-%d %H:%M:%S')
+        return None
+
+    def to_number(value):
+        if value is None:
+            return None
+        try:
+            return float(value) if isinstance(value, (int, float, str)) else None
+        except:
+            return None
+
+    return {
+        'condition_id': market.get('condition_id'),
+        'event_slug': market.get('event_slug'),
+        'market_slug': market.get('market_slug'),
+        'bet_structure': market.get('bet_structure'),
+        'market_subtype': market.get('market_subtype'),
+        'market_type': market.get('market_type'),
+        'liquidity': to_number(market.get('liquidity')),
+        'status': market.get('status'),
+        'winning_label': market.get('winning_side', {}).get('label') if isinstance(market.get('winning_side'), dict) else market.get('winning_side'),
+        'winning_id': market.get('winning_side', {}).get('id') if isinstance(market.get('winning_side'), dict) else None,
+        # Text fields
+        'title': market.get('title'),
+        'description': market.get('description'),
+        'resolution_source': market.get('resolution_source'),
+        'image': market.get('image'),
+        'negative_risk_id': market.get('negative_risk_id'),
+        'game_start_time_raw': market.get('game_start_time'),
+        # Volume fields
+        'volume_1_week': to_number(market.get('volume_1_week')),
+        'volume_1_month': to_number(market.get('volume_1_month')),
+        'volume_1_year': to_number(market.get('volume_1_year')),
+        'volume_total': to_number(market.get('volume_total')),
+        # Timestamp fields
+        'start_time': to_timestamp(market.get('start_time')),
+        'end_time': to_timestamp(market.get('end_time')),
+        'completed_time': to_timestamp(market.get('completed_time')),
+        'close_time': to_timestamp(market.get('close_time')),
+        'game_start_time': to_timestamp(market.get('game_start_time')),
+        # Unix timestamp fields
+        'start_time_unix': int(market.get('start_time')) if market.get('start_time') else None,
+        'end_time_unix': int(market.get('end_time')) if market.get('end_time') else None,
+        'completed_time_unix': int(market.get('completed_time')) if market.get('completed_time') else None,
+        'close_time_unix': int(market.get('close_time')) if market.get('close_time') else None,
+        # JSON fields
+        'side_a': json.dumps(market.get('side_a')) if market.get('side_a') else None,
+        'side_b': json.dumps(market.get('side_b')) if market.get('side_b') else None,
+        'tags': json.dumps(market.get('tags')) if market.get('tags') else None,
+    }
+
+
+class MarketFetchStats:
+    """Throughput and error accounting for one market fetch run."""
+
+    def __init__(self, requested: int = 0):
+        self.requested = requested
+        self.batches_total = (requested + MARKETS_BATCH_SIZE - 1) // MARKETS_BATCH_SIZE
+        self.batches_done = 0
+        self.batches_failed = 0
+        self.markets = 0
+        self.cache_hits = 0
+        self.failed_condition_ids: List[str] = []
+        self.started = time.time()
+
+    @property
+    def elapsed(self) -> float:
+        return time.time() - self.started
+
+    def summary(self) -> str:
+        rate = self.batches_done / self.elapsed if self.elapsed > 0 else 0.0
+        return (
+            f"{self.markets:,} markets for {self.requested:,} condition_ids | "
+            f"{self.cache_hits:,} from cache | "
+            f"{self.batches_done}/{self.batches_total} batches ({self.batches_failed} failed) | "
+            f"{self.elapsed:.1f}s ({rate:.1f} batches/s)"
+        )
+
+
+async def iter_markets(
+    dome: DomeAsyncClient,
+    condition_ids: List[str],
+    map_market: Callable[[Dict], Optional[Dict]] = map_market_to_schema,
+    max_in_flight: int = MARKETS_MAX_IN_FLIGHT,
+    stats: Optional[MarketFetchStats] = None,
+    cache: Optional[MarketCache] = None,
+    use_cache: bool = True,
+) -> AsyncIterator[Tuple[List[Dict], List[Dict]]]:
+    """
+    Fetches markets in 100-id batches with up to max_in_flight batches in flight.
+    Yields (mapped, raw) per batch in completion order, cache hits first. Markets
+    whose mapped row has no condition_id are dropped. Failed batches are logged
+    and counted in `stats` (their ids in stats.failed_condition_ids) instead of
+    raising. use_cache=False bypasses the cache for reads (results are still stored).
+    """
+    # De-dupe while keeping order so batches are stable run to run
+    ids = list(dict.fromkeys(cid for cid in condition_ids if cid))
+    if stats is None:
+        stats = MarketFetchStats(len(ids))
+    if not ids:
+        return
+    if cache is None:
+        cache = get_market_cache()
+
+    def map_batch(markets: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+        mapped_batch = []
+        raw_batch = []
+        for market in markets:
+            mapped = map_market(market)
+            if mapped and mapped.get('condition_id'):
+                mapped_batch.append(mapped)
+                raw_batch.append(market)
+        return mapped_batch, raw_batch
+
+    cached, ids = split_cached(ids, cache if use_cache else None)
+    if cached:
+        stats.cache_hits += len(cached)
+        cached_markets = list(cached.values())
+        for i in range(0, len(cached_markets), MARKETS_BATCH_SIZE):
+            mapped_batch, raw_batch = map_batch(cached_markets[i:i + MARKETS_BATCH_SIZE])
+            stats.markets += len(mapped_batch)
+            yield mapped_batch, raw_batch
+
+    batches = [ids[i:i + MARKETS_BATCH_SIZE] for i in range(0, len(ids), MARKETS_BATCH_SIZE)]
+    stats.batches_total = len(batches)
+
+    async def fetch(batch_num: int, batch: List[str]):
+        try:
+            return batch_num, batch, await dome.fetch_markets_batch(batch), None
+        except Exception as e:
+            return batch_num, batch, [], e
+
+    next_batch = 0
+    in_flight = set()
+    while next_batch < len(batches) or in_flight:
+        while next_batch < len(batches) and len(in_flight) < max_in_flight:
+            in_flight.add(asyncio.ensure_future(fetch(next_batch + 1, batches[next_batch])))
+            next_batch += 1
+
+        done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            batch_num, batch, markets, error = task.result()
+            stats.batches_done += 1
+            if error is not None:
+                stats.batches_failed += 1
+                stats.failed_condition_ids.extend(batch)
+                print(f"  ⚠️  Error fetching markets batch {batch_num}/{len(batches)}: {error}", flush=True)
+                continue
+
+            if cache is not None:
+                try:
+                    cache.put_many(markets)
+                except Exception as e:
+                    print(f"  ⚠️  Could not write markets batch {batch_num} to cache: {e}", flush=True)
+            mapped_batch, raw_batch = map_batch(markets)
+            stats.markets += len(mapped_batch)
+
+            if stats.batches_done % PROGRESS_EVERY_BATCHES == 0:
+                print(f"  Markets progress: {stats.summary()} | Dome rate: {dome.limiter.current_rps:.1f} req/s", flush=True)
+
+            yield mapped_batch, raw_batch
+
+
+def stream_markets_by_condition_ids(
+    condition_ids: List[str],
+    on_batch: Callable[[List[Dict], List[Dict]], None],
+    map_market: Callable[[Dict], Optional[Dict]] = map_market_to_schema,
+    max_in_flight: int = MARKETS_MAX_IN_FLIGHT,
+    api_key: Optional[str] = None,
+    use_cache: bool = True,
+) -> MarketFetchStats:
+    """Sync entry point: calls on_batch(mapped, raw) for each batch as it arrives."""
+    ids = list(dict.fromkeys(cid for cid in condition_ids if cid))
+    stats = MarketFetchStats(len(ids))
+    if not ids:
+        return stats
+
+    async def run():
+        async with DomeAsyncClient(api_key=api_key, max_concurrency=max_in_flight) as dome:
+            async for mapped_batch, raw_batch in iter_markets(dome, ids, map_market, max_in_flight, stats, use_cache=use_cache):
+                on_batch(mapped_batch, raw_batch)
+
+    asyncio.run(run())
+    print(f"  📊 Markets fetch: {stats.summary()}", flush=True)
+    return stats
+
+
+def fetch_markets_by_condition_ids(
+    condition_ids: List[str],
+    map_market: Callable[[Dict], Optional[Dict]] = map_market_to_schema,
+    max_in_flight: int = MARKETS_MAX_IN_FLIGHT,
+    api_key: Optional[str] = None,
+    use_cache: bool = True,
+) -> Tuple[List[Dict], List[Dict]]:
+    """Sync entry point: fetches all markets and returns (markets_mapped, markets_raw)."""
+    all_markets_mapped = []
+    all_markets_raw = []
+
+    def collect(mapped_batch, raw_batch):
+        all_markets_mapped.extend(mapped_batch)
+        all_markets_raw.extend(raw_batch)
+
+    stream_markets_by_condition_ids(condition_ids, collect, map_market, max_in_flight, api_key, use_cache)
+    return all_markets_mapped, all_markets_raw
@@ -0,0 +1,275 @@
+"""
+Adaptive throttling for Dome API traffic.
+
+One AdaptiveRateLimiter paces every Dome request in a process (and, with
+DOME_THROTTLE_STATE_FILE, across processes of the same job):
+- AIMD: the rate grows by DOME_THROTTLE_INCREASE req/s for every second of
+  clean traffic and is multiplied by DOME_THROTTLE_DECREASE on a 429
+- Retry-After and rate-limit headers (X-RateLimit-Remaining/Reset) pause all
+  callers until the server says capacity is back
+- current_rps / metrics() expose the live rate for progress logs
+
+Sync scripts:
+    session = get_throttled_session(max_retries=MAX_RETRIES)
+
+Async (DomeAsyncClient):
+    await asyncio.sleep(limiter.reserve())
+"""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Mapping, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# fcntl is only needed for cross-process sharing (not available on Windows)
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+DOME_THROTTLE_MAX_RPS = float(os.getenv("DOME_THROTTLE_MAX_RPS", os.getenv("DOME_RATE_LIMIT_RPS", "20")))  # Our key allows 20 RPS
+DOME_THROTTLE_MIN_RPS = float(os.getenv("DOME_THROTTLE_MIN_RPS", "1"))
+DOME_THROTTLE_INITIAL_RPS = float(os.getenv("DOME_THROTTLE_INITIAL_RPS", str(DOME_THROTTLE_MAX_RPS)))
+DOME_THROTTLE_INCREASE = float(os.getenv("DOME_THROTTLE_INCREASE", "1.0"))  # req/s added per second without 429s
+DOME_THROTTLE_DECREASE = float(os.getenv("DOME_THROTTLE_DECREASE", "0.5"))  # Rate multiplier on 429
+DOME_THROTTLE_DEFAULT_PAUSE = float(os.getenv("DOME_THROTTLE_DEFAULT_PAUSE", "2"))  # Pause on 429 without Retry-After
+DOME_THROTTLE_STATE_FILE = os.getenv("DOME_THROTTLE_STATE_FILE")  # Share limiter state across processes
+MAX_THROTTLE_RETRIES = int(os.getenv("DOME_MAX_THROTTLE_RETRIES", "5"))  # 429 retries per request (sync sessions)
+
+RATE_LIMIT_REMAINING_HEADERS = ("X-RateLimit-Remaining", "RateLimit-Remaining")
+RATE_LIMIT_RESET_HEADERS = ("X-RateLimit-Reset", "RateLimit-Reset")
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_rate_limit_reset(value: Optional[str]) -> Optional[float]:
+    """Seconds until a rate-limit window resets (header is delta-seconds or an epoch)."""
+    try:
+        reset = float(value)
+    except (TypeError, ValueError):
+        return None
+    if reset > 1e9:  # Epoch seconds
+        reset -= time.time()
+    return max(0.0, reset)
+
+
+def _header(headers: Mapping[str, str], names) -> Optional[str]:
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            return value
+    return None
+
+
+class AdaptiveRateLimiter:
+    """
+    Thread-safe AIMD request pacer.
+    Callers reserve the next send slot (reserve/acquire) and report outcomes
+    (record_success/record_throttle/observe_headers). With state_file the
+    slot schedule and rate live in a flock-protected JSON file, so every
+    process pointing at the same file shares one budget.
+    """
+
+    def __init__(
+        self,
+        initial_rps: float = DOME_THROTTLE_INITIAL_RPS,
+        min_rps: float = DOME_THROTTLE_MIN_RPS,
+        max_rps: float = DOME_THROTTLE_MAX_RPS,
+        increase: float = DOME_THROTTLE_INCREASE,
+        decrease: float = DOME_THROTTLE_DECREASE,
+        default_pause: float = DOME_THROTTLE_DEFAULT_PAUSE,
+        state_file: Optional[str] = None,
+    ):
+        self.min_rps = min_rps
+        self.max_rps = max_rps
+        self.increase = increase
+        self.decrease = decrease
+        self.default_pause = default_pause
+        self.state_file = state_file if FCNTL_AVAILABLE else None
+        self._lock = threading.Lock()
+        self._state = {
+            'rate': min(max_rps, max(min_rps, initial_rps)),
+            'next_slot': 0.0,
+            'paused_until': 0.0,
+            'throttled': 0,
+        }
+
+    @contextmanager
+    def _locked(self):
+        """Yields the mutable state; persisted to state_file (under flock) if set."""
+        with self._lock:
+            if not self.state_file:
+                yield self._state
+                return
+            with open(self.state_file, 'a+') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    raw = f.read()
+                    if raw:
+                        try:
+                            self._state.update(json.loads(raw))
+                        except ValueError:
+                            pass  # Corrupt/partial file: keep our in-memory view
+                    yield self._state
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(self._state))
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def reserve(self) -> float:
+        """Claims the next send slot and returns how many seconds to wait for it."""
+        with self._locked() as state:
+            now = time.time()
+            slot = max(now, state['next_slot'], state['paused_until'])
+            state['next_slot'] = slot + 1.0 / state['rate']
+            return slot - now
+
+    def acquire(self):
+        """Blocks until this caller may send a request."""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    def record_success(self):
+        """Additive increase: about +increase req/s per second of clean traffic."""
+        with self._locked() as state:
+            state['rate'] = min(self.max_rps, state['rate'] + self.increase / state['rate'])
+
+    def record_throttle(self, retry_after: Optional[float] = None):
+        """
+        Multiplicative decrease on a 429 and a shared pause of retry_after
+        seconds (default_pause if the server sent none). Concurrent 429s from
+        the same burst (arriving while already paused) only cut the rate once.
+        """
+        with self._locked() as state:
+            now = time.time()
+            state['throttled'] += 1
+            if now >= state['paused_until']:
+                state['rate'] = max(self.min_rps, state['rate'] * self.decrease)
+            pause = retry_after if retry_after is not None else self.default_pause
+            state['paused_until'] = max(state['paused_until'], now + pause)
+
+    def observe_headers(self, headers: Mapping[str, str]):
+        """Pauses until the window resets when the server reports no remaining requests."""
+        remaining = _header(headers, RATE_LIMIT_REMAINING_HEADERS)
+        if remaining is None:
+            return
+        try:
+            if float(remaining) > 0:
+                return
+        except ValueError:
+            return
+        reset = parse_rate_limit_reset(_header(headers, RATE_LIMIT_RESET_HEADERS))
+        if reset is None:
+            reset = self.default_pause
+        with self._locked() as state:
+            state['paused_until'] = max(state['paused_until'], time.time() + reset)
+
+    @property
+    def current_rps(self) -> float:
+        with self._locked() as state:
+            return state['rate']
+
+    def metrics(self) -> Dict[str, float]:
+        with self._locked() as state:
+            return {
+                'rate_rps': round(state['rate'], 2),
+                'throttled': state['throttled'],
+                'paused_for': round(max(0.0, state['paused_until'] - time.time()), 2),
+            }
+
+
+_shared_limiter: Optional[AdaptiveRateLimiter] = None
+_shared_limiter_lock = threading.Lock()
+
+
+def get_shared_limiter() -> AdaptiveRateLimiter:
+    """The process-wide limiter used by every Dome session/client by default."""
+    global _shared_limiter
+    with _shared_limiter_lock:
+        if _shared_limiter is None:
+            _shared_limiter = AdaptiveRateLimiter(state_file=DOME_THROTTLE_STATE_FILE)
+        return _shared_limiter
+
+
+class ThrottledAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that paces sends through an AdaptiveRateLimiter and retries
+    429s itself (waiting for the limiter's pause instead of urllib3 backoff).
+    """
+
+    def __init__(self, limiter: AdaptiveRateLimiter, max_throttle_retries: int = MAX_THROTTLE_RETRIES, **kwargs):
+        self.limiter = limiter
+        self.max_throttle_retries = max_throttle_retries
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            response = super().send(request, **kwargs)
+            self.limiter.observe_headers(response.headers)
+            if response.status_code != 429:
+                if response.status_code < 500:
+                    self.limiter.record_success()
+                return response
+            self.limiter.record_throttle(parse_retry_after(response.headers.get('Retry-After')))
+            attempt += 1
+            if attempt > self.max_throttle_retries:
+                return response
+            response.close()
+
+
+def get_throttled_session(
+    max_retries: int = 3,
+    limiter: Optional[AdaptiveRateLimiter] = None,
+    pool_maxsize: int = 20,
+) -> requests.Session:
+    """
+    requests.Session for the Dome API: 429s are handled by the adaptive
+    limiter, 5xx/connection errors by a short urllib3 Retry.
+    """
+    session = requests.Session()
+    retry_strategy = Retry(
+        total=max_retries,
+        backoff_factor=0.5,
+        status_forcelist=[500, 502, 503, 504],
+        allowed_methods=["GET"],
+        respect_retry_after_header=False,  # 429/Retry-After belong to the limiter
+    )
+    adapter = ThrottledAdapter(
+        limiter or get_shared_limiter(),
+        max_retries=retry_strategy,
+        pool_connections=10,
+        pool_maxsize=pool_maxsize,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
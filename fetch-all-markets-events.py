@@ -5,14 +5,15 @@ This ensures we have markets/events for all trades, not just what Phase 3 fetche
 """
 
 import os
-import json
 import time
-import requests
 from typing import List, Dict, Set, Tuple
 from google.cloud import bigquery
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from bq_metrics import MeteredClient
 from datetime import datetime
+from dome_client import MARKETS_BATCH_SIZE
+from dome_markets import fetch_markets_by_condition_ids, MARKETS_MAX_IN_FLIGHT
+from market_hash import select_changed_markets
+from bq_parquet import load_table_from_rows
 
 PROJECT_ID = "gen-lang-client-0299056258"
 DOME_API_KEY = os.getenv("DOME_API_KEY")
@@ -22,135 +23,9 @@ TRADES_TABLE = f"{PROJECT_ID}.{DATASET}.trades"
 MARKETS_TABLE = f"{PROJECT_ID}.{DATASET}.markets"
 EVENTS_TABLE = f"{PROJECT_ID}.{DATASET}.events"
 
-API_RATE_LIMIT_DELAY = 0.05  # 20 RPS
-BATCH_SIZE = 100  # Dome API limit
 
 def get_bigquery_client():
-    return bigquery.Client(project=PROJECT_ID)
-
-def get_http_session():
-    """HTTP session with retry logic"""
-    session = requests.Session()
-    retry_strategy = Retry(
-        total=5,
-        backoff_factor=2,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["GET"]
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy, pool_connections=10, pool_maxsize=20)
-    session.mount("https://", adapter)
-    return session
-
-def fetch_markets_by_condition_ids(
-    session: requests.Session, 
-    condition_ids: List[str]
-) -> Tuple[List[Dict], List[Dict]]:
-    """Fetches markets from Dome API /polymarket/markets endpoint"""
-    if not condition_ids:
-        return [], []
-    
-    all_markets_mapped = []
-    all_markets_raw = []
-    base_url = "https://api.domeapi.io/v1"
-    
-    # Batch in chunks of 100
-    total_batches = (len(condition_ids) + BATCH_SIZE - 1) // BATCH_SIZE
-    
-    for i in range(0, len(condition_ids), BATCH_SIZE):
-        batch = condition_ids[i:i + BATCH_SIZE]
-        batch_num = i // BATCH_SIZE + 1
-        
-        from urllib.parse import urlencode
-        url = f"{base_url}/polymarket/markets"
-        params = [('limit', len(batch))]
-        for cid in batch:
-            params.append(('condition_id', cid))
-        url = f"{url}?{urlencode(params)}"
-        
-        headers = {"Authorization": f"Bearer {DOME_API_KEY}", "Accept": "application/json"}
-        
-        try:
-            time.sleep(API_RATE_LIMIT_DELAY)
-            response = session.get(url, headers=headers, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-            
-            # Handle different response formats
-            markets = []
-            if isinstance(data, list):
-                markets = data
-            elif isinstance(data, dict):
-                markets = data.get('markets', [])
-                if not markets and 'results' in data:
-                    markets = data.get('results', [])
-            
-            for market in markets:
-                all_markets_raw.append(market)
-                # Map to our schema (matching backfill_v3_hybrid.py)
-                # Convert timestamps
-                def to_timestamp(unix_seconds):
-                    if unix_seconds and isinstance(unix_seconds, (int, float)):
-                        dt = datetime.fromtimestamp(unix_seconds)
-                        return dt.strftime('%Y-%m-%d %H:%M:%S')
-                    return None
-                
-                def to_number(value):
-                    if value is None:
-                        return None
-                    try:
-                        return float(value) if isinstance(value, (int, float, str)) else None
-                    except:
-                        return None
-                
-                mapped = {
-                    'condition_id': market.get('condition_id'),
-                    'event_slug': market.get('event_slug'),
-                    'market_slug': market.get('market_slug'),
-                    'bet_structure': market.get('bet_structure'),
-                    'market_subtype': market.get('market_subtype'),
-                    'market_type': market.get('market_type'),
-                    'liquidity': to_number(market.get('liquidity')),
-                    'status': market.get('status'),
-                    'winning_label': market.get('winning_side', {}).get('label') if isinstance(market.get('winning_side'), dict) else market.get('winning_side'),
-                    'winning_id': market.get('winning_side', {}).get('id') if isinstance(market.get('winning_side'), dict) else None,
-                    # Text fields
-                    'title': market.get('title'),
-                    'description': market.get('description'),
-                    'resolution_source': market.get('resolution_source'),
-                    'image': market.get('image'),
-                    'negative_risk_id': market.get('negative_risk_id'),
-                    'game_start_time_raw': market.get('game_start_time'),
-                    # Volume fields
-                    'volume_1_week': to_number(market.get('volume_1_week')),
-                    'volume_1_month': to_number(market.get('volume_1_month')),
-                    'volume_1_year': to_number(market.get('volume_1_year')),
-                    'volume_total': to_number(market.get('volume_total')),
-                    # Timestamp fields
-                    'start_time': to_timestamp(market.get('start_time')),
-                    'end_time': to_timestamp(market.get('end_time')),
-                    'completed_time': to_timestamp(market.get('completed_time')),
-                    'close_time': to_timestamp(market.get('close_time')),
-                    'game_start_time': to_timestamp(market.get('game_start_time')),
-                    # Unix timestamp fields
-                    'start_time_unix': int(market.get('start_time')) if market.get('start_time') else None,
-                    'end_time_unix': int(market.get('end_time')) if market.get('end_time') else None,
-                    'completed_time_unix': int(market.get('completed_time')) if market.get('completed_time') else None,
-                    'close_time_unix': int(market.get('close_time')) if market.get('close_time') else None,
-                    # JSON fields
-                    'side_a': json.dumps(market.get('side_a')) if market.get('side_a') else None,
-                    'side_b': json.dumps(market.get('side_b')) if market.get('side_b') else None,
-                    'tags': json.dumps(market.get('tags')) if market.get('tags') else None,
-                }
-                if mapped['condition_id']:
-                    all_markets_mapped.append(mapped)
-            
-            print(f"  Batch {batch_num}/{total_batches}: Fetched {len(markets)} markets", flush=True)
-            
-        except Exception as e:
-            print(f"  ⚠️  Error fetching batch {batch_num}: {e}", flush=True)
-            continue
-    
-    return all_markets_mapped, all_markets_raw
+    return MeteredClient(project=PROJECT_ID)
 
 def extract_events_from_markets(markets_raw: List[Dict], already_fetched: Set[str] = None) -> Tuple[List[Dict], Set[str]]:
     """Extracts events from markets (matching backfill_v3_hybrid.py logic)"""
@@ -193,6 +68,10 @@ def load_markets_to_bigquery(client: bigquery.Client, markets: List[Dict]) -> bo
     if not markets:
         return True
     
+    markets = select_changed_markets(client, MARKETS_TABLE, markets)
+    if not markets:
+        return True
+    
     try:
         temp_table_id = f"{MARKETS_TABLE}_temp_{int(time.time() * 1000000)}"
         dest_table = client.get_table(MARKETS_TABLE)
@@ -204,7 +83,7 @@ def load_markets_to_bigquery(client: bigquery.Client, markets: List[Dict]) -> bo
             source_format="NEWLINE_DELIMITED_JSON",
             autodetect=False
         )
-        load_job = client.load_table_from_json(markets, temp_table_id, job_config=job_config)
+        load_job = load_table_from_rows(client, markets, temp_table_id, job_config=job_config, schema=dest_table.schema)
         load_job.result()
         
         merge_query = f"""
@@ -248,6 +127,7 @@ def load_markets_to_bigquery(client: bigquery.Client, markets: List[Dict]) -> bo
             side_a = source.side_a,
             side_b = source.side_b,
             tags = source.tags,
+            content_hash = source.content_hash,
             last_updated = CURRENT_TIMESTAMP()
         """.strip()
         
@@ -278,7 +158,7 @@ def load_events_to_bigquery(client: bigquery.Client, events: List[Dict]) -> bool
             source_format="NEWLINE_DELIMITED_JSON",
             autodetect=False
         )
-        load_job = client.load_table_from_json(events, temp_table_id, job_config=job_config)
+        load_job = load_table_from_rows(client, events, temp_table_id, job_config=job_config, schema=dest_table.schema)
         load_job.result()
         
         merge_query = f"""
@@ -319,7 +199,6 @@ def main():
     print()
     
     bq_client = get_bigquery_client()
-    session = get_http_session()
     
     # Get ONLY missing condition_ids (more efficient)
     print("Step 1: Finding condition_ids missing markets...")
@@ -343,11 +222,11 @@ def main():
     
     # Fetch missing markets
     print("Step 3: Fetching missing markets from Dome API...")
-    print(f"  Fetching {len(missing_condition_ids):,} condition_ids in batches of {BATCH_SIZE}...")
-    print(f"  This will take approximately {len(missing_condition_ids) // BATCH_SIZE * API_RATE_LIMIT_DELAY / 60:.1f} minutes")
+    print(f"  Fetching {len(missing_condition_ids):,} condition_ids in batches of {MARKETS_BATCH_SIZE}...")
+    print(f"  Keeping up to {MARKETS_MAX_IN_FLIGHT} batches in flight")
     print()
     
-    markets_mapped, markets_raw = fetch_markets_by_condition_ids(session, missing_condition_ids)
+    markets_mapped, markets_raw = fetch_markets_by_condition_ids(missing_condition_ids, api_key=DOME_API_KEY)
     
     print(f"  Fetched {len(markets_mapped)} markets")
     print()
@@ -5,11 +5,13 @@ Fetch missing markets and events from Dome API for all condition_ids in trades
 
 import os
 import time
-import requests
 from typing import List, Dict, Set, Tuple
 from google.cloud import bigquery
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from bq_metrics import MeteredClient
+from dome_client import MARKETS_BATCH_SIZE
+from dome_markets import fetch_markets_by_condition_ids
+from market_hash import select_changed_markets
+from bq_parquet import load_table_from_rows
 
 PROJECT_ID = "gen-lang-client-0299056258"
 DOME_API_KEY = os.getenv("DOME_API_KEY")
@@ -19,81 +21,23 @@ TRADES_TABLE = f"{PROJECT_ID}.{DATASET}.trades"
 MARKETS_TABLE = f"{PROJECT_ID}.{DATASET}.markets"
 EVENTS_TABLE = f"{PROJECT_ID}.{DATASET}.events"
 
-API_RATE_LIMIT_DELAY = 0.05  # 20 RPS
-BATCH_SIZE = 100  # Dome API limit
-
 def get_bigquery_client():
-    return bigquery.Client(project=PROJECT_ID)
-
-def get_http_session():
-    """HTTP session with retry logic"""
-    session = requests.Session()
-    retry_strategy = Retry(
-        total=5,
-        backoff_factor=2,
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["GET"]
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy, pool_connections=10, pool_maxsize=20)
-    session.mount("https://", adapter)
-    return session
+    return MeteredClient(project=PROJECT_ID)
 
-def fetch_markets_by_condition_ids(
-    session: requests.Session, 
-    condition_ids: List[str]
-) -> Tuple[List[Dict], List[Dict]]:
-    """Fetches markets from Dome API /polymarket/markets endpoint"""
-    if not condition_ids:
-        return [], []
-    
-    all_markets_mapped = []
-    all_markets_raw = []
-    base_url = "https://api.domeapi.io/v1"
-    
-    # Batch in chunks of 100
-    for i in range(0, len(condition_ids), BATCH_SIZE):
-        batch = condition_ids[i:i + BATCH_SIZE]
-        
-        from urllib.parse import urlencode
-        url = f"{base_url}/polymarket/markets"
-        params = [('limit', len(batch))]
-        for cid in batch:
-            params.append(('condition_id', cid))
-        url = f"{url}?{urlencode(params)}"
-        
-        headers = {"Authorization": f"Bearer {DOME_API_KEY}", "Accept": "application/json"}
-        
-        try:
-            time.sleep(API_RATE_LIMIT_DELAY)
-            response = session.get(url, headers=headers, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-            
-            if isinstance(data, list):
-                for market in data:
-                    all_markets_raw.append(market)
-                    # Map to our schema
-                    mapped = {
-                        'condition_id': market.get('condition_id'),
-                        'event_slug': market.get('event_slug'),
-                        'market_slug': market.get('market_slug'),
-                        'bet_structure': market.get('bet_structure'),
-                        'market_subtype': market.get('market_subtype'),
-                        'liquidity': market.get('liquidity'),
-                        'status': market.get('status'),
-                        'winning_label': market.get('winning_label'),
-                        'winning_id': market.get('winning_id'),
-                        'last_updated': market.get('last_updated'),
-                    }
-                    all_markets_mapped.append(mapped)
-            
-            print(f"  Fetched batch {i // BATCH_SIZE + 1}: {len(data)} markets", flush=True)
-            
-        except Exception as e:
-            print(f"  ⚠️  Error fetching batch: {e}", flush=True)
-            continue
-    
-    return all_markets_mapped, all_markets_raw
+def map_market_to_bigquery(market: Dict) -> Dict:
+    """Maps Dome API market to the core markets columns"""
+    return {
+        'condition_id': market.get('condition_id'),
+        'event_slug': market.get('event_slug'),
+        'market_slug': market.get('market_slug'),
+        'bet_structure': market.get('bet_structure'),
+        'market_subtype': market.get('market_subtype'),
+        'liquidity': market.get('liquidity'),
+        'status': market.get('status'),
+        'winning_label': market.get('winning_label'),
+        'winning_id': market.get('winning_id'),
+        'last_updated': market.get('last_updated'),
+    }
 
 def extract_events_from_markets(markets_raw: List[Dict], already_fetched: Set[str] = None) -> Tuple[List[Dict], Set[str]]:
     """Extracts events from markets"""
@@ -137,6 +81,10 @@ def load_markets_to_bigquery(client: bigquery.Client, markets: List[Dict]) -> bo
     if not markets:
         return True
     
+    markets = select_changed_markets(client, MARKETS_TABLE, markets)
+    if not markets:
+        return True
+    
     try:
         temp_table_id = f"{MARKETS_TABLE}_temp_{int(time.time() * 1000000)}"
         dest_table = client.get_table(MARKETS_TABLE)
@@ -148,7 +96,7 @@ def load_markets_to_bigquery(client: bigquery.Client, markets: List[Dict]) -> bo
             source_format="NEWLINE_DELIMITED_JSON",
             autodetect=False
         )
-        load_job = client.load_table_from_json(markets, temp_table_id, job_config=job_config)
+        load_job = load_table_from_rows(client, markets, temp_table_id, job_config=job_config, schema=dest_table.schema)
         load_job.result()
         
         merge_query = f"""
@@ -169,6 +117,7 @@ def load_markets_to_bigquery(client: bigquery.Client, markets: List[Dict]) -> bo
             status = source.status,
             winning_label = source.winning_label,
             winning_id = source.winning_id,
+            content_hash = source.content_hash,
             last_updated = CURRENT_TIMESTAMP()
         """
         
@@ -197,7 +146,7 @@ def load_events_to_bigquery(client: bigquery.Client, events: List[Dict]) -> bool
             source_format="NEWLINE_DELIMITED_JSON",
             autodetect=False
         )
-        load_job = client.load_table_from_json(events, temp_table_id, job_config=job_config)
+        load_job = load_table_from_rows(client, events, temp_table_id, job_config=job_config, schema=dest_table.schema)
         load_job.result()
         
         merge_query = f"""
@@ -236,7 +185,6 @@ def main():
     print()
     
     bq_client = get_bigquery_client()
-    session = get_http_session()
     
     # Get all condition_ids from trades that don't have markets
     print("Step 1: Finding missing condition_ids...")
@@ -260,8 +208,10 @@ def main():
     
     # Fetch markets
     print("Step 2: Fetching markets from Dome API...")
-    print(f"  Fetching {len(missing_condition_ids)} condition_ids in batches of {BATCH_SIZE}...")
-    markets_mapped, markets_raw = fetch_markets_by_condition_ids(session, missing_condition_ids)
+    print(f"  Fetching {len(missing_condition_ids)} condition_ids in batches of {MARKETS_BATCH_SIZE}...")
+    markets_mapped, markets_raw = fetch_markets_by_condition_ids(
+        missing_condition_ids, map_market=map_market_to_bigquery, api_key=DOME_API_KEY
+    )
     
     print(f"  Fetched {len(markets_mapped)} markets")
     print()
@@ -0,0 +1,133 @@
+"""
+Bounded buffer that hands rows to a loader in chunks.
+
+Used by the daily sync's streaming mode (SYNC_STREAMING=true): instead of
+holding every trade, market and event until the end of the run, rows are
+added to a FlushBuffer and flushed whenever it holds SYNC_FLUSH_ROWS rows,
+about SYNC_FLUSH_MB of row data, or the process RSS passes
+SYNC_MEMORY_CEILING_MB.
+
+Rows are grouped by name ("trades", "markets", "events") so one flush can
+load related tables together. The buffer records failed chunks instead of
+stopping; callers check `ok` before advancing any checkpoint, so a failed
+chunk is re-fetched by the next run (the MERGEs are idempotent).
+
+Usage:
+    buffer = FlushBuffer("trades", lambda chunk: load(chunk["trades"]))
+    buffer.add("trades", rows)
+    if buffer.should_flush():
+        buffer.flush()
+    buffer.flush()
+    if buffer.ok: advance_checkpoint()
+"""
+
+import os
+import time
+from typing import Callable, Dict, List, Optional
+
+SYNC_FLUSH_ROWS = int(os.getenv("SYNC_FLUSH_ROWS", "50000"))  # Flush after this many buffered rows
+SYNC_FLUSH_MB = float(os.getenv("SYNC_FLUSH_MB", "200"))  # ... or this much estimated row data
+SYNC_MEMORY_CEILING_MB = float(os.getenv("SYNC_MEMORY_CEILING_MB", "1536"))  # ... or when RSS passes this (0 = off)
+MIN_ROWS_UNDER_PRESSURE = 1000  # RSS rarely drops after a flush; don't flush tiny chunks on every add
+
+ROW_OVERHEAD_BYTES = 240  # dict + key references
+FIELD_OVERHEAD_BYTES = 50  # str/float object headers
+
+
+def estimate_row_bytes(row: Dict) -> int:
+    """Rough in-memory size of one mapped row (no deep sys.getsizeof walk)."""
+    size = ROW_OVERHEAD_BYTES
+    for value in row.values():
+        size += FIELD_OVERHEAD_BYTES + (len(value) if isinstance(value, str) else 8)
+    return size
+
+
+def current_rss_mb() -> Optional[float]:
+    """Resident set size from /proc (Linux / Cloud Run), None elsewhere."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class FlushBuffer:
+    """Collects named row lists and flushes them through flush_fn(chunk) -> bool."""
+
+    def __init__(
+        self,
+        name: str,
+        flush_fn: Callable[[Dict[str, List[Dict]]], bool],
+        max_rows: int = SYNC_FLUSH_ROWS,
+        max_mb: float = SYNC_FLUSH_MB,
+        memory_ceiling_mb: float = SYNC_MEMORY_CEILING_MB,
+    ):
+        self.name = name
+        self.flush_fn = flush_fn
+        self.max_rows = max_rows
+        self.max_bytes = max_mb * 1024 * 1024
+        self.memory_ceiling_mb = memory_ceiling_mb
+        self.chunk: Dict[str, List[Dict]] = {}
+        self.rows = 0
+        self.bytes = 0
+        self.added: Dict[str, int] = {}
+        self.chunks = 0
+        self.failed_chunks = 0
+        self.peak_rss_mb = 0.0
+
+    def add(self, table: str, rows: List[Dict]):
+        if not rows:
+            return
+        self.chunk.setdefault(table, []).extend(rows)
+        self.rows += len(rows)
+        self.bytes += sum(estimate_row_bytes(row) for row in rows)
+        self.added[table] = self.added.get(table, 0) + len(rows)
+
+    def memory_pressure(self) -> bool:
+        if self.memory_ceiling_mb <= 0:
+            return False
+        rss = current_rss_mb()
+        if rss is None:
+            return False
+        self.peak_rss_mb = max(self.peak_rss_mb, rss)
+        return rss >= self.memory_ceiling_mb
+
+    def should_flush(self) -> bool:
+        pressure = self.memory_pressure()
+        if self.rows >= self.max_rows or self.bytes >= self.max_bytes:
+            return True
+        return pressure and self.rows >= MIN_ROWS_UNDER_PRESSURE
+
+    def flush(self) -> bool:
+        """Loads the buffered chunk (no-op when empty). Returns the chunk's success."""
+        if not self.rows:
+            return True
+        chunk, size = self.chunk, self.bytes
+        self.chunk, self.rows, self.bytes = {}, 0, 0
+        self.chunks += 1
+        counts = ", ".join(f"{len(v)} {k}" for k, v in chunk.items())
+        print(f"  🚚 Flushing {self.name} chunk {self.chunks}: {counts} (~{size / 1e6:.0f} MB)", flush=True)
+        start = time.time()
+        try:
+            success = bool(self.flush_fn(chunk))
+        except Exception as e:
+            print(f"  ❌ {self.name} chunk {self.chunks} failed: {e}", flush=True)
+            success = False
+        if not success:
+            self.failed_chunks += 1
+        print(f"  {'✅' if success else '❌'} {self.name} chunk {self.chunks} {'loaded' if success else 'failed'} in {time.time() - start:.1f}s", flush=True)
+        return success
+
+    @property
+    def ok(self) -> bool:
+        """True when every chunk flushed so far succeeded."""
+        return self.failed_chunks == 0
+
+    def count(self, table: str) -> int:
+        """Rows of `table` added so far (flushed or not)."""
+        return self.added.get(table, 0)
+
+    def summary(self) -> str:
+        rss = f", peak RSS {self.peak_rss_mb:.0f} MB" if self.peak_rss_mb else ""
+        return f"{self.chunks} chunks ({self.failed_chunks} failed){rss}"
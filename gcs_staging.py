@@ -0,0 +1,156 @@
+"""
+Buffered, gzip-compressed NDJSON writer for GCS staging files.
+
+Rows are serialized in batches of STAGING_BATCH_ROWS (one json.dumps per
+row, one write per batch) and streamed through gzip into the blob, so large
+wallets no longer pay a write call per trade or upload uncompressed JSON.
+BigQuery loads .jsonl.gz natively (NEWLINE_DELIMITED_JSON).
+
+Usage:
+    with NDJSONStagingWriter(bucket, staging_path(f"trades/{wallet}")) as writer:
+        writer.write(row)
+    print(writer.stats.summary())
+"""
+
+import os
+import gzip
+import json
+import time
+from typing import Dict, Iterable, List, Optional
+
+GCS_STAGING_GZIP = os.getenv("GCS_STAGING_GZIP", "true").lower() == "true"
+STAGING_BATCH_ROWS = int(os.getenv("STAGING_BATCH_ROWS", "5000"))  # Rows serialized per write
+STAGING_GZIP_LEVEL = int(os.getenv("STAGING_GZIP_LEVEL", "6"))  # 1 = fastest, 9 = smallest
+STAGING_CHUNK_SIZE = 8 * 1024 * 1024  # Resumable upload chunk (multiple of 256 KB)
+
+STAGING_SUFFIXES = (".jsonl.gz", ".jsonl")
+
+
+def staging_path(base: str, compress: bool = GCS_STAGING_GZIP) -> str:
+    """Object name for a staging file: `base` + .jsonl.gz (or .jsonl)."""
+    return f"{base}.jsonl.gz" if compress else f"{base}.jsonl"
+
+
+def is_staging_file(name: str) -> bool:
+    return name.endswith(STAGING_SUFFIXES)
+
+
+def strip_staging_suffix(name: str) -> str:
+    """trades/0xabc.jsonl.gz -> trades/0xabc"""
+    for suffix in STAGING_SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+class StagingFileStats:
+    """Rows and bytes written to one staging file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rows = 0
+        self.raw_bytes = 0  # Uncompressed NDJSON
+        self.bytes_written = 0  # Bytes uploaded to GCS
+        self.started = time.time()
+        self.elapsed = 0.0
+
+    @property
+    def compression_ratio(self) -> float:
+        return self.raw_bytes / self.bytes_written if self.bytes_written else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{self.path}: {self.rows:,} rows, {self.bytes_written / 1e6:.2f} MB written "
+            f"({self.raw_bytes / 1e6:.2f} MB raw, {self.compression_ratio:.1f}x) in {self.elapsed:.1f}s"
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            'path': self.path,
+            'rows': self.rows,
+            'raw_bytes': self.raw_bytes,
+            'bytes_written': self.bytes_written,
+            'elapsed_seconds': round(self.elapsed, 2),
+        }
+
+
+class _CountingWriter:
+    """File-like wrapper that counts bytes passed to the underlying stream."""
+
+    def __init__(self, stream, stats: StagingFileStats):
+        self._stream = stream
+        self._stats = stats
+
+    def write(self, data) -> int:
+        self._stats.bytes_written += len(data)
+        return self._stream.write(data)
+
+    def flush(self):
+        self._stream.flush()
+
+
+class NDJSONStagingWriter:
+    """
+    Writes dict rows as NDJSON to gs://bucket/path, gzip-compressed when the
+    path ends in .gz. Rows are buffered and serialized STAGING_BATCH_ROWS at a
+    time; close() (or leaving the `with` block) flushes and finalizes the upload.
+    """
+
+    def __init__(
+        self,
+        bucket,
+        path: str,
+        batch_rows: int = STAGING_BATCH_ROWS,
+        compresslevel: int = STAGING_GZIP_LEVEL,
+    ):
+        self.path = path
+        self.batch_rows = batch_rows
+        self.stats = StagingFileStats(path)
+        self._buffer: List[Dict] = []
+
+        blob = bucket.blob(path)
+        blob.content_type = "application/x-ndjson"
+        self._blob_stream = blob.open("wb", chunk_size=STAGING_CHUNK_SIZE)
+        counting = _CountingWriter(self._blob_stream, self.stats)
+        if path.endswith(".gz"):
+            self._gzip: Optional[gzip.GzipFile] = gzip.GzipFile(fileobj=counting, mode="wb", compresslevel=compresslevel)
+            self._out = self._gzip
+        else:
+            self._gzip = None
+            self._out = counting
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write(self, row: Dict):
+        self._buffer.append(row)
+        if len(self._buffer) >= self.batch_rows:
+            self.flush()
+
+    def write_rows(self, rows: Iterable[Dict]):
+        for row in rows:
+            self.write(row)
+
+    def flush(self):
+        """Serializes buffered rows as one NDJSON block."""
+        if not self._buffer:
+            return
+        data = ("\n".join(json.dumps(row, separators=(",", ":")) for row in self._buffer) + "\n").encode("utf-8")
+        self._out.write(data)
+        self.stats.rows += len(self._buffer)
+        self.stats.raw_bytes += len(data)
+        self._buffer = []
+
+    def close(self) -> StagingFileStats:
+        if self._blob_stream is None:
+            return self.stats
+        self.flush()
+        if self._gzip is not None:
+            self._gzip.close()  # Writes the gzip trailer; leaves the blob stream open
+        self._blob_stream.close()
+        self._blob_stream = None
+        self.stats.elapsed = time.time() - self.stats.started
+        return self.stats
@@ -0,0 +1,276 @@
+"""
+Local snapshot of market and event keys already in BigQuery.
+
+New-vs-existing decisions ("which condition_ids do we still need to fetch?")
+used to pull every condition_id / event_slug out of BigQuery on each run.
+KeySnapshot keeps them in SQLite and refreshes incrementally: only rows whose
+timestamp column (markets.last_updated, events.created_at) is newer than the
+stored watermark (minus KEY_SNAPSHOT_OVERLAP_MINUTES) are read. A full reload
+runs when there is no watermark, the table has no timestamp column, or the
+last full reload is older than KEY_SNAPSHOT_FULL_REFRESH_HOURS (this also
+drops deleted keys).
+
+As with the market cache, with KEY_SNAPSHOT_GCS_URI set the file is restored
+from GCS on first use and uploaded back at exit when it changed.
+
+Usage:
+    known = known_keys(bq_client, "market", MARKETS_TABLE)   # refreshed once per process
+    new_ids = [cid for cid in condition_ids if cid not in known]
+    known.add(cid)   # in-memory only; BigQuery stays the source of truth
+"""
+
+import os
+import time
+import atexit
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, Optional, Set, Tuple
+
+from google.cloud import bigquery
+from market_cache import SQLITE_MAX_VARIABLES, restore_from_gcs, upload_to_gcs
+
+KEY_SNAPSHOT_ENABLED = os.getenv("KEY_SNAPSHOT_ENABLED", "true").lower() == "true"
+KEY_SNAPSHOT_PATH = os.getenv("KEY_SNAPSHOT_PATH", "/tmp/known_keys.sqlite")
+KEY_SNAPSHOT_GCS_URI = os.getenv("KEY_SNAPSHOT_GCS_URI")  # e.g. gs://bucket/cache/known_keys.sqlite
+KEY_SNAPSHOT_OVERLAP_MINUTES = int(os.getenv("KEY_SNAPSHOT_OVERLAP_MINUTES", "60"))  # Re-read this much before the watermark
+KEY_SNAPSHOT_FULL_REFRESH_HOURS = int(os.getenv("KEY_SNAPSHOT_FULL_REFRESH_HOURS", "168"))  # Weekly full reload
+
+# kind -> (key column, timestamp column used for incremental refresh)
+KEY_SOURCES: Dict[str, Tuple[str, str]] = {
+    "market": ("condition_id", "last_updated"),
+    "event": ("event_slug", "created_at"),
+}
+
+
+class KeySnapshot:
+    """
+    Thread-safe SQLite store of known keys per kind.
+    Tables: keys(kind, key), sync_state(kind, source_table, watermark, full_refreshed_at).
+    """
+
+    def __init__(self, path: str = KEY_SNAPSHOT_PATH):
+        self.path = path
+        self.writes = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS keys (
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                PRIMARY KEY (kind, key)
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS sync_state (
+                kind TEXT PRIMARY KEY,
+                source_table TEXT NOT NULL,
+                watermark TEXT,
+                full_refreshed_at INTEGER NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    def _state(self, kind: str):
+        return self._conn.execute(
+            "SELECT source_table, watermark, full_refreshed_at FROM sync_state WHERE kind = ?", (kind,)
+        ).fetchone()
+
+    def refresh(self, client: bigquery.Client, kind: str, table_id: str, now: Optional[float] = None) -> int:
+        """Pulls keys added since the last refresh. Returns the number of keys read from BigQuery."""
+        key_column, ts_column = KEY_SOURCES[kind]
+        now = int(now if now is not None else time.time())
+        with self._lock:
+            state = self._state(kind)
+        try:
+            columns = {f.name for f in client.get_table(table_id).schema}
+        except Exception as e:
+            print(f"⚠️  Key snapshot: cannot read {table_id} schema ({e}) - using local snapshot as is", flush=True)
+            return 0
+        if ts_column not in columns:
+            ts_column = None
+
+        full = (
+            state is None
+            or state[0] != table_id
+            or state[1] is None
+            or ts_column is None
+            or now - state[2] >= KEY_SNAPSHOT_FULL_REFRESH_HOURS * 3600
+        )
+        ts_select = f"MAX({ts_column})" if ts_column else "CAST(NULL AS TIMESTAMP)"
+        query = f"SELECT {key_column} AS k, {ts_select} AS ts FROM `{table_id}` WHERE {key_column} IS NOT NULL"
+        params = []
+        if not full:
+            since = datetime.fromisoformat(state[1]) - timedelta(minutes=KEY_SNAPSHOT_OVERLAP_MINUTES)
+            # Rows inserted without a timestamp (INSERT ROW skips column defaults) are re-read every time
+            query += f" AND ({ts_column} >= @since OR {ts_column} IS NULL)"
+            params.append(bigquery.ScalarQueryParameter("since", "TIMESTAMP", since))
+        query += " GROUP BY k"
+
+        rows = client.query(query, job_config=bigquery.QueryJobConfig(query_parameters=params)).result()
+        keys = []
+        watermark = None if full else datetime.fromisoformat(state[1])
+        for row in rows:
+            keys.append((kind, row["k"]))
+            ts = row["ts"]
+            if ts is not None and (watermark is None or ts > watermark):
+                watermark = ts
+        if watermark is not None and watermark.tzinfo is None:
+            watermark = watermark.replace(tzinfo=timezone.utc)
+
+        with self._lock:
+            if full:
+                self._conn.execute("DELETE FROM keys WHERE kind = ?", (kind,))
+            self._conn.executemany("INSERT OR IGNORE INTO keys (kind, key) VALUES (?, ?)", keys)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sync_state (kind, source_table, watermark, full_refreshed_at) VALUES (?, ?, ?, ?)",
+                (kind, table_id, watermark.isoformat() if watermark else None, now if full else state[2]),
+            )
+            self._conn.commit()
+            self.writes += 1
+        print(
+            f"🗂️  Key snapshot ({kind}): {'full reload' if full else 'incremental'} read {len(keys):,} keys from {table_id} "
+            f"({self.count(kind):,} known)",
+            flush=True,
+        )
+        return len(keys)
+
+    def contains_many(self, kind: str, keys: Iterable[str]) -> Set[str]:
+        """The subset of `keys` present in the snapshot."""
+        keys = list(dict.fromkeys(k for k in keys if k))
+        found = set()
+        with self._lock:
+            for i in range(0, len(keys), SQLITE_MAX_VARIABLES):
+                chunk = keys[i:i + SQLITE_MAX_VARIABLES]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key FROM keys WHERE kind = ? AND key IN ({placeholders})", [kind] + chunk
+                ).fetchall()
+                found.update(r[0] for r in rows)
+        return found
+
+    def contains(self, kind: str, key: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM keys WHERE kind = ? AND key = ?", (kind, key)).fetchone() is not None
+
+    def iter_keys(self, kind: str) -> Iterator[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT key FROM keys WHERE kind = ? ORDER BY key", (kind,)).fetchall()
+        return (r[0] for r in rows)
+
+    def count(self, kind: Optional[str] = None) -> int:
+        with self._lock:
+            if kind is None:
+                return self._conn.execute("SELECT COUNT(*) FROM keys").fetchone()[0]
+            return self._conn.execute("SELECT COUNT(*) FROM keys WHERE kind = ?", (kind,)).fetchone()[0]
+
+    def checkpoint(self):
+        """Folds the WAL into the main file so it can be copied as one file."""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+class KnownKeys:
+    """
+    Set-like view of one kind: `in` checks the snapshot plus keys added this
+    run. add() is in-memory only, so a key whose load fails is not recorded
+    as known; it reaches the snapshot through the next refresh.
+    """
+
+    def __init__(self, snapshot: Optional[KeySnapshot], kind: str, fallback: Optional[Set[str]] = None):
+        self.snapshot = snapshot
+        self.kind = kind
+        self.added: Set[str] = set(fallback or ())
+
+    def __contains__(self, key) -> bool:
+        if not key:
+            return False
+        return key in self.added or (self.snapshot is not None and self.snapshot.contains(self.kind, key))
+
+    def add(self, key: str):
+        if key:
+            self.added.add(key)
+
+    def update(self, keys: Iterable[str]):
+        for key in keys:
+            self.add(key)
+
+    def missing(self, keys: Iterable[str]) -> Set[str]:
+        """Keys not known yet (one batched lookup instead of one per key)."""
+        keys = {k for k in keys if k and k not in self.added}
+        if self.snapshot is None:
+            return keys
+        return keys - self.snapshot.contains_many(self.kind, keys)
+
+    def __iter__(self) -> Iterator[str]:
+        seen = set()
+        if self.snapshot is not None:
+            for key in self.snapshot.iter_keys(self.kind):
+                seen.add(key)
+                yield key
+        for key in self.added - seen:
+            yield key
+
+    def __len__(self) -> int:
+        if self.snapshot is None:
+            return len(self.added)
+        return self.snapshot.count(self.kind) + len(self.added - self.snapshot.contains_many(self.kind, self.added))
+
+
+_snapshot: Optional[KeySnapshot] = None
+_snapshot_lock = threading.Lock()
+_refreshed: Set[str] = set()
+
+
+def get_key_snapshot() -> Optional[KeySnapshot]:
+    """The process-wide snapshot, or None when KEY_SNAPSHOT_ENABLED=false."""
+    global _snapshot
+    if not KEY_SNAPSHOT_ENABLED:
+        return None
+    with _snapshot_lock:
+        if _snapshot is None:
+            if KEY_SNAPSHOT_GCS_URI and not os.path.exists(KEY_SNAPSHOT_PATH):
+                restore_from_gcs(KEY_SNAPSHOT_GCS_URI, KEY_SNAPSHOT_PATH, name="key snapshot")
+            try:
+                _snapshot = KeySnapshot(KEY_SNAPSHOT_PATH)
+            except sqlite3.Error as e:
+                print(f"⚠️  Key snapshot unavailable ({KEY_SNAPSHOT_PATH}): {e}", flush=True)
+                return None
+            if KEY_SNAPSHOT_GCS_URI:
+                atexit.register(_upload_if_changed, _snapshot)
+        return _snapshot
+
+
+def _upload_if_changed(snapshot: KeySnapshot):
+    if snapshot.writes:
+        upload_to_gcs(snapshot, KEY_SNAPSHOT_GCS_URI, name="key snapshot")
+
+
+def _distinct_keys(client: bigquery.Client, kind: str, table_id: str) -> Set[str]:
+    key_column = KEY_SOURCES[kind][0]
+    query = f"SELECT DISTINCT {key_column} AS k FROM `{table_id}` WHERE {key_column} IS NOT NULL"
+    return {row["k"] for row in client.query(query).result()}
+
+
+def known_keys(client: bigquery.Client, kind: str, table_id: str) -> KnownKeys:
+    """
+    Known keys of `kind` in table_id, refreshing the snapshot on the first call
+    per process. Falls back to a full DISTINCT scan when the snapshot is
+    disabled or its refresh fails.
+    """
+    snapshot = get_key_snapshot()
+    if snapshot is not None:
+        refresh_key = f"{kind}:{table_id}"
+        try:
+            if refresh_key not in _refreshed:
+                snapshot.refresh(client, kind, table_id)
+                _refreshed.add(refresh_key)
+            return KnownKeys(snapshot, kind)
+        except Exception as e:
+            print(f"⚠️  Key snapshot refresh failed for {table_id}: {e} - scanning the table", flush=True)
+    return KnownKeys(None, kind, _distinct_keys(client, kind, table_id))
@@ -4,7 +4,8 @@ Load missing trades from GCS to BigQuery.
 
 This script:
 1. Finds wallets with GCS files but no trades in BigQuery
-2. Loads GCS files to staging table in batches
+2. Loads GCS files to staging table in byte-sized batches, paced against the
+   table's daily load-job quota (bq_load_coordinator.py)
 3. Copies from staging to production with deduplication
 """
 
@@ -13,7 +14,10 @@ import json
 import time
 from typing import List, Set
 from google.cloud import bigquery
+from bq_metrics import MeteredClient
 from google.cloud import storage
+from gcs_staging import is_staging_file, strip_staging_suffix
+from bq_load_coordinator import LoadJobCoordinator, StagedFile
 
 # Configuration
 PROJECT_ID = os.getenv('GOOGLE_CLOUD_PROJECT', 'gen-lang-client-0299056258')
@@ -21,11 +25,9 @@ DATASET = os.getenv('DATASET', 'polycopy_v1')
 GCS_BUCKET = os.getenv('GCS_BUCKET', f"{PROJECT_ID}-backfill-temp")
 TRADES_STAGING_TABLE = f"{PROJECT_ID}.{DATASET}.trades_staging"
 TRADES_TABLE = f"{PROJECT_ID}.{DATASET}.trades"
-BATCH_SIZE = int(os.getenv('BATCH_SIZE', '10'))  # Load 10 files at a time (reduced to avoid quota)
-LOAD_DELAY = float(os.getenv('LOAD_DELAY', '2.0'))  # Delay between loads in seconds
 
 # Initialize clients
-bq_client = bigquery.Client(project=PROJECT_ID)
+bq_client = MeteredClient(project=PROJECT_ID)
 storage_client = storage.Client(project=PROJECT_ID)
 
 
@@ -40,16 +42,16 @@ def get_wallets_with_trades_in_bq() -> Set[str]:
     return {row['wallet_address'].lower() for row in results if row.get('wallet_address')}
 
 
-def get_gcs_files() -> List[str]:
-    """Get list of all GCS trade files"""
+def get_gcs_files() -> List[StagedFile]:
+    """Get all GCS trade files (StagedFile.key is the wallet)"""
     bucket = storage_client.bucket(GCS_BUCKET)
     blobs = bucket.list_blobs(prefix="trades/")
     files = []
     for blob in blobs:
-        if blob.name.endswith('.jsonl') and blob.name.startswith('trades/'):
-            # Extract wallet address from filename: trades/0x...jsonl
-            wallet = blob.name.replace('trades/', '').replace('.jsonl', '')
-            files.append((wallet, blob.name))
+        if is_staging_file(blob.name) and blob.name.startswith('trades/'):
+            # Extract wallet address from filename: trades/0x...jsonl(.gz)
+            wallet = strip_staging_suffix(blob.name).replace('trades/', '')
+            files.append(StagedFile(f"gs://{GCS_BUCKET}/{blob.name}", blob.size or 0, wallet))
     return files
 
 
@@ -69,84 +71,68 @@ def get_trades_schema():
             return None
 
 
-def load_gcs_file_to_staging(gcs_uri: str, retries: int = 3) -> bool:
-    """Load a single GCS file to staging table with deduplication"""
+def load_gcs_files_to_staging(gcs_uris: List[str]) -> bool:
+    """
+    Load a batch of GCS files to staging table with deduplication (one load
+    job + MERGE). Errors propagate so the coordinator can retry rate limits
+    and stop on quota exhaustion.
+    """
     # Use a temp table to deduplicate before merging into staging
     temp_table_id = f"{PROJECT_ID}.{DATASET}.temp_load_{int(time.time() * 1000000)}"
     
-    for attempt in range(retries):
-        try:
-            # Step 1: Get schema (from staging or production)
-            schema = get_trades_schema()
-            
-            # Step 2: Create temp table with same schema (or autodetect)
-            if schema:
-                temp_table = bigquery.Table(temp_table_id, schema=schema)
-                temp_table = bq_client.create_table(temp_table, exists_ok=True)
-                job_config = bigquery.LoadJobConfig(
-                    source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
-                    write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
-                    schema=schema,
-                    ignore_unknown_values=True,
-                )
-            else:
-                # Use autodetect if schema unavailable
-                job_config = bigquery.LoadJobConfig(
-                    source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
-                    write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
-                    autodetect=True,
-                    ignore_unknown_values=True,
-                )
-            
-            # Step 3: Load to temp table
-            load_job = bq_client.load_table_from_uri(
-                gcs_uri,
-                temp_table_id,
-                job_config=job_config
+    try:
+        # Step 1: Get schema (from staging or production)
+        schema = get_trades_schema()
+        
+        # Step 2: Create temp table with same schema (or autodetect)
+        if schema:
+            temp_table = bigquery.Table(temp_table_id, schema=schema)
+            temp_table = bq_client.create_table(temp_table, exists_ok=True)
+            job_config = bigquery.LoadJobConfig(
+                source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+                write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+                schema=schema,
+                ignore_unknown_values=True,
             )
-            
-            load_job.result()  # Wait for job to complete
-            
-            # Step 4: Deduplicate and merge into staging
-            merge_query = f"""
-            MERGE `{TRADES_STAGING_TABLE}` AS target
-            USING (
-                SELECT *
-                FROM `{temp_table_id}`
-                QUALIFY ROW_NUMBER() OVER (PARTITION BY id ORDER BY timestamp DESC) = 1
-            ) AS source
-            ON target.id = source.id
-            WHEN NOT MATCHED THEN INSERT ROW
-            """
-            
-            merge_job = bq_client.query(merge_query)
-            merge_job.result()
-            
-            # Step 5: Clean up temp table
-            try:
-                bq_client.delete_table(temp_table_id, not_found_ok=True)
-            except:
-                pass
-            
-            return True
-        except Exception as e:
-            error_msg = str(e)
-            # Clean up temp table on error
-            try:
-                bq_client.delete_table(temp_table_id, not_found_ok=True)
-            except:
-                pass
-            
-            # Check if it's a quota error
-            if 'rateLimitExceeded' in error_msg or 'rate limit' in error_msg.lower():
-                if attempt < retries - 1:
-                    wait_time = (attempt + 1) * 5  # Exponential backoff: 5s, 10s, 15s
-                    print(f"  ⏳ Quota limit hit, waiting {wait_time}s before retry...", flush=True)
-                    time.sleep(wait_time)
-                    continue
-            print(f"  ⚠️  Error loading {gcs_uri}: {e}", flush=True)
-            return False
-    return False
+        else:
+            # Use autodetect if schema unavailable
+            job_config = bigquery.LoadJobConfig(
+                source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+                write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+                autodetect=True,
+                ignore_unknown_values=True,
+            )
+        
+        # Step 3: Load all files of the batch to temp table in one job
+        load_job = bq_client.load_table_from_uri(
+            gcs_uris,
+            temp_table_id,
+            job_config=job_config
+        )
+        
+        load_job.result()  # Wait for job to complete
+        
+        # Step 4: Deduplicate and merge into staging
+        merge_query = f"""
+        MERGE `{TRADES_STAGING_TABLE}` AS target
+        USING (
+            SELECT *
+            FROM `{temp_table_id}`
+            QUALIFY ROW_NUMBER() OVER (PARTITION BY id ORDER BY timestamp DESC) = 1
+        ) AS source
+        ON target.id = source.id
+        WHEN NOT MATCHED THEN INSERT ROW
+        """
+        
+        merge_job = bq_client.query(merge_query)
+        merge_job.result()
+        return True
+    finally:
+        # Step 5: Clean up temp table
+        try:
+            bq_client.delete_table(temp_table_id, not_found_ok=True)
+        except:
+            pass
 
 
 def copy_staging_to_production():
@@ -200,11 +186,7 @@ def main():
     
     # Step 3: Filter to missing wallets
     print("Step 3: Identifying missing wallets...")
-    missing_files = [
-        (wallet, gcs_path) 
-        for wallet, gcs_path in gcs_files 
-        if wallet.lower() not in wallets_in_bq
-    ]
+    missing_files = [f for f in gcs_files if f.key.lower() not in wallets_in_bq]
     print(f"  Found {len(missing_files)} wallets with GCS files but no trades in BigQuery")
     print()
     
@@ -212,39 +194,19 @@ def main():
         print("✅ All wallets already have trades!")
         return
     
-    # Step 4: Load files in batches
+    # Step 4: Load files in quota-aware batches
     print(f"Step 4: Loading {len(missing_files)} GCS files to staging table...")
-    print(f"  Processing in batches of {BATCH_SIZE}")
+    coordinator = LoadJobCoordinator(bq_client, TRADES_STAGING_TABLE)
+    batches = coordinator.plan(missing_files)
     print()
     
-    loaded = 0
-    failed = 0
-    
-    for i in range(0, len(missing_files), BATCH_SIZE):
-        batch = missing_files[i:i + BATCH_SIZE]
-        batch_num = i // BATCH_SIZE + 1
-        total_batches = (len(missing_files) + BATCH_SIZE - 1) // BATCH_SIZE
-        
-        print(f"📦 Batch {batch_num}/{total_batches}: Loading {len(batch)} files...", flush=True)
-        
-        for wallet, gcs_path in batch:
-            gcs_uri = f"gs://{GCS_BUCKET}/{gcs_path}"
-            if load_gcs_file_to_staging(gcs_uri):
-                loaded += 1
-            else:
-                failed += 1
-            
-            # Delay between each file load to avoid quota
-            time.sleep(LOAD_DELAY)
-        
-        print(f"  ✅ Loaded {loaded} files, {failed} failed so far", flush=True)
-        print()
-        
-        # Additional delay between batches to avoid quota issues
-        if i + BATCH_SIZE < len(missing_files):
-            time.sleep(5)
+    _, deferred = coordinator.run(batches, load_gcs_files_to_staging)
+    loaded = coordinator.loaded_files
+    failed = sum(len(b.files) for b in batches) - loaded - sum(len(b.files) for b in deferred)
     
     print(f"✅ Loaded {loaded} files to staging, {failed} failed")
+    if deferred:
+        print(f"⏳ {sum(len(b.files) for b in deferred)} files deferred (load quota) - rerun later to load them")
     print()
     
     # Step 5: Copy staging to production
@@ -0,0 +1,233 @@
+"""
+Persistent on-disk cache of Dome /polymarket/markets responses.
+
+Raw market payloads are stored in SQLite keyed by condition_id, so every
+market fetcher (dome_markets.iter_markets) only calls Dome for ids that are
+missing or stale:
+- closed/resolved markets never expire
+- open markets expire after MARKET_CACHE_OPEN_TTL_SECONDS, sooner if their
+  end_time or game_start_time falls inside that window (a market is
+  re-fetched right after it ends or its game starts)
+- open markets past their end_time (awaiting resolution) expire after
+  MARKET_CACHE_PENDING_TTL_SECONDS
+
+Cloud Run disks are ephemeral, so with MARKET_CACHE_GCS_URI set the cache
+file is restored from GCS on first use and uploaded back at process exit
+(only if it changed).
+
+Usage:
+    cache = get_market_cache()
+    hits = cache.get_many(condition_ids)   # {condition_id: raw_market}
+    cache.put_many(raw_markets)
+"""
+
+import os
+import json
+import time
+import atexit
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional
+
+MARKET_CACHE_ENABLED = os.getenv("MARKET_CACHE_ENABLED", "true").lower() == "true"
+MARKET_CACHE_PATH = os.getenv("MARKET_CACHE_PATH", "/tmp/dome_market_cache.sqlite")
+MARKET_CACHE_GCS_URI = os.getenv("MARKET_CACHE_GCS_URI")  # e.g. gs://bucket/cache/dome_market_cache.sqlite
+MARKET_CACHE_OPEN_TTL_SECONDS = int(os.getenv("MARKET_CACHE_OPEN_TTL_SECONDS", str(6 * 3600)))
+MARKET_CACHE_PENDING_TTL_SECONDS = int(os.getenv("MARKET_CACHE_PENDING_TTL_SECONDS", "900"))
+MARKET_CACHE_MIN_TTL_SECONDS = int(os.getenv("MARKET_CACHE_MIN_TTL_SECONDS", "300"))
+
+SQLITE_MAX_VARIABLES = 900  # Stay under SQLite's default bound-parameter limit
+
+RESOLVED_STATUSES = {"closed", "resolved", "settled"}
+
+
+def _unix(value) -> Optional[int]:
+    if isinstance(value, (int, float)) and value > 0:
+        return int(value)
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return None
+
+
+def is_resolved(market: Dict) -> bool:
+    """A market that can no longer change: closed status, a winner, or a completed_time."""
+    status = (market.get('status') or '').lower()
+    return status in RESOLVED_STATUSES or bool(market.get('winning_side')) or _unix(market.get('completed_time')) is not None
+
+
+def market_expires_at(market: Dict, now: Optional[float] = None) -> Optional[int]:
+    """Unix time the cached market goes stale, or None if it never does."""
+    if is_resolved(market):
+        return None
+    now = int(now if now is not None else time.time())
+
+    end_time = _unix(market.get('end_time'))
+    if end_time is not None and end_time <= now:
+        return now + MARKET_CACHE_PENDING_TTL_SECONDS
+
+    expires = now + MARKET_CACHE_OPEN_TTL_SECONDS
+    for boundary in (end_time, _unix(market.get('game_start_time'))):
+        if boundary is not None and boundary > now:
+            expires = min(expires, boundary)
+    return max(expires, now + MARKET_CACHE_MIN_TTL_SECONDS)
+
+
+class MarketCache:
+    """
+    Thread-safe SQLite cache of raw market payloads.
+    Rows: condition_id, payload (JSON), fetched_at, expires_at (NULL = never).
+    """
+
+    def __init__(self, path: str = MARKET_CACHE_PATH):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS markets (
+                condition_id TEXT PRIMARY KEY,
+                payload TEXT NOT NULL,
+                fetched_at INTEGER NOT NULL,
+                expires_at INTEGER
+            )
+        """)
+        self._conn.commit()
+
+    def get_many(self, condition_ids: Iterable[str], now: Optional[float] = None) -> Dict[str, Dict]:
+        """Fresh cached markets for the given ids: {condition_id: raw_market}."""
+        ids = list(dict.fromkeys(cid for cid in condition_ids if cid))
+        now = int(now if now is not None else time.time())
+        found = {}
+        with self._lock:
+            for i in range(0, len(ids), SQLITE_MAX_VARIABLES):
+                chunk = ids[i:i + SQLITE_MAX_VARIABLES]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT condition_id, payload FROM markets "
+                    f"WHERE condition_id IN ({placeholders}) AND (expires_at IS NULL OR expires_at > ?)",
+                    chunk + [now],
+                ).fetchall()
+                for condition_id, payload in rows:
+                    found[condition_id] = json.loads(payload)
+            self.hits += len(found)
+            self.misses += len(ids) - len(found)
+        return found
+
+    def put_many(self, markets: Iterable[Dict], now: Optional[float] = None):
+        """Stores raw markets (those without a condition_id are ignored)."""
+        now = int(now if now is not None else time.time())
+        rows = [
+            (m['condition_id'], json.dumps(m, separators=(",", ":")), now, market_expires_at(m, now))
+            for m in markets
+            if m.get('condition_id')
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO markets (condition_id, payload, fetched_at, expires_at) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self._conn.commit()
+            self.writes += len(rows)
+
+    def purge_expired(self, now: Optional[float] = None) -> int:
+        now = int(now if now is not None else time.time())
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM markets WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+            self._conn.commit()
+            return cursor.rowcount
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM markets").fetchone()[0]
+
+    def checkpoint(self):
+        """Folds the WAL into the main file so it can be copied as one file."""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def summary(self) -> str:
+        lookups = self.hits + self.misses
+        hit_rate = 100.0 * self.hits / lookups if lookups else 0.0
+        return f"{self.hits:,} hits / {lookups:,} lookups ({hit_rate:.0f}%), {self.writes:,} writes"
+
+
+def _split_gcs_uri(uri: str):
+    path = uri[len("gs://"):] if uri.startswith("gs://") else uri
+    bucket_name, _, blob_name = path.partition("/")
+    return bucket_name, blob_name
+
+
+def restore_from_gcs(uri: str, path: str, name: str = "market cache") -> bool:
+    """Downloads the cache file from GCS (if it exists) before it is opened."""
+    try:
+        from google.cloud import storage
+        bucket_name, blob_name = _split_gcs_uri(uri)
+        blob = storage.Client().bucket(bucket_name).blob(blob_name)
+        if not blob.exists():
+            return False
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        blob.download_to_filename(path)
+        print(f"📦 Restored {name} from {uri}", flush=True)
+        return True
+    except Exception as e:
+        print(f"⚠️  Could not restore {name} from {uri} (starting empty): {e}", flush=True)
+        return False
+
+
+def upload_to_gcs(cache, uri: str, name: str = "market cache"):
+    """Uploads a SQLite-backed store (anything with path/checkpoint/count) to GCS."""
+    try:
+        from google.cloud import storage
+        cache.checkpoint()
+        bucket_name, blob_name = _split_gcs_uri(uri)
+        storage.Client().bucket(bucket_name).blob(blob_name).upload_from_filename(cache.path)
+        print(f"📦 Uploaded {name} ({cache.count():,} rows) to {uri}", flush=True)
+    except Exception as e:
+        print(f"⚠️  Could not upload {name} to {uri}: {e}", flush=True)
+
+
+_market_cache: Optional[MarketCache] = None
+_market_cache_lock = threading.Lock()
+
+
+def get_market_cache() -> Optional[MarketCache]:
+    """The process-wide market cache, or None when MARKET_CACHE_ENABLED=false."""
+    global _market_cache
+    if not MARKET_CACHE_ENABLED:
+        return None
+    with _market_cache_lock:
+        if _market_cache is None:
+            if MARKET_CACHE_GCS_URI and not os.path.exists(MARKET_CACHE_PATH):
+                restore_from_gcs(MARKET_CACHE_GCS_URI, MARKET_CACHE_PATH)
+            try:
+                _market_cache = MarketCache(MARKET_CACHE_PATH)
+            except sqlite3.Error as e:
+                print(f"⚠️  Market cache unavailable ({MARKET_CACHE_PATH}): {e}", flush=True)
+                return None
+            if MARKET_CACHE_GCS_URI:
+                atexit.register(_upload_if_changed, _market_cache)
+        return _market_cache
+
+
+def _upload_if_changed(cache: MarketCache):
+    if cache.writes:
+        upload_to_gcs(cache, MARKET_CACHE_GCS_URI)
+
+
+def split_cached(condition_ids: List[str], cache: Optional[MarketCache]):
+    """(cached {condition_id: raw_market}, ids still to fetch) for a list of ids."""
+    if cache is None:
+        return {}, list(condition_ids)
+    cached = cache.get_many(condition_ids)
+    return cached, [cid for cid in condition_ids if cid not in cached]
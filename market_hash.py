@@ -0,0 +1,93 @@
+"""
+Change detection for market upserts.
+
+Every mapped market row carries a content_hash (SHA-256 of the row's
+canonical JSON, excluding bookkeeping columns) that is stored in the markets
+table. Before loading, loaders drop rows whose hash matches the stored one,
+so refreshing thousands of open markets only loads and MERGEs the markets
+that actually changed.
+
+Usage (inside a load_markets_to_bigquery):
+    markets = select_changed_markets(client, MARKETS_TABLE, markets)
+    if not markets:
+        return True
+    ... load to temp table, MERGE with content_hash = source.content_hash ...
+"""
+
+import json
+import hashlib
+from typing import Dict, List, Set
+
+from google.cloud import bigquery
+
+CONTENT_HASH_COLUMN = "content_hash"
+HASH_EXCLUDED_FIELDS = {CONTENT_HASH_COLUMN, "last_updated"}
+
+_tables_with_hash_column: Set[str] = set()
+
+
+def market_content_hash(row: Dict) -> str:
+    """Stable hash of a mapped market row (key order and bookkeeping columns ignored)."""
+    content = {k: v for k, v in row.items() if k not in HASH_EXCLUDED_FIELDS}
+    canonical = json.dumps(content, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def add_content_hashes(markets: List[Dict]) -> List[Dict]:
+    for row in markets:
+        row[CONTENT_HASH_COLUMN] = market_content_hash(row)
+    return markets
+
+
+def ensure_content_hash_column(client: bigquery.Client, markets_table: str):
+    """Adds the content_hash column to the markets table once per process."""
+    if markets_table in _tables_with_hash_column:
+        return
+    client.query(
+        f"ALTER TABLE `{markets_table}` ADD COLUMN IF NOT EXISTS {CONTENT_HASH_COLUMN} STRING"
+    ).result()
+    _tables_with_hash_column.add(markets_table)
+
+
+def get_stored_hashes(client: bigquery.Client, markets_table: str, condition_ids: List[str]) -> Dict[str, str]:
+    """{condition_id: content_hash} for rows already in the markets table (reads two columns)."""
+    if not condition_ids:
+        return {}
+    query = f"""
+    SELECT condition_id, {CONTENT_HASH_COLUMN}
+    FROM `{markets_table}`
+    WHERE condition_id IN UNNEST(@condition_ids)
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter("condition_ids", "STRING", condition_ids)]
+    )
+    return {
+        row['condition_id']: row[CONTENT_HASH_COLUMN]
+        for row in client.query(query, job_config=job_config).result()
+    }
+
+
+def select_changed_markets(client: bigquery.Client, markets_table: str, markets: List[Dict]) -> List[Dict]:
+    """
+    Hashes each row and returns only new markets and markets whose hash
+    differs from the stored one. If the stored hashes cannot be read, every
+    row is returned (a full upsert is always safe).
+    """
+    if not markets:
+        return markets
+    add_content_hashes(markets)
+    try:
+        ensure_content_hash_column(client, markets_table)
+        stored = get_stored_hashes(client, markets_table, list({m['condition_id'] for m in markets}))
+    except Exception as e:
+        print(f"  ⚠️  Could not read market hashes (upserting all {len(markets)} rows): {e}", flush=True)
+        return markets
+
+    changed = [m for m in markets if stored.get(m['condition_id']) != m[CONTENT_HASH_COLUMN]]
+    new_count = sum(1 for m in changed if m['condition_id'] not in stored)
+    print(
+        f"  🔍 Markets: {len(changed)} to upsert ({new_count} new, {len(changed) - new_count} changed), "
+        f"{len(markets) - len(changed)} unchanged skipped",
+        flush=True,
+    )
+    return changed
@@ -0,0 +1,320 @@
+"""
+Local stand-in for the Dome API (/polymarket/orders and /polymarket/markets).
+
+Serves recorded fixtures (see benchmark-ingestion.py --record) or synthetic
+wallets/markets with configurable latency, Dome-style pagination (offset up
+to 10000, then pagination_key) and injected 429s, so ingestion throughput
+can be measured without spending API quota.
+
+Standalone:
+    python mock_dome_server.py --port 8765 --wallets 20 --trades-per-wallet 15000
+    DOME_API_BASE=http://127.0.0.1:8765/v1 python daily-sync-trades-markets.py
+
+In-process (benchmarks):
+    server = MockDomeServer(MockDomeConfig(latency_ms=50, throttle_rate=0.02))
+    base_url = server.start()
+    ...
+    server.stop()
+
+Fixture file format (JSON):
+    {"orders": {"0xwallet": [order, ...]}, "markets": [market, ...]}
+"""
+
+import os
+import json
+import time
+import zlib
+import hashlib
+import base64
+import random
+import asyncio
+import argparse
+import threading
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+ORDERS_MAX_OFFSET = 10000  # Same limit as the real API: past this, pagination_key is required
+ORDERS_MAX_LIMIT = 1000
+SYNTHETIC_BASE_TIME = 1735689600  # 2025-01-01 UTC
+SYNTHETIC_TRADE_SPACING = 60  # Seconds between synthetic trades of one wallet
+
+
+class MockDomeConfig:
+    """Fixture source and fault injection settings for MockDomeServer."""
+
+    def __init__(
+        self,
+        wallets: int = 10,
+        trades_per_wallet: int = 2000,
+        markets: int = 500,
+        fixtures_path: Optional[str] = None,
+        latency_ms: float = 30.0,
+        jitter_ms: float = 20.0,
+        throttle_rate: float = 0.0,
+        retry_after: float = 0.2,
+        seed: int = 42,
+    ):
+        self.wallets = wallets
+        self.trades_per_wallet = trades_per_wallet
+        self.markets = markets
+        self.fixtures_path = fixtures_path
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.throttle_rate = throttle_rate  # Fraction of requests answered with 429
+        self.retry_after = retry_after  # Retry-After seconds sent with injected 429s
+        self.seed = seed
+
+
+def synthetic_wallet(i: int) -> str:
+    return "0x" + hashlib.sha1(f"wallet-{i}".encode()).hexdigest()
+
+
+def synthetic_condition_id(i: int) -> str:
+    return f"0x{i:064x}"
+
+
+def synthetic_orders(wallet: str, count: int, markets: int) -> List[Dict]:
+    """Deterministic orders for a wallet, newest first (like the API)."""
+    rng = random.Random(zlib.crc32(wallet.encode()))
+    orders = []
+    for n in range(count):
+        market = rng.randrange(markets)
+        orders.append({
+            'order_hash': f"0x{zlib.crc32(f'{wallet}:{n}'.encode()):08x}{n:056x}",
+            'tx_hash': f"0x{n:064x}",
+            'user': wallet,
+            'taker': synthetic_wallet(rng.randrange(1 << 20)),
+            'condition_id': synthetic_condition_id(market),
+            'market_slug': f"market-{market}",
+            'title': f"Synthetic market {market}",
+            'token_id': str(market * 2 + rng.randrange(2)),
+            'token_label': rng.choice(['Yes', 'No']),
+            'side': rng.choice(['BUY', 'SELL']),
+            'price': round(rng.uniform(0.01, 0.99), 4),
+            'shares': rng.randrange(1, 10000) * 1000000,
+            'shares_normalized': float(rng.randrange(1, 10000)),
+            'timestamp': SYNTHETIC_BASE_TIME + (count - n) * SYNTHETIC_TRADE_SPACING,
+        })
+    return orders
+
+
+def synthetic_market(condition_id: str) -> Dict:
+    n = int(condition_id, 16) if condition_id.startswith("0x") else zlib.crc32(condition_id.encode())
+    closed = n % 3 != 0
+    end_time = SYNTHETIC_BASE_TIME + (n % 365) * 86400
+    return {
+        'condition_id': condition_id,
+        'market_slug': f"market-{n}",
+        'event_slug': f"event-{n // 5}",
+        'title': f"Synthetic market {n}",
+        'description': "Synthetic market served by mock_dome_server.py",
+        'status': 'closed' if closed else 'open',
+        'start_time': end_time - 30 * 86400,
+        'end_time': end_time,
+        'completed_time': end_time if closed else None,
+        'close_time': end_time if closed else None,
+        'winning_side': {'id': str(n * 2), 'label': 'Yes'} if closed else None,
+        'side_a': {'id': str(n * 2), 'label': 'Yes'},
+        'side_b': {'id': str(n * 2 + 1), 'label': 'No'},
+        'volume_total': float(n % 100000),
+        'tags': ['synthetic'],
+    }
+
+
+def encode_pagination_key(wallet: str, offset: int, start_time: Optional[int]) -> str:
+    raw = json.dumps({'w': wallet, 'o': offset, 's': start_time}).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_pagination_key(key: str) -> Dict:
+    return json.loads(base64.urlsafe_b64decode(key.encode()))
+
+
+class MockDomeServer:
+    """aiohttp app serving fixtures; run it in a background thread with start()."""
+
+    def __init__(self, config: Optional[MockDomeConfig] = None):
+        self.config = config or MockDomeConfig()
+        self._rng = random.Random(self.config.seed)
+        self._orders: Dict[str, List[Dict]] = {}
+        self._markets: Dict[str, Dict] = {}
+        self._loop = None
+        self._runner = None
+        self._thread = None
+        self.base_url = None
+        self.reset_stats()
+
+        if self.config.fixtures_path:
+            with open(self.config.fixtures_path) as f:
+                fixtures = json.load(f)
+            self._orders = {w.lower(): orders for w, orders in fixtures.get('orders', {}).items()}
+            self._markets = {m['condition_id']: m for m in fixtures.get('markets', []) if m.get('condition_id')}
+
+    @property
+    def wallets(self) -> List[str]:
+        if self.config.fixtures_path:
+            return sorted(self._orders)
+        return [synthetic_wallet(i + 1) for i in range(self.config.wallets)]
+
+    def condition_ids(self) -> List[str]:
+        if self.config.fixtures_path:
+            return sorted(self._markets)
+        return [synthetic_condition_id(i) for i in range(self.config.markets)]
+
+    def reset_stats(self):
+        self.stats = {'orders_pages': 0, 'orders_rows': 0, 'markets_requests': 0, 'markets_rows': 0, 'throttled': 0, 'errors': 0}
+
+    def _wallet_orders(self, wallet: str) -> List[Dict]:
+        if wallet not in self._orders and not self.config.fixtures_path:
+            self._orders[wallet] = synthetic_orders(wallet, self.config.trades_per_wallet, self.config.markets)
+        return self._orders.get(wallet, [])
+
+    async def _delay_or_throttle(self) -> Optional[web.Response]:
+        delay = (self.config.latency_ms + self._rng.uniform(0, self.config.jitter_ms)) / 1000.0
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.config.throttle_rate and self._rng.random() < self.config.throttle_rate:
+            self.stats['throttled'] += 1
+            return web.json_response(
+                {'error': 'Too Many Requests'},
+                status=429,
+                headers={'Retry-After': str(self.config.retry_after)},
+            )
+        return None
+
+    def _error(self, status: int, message: str) -> web.Response:
+        self.stats['errors'] += 1
+        return web.json_response({'error': message}, status=status)
+
+    async def handle_orders(self, request: web.Request) -> web.Response:
+        throttled = await self._delay_or_throttle()
+        if throttled is not None:
+            return throttled
+
+        query = request.query
+        wallet = (query.get('user') or '').lower()
+        if not wallet:
+            return self._error(400, "user is required")
+        try:
+            limit = min(int(query.get('limit', 100)), ORDERS_MAX_LIMIT)
+            start_time = int(query['start_time']) if query.get('start_time') else None
+            if query.get('pagination_key'):
+                key = decode_pagination_key(query['pagination_key'])
+                if key['w'] != wallet:
+                    return self._error(400, "pagination_key does not match user")
+                offset = key['o']
+                start_time = key['s']
+            else:
+                offset = int(query.get('offset', 0))
+                if offset > ORDERS_MAX_OFFSET:
+                    return self._error(400, f"offset cannot exceed {ORDERS_MAX_OFFSET}; use pagination_key")
+        except (KeyError, ValueError) as e:
+            return self._error(400, f"bad request: {e}")
+
+        orders = self._wallet_orders(wallet)
+        if start_time is not None:
+            orders = [o for o in orders if (o.get('timestamp') or 0) >= start_time]
+        page = orders[offset:offset + limit]
+        next_offset = offset + len(page)
+        has_more = next_offset < len(orders)
+
+        pagination = {'limit': limit, 'offset': offset, 'total': len(orders), 'has_more': has_more}
+        if has_more and next_offset > ORDERS_MAX_OFFSET:
+            pagination['pagination_key'] = encode_pagination_key(wallet, next_offset, start_time)
+
+        self.stats['orders_pages'] += 1
+        self.stats['orders_rows'] += len(page)
+        return web.json_response({'orders': page, 'pagination': pagination})
+
+    async def handle_markets(self, request: web.Request) -> web.Response:
+        throttled = await self._delay_or_throttle()
+        if throttled is not None:
+            return throttled
+
+        condition_ids = request.query.getall('condition_id', [])
+        if len(condition_ids) > 100:
+            return self._error(400, "at most 100 condition_id values")
+        if self.config.fixtures_path:
+            markets = [self._markets[cid] for cid in condition_ids if cid in self._markets]
+        else:
+            markets = [synthetic_market(cid) for cid in condition_ids]
+
+        self.stats['markets_requests'] += 1
+        self.stats['markets_rows'] += len(markets)
+        return web.json_response({'markets': markets, 'pagination': {'limit': len(condition_ids), 'total': len(markets)}})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/v1/polymarket/orders', self.handle_orders)
+        app.router.add_get('/v1/polymarket/markets', self.handle_markets)
+        return app
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Starts the server on a background thread; returns its base URL (…/v1)."""
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._runner = web.AppRunner(self.app())
+            self._loop.run_until_complete(self._runner.setup())
+            site = web.TCPSite(self._runner, host, port)
+            self._loop.run_until_complete(site.start())
+            bound_port = self._runner.addresses[0][1]
+            self.base_url = f"http://{host}:{bound_port}/v1"
+            started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self._runner.cleanup())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="mock-dome", daemon=True)
+        self._thread.start()
+        if not started.wait(10):
+            raise RuntimeError("Mock Dome server did not start")
+        return self.base_url
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(10)
+            self._loop = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock of the Dome API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.getenv("MOCK_DOME_PORT", "8765")))
+    parser.add_argument("--fixtures", help="Recorded fixture JSON (default: synthetic data)")
+    parser.add_argument("--wallets", type=int, default=10)
+    parser.add_argument("--trades-per-wallet", type=int, default=2000)
+    parser.add_argument("--markets", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=30.0)
+    parser.add_argument("--jitter-ms", type=float, default=20.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0.2)
+    args = parser.parse_args()
+
+    server = MockDomeServer(MockDomeConfig(
+        wallets=args.wallets,
+        trades_per_wallet=args.trades_per_wallet,
+        markets=args.markets,
+        fixtures_path=args.fixtures,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        throttle_rate=args.throttle_rate,
+        retry_after=args.retry_after,
+    ))
+    base_url = server.start(args.host, args.port)
+    print(f"🧪 Mock Dome API at {base_url} ({len(server.wallets)} wallets)", flush=True)
+    print(f"   DOME_API_BASE={base_url}", flush=True)
+    try:
+        while True:
+            time.sleep(60)
+            print(f"   {server.stats}", flush=True)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
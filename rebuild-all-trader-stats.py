@@ -13,6 +13,7 @@ import os
 import sys
 from datetime import datetime, timezone
 from google.cloud import bigquery
+from bq_metrics import MeteredClient
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
@@ -30,7 +31,7 @@ SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 
 def get_bigquery_client():
     """Initialize BigQuery client."""
-    return bigquery.Client(project=PROJECT_ID)
+    return MeteredClient(project=PROJECT_ID)
 
 def get_supabase_client() -> Client:
     """Initialize Supabase client."""
@@ -7,9 +7,11 @@ Sync all wallet addresses from Supabase traders table to BigQuery traders table
 import os
 import sys
 from supabase import create_client, Client
-from google.cloud import bigquery
 from dotenv import load_dotenv
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from bq_metrics import MeteredClient
+
 load_dotenv('.env.local')
 
 SUPABASE_URL = os.getenv('NEXT_PUBLIC_SUPABASE_URL')
@@ -23,7 +25,7 @@ if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
     sys.exit(1)
 
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
-bq_client = bigquery.Client(project=PROJECT_ID)
+bq_client = MeteredClient(project=PROJECT_ID)
 
 def main():
     print('=' * 60)
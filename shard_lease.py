@@ -0,0 +1,490 @@
+"""
+Lease-based work sharing for multi-task backfills.
+
+Wallets are hashed into BACKFILL_SHARDS shards. Each Cloud Run task (or local
+process) claims one shard at a time through a time-bounded lease in a work
+table, renews the lease while it works (LeaseHeartbeat), and marks the shard
+complete at the end. A task that dies stops renewing; once its lease expires
+any other task reclaims the shard. N tasks therefore split the wallet list
+without coordination beyond the lease table. A shard whose work raises on
+LEASE_MAX_ATTEMPTS claims is marked failed (completed with an error) so the
+other shards still finish and the run can finalize.
+
+Two stores implement the same interface:
+- BigQueryLeaseStore: `backfill_shard_leases` table, claims are single UPDATE
+  statements (BigQuery serializes concurrent DML on a table).
+- SQLiteLeaseStore: a local file, claims run in BEGIN IMMEDIATE transactions.
+  Several local processes can share it (LEASE_STORE=sqlite).
+
+Rows are keyed by run id (BACKFILL_RUN_ID, else the Cloud Run execution name),
+so each execution gets a fresh set of shards. Shard -1 is the finalize marker:
+exactly one task wins it once every shard is complete (try_finalize) and runs
+the one-off staging -> production copy.
+
+Local check with several processes against a SQLite store:
+    python shard_lease.py demo --workers 4 --shards 32 --store /tmp/leases.sqlite
+"""
+
+import os
+import sys
+import time
+import uuid
+import random
+import socket
+import hashlib
+import sqlite3
+import argparse
+import threading
+from typing import Dict, Iterable, List, Optional
+
+BACKFILL_SHARDS = int(os.getenv("BACKFILL_SHARDS", "0"))  # 0 = single-process mode (no leases)
+LEASE_SECONDS = int(os.getenv("LEASE_SECONDS", "900"))  # Lease length; renewed every LEASE_SECONDS / 3
+LEASE_POLL_SECONDS = int(os.getenv("LEASE_POLL_SECONDS", "30"))  # Wait between claims while other tasks hold leases
+LEASE_MAX_ATTEMPTS = int(os.getenv("LEASE_MAX_ATTEMPTS", "3"))  # Claims of a failing shard before it is marked failed
+LEASE_STORE = os.getenv("LEASE_STORE", "bigquery")  # bigquery | sqlite
+LEASE_STORE_PATH = os.getenv("LEASE_STORE_PATH", "/tmp/shard_leases.sqlite")
+BACKFILL_RUN_ID = os.getenv("BACKFILL_RUN_ID") or os.getenv("CLOUD_RUN_EXECUTION") or "default"
+FINALIZE_SHARD = -1
+DML_MAX_RETRIES = 5
+
+
+def wallet_shard(wallet: str, num_shards: int) -> int:
+    """Stable shard of a wallet (case-insensitive), independent of process and task."""
+    digest = hashlib.md5(wallet.lower().encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % num_shards
+
+
+def group_by_shard(wallets: Iterable[str], num_shards: int) -> Dict[int, List[str]]:
+    shards: Dict[int, List[str]] = {}
+    for wallet in wallets:
+        shards.setdefault(wallet_shard(wallet, num_shards), []).append(wallet)
+    return shards
+
+
+def lease_owner_id() -> str:
+    """Unique owner id: host, Cloud Run task index, pid and a random suffix."""
+    task = os.getenv("CLOUD_RUN_TASK_INDEX", "0")
+    return f"{socket.gethostname()}:task{task}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class Lease:
+    """A claimed shard."""
+
+    def __init__(self, shard: int, owner: str, attempts: int):
+        self.shard = shard
+        self.owner = owner
+        self.attempts = attempts
+
+    @property
+    def reclaimed(self) -> bool:
+        """True when an earlier owner held this shard (it may have finished some wallets)."""
+        return self.attempts > 1
+
+
+class SQLiteLeaseStore:
+    """Lease table in a local SQLite file, shared by processes on one machine."""
+
+    def __init__(self, path: str = LEASE_STORE_PATH, run_id: str = BACKFILL_RUN_ID):
+        self.path = path
+        self.run_id = run_id
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS shard_leases (
+                run_id TEXT NOT NULL,
+                shard INTEGER NOT NULL,
+                owner TEXT,
+                lease_expires_at REAL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                completed_at REAL,
+                error TEXT,
+                PRIMARY KEY (run_id, shard)
+            )
+        """)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(shard_leases)")}
+        if "error" not in columns:
+            self._conn.execute("ALTER TABLE shard_leases ADD COLUMN error TEXT")
+
+    def _transaction(self, fn):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._conn)
+                self._conn.execute("COMMIT")
+                return result
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def ensure_shards(self, num_shards: int):
+        rows = [(self.run_id, shard) for shard in range(FINALIZE_SHARD, num_shards)]
+        self._transaction(lambda c: c.executemany(
+            "INSERT OR IGNORE INTO shard_leases (run_id, shard) VALUES (?, ?)", rows
+        ))
+
+    def claim(self, owner: str, lease_seconds: int = LEASE_SECONDS) -> Optional[Lease]:
+        def _claim(c):
+            now = time.time()
+            row = c.execute(
+                """
+                SELECT shard, attempts FROM shard_leases
+                WHERE run_id = ? AND shard >= 0 AND completed_at IS NULL
+                  AND (owner IS NULL OR lease_expires_at < ?)
+                ORDER BY RANDOM() LIMIT 1
+                """,
+                (self.run_id, now),
+            ).fetchone()
+            if row is None:
+                return None
+            c.execute(
+                "UPDATE shard_leases SET owner = ?, lease_expires_at = ?, attempts = attempts + 1 WHERE run_id = ? AND shard = ?",
+                (owner, now + lease_seconds, self.run_id, row[0]),
+            )
+            return Lease(row[0], owner, row[1] + 1)
+        return self._transaction(_claim)
+
+    def renew(self, lease: Lease, lease_seconds: int = LEASE_SECONDS) -> bool:
+        return self._transaction(lambda c: c.execute(
+            "UPDATE shard_leases SET lease_expires_at = ? WHERE run_id = ? AND shard = ? AND owner = ? AND completed_at IS NULL",
+            (time.time() + lease_seconds, self.run_id, lease.shard, lease.owner),
+        ).rowcount == 1)
+
+    def complete(self, lease: Lease) -> bool:
+        return self._transaction(lambda c: c.execute(
+            "UPDATE shard_leases SET completed_at = ? WHERE run_id = ? AND shard = ? AND owner = ? AND completed_at IS NULL",
+            (time.time(), self.run_id, lease.shard, lease.owner),
+        ).rowcount == 1)
+
+    def fail(self, lease: Lease, error: str) -> bool:
+        """Completes the shard with an error: no task claims it again in this run."""
+        return self._transaction(lambda c: c.execute(
+            "UPDATE shard_leases SET completed_at = ?, error = ? WHERE run_id = ? AND shard = ? AND owner = ? AND completed_at IS NULL",
+            (time.time(), error, self.run_id, lease.shard, lease.owner),
+        ).rowcount == 1)
+
+    def release(self, lease: Lease):
+        """Gives the lease up early so another task can retry the shard right away."""
+        self._transaction(lambda c: c.execute(
+            "UPDATE shard_leases SET owner = NULL, lease_expires_at = NULL WHERE run_id = ? AND shard = ? AND owner = ? AND completed_at IS NULL",
+            (self.run_id, lease.shard, lease.owner),
+        ))
+
+    def try_finalize(self, owner: str) -> bool:
+        """Claims the finalize marker once every shard is complete. True for exactly one caller."""
+        return self._transaction(lambda c: c.execute(
+            """
+            UPDATE shard_leases SET owner = ?, completed_at = ?
+            WHERE run_id = ? AND shard = ? AND completed_at IS NULL
+              AND NOT EXISTS (
+                  SELECT 1 FROM shard_leases WHERE run_id = ? AND shard >= 0 AND completed_at IS NULL
+              )
+            """,
+            (owner, time.time(), self.run_id, FINALIZE_SHARD, self.run_id),
+        ).rowcount == 1)
+
+    def status(self) -> Dict[str, int]:
+        with self._lock:
+            row = self._conn.execute(
+                """
+                SELECT COUNT(*),
+                       COALESCE(SUM(completed_at IS NOT NULL), 0),
+                       COALESCE(SUM(completed_at IS NULL AND lease_expires_at >= ?), 0),
+                       COALESCE(SUM(attempts), 0),
+                       COALESCE(SUM(error IS NOT NULL), 0)
+                FROM shard_leases WHERE run_id = ? AND shard >= 0
+                """,
+                (time.time(), self.run_id),
+            ).fetchone()
+        return {'total': row[0], 'completed': row[1], 'leased': row[2], 'claims': row[3], 'failed': row[4]}
+
+
+class BigQueryLeaseStore:
+    """Lease table in BigQuery (shared by all Cloud Run tasks of an execution)."""
+
+    def __init__(self, client, table_id: str, run_id: str = BACKFILL_RUN_ID):
+        from google.cloud import bigquery
+        self._bq = bigquery
+        self.client = client
+        self.table_id = table_id
+        self.run_id = run_id
+        schema = [
+            bigquery.SchemaField("run_id", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("shard", "INT64", mode="REQUIRED"),
+            bigquery.SchemaField("owner", "STRING"),
+            bigquery.SchemaField("claim_token", "STRING"),
+            bigquery.SchemaField("lease_expires_at", "TIMESTAMP"),
+            bigquery.SchemaField("attempts", "INT64"),
+            bigquery.SchemaField("completed_at", "TIMESTAMP"),
+            bigquery.SchemaField("error", "STRING"),
+        ]
+        table = client.create_table(bigquery.Table(table_id, schema=schema), exists_ok=True)
+        existing = {field.name for field in table.schema}
+        missing = [field for field in schema if field.name not in existing]
+        if missing:
+            add_columns = ", ".join(f"ADD COLUMN IF NOT EXISTS {field.name} {field.field_type}" for field in missing)
+            client.query(f"ALTER TABLE `{table_id}` {add_columns}").result()
+
+    def _query(self, sql: str, params: List):
+        """Runs one statement, retrying concurrent-DML conflicts between tasks."""
+        job_config = self._bq.QueryJobConfig(query_parameters=params)
+        for attempt in range(DML_MAX_RETRIES):
+            try:
+                job = self.client.query(sql, job_config=job_config)
+                rows = list(job.result())
+                return job, rows
+            except Exception as e:
+                if "concurrent update" not in str(e).lower() or attempt == DML_MAX_RETRIES - 1:
+                    raise
+                time.sleep(random.uniform(1, 2 ** (attempt + 1)))
+
+    def _param(self, name: str, type_: str, value):
+        return self._bq.ScalarQueryParameter(name, type_, value)
+
+    def ensure_shards(self, num_shards: int):
+        self._query(
+            f"""
+            MERGE `{self.table_id}` T
+            USING (SELECT shard FROM UNNEST(GENERATE_ARRAY(@first, @last)) AS shard) S
+            ON T.run_id = @run_id AND T.shard = S.shard
+            WHEN NOT MATCHED THEN
+              INSERT (run_id, shard, attempts) VALUES (@run_id, S.shard, 0)
+            """,
+            [
+                self._param("run_id", "STRING", self.run_id),
+                self._param("first", "INT64", FINALIZE_SHARD),
+                self._param("last", "INT64", num_shards - 1),
+            ],
+        )
+
+    def claim(self, owner: str, lease_seconds: int = LEASE_SECONDS) -> Optional[Lease]:
+        # Random candidate order keeps tasks from all racing for the same shard;
+        # the claim token tells us which row (if any) our UPDATE took.
+        token = uuid.uuid4().hex
+        free = "completed_at IS NULL AND (owner IS NULL OR lease_expires_at < CURRENT_TIMESTAMP())"
+        self._query(
+            f"""
+            UPDATE `{self.table_id}`
+            SET owner = @owner, claim_token = @token, attempts = attempts + 1,
+                lease_expires_at = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL @lease_seconds SECOND)
+            WHERE run_id = @run_id AND {free}
+              AND shard = (
+                  SELECT shard FROM `{self.table_id}`
+                  WHERE run_id = @run_id AND shard >= 0 AND {free}
+                  ORDER BY FARM_FINGERPRINT(CONCAT(@token, CAST(shard AS STRING)))
+                  LIMIT 1
+              )
+            """,
+            [
+                self._param("run_id", "STRING", self.run_id),
+                self._param("owner", "STRING", owner),
+                self._param("token", "STRING", token),
+                self._param("lease_seconds", "INT64", lease_seconds),
+            ],
+        )
+        _, rows = self._query(
+            f"SELECT shard, attempts FROM `{self.table_id}` WHERE run_id = @run_id AND claim_token = @token",
+            [self._param("run_id", "STRING", self.run_id), self._param("token", "STRING", token)],
+        )
+        if not rows:
+            return None
+        return Lease(rows[0]["shard"], owner, rows[0]["attempts"])
+
+    def _owned_update(self, lease: Lease, set_sql: str, extra: Optional[List] = None) -> bool:
+        job, _ = self._query(
+            f"""
+            UPDATE `{self.table_id}` SET {set_sql}
+            WHERE run_id = @run_id AND shard = @shard AND owner = @owner AND completed_at IS NULL
+            """,
+            [
+                self._param("run_id", "STRING", self.run_id),
+                self._param("shard", "INT64", lease.shard),
+                self._param("owner", "STRING", lease.owner),
+            ] + (extra or []),
+        )
+        return (job.num_dml_affected_rows or 0) == 1
+
+    def renew(self, lease: Lease, lease_seconds: int = LEASE_SECONDS) -> bool:
+        return self._owned_update(
+            lease,
+            "lease_expires_at = TIMESTAMP_ADD(CURRENT_TIMESTAMP(), INTERVAL @lease_seconds SECOND)",
+            [self._param("lease_seconds", "INT64", lease_seconds)],
+        )
+
+    def complete(self, lease: Lease) -> bool:
+        return self._owned_update(lease, "completed_at = CURRENT_TIMESTAMP()")
+
+    def fail(self, lease: Lease, error: str) -> bool:
+        return self._owned_update(
+            lease,
+            "completed_at = CURRENT_TIMESTAMP(), error = @error",
+            [self._param("error", "STRING", error)],
+        )
+
+    def release(self, lease: Lease):
+        self._owned_update(lease, "owner = NULL, lease_expires_at = NULL")
+
+    def try_finalize(self, owner: str) -> bool:
+        job, _ = self._query(
+            f"""
+            UPDATE `{self.table_id}` SET owner = @owner, completed_at = CURRENT_TIMESTAMP()
+            WHERE run_id = @run_id AND shard = @finalize AND completed_at IS NULL
+              AND NOT EXISTS (
+                  SELECT 1 FROM `{self.table_id}` WHERE run_id = @run_id AND shard >= 0 AND completed_at IS NULL
+              )
+            """,
+            [
+                self._param("run_id", "STRING", self.run_id),
+                self._param("owner", "STRING", owner),
+                self._param("finalize", "INT64", FINALIZE_SHARD),
+            ],
+        )
+        return (job.num_dml_affected_rows or 0) == 1
+
+    def status(self) -> Dict[str, int]:
+        _, rows = self._query(
+            f"""
+            SELECT COUNT(*) AS total,
+                   COUNTIF(completed_at IS NOT NULL) AS completed,
+                   COUNTIF(completed_at IS NULL AND lease_expires_at >= CURRENT_TIMESTAMP()) AS leased,
+                   IFNULL(SUM(attempts), 0) AS claims,
+                   COUNTIF(error IS NOT NULL) AS failed
+            FROM `{self.table_id}` WHERE run_id = @run_id AND shard >= 0
+            """,
+            [self._param("run_id", "STRING", self.run_id)],
+        )
+        row = rows[0]
+        return {'total': row["total"], 'completed': row["completed"], 'leased': row["leased"], 'claims': row["claims"], 'failed': row["failed"]}
+
+
+def get_lease_store(client=None, table_id: Optional[str] = None):
+    """The store selected by LEASE_STORE (sqlite for local multi-process runs)."""
+    if LEASE_STORE == "sqlite" or client is None:
+        return SQLiteLeaseStore(LEASE_STORE_PATH)
+    return BigQueryLeaseStore(client, table_id)
+
+
+class LeaseHeartbeat:
+    """Renews a lease in the background; `lost` is set if another task took the shard over."""
+
+    def __init__(self, store, lease: Lease, lease_seconds: int = LEASE_SECONDS):
+        self.store = store
+        self.lease = lease
+        self.lease_seconds = lease_seconds
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"lease-{lease.shard}", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(max(self.lease_seconds / 3, 1)):
+            try:
+                if not self.store.renew(self.lease, self.lease_seconds):
+                    self.lost = True
+                    print(f"  ⚠️  Lost lease on shard {self.lease.shard} (expired and reclaimed)", flush=True)
+                    return
+            except Exception as e:
+                print(f"  ⚠️  Lease renew failed for shard {self.lease.shard}: {e}", flush=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+
+
+def run_leased_shards(
+    store,
+    owner: str,
+    work_fn,
+    lease_seconds: int = LEASE_SECONDS,
+    poll_seconds: int = LEASE_POLL_SECONDS,
+    max_attempts: int = LEASE_MAX_ATTEMPTS,
+) -> int:
+    """
+    Claims shards until every shard is complete, calling work_fn(lease) for each
+    while a heartbeat renews the lease. A shard is completed when work_fn returns
+    and released when it raises, unless it has been claimed max_attempts times:
+    then it is marked failed so the run can still finish. Returns the number of
+    shards this owner completed.
+    """
+    done = 0
+    while True:
+        lease = store.claim(owner, lease_seconds)
+        if lease is None:
+            status = store.status()
+            if status['completed'] >= status['total']:
+                return done
+            print(f"⏳ No free shard ({status['completed']}/{status['total']} complete, {status['leased']} leased) - waiting {poll_seconds}s", flush=True)
+            time.sleep(poll_seconds)
+            continue
+        print(f"🔒 Claimed shard {lease.shard}{' (reclaimed)' if lease.reclaimed else ''}", flush=True)
+        with LeaseHeartbeat(store, lease, lease_seconds):
+            try:
+                work_fn(lease)
+            except Exception as e:
+                if lease.attempts >= max_attempts:
+                    print(f"  ❌ Shard {lease.shard} failed on attempt {lease.attempts}/{max_attempts}: {e} - marking it failed", flush=True)
+                    store.fail(lease, f"{type(e).__name__}: {e}"[:1000])
+                else:
+                    print(f"  ❌ Shard {lease.shard} failed on attempt {lease.attempts}/{max_attempts}: {e} - releasing lease", flush=True)
+                    store.release(lease)
+                continue
+        if store.complete(lease):
+            done += 1
+            print(f"✅ Shard {lease.shard} complete", flush=True)
+        else:
+            print(f"  ⚠️  Shard {lease.shard} was reclaimed by another task before completion", flush=True)
+
+
+def _demo_worker(path: str, run_id: str, worker: int, num_shards: int, work_seconds: float, crash_after: int):
+    store = SQLiteLeaseStore(path, run_id)
+    owner = f"worker{worker}:{os.getpid()}"
+    shards: List[int] = []
+
+    def work(lease: Lease):
+        if crash_after and len(shards) >= crash_after:
+            os._exit(1)  # Dies holding the lease; another worker reclaims it after expiry
+        time.sleep(work_seconds)
+        shards.append(lease.shard)
+
+    run_leased_shards(store, owner, work, lease_seconds=2, poll_seconds=1)
+    finalized = store.try_finalize(owner)
+    print(f"worker{worker}: completed shards {sorted(shards)}{' + finalize' if finalized else ''}", flush=True)
+
+
+def _demo(args):
+    import multiprocessing
+    run_id = f"demo-{uuid.uuid4().hex[:8]}"
+    SQLiteLeaseStore(args.store, run_id).ensure_shards(args.shards)
+    start = time.time()
+    procs = [
+        multiprocessing.Process(
+            target=_demo_worker,
+            args=(args.store, run_id, i, args.shards, args.work_seconds, args.crash_after if i == 0 else 0),
+        )
+        for i in range(args.workers)
+    ]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    status = SQLiteLeaseStore(args.store, run_id).status()
+    print(f"{status['completed']}/{status['total']} shards complete, {status['claims']} claims, {time.time() - start:.1f}s", flush=True)
+    return 0 if status['completed'] == status['total'] else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shard lease tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    demo = sub.add_parser("demo", help="Run local worker processes against a SQLite lease store")
+    demo.add_argument("--workers", type=int, default=4)
+    demo.add_argument("--shards", type=int, default=32)
+    demo.add_argument("--store", default=LEASE_STORE_PATH)
+    demo.add_argument("--work-seconds", type=float, default=0.2)
+    demo.add_argument("--crash-after", type=int, default=2, help="Worker 0 dies holding a lease after N shards (0 = never)")
+    sys.exit(_demo(parser.parse_args()))
@@ -10,6 +10,7 @@ import sys
 from datetime import datetime
 from typing import List, Dict, Optional
 from google.cloud import bigquery
+from bq_metrics import MeteredClient
 from supabase import create_client, Client
 
 # Load environment variables
@@ -34,7 +35,7 @@ SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 
 def get_bigquery_client():
     """Initializes BigQuery client."""
-    return bigquery.Client(project=PROJECT_ID)
+    return MeteredClient(project=PROJECT_ID)
 
 def get_supabase_client() -> Optional[Client]:
     """Initializes Supabase client."""
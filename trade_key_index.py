@@ -0,0 +1,324 @@
+"""
+Memory-mapped index of trade keys for client-side dedup.
+
+get_existing_ids(client, TRADES_TABLE, "id") pulls every trade id into a
+Python set: tens of millions of rows cost several GB of RAM and minutes of
+download. TradeKeyIndex keeps 64-bit hashes of the keys instead:
+
+1. BigQuery computes the hash (first 8 bytes of MD5(key)) and EXPORT DATA
+   writes it to GCS as gzipped CSV, so only 16 hex chars per row leave
+   BigQuery
+2. the export is streamed into 256 spill files by the hash's top byte, each
+   sorted and deduped on its own (peak memory is one bucket), and written to
+   one file: header, offsets per 16-bit prefix, sorted uint64 hashes
+3. lookups mmap the file and binary-search the prefix's range, so resident
+   memory is whatever pages the OS keeps cached (8 bytes per key on disk)
+
+An optional Bloom filter (TRADE_INDEX_BLOOM, ~10 bits per key at 1%) answers
+most misses without touching the sorted array. Keys added during the run go
+to a small in-memory set.
+
+A 64-bit hash can collide; with 100M keys the chance that a given new key
+is wrongly reported as present is ~5e-12.
+
+The index is reused while the source table's last-modified time and the key
+expression are unchanged.
+
+Usage:
+    existing_trade_ids = load_trade_key_index(client, TRADES_STAGING_TABLE, "id")
+    if trade_id in existing_trade_ids: ...
+    existing_trade_ids.add(trade_id)
+"""
+
+import os
+import sys
+import gzip
+import json
+import math
+import mmap
+import time
+import bisect
+import hashlib
+import tempfile
+from array import array
+from typing import Iterable, Iterator, Optional, Set
+
+from google.cloud import bigquery
+
+TRADE_INDEX_ENABLED = os.getenv("TRADE_INDEX_ENABLED", "true").lower() == "true"  # false = in-RAM set of ids
+TRADE_INDEX_PATH = os.getenv("TRADE_INDEX_PATH", "/tmp/trade_key_index.bin")
+TRADE_INDEX_GCS_PREFIX = os.getenv("TRADE_INDEX_GCS_PREFIX")  # Export location, default gs://<project>-backfill-temp/trade_key_index
+TRADE_INDEX_BLOOM = os.getenv("TRADE_INDEX_BLOOM", "false").lower() == "true"
+TRADE_INDEX_BLOOM_FP_RATE = float(os.getenv("TRADE_INDEX_BLOOM_FP_RATE", "0.01"))
+
+MAGIC = b"TKIDX001"
+PREFIX_BITS = 16
+PREFIX_SLOTS = 1 << PREFIX_BITS
+HEADER_BYTES = len(MAGIC) + 8 + (PREFIX_SLOTS + 1) * 8
+SPILL_BUFFER = 65536  # Hashes buffered per bucket before writing to its spill file
+
+
+def key_hash(key: str) -> int:
+    """Unsigned 64-bit hash; matches TO_HEX(SUBSTR(MD5(key), 1, 8)) in BigQuery."""
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+def hash_sql(key_sql: str) -> str:
+    return f"TO_HEX(SUBSTR(MD5(CAST({key_sql} AS STRING)), 1, 8))"
+
+
+class BloomFilter:
+    """Bit array over a memory-mapped file; k positions by double hashing the 64-bit key hash."""
+
+    def __init__(self, bits: bytearray, num_bits: int, num_hashes: int):
+        self.bits = bits
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+
+    @staticmethod
+    def sizing(count: int, fp_rate: float):
+        num_bits = max(int(-count * math.log(fp_rate) / (math.log(2) ** 2)), 64)
+        num_hashes = max(int(round(num_bits / max(count, 1) * math.log(2))), 1)
+        return num_bits, num_hashes
+
+    def _positions(self, h: int) -> Iterator[int]:
+        h1 = h & 0xFFFFFFFF
+        h2 = (h >> 32) | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, h: int):
+        for pos in self._positions(h):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def might_contain(self, h: int) -> bool:
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(h))
+
+
+class TradeKeyIndex:
+    """Read-only sorted hash file plus an in-memory set of keys added this run."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.added: Set[int] = set()
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        if bytes(view[:len(MAGIC)]) != MAGIC:
+            view.release()
+            self.close()
+            raise ValueError(f"{path} is not a trade key index")
+        self.count = int.from_bytes(view[len(MAGIC):len(MAGIC) + 8], sys.byteorder)
+        self._offsets = view[len(MAGIC) + 8:HEADER_BYTES].cast("Q")
+        self._values = view[HEADER_BYTES:HEADER_BYTES + self.count * 8].cast("Q")
+        view.release()
+
+        self.bloom = None
+        self._bloom_file = None
+        self._bloom_mmap = None
+        meta = read_meta(path) or {}
+        bloom_path = path + ".bloom"
+        if meta.get("bloom") and os.path.exists(bloom_path):
+            self._bloom_file = open(bloom_path, "rb")
+            self._bloom_mmap = mmap.mmap(self._bloom_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.bloom = BloomFilter(self._bloom_mmap, meta["bloom"]["bits"], meta["bloom"]["hashes"])
+
+    def contains_hash(self, h: int) -> bool:
+        if h in self.added:
+            return True
+        if self.bloom is not None and not self.bloom.might_contain(h):
+            return False
+        prefix = h >> (64 - PREFIX_BITS)
+        lo, hi = self._offsets[prefix], self._offsets[prefix + 1]
+        i = bisect.bisect_left(self._values, h, lo, hi)
+        return i < hi and self._values[i] == h
+
+    def __contains__(self, key) -> bool:
+        if not key:
+            return False
+        return self.contains_hash(key_hash(str(key)))
+
+    def add(self, key: str):
+        if key:
+            self.added.add(key_hash(str(key)))
+
+    def __len__(self) -> int:
+        return self.count + len(self.added)
+
+    def close(self):
+        for view in (getattr(self, "_offsets", None), getattr(self, "_values", None)):
+            if view is not None:
+                view.release()
+        for handle in (self._mmap, self._file, getattr(self, "_bloom_mmap", None), getattr(self, "_bloom_file", None)):
+            if handle is not None:
+                handle.close()
+
+
+def read_meta(path: str) -> Optional[dict]:
+    try:
+        with open(path + ".json") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_index(hashes: Iterable[int], path: str, bloom_fp_rate: Optional[float] = None, meta: Optional[dict] = None) -> int:
+    """
+    Sorts and dedupes `hashes` into an index file at path (bucketed through
+    temp spill files, so memory stays at one 1/256 bucket). Returns the
+    number of distinct hashes written.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=directory) as spill_dir:
+        buffers = [array("Q") for _ in range(256)]
+        spills = [open(os.path.join(spill_dir, f"{b:03d}"), "wb") for b in range(256)]
+        try:
+            for h in hashes:
+                bucket = h >> 56
+                buffers[bucket].append(h)
+                if len(buffers[bucket]) >= SPILL_BUFFER:
+                    buffers[bucket].tofile(spills[bucket])
+                    del buffers[bucket][:]
+            for bucket, buffer in enumerate(buffers):
+                buffer.tofile(spills[bucket])
+        finally:
+            for spill in spills:
+                spill.close()
+        del buffers
+
+        offsets = array("Q", [0] * (PREFIX_SLOTS + 1))
+        tmp_path = path + ".tmp"
+        count = 0
+        with open(tmp_path, "wb") as out:
+            out.write(b"\0" * HEADER_BYTES)
+            for bucket in range(256):
+                spill_path = os.path.join(spill_dir, f"{bucket:03d}")
+                values = array("Q")
+                with open(spill_path, "rb") as f:
+                    values.frombytes(f.read())
+                os.remove(spill_path)
+                values = array("Q", sorted(set(values)))
+                for sub in range(256):
+                    offsets[(bucket << 8) | sub] = count + bisect.bisect_left(values, (bucket << 56) | (sub << 48))
+                values.tofile(out)
+                count += len(values)
+            offsets[PREFIX_SLOTS] = count
+            out.seek(0)
+            out.write(MAGIC)
+            out.write(count.to_bytes(8, sys.byteorder))
+            offsets.tofile(out)
+        os.replace(tmp_path, path)
+
+    meta = dict(meta or {}, count=count, byteorder=sys.byteorder, bloom=None)
+    if bloom_fp_rate:
+        meta["bloom"] = _write_bloom(path, count, bloom_fp_rate)
+    with open(path + ".json", "w") as f:
+        json.dump(meta, f)
+    return count
+
+
+def _write_bloom(path: str, count: int, fp_rate: float) -> dict:
+    num_bits, num_hashes = BloomFilter.sizing(count, fp_rate)
+    bloom = BloomFilter(bytearray((num_bits + 7) // 8), num_bits, num_hashes)
+    index = TradeKeyIndex(path)
+    try:
+        for h in index._values:
+            bloom.add(h)
+    finally:
+        index.close()
+    with open(path + ".bloom", "wb") as f:
+        f.write(bloom.bits)
+    return {"bits": num_bits, "hashes": num_hashes}
+
+
+def _export_prefix(client: bigquery.Client) -> str:
+    return (TRADE_INDEX_GCS_PREFIX or f"gs://{client.project}-backfill-temp/trade_key_index").rstrip("/")
+
+
+def _iter_exported_hashes(bucket, prefix: str) -> Iterator[int]:
+    for blob in bucket.list_blobs(prefix=prefix):
+        with blob.open("rb") as raw, gzip.open(raw, "rt") as lines:
+            for line in lines:
+                line = line.strip()
+                if line:
+                    yield int(line, 16)
+
+
+def build_trade_key_index(client: bigquery.Client, table_id: str, key_sql: str = "id", path: str = TRADE_INDEX_PATH) -> int:
+    """Exports hashed keys of table_id through GCS and writes the index at path."""
+    from google.cloud import storage
+
+    table = client.get_table(table_id)
+    export_uri = f"{_export_prefix(client)}/{table_id.replace('.', '_')}/{int(time.time())}"
+    bucket_name, blob_prefix = export_uri[len("gs://"):].split("/", 1)
+
+    start = time.time()
+    print(f"  🗜️  Exporting hashed keys of {table_id} to {export_uri}...", flush=True)
+    client.query(f"""
+        EXPORT DATA OPTIONS (
+            uri = '{export_uri}/part-*.csv.gz',
+            format = 'CSV',
+            compression = 'GZIP',
+            header = false,
+            overwrite = true
+        ) AS
+        SELECT {hash_sql(key_sql)} AS h
+        FROM `{table_id}`
+        WHERE {key_sql} IS NOT NULL
+    """).result()
+
+    bucket = storage.Client(project=client.project).bucket(bucket_name)
+    meta = {
+        "source_table": table_id,
+        "key_sql": key_sql,
+        "modified": table.modified.isoformat() if table.modified else None,
+    }
+    try:
+        count = write_index(
+            _iter_exported_hashes(bucket, blob_prefix + "/"),
+            path,
+            bloom_fp_rate=TRADE_INDEX_BLOOM_FP_RATE if TRADE_INDEX_BLOOM else None,
+            meta=meta,
+        )
+    finally:
+        for blob in bucket.list_blobs(prefix=blob_prefix + "/"):
+            blob.delete()
+    print(
+        f"  ✅ Trade key index: {count:,} keys, {os.path.getsize(path) / 1e6:.1f} MB on disk "
+        f"({time.time() - start:.0f}s)",
+        flush=True,
+    )
+    return count
+
+
+def load_trade_key_index(client: bigquery.Client, table_id: str, key_sql: str = "id", path: str = TRADE_INDEX_PATH) -> Optional[TradeKeyIndex]:
+    """
+    The index for table_id, rebuilt when the table changed since the last
+    build. Returns None when disabled or the build fails (callers fall back
+    to an in-memory set).
+    """
+    if not TRADE_INDEX_ENABLED:
+        return None
+    try:
+        table = client.get_table(table_id)
+        modified = table.modified.isoformat() if table.modified else None
+        meta = read_meta(path)
+        fresh = (
+            meta is not None
+            and os.path.exists(path)
+            and meta.get("source_table") == table_id
+            and meta.get("key_sql") == key_sql
+            and meta.get("modified") == modified
+            and meta.get("byteorder") == sys.byteorder
+            and bool(meta.get("bloom")) == TRADE_INDEX_BLOOM
+        )
+        if fresh:
+            print(f"  ♻️  Reusing trade key index {path} ({meta.get('count', 0):,} keys)", flush=True)
+        else:
+            build_trade_key_index(client, table_id, key_sql, path)
+        return TradeKeyIndex(path)
+    except Exception as e:
+        print(f"  ⚠️  Trade key index unavailable for {table_id}: {e}", flush=True)
+        return None
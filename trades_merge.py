@@ -0,0 +1,125 @@
+"""
+Partition- and cluster-pruned MERGE for the trades upsert.
+
+The trades table is partitioned by DATE(timestamp) and clustered by
+wallet_address, but a MERGE that joins only on the idempotency key
+(wallet_address, tx_hash, order_hash) reads every partition. Here the batch's
+timestamp range and wallet set are computed client-side and added to the ON
+clause as literals, so BigQuery prunes partitions and clustered blocks and
+bytes processed scale with the batch instead of the table.
+
+A trade's timestamp never changes for a given key, so a target row outside
+the window cannot match a source row; the window is padded by
+TRADES_MERGE_PADDING_HOURS to absorb timezone differences between writers.
+
+Usage:
+    bounds = trade_bounds(valid_trades)
+    merge_query = trades_merge_sql(TRADES_TABLE, f"`{temp_table_id}`", bounds)
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+TRADES_MERGE_PRUNE = os.getenv("TRADES_MERGE_PRUNE", "true").lower() == "true"
+TRADES_MERGE_PADDING_HOURS = int(os.getenv("TRADES_MERGE_PADDING_HOURS", "24"))  # Widen the timestamp window each side
+TRADES_MERGE_MAX_WALLETS = int(os.getenv("TRADES_MERGE_MAX_WALLETS", "5000"))  # Above this, prune on time only (query size)
+
+TRADE_KEY_COLUMNS = ["wallet_address", "tx_hash", "COALESCE(order_hash, '')"]
+TRADE_KEY_CONDITIONS = [
+    "target.wallet_address = source.wallet_address",
+    "target.tx_hash = source.tx_hash",
+    "COALESCE(target.order_hash, '') = COALESCE(source.order_hash, '')",
+]
+
+
+class TradeBounds:
+    """Timestamp range and wallet set of one batch of trades."""
+
+    def __init__(self, min_ts: datetime, max_ts: datetime, wallets: List[str]):
+        self.min_ts = min_ts
+        self.max_ts = max_ts
+        self.wallets = wallets
+
+    def __repr__(self):
+        return f"TradeBounds({self.min_ts.isoformat()} .. {self.max_ts.isoformat()}, {len(self.wallets)} wallets)"
+
+
+def _parse_timestamp(value) -> Optional[datetime]:
+    """datetime, unix seconds or 'YYYY-MM-DD HH:MM:SS' (naive = UTC)."""
+    if value is None or value == "":
+        return None
+    try:
+        if isinstance(value, datetime):
+            parsed = value
+        elif isinstance(value, (int, float)):
+            return datetime.fromtimestamp(value, tz=timezone.utc)
+        else:
+            parsed = datetime.fromisoformat(str(value).strip().replace("T", " ").replace("Z", "+00:00"))
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def trade_bounds(trades: List[Dict]) -> Optional[TradeBounds]:
+    """
+    Bounds of a batch, or None when any timestamp or wallet is unusable (the
+    MERGE then falls back to the unpruned join rather than risk duplicates).
+    """
+    if not trades:
+        return None
+    timestamps = []
+    wallets = set()
+    for trade in trades:
+        ts = _parse_timestamp(trade.get("timestamp"))
+        wallet = trade.get("wallet_address")
+        if ts is None or not wallet:
+            return None
+        timestamps.append(ts)
+        wallets.add(wallet)
+    return TradeBounds(min(timestamps), max(timestamps), sorted(wallets))
+
+
+def _quote(value: str) -> str:
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def _timestamp_literal(value: datetime) -> str:
+    return f"TIMESTAMP '{value.strftime('%Y-%m-%d %H:%M:%S')}+00'"
+
+
+def target_filters(bounds: Optional[TradeBounds]) -> List[str]:
+    """Constant conditions on the target side of the MERGE (empty = no pruning)."""
+    if bounds is None or not TRADES_MERGE_PRUNE:
+        return []
+    padding = timedelta(hours=TRADES_MERGE_PADDING_HOURS)
+    filters = [
+        f"target.timestamp BETWEEN {_timestamp_literal(bounds.min_ts - padding)} "
+        f"AND {_timestamp_literal(bounds.max_ts + padding)}"
+    ]
+    if len(bounds.wallets) <= TRADES_MERGE_MAX_WALLETS:
+        filters.append(f"target.wallet_address IN ({', '.join(_quote(w) for w in bounds.wallets)})")
+    return filters
+
+
+def trades_merge_sql(trades_table: str, source: str, bounds: Optional[TradeBounds] = None) -> str:
+    """
+    Insert-only MERGE of `source` (a table reference) into trades_table,
+    deduped on the trade key and pruned to `bounds` when given.
+    """
+    on_clause = "\n           AND ".join(TRADE_KEY_CONDITIONS + target_filters(bounds))
+    return f"""
+        MERGE `{trades_table}` AS target
+        USING (
+            SELECT *
+            FROM {source}
+            QUALIFY ROW_NUMBER() OVER (
+                PARTITION BY {", ".join(TRADE_KEY_COLUMNS)}
+                ORDER BY timestamp DESC, id DESC
+            ) = 1
+        ) AS source
+        ON {on_clause}
+        WHEN NOT MATCHED THEN INSERT ROW
+        """
@@ -0,0 +1,222 @@
+"""
+Mid-wallet resume for the backfills.
+
+A crash or redeploy used to restart a wallet at offset 0; for wallets with
+100k+ orders that is hundreds of Dome pages fetched again. ResumableWalletWriter
+writes a wallet's rows as GCS part files and, every WALLET_CURSOR_EVERY_PAGES
+pages, finalizes the current part and saves the pagination cursor next to it:
+
+    parts/trades/<wallet>/part-00000.jsonl.gz
+    parts/trades/<wallet>/cursor.json   {offset, pagination_key, page_count, trade_count, parts, ...}
+
+A restarted job loads cursor.json and continues from the last durable page
+(pages after it are fetched again, into a new part). When the wallet is done,
+finish() composes the parts into the usual staging file (trades/<wallet>.jsonl.gz;
+concatenated gzip members are a valid gzip stream) and deletes the parts and
+the cursor. Parts live outside trades/ so DTS and load jobs never see them.
+
+Usage:
+    writer = ResumableWalletWriter(bucket, wallet, staging_path(f"trades/{wallet}"))
+    offset, pagination_key = writer.cursor.offset, writer.cursor.pagination_key
+    ... writer.write(row) ...
+    writer.page_done(offset, pagination_key, page_count, trade_count, condition_ids)
+    writer.finish()
+"""
+
+import os
+import gzip
+import json
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from gcs_staging import NDJSONStagingWriter, staging_path
+
+WALLET_CURSOR_ENABLED = os.getenv("WALLET_CURSOR_ENABLED", "true").lower() == "true"
+WALLET_CURSOR_EVERY_PAGES = int(os.getenv("WALLET_CURSOR_EVERY_PAGES", "20"))  # Persist the cursor every K pages
+WALLET_PARTS_PREFIX = os.getenv("WALLET_PARTS_PREFIX", "parts")
+COMPOSE_MAX_SOURCES = 32  # GCS compose limit per request
+
+
+class WalletCursor:
+    """Durable fetch state of one wallet."""
+
+    def __init__(
+        self,
+        wallet: str,
+        offset: Optional[int] = 0,
+        pagination_key: Optional[str] = None,
+        page_count: int = 0,
+        trade_count: int = 0,
+        parts: Optional[List[str]] = None,
+        condition_ids: Optional[Iterable[str]] = None,
+        updated_at: Optional[float] = None,
+    ):
+        self.wallet = wallet
+        self.offset = offset
+        self.pagination_key = pagination_key
+        self.page_count = page_count
+        self.trade_count = trade_count
+        self.parts = parts or []
+        self.condition_ids = set(condition_ids or ())
+        self.updated_at = updated_at
+
+    def to_dict(self) -> Dict:
+        return {
+            'wallet': self.wallet,
+            'offset': self.offset,
+            'pagination_key': self.pagination_key,
+            'page_count': self.page_count,
+            'trade_count': self.trade_count,
+            'parts': self.parts,
+            'condition_ids': sorted(self.condition_ids),
+            'updated_at': self.updated_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "WalletCursor":
+        return cls(**{k: data.get(k) for k in (
+            'wallet', 'offset', 'pagination_key', 'page_count', 'trade_count', 'parts', 'condition_ids', 'updated_at'
+        )})
+
+
+class ResumableWalletWriter:
+    """Part-file writer for one wallet that persists its pagination cursor every K pages."""
+
+    def __init__(
+        self,
+        bucket,
+        wallet: str,
+        final_path: str,
+        kind: str = "trades",
+        every_pages: int = WALLET_CURSOR_EVERY_PAGES,
+    ):
+        self.bucket = bucket
+        self.wallet = wallet
+        self.final_path = final_path
+        self.every_pages = max(every_pages, 1)
+        self.prefix = f"{WALLET_PARTS_PREFIX}/{kind}/{wallet}"
+        self.cursor_path = f"{self.prefix}/cursor.json"
+        self.enabled = WALLET_CURSOR_ENABLED
+        self.cursor = (self._load_cursor() if self.enabled else None) or WalletCursor(wallet)
+        self.resumed_at_page = self.cursor.page_count
+        self.resumed = bool(self.resumed_at_page)
+        self.persisted = self.resumed  # True once a cursor.json exists that discard() must remove
+        self.rows_written = 0
+        self.bytes_written = 0
+        self._part: Optional[NDJSONStagingWriter] = None
+        if self.resumed:
+            print(
+                f"    ↪️  [{wallet[:10]}...] Resuming at page {self.cursor.page_count} "
+                f"({self.cursor.trade_count:,} trades in {len(self.cursor.parts)} parts)",
+                flush=True,
+            )
+
+    def _load_cursor(self) -> Optional[WalletCursor]:
+        blob = self.bucket.blob(self.cursor_path)
+        try:
+            if not blob.exists():
+                return None
+            cursor = WalletCursor.from_dict(json.loads(blob.download_as_bytes()))
+        except Exception as e:
+            print(f"    ⚠️  [{self.wallet[:10]}...] Unreadable cursor {self.cursor_path}: {e} - starting over", flush=True)
+            return None
+        # Only parts that made it to GCS count; without them the cursor is useless
+        if any(not self.bucket.blob(part).exists() for part in cursor.parts):
+            print(f"    ⚠️  [{self.wallet[:10]}...] Cursor references missing parts - starting over", flush=True)
+            return None
+        return cursor
+
+    def write(self, row: Dict):
+        if self._part is None:
+            name = staging_path(f"{self.prefix}/part-{len(self.cursor.parts):05d}")
+            self._part = NDJSONStagingWriter(self.bucket, name)
+        self._part.write(row)
+
+    def write_rows(self, rows: Iterable[Dict]):
+        for row in rows:
+            self.write(row)
+
+    def checkpoint_due(self, page_count: int) -> bool:
+        """True when page_done(page_count) will persist the cursor."""
+        return self.enabled and page_count % self.every_pages == 0
+
+    def _close_part(self):
+        if self._part is None:
+            return
+        stats = self._part.close()
+        if stats.rows:
+            self.cursor.parts.append(self._part.path)
+            self.rows_written += stats.rows
+            self.bytes_written += stats.bytes_written
+        else:
+            self.bucket.blob(self._part.path).delete()
+        self._part = None
+
+    def checkpoint(self):
+        """Finalizes the current part and saves the cursor (the pages so far become durable)."""
+        self._close_part()
+        self.cursor.updated_at = time.time()
+        blob = self.bucket.blob(self.cursor_path)
+        blob.upload_from_string(json.dumps(self.cursor.to_dict()), content_type="application/json")
+        self.persisted = True
+
+    def page_done(
+        self,
+        offset: Optional[int],
+        pagination_key: Optional[str],
+        page_count: int,
+        trade_count: int,
+        condition_ids: Iterable[str] = (),
+    ):
+        """Records the cursor for the NEXT page; persisted every `every_pages` pages."""
+        self.cursor.offset = offset
+        self.cursor.pagination_key = pagination_key
+        self.cursor.page_count = page_count
+        self.cursor.trade_count = trade_count
+        self.cursor.condition_ids.update(condition_ids)
+        if self.checkpoint_due(page_count):
+            self.checkpoint()
+
+    def read_rows(self) -> Iterator[Dict]:
+        """Rows already in the durable parts (for callers that rebuild in-memory state on resume)."""
+        for part in self.cursor.parts:
+            data = self.bucket.blob(part).download_as_bytes()
+            if part.endswith(".gz"):
+                data = gzip.decompress(data)
+            for line in data.splitlines():
+                if line.strip():
+                    yield json.loads(line)
+
+    def finish(self) -> str:
+        """Composes all parts into final_path and removes parts + cursor. Returns final_path."""
+        self._close_part()
+        parts = list(self.cursor.parts)
+        if not parts:
+            NDJSONStagingWriter(self.bucket, self.final_path).close()  # Empty staging file, as before
+        else:
+            final = self.bucket.blob(self.final_path)
+            final.content_type = "application/x-ndjson"
+            sources = [self.bucket.blob(p) for p in parts[:COMPOSE_MAX_SOURCES]]
+            final.compose(sources)
+            for i in range(COMPOSE_MAX_SOURCES, len(parts), COMPOSE_MAX_SOURCES - 1):
+                final.compose([final] + [self.bucket.blob(p) for p in parts[i:i + COMPOSE_MAX_SOURCES - 1]])
+        self.discard()
+        return self.final_path
+
+    def discard(self):
+        """Deletes parts and cursor (after the rows are safely elsewhere)."""
+        if self._part is not None:
+            self._part.close()
+            self.bucket.blob(self._part.path).delete()
+            self._part = None
+        for blob in self.bucket.list_blobs(prefix=self.prefix + "/"):
+            try:
+                blob.delete()
+            except Exception as e:
+                print(f"    ⚠️  Could not delete {blob.name}: {e}", flush=True)
+        self.cursor.parts = []
+        self.persisted = False
+
+    def summary(self) -> str:
+        resumed = f", resumed at page {self.resumed_at_page}" if self.resumed else ""
+        return f"{self.final_path}: {self.rows_written:,} rows this run in {self.bytes_written / 1e6:.1f} MB{resumed}"
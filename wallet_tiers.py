@@ -0,0 +1,121 @@
+"""
+Hot/cold wallet tiering for trade ingestion.
+
+Wallets are ranked by how many trades they made in the last
+TIER_LOOKBACK_DAYS (from the trades table). Hot wallets are polled every
+HOT_POLL_INTERVAL_MINUTES, cold wallets every COLD_POLL_INTERVAL_HOURS.
+Tiers are recomputed from the trades table on every run, so a cold wallet
+that starts trading is promoted as soon as its trades are ingested.
+
+Usage (daily sync):
+    activity = get_wallet_activity(bq_client, TRADES_TABLE)
+    tiers = assign_tiers(wallets, activity)
+    due, skipped = select_due_wallets(wallets, tiers, watermarks, now_unix)
+"""
+
+import os
+from typing import Dict, List, Optional, Tuple
+
+from google.cloud import bigquery
+
+WALLET_TIERING = os.getenv("WALLET_TIERING", "true").lower() == "true"  # false = poll every wallet every run
+TIER_LOOKBACK_DAYS = int(os.getenv("TIER_LOOKBACK_DAYS", "7"))
+HOT_MIN_TRADES = int(os.getenv("HOT_MIN_TRADES", "10"))  # Trades in the lookback window to be hot
+HOT_MAX_WALLETS = int(os.getenv("HOT_MAX_WALLETS", "0"))  # 0 = no cap; otherwise only the N most active
+HOT_POLL_INTERVAL_MINUTES = float(os.getenv("HOT_POLL_INTERVAL_MINUTES", "0"))  # 0 = every run
+COLD_POLL_INTERVAL_HOURS = float(os.getenv("COLD_POLL_INTERVAL_HOURS", "24"))
+WALLET_POLL_SLACK_MINUTES = float(os.getenv("WALLET_POLL_SLACK_MINUTES", "60"))  # Scheduler jitter: due this early
+
+TIER_HOT = "hot"
+TIER_COLD = "cold"
+
+
+def get_wallet_activity(bq_client: bigquery.Client, trades_table: str) -> Dict[str, int]:
+    """Trades per wallet over the last TIER_LOOKBACK_DAYS."""
+    query = f"""
+    SELECT LOWER(wallet_address) AS wallet_address, COUNT(*) AS trade_count
+    FROM `{trades_table}`
+    WHERE timestamp >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {TIER_LOOKBACK_DAYS} DAY)
+      AND wallet_address IS NOT NULL
+    GROUP BY 1
+    """
+    activity = {}
+    try:
+        for row in bq_client.query(query).result():
+            activity[row['wallet_address']] = row['trade_count']
+    except Exception as e:
+        print(f"⚠️  Could not load wallet activity (all wallets treated as hot): {e}", flush=True)
+        return {}
+    return activity
+
+
+def assign_tiers(wallets: List[str], activity: Dict[str, int]) -> Dict[str, str]:
+    """
+    Hot: at least HOT_MIN_TRADES recent trades (capped to the HOT_MAX_WALLETS
+    most active if set). Everything else is cold. With no activity data at all
+    every wallet is hot, so a failed activity query never slows ingestion.
+    """
+    keys = [w.lower().strip() for w in wallets]
+    if not activity:
+        return {w: TIER_HOT for w in keys}
+
+    ranked = sorted(
+        (w for w in keys if activity.get(w, 0) >= HOT_MIN_TRADES),
+        key=lambda w: (-activity[w], w),
+    )
+    if HOT_MAX_WALLETS > 0:
+        ranked = ranked[:HOT_MAX_WALLETS]
+    hot = set(ranked)
+    return {w: TIER_HOT if w in hot else TIER_COLD for w in keys}
+
+
+def poll_interval_seconds(tier: str) -> float:
+    if tier == TIER_HOT:
+        return HOT_POLL_INTERVAL_MINUTES * 60
+    return COLD_POLL_INTERVAL_HOURS * 3600
+
+
+def is_due(tier: str, watermark: Optional[Dict], now: int) -> bool:
+    """
+    A wallet is due if it was never polled, has an interrupted fetch to
+    resume, or its tier's poll interval has elapsed since the last poll.
+    `now` and last_polled_at are run start times; WALLET_POLL_SLACK_MINUTES
+    absorbs scheduler jitter, so a 24h wallet is polled by every daily run
+    rather than every other one.
+    """
+    if not watermark or watermark.get('last_polled_at') is None:
+        return True
+    if watermark.get('cursor_offset') is not None or watermark.get('cursor_pagination_key'):
+        return True
+    return now - watermark['last_polled_at'] >= poll_interval_seconds(tier) - WALLET_POLL_SLACK_MINUTES * 60
+
+
+def select_due_wallets(
+    wallets: List[str],
+    tiers: Dict[str, str],
+    watermarks: Dict[str, Dict],
+    now: int,
+) -> Tuple[List[str], List[str]]:
+    """Splits wallets into (due, skipped) for this run, keeping input order."""
+    if not WALLET_TIERING:
+        return list(wallets), []
+
+    due = []
+    skipped = []
+    for wallet in wallets:
+        key = wallet.lower().strip()
+        if is_due(tiers.get(key, TIER_HOT), watermarks.get(key), now):
+            due.append(wallet)
+        else:
+            skipped.append(wallet)
+    return due, skipped
+
+
+def tier_summary(tiers: Dict[str, str], due: List[str]) -> str:
+    due_keys = {w.lower().strip() for w in due}
+    hot = [w for w, t in tiers.items() if t == TIER_HOT]
+    cold = [w for w, t in tiers.items() if t == TIER_COLD]
+    return (
+        f"{len(hot)} hot ({sum(1 for w in hot if w in due_keys)} due), "
+        f"{len(cold)} cold ({sum(1 for w in cold if w in due_keys)} due)"
+    )